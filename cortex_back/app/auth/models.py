@@ -31,6 +31,11 @@ class QueryLog(Base):
     
     # Información de rendimiento
     processing_time = Column(Float, nullable=True)  # Tiempo total en segundos
+    model_name = Column(String(100), nullable=True)        # Modelo LLM usado
+    prompt_tokens = Column(Integer, nullable=True)         # Tokens de prompt evaluados (todos los intentos)
+    completion_tokens = Column(Integer, nullable=True)     # Tokens generados (todos los intentos)
+    load_time = Column(Float, nullable=True)               # Carga del modelo en segundos
+    generation_metrics = Column(JSON, nullable=True)       # Tokens y tiempos por intento
     
     # Metadatos
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
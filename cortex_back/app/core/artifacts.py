@@ -0,0 +1,154 @@
+import json
+import hashlib
+import logging
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+from app.core.config import (
+    RAG_INDEX_DIR, DATASET_PATH, OMOP_SCHEMA_PATH, OMOP_DB_PATH, SNOMED_DIR, EMBED_MODEL_NAME
+)
+
+logger = logging.getLogger(__name__)
+
+RAG_INDEX_FILE = "faiss.index"
+RAG_HEADER_FILE = "metadata.json"
+
+
+class ArtifactError(FileNotFoundError):
+    """Artefacto requerido ausente o desactualizado"""
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with Path(path).open("rb") as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclass
+class ArtifactStatus:
+    name: str
+    path: str
+    required: bool
+    exists: bool
+    fresh: Optional[bool] = None  # None: frescura no verificable
+    detail: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.exists and self.fresh is not False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**asdict(self), "ok": self.ok}
+
+
+class ArtifactLocator:
+    """Ubicación única de los artefactos del backend, resuelta desde la configuración"""
+
+    def __init__(
+        self,
+        rag_index_dir: Path = RAG_INDEX_DIR,
+        dataset_path: Path = DATASET_PATH,
+        omop_schema_path: Path = OMOP_SCHEMA_PATH,
+        omop_db_path: Path = OMOP_DB_PATH,
+        snomed_dir: Path = SNOMED_DIR,
+        embed_model: str = EMBED_MODEL_NAME
+    ):
+        self.rag_index_dir = Path(rag_index_dir)
+        self.dataset_path = Path(dataset_path)
+        self.omop_schema_path = Path(omop_schema_path)
+        self.omop_db_path = Path(omop_db_path)
+        self.snomed_dir = Path(snomed_dir)
+        self.embed_model = embed_model
+
+    @property
+    def rag_index_file(self) -> Path:
+        return self.rag_index_dir / RAG_INDEX_FILE
+
+    @property
+    def rag_header_file(self) -> Path:
+        return self.rag_index_dir / RAG_HEADER_FILE
+
+    def snomed_path(self, filename: str) -> Path:
+        return self.snomed_dir / filename
+
+    def _check_rag_index(self) -> ArtifactStatus:
+        status = ArtifactStatus(
+            name="rag_index",
+            path=str(self.rag_index_dir),
+            required=True,
+            exists=self.rag_index_file.exists() and self.rag_header_file.exists()
+        )
+        if not status.exists:
+            status.detail = "Run `python -m app.sql_generation.build_index` to build it"
+            return status
+
+        with self.rag_header_file.open("r", encoding="utf-8") as fp:
+            header = json.load(fp)
+
+        if header.get("embed_model") not in (None, self.embed_model):
+            status.fresh = False
+            status.detail = f"Built with {header['embed_model']}, configured model is {self.embed_model}"
+        elif not header.get("dataset_sha256"):
+            status.detail = "Index header has no dataset hash; freshness not verifiable"
+        elif not self.dataset_path.exists():
+            status.detail = "Dataset not available; freshness not verifiable"
+        elif header["dataset_sha256"] != file_sha256(self.dataset_path):
+            status.fresh = False
+            status.detail = f"Index is older than {self.dataset_path.name}; rebuild it"
+        else:
+            status.fresh = True
+        return status
+
+    def check(self) -> List[ArtifactStatus]:
+        """Estado de todos los artefactos conocidos"""
+        statuses = [
+            self._check_rag_index(),
+            ArtifactStatus("omop_schema", str(self.omop_schema_path), True, self.omop_schema_path.exists()),
+            ArtifactStatus("text2sql_dataset", str(self.dataset_path), False, self.dataset_path.exists()),
+            ArtifactStatus("omop_test_db", str(self.omop_db_path), False, self.omop_db_path.exists()),
+        ]
+        for filename in ("faiss_snomed.index", "concept_ids.pkl", "synonyms.parquet", "omop_snomed.db"):
+            path = self.snomed_path(filename)
+            statuses.append(ArtifactStatus(f"snomed:{filename}", str(path), False, path.exists()))
+        return statuses
+
+    def preflight(self, strict: bool = True) -> List[ArtifactStatus]:
+        """Comprobar artefactos; en modo estricto falla si falta o está desactualizado uno requerido"""
+        statuses = self.check()
+        failures = [s for s in statuses if s.required and not s.ok]
+
+        for s in statuses:
+            if s.ok and s.fresh is not None:
+                logger.info(f"Artifact {s.name}: ok ({s.path})")
+            elif s.ok:
+                logger.info(f"Artifact {s.name}: present ({s.path}){' - ' + s.detail if s.detail else ''}")
+            else:
+                state = "missing" if not s.exists else "stale"
+                log = logger.error if s.required else logger.warning
+                log(f"Artifact {s.name}: {state} ({s.path}){' - ' + s.detail if s.detail else ''}")
+
+        if failures and strict:
+            names = ", ".join(f"{s.name} ({s.path})" for s in failures)
+            raise ArtifactError(f"Required artifacts missing or stale: {names}")
+        return statuses
+
+
+_locator: Optional[ArtifactLocator] = None
+_last_preflight: List[ArtifactStatus] = []
+
+def get_artifact_locator() -> ArtifactLocator:
+    global _locator
+    if _locator is None:
+        _locator = ArtifactLocator()
+    return _locator
+
+def run_preflight(strict: bool = True) -> List[ArtifactStatus]:
+    global _last_preflight
+    _last_preflight = get_artifact_locator().preflight(strict=strict)
+    return _last_preflight
+
+def get_preflight_report() -> List[Dict[str, Any]]:
+    return [s.to_dict() for s in _last_preflight]
@@ -1,27 +1,109 @@
 import os
 from pathlib import Path
 
-# Rutas base
-BASE_DIR = Path(__file__).parent.parent.parent
-DATA_DIR = BASE_DIR / "data"
-RAG_INDEX_DIR = DATA_DIR / "rag_index"
-
-# Crear directorios si no existen
-DATA_DIR.mkdir(exist_ok=True)
-RAG_INDEX_DIR.mkdir(exist_ok=True)
+# Rutas base (absolutas: no dependen del directorio desde el que se arranque uvicorn)
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+DATA_DIR = Path(os.getenv("CORTEX_DATA_DIR", str(BASE_DIR / "data")))
+RAG_INDEX_DIR = Path(os.getenv("RAG_INDEX_DIR", str(BASE_DIR / "rag_index")))
+SNOMED_DIR = Path(os.getenv("SNOMED_DIR", str(BASE_DIR / "app" / "OMOP_SNOMED")))
 
 # Configuración Ollama
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "deepseek-coder-v2:16b-lite-instruct-q4_K_M")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")        # tiempo que Ollama mantiene el modelo cargado
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "8192"))         # contexto: esquema + ejemplos + pregunta (0 = defecto del servidor)
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "true").lower() == "true"  # cargar modelo y prefijo al arrancar
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))      # segundos entre sondeos
+OLLAMA_MODELS_TTL = float(os.getenv("OLLAMA_MODELS_TTL", "300"))               # caché de la lista de modelos
+OLLAMA_FAILURE_THRESHOLD = int(os.getenv("OLLAMA_FAILURE_THRESHOLD", "3"))     # fallos seguidos para abrir el circuito
+OLLAMA_CIRCUIT_RESET = float(os.getenv("OLLAMA_CIRCUIT_RESET", "30"))          # segundos con el circuito abierto
+OLLAMA_PARALLEL_SLOTS = int(os.getenv("OLLAMA_PARALLEL_SLOTS", "1"))           # = OLLAMA_NUM_PARALLEL del servidor
+OLLAMA_MAX_QUEUE_DEPTH = int(os.getenv("OLLAMA_MAX_QUEUE_DEPTH", "16"))        # peticiones en espera antes de rechazar
+# Varios backends (url|modelo|peso|nivel, separados por comas); vacío = OLLAMA_BASE_URL + OLLAMA_MODEL
+OLLAMA_BACKENDS = os.getenv("OLLAMA_BACKENDS", "")
+OLLAMA_TIERS = [t.strip() for t in os.getenv("OLLAMA_TIERS", "fast,main").split(",") if t.strip()]  # orden de escalado
 
 # Configuración SQL Generation
 SQL_GENERATION_TIMEOUT = int(os.getenv("SQL_GENERATION_TIMEOUT", "300"))  
 MAX_SQL_ATTEMPTS = int(os.getenv("MAX_SQL_ATTEMPTS", "3"))
+# Candidatos en paralelo en la primera iteración (0/1 = bucle secuencial). Útil si OLLAMA_NUM_PARALLEL >= N
+SQL_PARALLEL_CANDIDATES = int(os.getenv("SQL_PARALLEL_CANDIDATES", "0"))
+SQL_CANDIDATE_TEMPERATURES = [float(t) for t in os.getenv("SQL_CANDIDATE_TEMPERATURES", "0.05,0.3,0.6").split(",")]
+
+# Validación del SQL generado: "explain" no ejecuta la consulta; "execute" la ejecuta con límite de filas
+SQL_VALIDATION_MODE = os.getenv("SQL_VALIDATION_MODE", "explain")
+SQL_VALIDATION_MAX_ROWS = int(os.getenv("SQL_VALIDATION_MAX_ROWS", "1000"))
+SQL_VALIDATION_TIME_BUDGET = float(os.getenv("SQL_VALIDATION_TIME_BUDGET", "5"))        # segundos de reloj por consulta
+SQL_VALIDATION_STEP_BUDGET = int(os.getenv("SQL_VALIDATION_STEP_BUDGET", "50000000"))   # instrucciones de la VM de SQLite
+SQL_VALIDATION_CACHE_SIZE = int(os.getenv("SQL_VALIDATION_CACHE_SIZE", "2048"))     # 0 desactiva la caché de validaciones
+SQL_VALIDATION_CACHE_TTL = float(os.getenv("SQL_VALIDATION_CACHE_TTL", "3600"))     # segundos; 0 sin caducidad
+SQL_VALIDATION_CACHE_TIMEOUT_TTL = float(os.getenv("SQL_VALIDATION_CACHE_TIMEOUT_TTL", "30"))  # segundos para tiempos agotados; 0 no los cachea
+SQL_SANDBOX_WORKERS = int(os.getenv("SQL_SANDBOX_WORKERS", "0"))          # procesos aislados; 0 ejecuta en el proceso de la API
+SQL_SANDBOX_MEMORY_MB = int(os.getenv("SQL_SANDBOX_MEMORY_MB", "1024"))    # RLIMIT_AS de cada proceso aislado
+SQL_SANDBOX_KILL_GRACE = float(os.getenv("SQL_SANDBOX_KILL_GRACE", "2"))   # s tras el presupuesto antes de matar el proceso
+SQL_SCHEMA_CHECK = os.getenv("SQL_SCHEMA_CHECK", "true").lower() == "true"  # resolver tablas/columnas con el esquema OMOP
+
+# Estimación de coste antes de ejecutar (plan + estadísticas de las tablas OMOP)
+SQL_COST_ACTION = os.getenv("SQL_COST_ACTION", "flag").lower()                 # off, flag (solo informar) o reject
+SQL_COST_MAX_ROWS = int(os.getenv("SQL_COST_MAX_ROWS", "50000000"))            # filas leídas estimadas
+SQL_COST_LARGE_TABLE_ROWS = int(os.getenv("SQL_COST_LARGE_TABLE_ROWS", "1000000"))  # tabla grande a efectos de avisos
+
+# Motor de ejecución de las consultas: "sqlite" o "duckdb" (requiere el paquete duckdb)
+SQL_ENGINE = os.getenv("SQL_ENGINE", "sqlite").lower()
+DUCKDB_SOURCE = os.getenv("DUCKDB_SOURCE", "parquet")     # "attach": el fichero SQLite; "parquet": tablas convertidas
+DUCKDB_PARQUET_DIR = os.getenv("DUCKDB_PARQUET_DIR", str(BASE_DIR / "omop_testing" / "parquet"))
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", "0"))    # 0: los núcleos disponibles
+
+# Ejecución de consultas validadas con resultados paginados (POST /sql-generation/execute)
+SQL_EXECUTION_PAGE_SIZE = int(os.getenv("SQL_EXECUTION_PAGE_SIZE", "500"))        # filas por página por defecto
+SQL_EXECUTION_MAX_ROWS = int(os.getenv("SQL_EXECUTION_MAX_ROWS", "10000"))        # máximo de filas por página
+SQL_EXECUTION_BATCH_SIZE = int(os.getenv("SQL_EXECUTION_BATCH_SIZE", "200"))      # filas por fetchmany
+SQL_EXECUTION_TIME_BUDGET = float(os.getenv("SQL_EXECUTION_TIME_BUDGET", "60"))   # segundos por página
+SQL_EXECUTION_MAX_STREAMS = int(os.getenv("SQL_EXECUTION_MAX_STREAMS", "4"))      # ejecuciones simultáneas
+SQL_EXPORT_MAX_ROWS = int(os.getenv("SQL_EXPORT_MAX_ROWS", "5000000"))            # filas por exportación (CSV/Arrow/Parquet)
+SQL_EXPORT_BATCH_SIZE = int(os.getenv("SQL_EXPORT_BATCH_SIZE", "20000"))          # filas por lote / row group
+
+# Pool de conexiones de solo lectura a la base de datos OMOP de validación
+OMOP_POOL_SIZE = int(os.getenv("OMOP_POOL_SIZE", "4"))
+OMOP_DB_IMMUTABLE = os.getenv("OMOP_DB_IMMUTABLE", "true").lower() == "true"   # la BD no cambia con el servidor en marcha
+OMOP_CACHE_SIZE_KB = int(os.getenv("OMOP_CACHE_SIZE_KB", "65536"))             # caché de páginas por conexión
+OMOP_MMAP_SIZE = int(os.getenv("OMOP_MMAP_SIZE", str(256 * 1024 * 1024)))
+OMOP_POOL_HEALTH_INTERVAL = float(os.getenv("OMOP_POOL_HEALTH_INTERVAL", "30"))  # s de inactividad antes de revalidar
+
+# Esquema OMOP completo (~9 KB) en el prefijo de cada prompt: desactivado por defecto
+PROMPT_INCLUDE_SCHEMA = os.getenv("PROMPT_INCLUDE_SCHEMA", "false").lower() == "true"
 
 # Configuración RAG
 RAG_TOP_K = int(os.getenv("RAG_TOP_K", "1"))
-DATASET_PATH = str(BASE_DIR / "text2sql_epi_dataset_omop.xlsx")
-OMOP_SCHEMA_PATH = str(BASE_DIR / "omop_schema_stub.txt")
+RAG_FETCH_K = int(os.getenv("RAG_FETCH_K", "20"))              # variantes candidatas antes de MMR
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))     # 1.0 = solo relevancia
+RAG_PROMPT_TOKEN_BUDGET = int(os.getenv("RAG_PROMPT_TOKEN_BUDGET", "1500"))
+RAG_BUILD_WORKERS = int(os.getenv("RAG_BUILD_WORKERS", "1"))  # procesos de encoding al construir el índice
+# Reconstruir el índice en la ruta de una petición tarda minutos: desactivado salvo petición expresa
+RAG_ALLOW_RUNTIME_BUILD = os.getenv("RAG_ALLOW_RUNTIME_BUILD", "false").lower() == "true"
+DATASET_PATH = os.getenv("DATASET_PATH", str(DATA_DIR / "text2sql_epi_dataset_omop.xlsx"))
+OMOP_SCHEMA_PATH = os.getenv("OMOP_SCHEMA_PATH", str(DATA_DIR / "omop_schema_stub.txt"))
+
+# Caché semántica de SQL validado (preguntas parafraseadas con los mismos conceptos)
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true"
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH", str(BASE_DIR / "cache" / "sql_cache.db"))  # vacío: solo memoria
+SQL_CACHE_THRESHOLD = float(os.getenv("SQL_CACHE_THRESHOLD", "0.95"))   # similitud coseno mínima
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "5000"))
 
 # Base de datos OMOP de prueba
-OMOP_DB_PATH = str(BASE_DIR / "omop_testing" / "omop_complete.db")
\ No newline at end of file
+OMOP_DB_PATH = os.getenv("OMOP_DB_PATH", str(BASE_DIR / "omop_testing" / "omop_complete.db"))
+
+# Comprobación de artefactos al arrancar: strict (falla), warn (solo log) u off
+STARTUP_PREFLIGHT = os.getenv("STARTUP_PREFLIGHT", "strict").lower()
+
+# Re-ranking de términos similares (cross-encoder)
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "ncbi/MedCPT-Cross-Encoder")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "20"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+
+# Servicio de embeddings compartido (linker médico + RAG)
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "pritamdeka/BioBERT-mnli-snli-scinli-scitail-mednli-stsb")
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "32"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
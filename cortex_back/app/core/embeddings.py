@@ -0,0 +1,170 @@
+import queue
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from app.core.config import EMBED_MODEL_NAME, EMBED_MAX_BATCH_SIZE, EMBED_MAX_WAIT_MS, EMBED_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingService:
+    """Modelo SentenceTransformer compartido por proceso con batching y caché de consultas"""
+
+    def __init__(
+        self,
+        model_name: str = EMBED_MODEL_NAME,
+        max_batch_size: int = EMBED_MAX_BATCH_SIZE,
+        max_wait_ms: float = EMBED_MAX_WAIT_MS,
+        cache_size: int = EMBED_CACHE_SIZE
+    ):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.cache_size = cache_size
+
+        logger.info(f"Loading SentenceTransformer model {model_name}")
+        self.model = SentenceTransformer(model_name)
+
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._stats = {
+            'requests': 0,
+            'cache_hits': 0,
+            'coalesced': 0,
+            'batches': 0,
+            'encoded': 0,
+        }
+
+        self._worker = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+        self._worker.start()
+
+    def encode_query(self, text: str) -> np.ndarray:
+        """Embedding (1, dim) float32 de un texto; copia propia del llamante"""
+        return self.encode_queries([text])
+
+    def encode_queries(self, texts: List[str]) -> np.ndarray:
+        """Embeddings de consultas cortas a través de la cola y la caché compartida"""
+        futures: List[Future] = []
+        with self._lock:
+            for text in texts:
+                self._stats['requests'] += 1
+                cached = self._cache.get(text)
+                if cached is not None:
+                    self._cache.move_to_end(text)
+                    self._stats['cache_hits'] += 1
+                    future = Future()
+                    future.set_result(cached)
+                elif text in self._pending:
+                    self._stats['coalesced'] += 1
+                    future = self._pending[text]
+                else:
+                    future = Future()
+                    self._pending[text] = future
+                    self._queue.put(text)
+                futures.append(future)
+
+        # Las entradas de la caché no se modifican nunca: se devuelve una copia
+        # porque faiss.normalize_L2 normaliza en sitio.
+        return np.vstack([f.result() for f in futures]).astype("float32", copy=True)
+
+    def encode_batch(
+        self,
+        texts: List[str],
+        batch_size: int = 64,
+        show_progress_bar: bool = False,
+        workers: int = 1
+    ) -> np.ndarray:
+        """Encoding masivo (construcción de índices) sin pasar por la caché"""
+        if workers > 1 and len(texts) > batch_size:
+            pool = self.model.start_multi_process_pool(target_devices=["cpu"] * workers)
+            try:
+                embeds = self.model.encode_multi_process(texts, pool, batch_size=batch_size)
+            finally:
+                self.model.stop_multi_process_pool(pool)
+        else:
+            embeds = self.model.encode(
+                texts,
+                batch_size=batch_size,
+                show_progress_bar=show_progress_bar,
+                convert_to_numpy=True
+            )
+        return np.asarray(embeds, dtype="float32")
+
+    def _collect_batch(self) -> List[str]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                embeds = self.model.encode(batch, convert_to_numpy=True)
+                embeds = np.asarray(embeds, dtype="float32")
+            except Exception as e:
+                logger.error(f"Error encoding batch of {len(batch)} texts: {e}")
+                with self._lock:
+                    for text in batch:
+                        self._pending.pop(text).set_exception(e)
+                continue
+
+            with self._lock:
+                self._stats['batches'] += 1
+                self._stats['encoded'] += len(batch)
+                for text, vector in zip(batch, embeds):
+                    vector = vector.reshape(1, -1)
+                    vector.setflags(write=False)
+                    self._cache[text] = vector
+                    self._pending.pop(text).set_result(vector)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            cached = len(self._cache)
+            cache_bytes = sum(arr.nbytes for arr in self._cache.values())
+        stats.update({
+            'model': self.model_name,
+            'cached_texts': cached,
+            'cache_size_mb': round(cache_bytes / (1024 * 1024), 2),
+            'hit_rate': round(stats['cache_hits'] / stats['requests'], 4) if stats['requests'] else 0.0,
+            'avg_batch_size': round(stats['encoded'] / stats['batches'], 2) if stats['batches'] else 0.0,
+        })
+        return stats
+
+    def clear_cache(self) -> int:
+        with self._lock:
+            removed = len(self._cache)
+            self._cache.clear()
+        logger.info(f"Embedding cache cleared: {removed} texts removed")
+        return removed
+
+
+_services: Dict[str, EmbeddingService] = {}
+_services_lock = threading.Lock()
+
+def get_embedding_service(model_name: Optional[str] = None) -> EmbeddingService:
+    """Instancia única por modelo y proceso"""
+    model_name = model_name or EMBED_MODEL_NAME
+    with _services_lock:
+        if model_name not in _services:
+            _services[model_name] = EmbeddingService(model_name)
+        return _services[model_name]
@@ -4,6 +4,9 @@ from fastapi import FastAPI, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 import logging
 
+from dotenv import load_dotenv
+load_dotenv()  # antes de importar módulos que leen la configuración
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -11,17 +14,17 @@ from app.medical.ner import extract_medical_terms
 from app.medical.ner_es import extract_medical_terms_es
 from app.medical.similarity import get_similar_terms
 from app.medical.similarity_bd import get_similar_terms_bd, get_entity_linker, get_similarity_stats
+from app.medical.reranker import get_reranker
 from app.medical.models import (
     TextInput, TextEntities, Entity,
     SimilarTermInput, SimilarTerm, SimilarTermList
 )
 from app.auth.routes import router as auth_router
 from app.query_routes import router as query_router
-from app.auth.database import Base as AuthBase, engine as auth_engine
-from app.sql_generation.routes import router as sql_generation_router
-
-from dotenv import load_dotenv
-load_dotenv() 
+from app.auth.database import Base as AuthBase, engine as auth_engine, add_missing_columns
+from app.sql_generation.routes import router as sql_generation_router, get_sql_service
+from app.core.artifacts import run_preflight, get_preflight_report
+from app.core.config import STARTUP_PREFLIGHT, OLLAMA_WARMUP, RERANK_ENABLED
 
 app = FastAPI(
     title="Cortex Medical API",
@@ -38,23 +41,41 @@ app.add_middleware(
 )
 
 AuthBase.metadata.create_all(bind=auth_engine)
+add_missing_columns(auth_engine)
 
 def initialize_medical_services():
     try:
         logger.info("Initializing medical services")
         linker = get_entity_linker()
+        if RERANK_ENABLED:
+            # El cross-encoder se carga aquí y no en la primera búsqueda
+            get_reranker()
         stats = linker.get_cache_stats()
         logger.info(f"Medical services initialized: {stats}")
     except Exception as e:
         logger.error(f"Error initializing medical services: {e}")
 
+def warmup_sql_generation():
+    # La primera consulta no paga la carga del modelo ni la evaluación del prefijo
+    try:
+        get_sql_service().warmup()
+    except Exception as e:
+        logger.error(f"Error in SQL generation warmup: {e}")
+
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting Cortex Medical API")
     
+    # Fallar al arrancar en lugar de reconstruir artefactos en la primera petición
+    if STARTUP_PREFLIGHT != "off":
+        run_preflight(strict=STARTUP_PREFLIGHT == "strict")
+    
     import threading
     init_thread = threading.Thread(target=initialize_medical_services)
     init_thread.start()
+    
+    if OLLAMA_WARMUP:
+        threading.Thread(target=warmup_sql_generation, daemon=True).start()
 
 app.include_router(auth_router)
 app.include_router(query_router)
@@ -90,7 +111,7 @@ def similar_terms(input: SimilarTermInput):
 @app.post("/similar_db", response_model=SimilarTermList)
 def similar_terms_db(input: SimilarTermInput):
     try:
-        raw_results = get_similar_terms_bd(input.term)
+        raw_results = get_similar_terms_bd(input.term, k=input.k, rerank=input.rerank)
         results = [
             SimilarTerm(
                 term=str(item["term"]),
@@ -146,6 +167,10 @@ def clear_similarity_cache():
             "message": str(e)
         }
 
+@app.get("/artifacts")
+def artifacts_status():
+    return {"artifacts": get_preflight_report()}
+
 @app.get("/")
 def root():
     return {
@@ -159,7 +184,17 @@ def root():
             "similarity_health": "/similarity/health",
             "similarity_stats": "/similarity/stats",
             "sql_generation": "/sql-generation/",
+            "sql_generation_stream": "/sql-generation/stream",
+            "sql_execute": "/sql-generation/execute",
+            "sql_export": "/sql-generation/export",
             "queries": "/queries/",
-            "health": "/sql-generation/health"
+            "health": "/sql-generation/health",
+            "generation_queue": "/sql-generation/queue",
+            "sql_cache": "/sql-generation/cache",
+            "generation_telemetry": "/sql-generation/telemetry",
+            "omop_db_pool": "/sql-generation/db-pool",
+            "validation_cache": "/sql-generation/validation-cache",
+            "sql_sandbox": "/sql-generation/sandbox",
+            "artifacts": "/artifacts"
         }
     }
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 class TextInput(BaseModel):
     text: str
@@ -16,6 +16,8 @@ class TextEntities(BaseModel):
 
 class SimilarTermInput(BaseModel):
     term: str
+    k: int = 50
+    rerank: Optional[bool] = None
 
 class SimilarTerm(BaseModel):
     term: str
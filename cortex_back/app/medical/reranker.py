@@ -0,0 +1,133 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Tuple, Optional
+
+from sentence_transformers import CrossEncoder
+
+from app.core.config import RERANK_MODEL, RERANK_TOP_N, RERANK_BUDGET_MS
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """Re-ranking de los mejores candidatos FAISS con un cross-encoder local"""
+
+    def __init__(
+        self,
+        model_name: str = RERANK_MODEL,
+        top_n: int = RERANK_TOP_N,
+        budget_ms: float = RERANK_BUDGET_MS
+    ):
+        self.model_name = model_name
+        self.top_n = top_n
+        self.budget_ms = budget_ms
+
+        logger.info(f"Loading cross-encoder {model_name}")
+        self.model = CrossEncoder(model_name)
+
+        # Un único worker: si una llamada anterior sigue ocupándolo, las
+        # siguientes agotan el presupuesto y devuelven el orden FAISS.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'reranked': 0,
+            'over_budget': 0,
+            'errors': 0,
+            'pairs_scored': 0,
+            'total_ms': 0.0,
+        }
+
+    def _score(self, query: str, texts: List[str]) -> Tuple[List[float], float]:
+        start = time.perf_counter()
+        pairs = [(query, text) for text in texts]
+        scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        return [float(s) for s in scores], (time.perf_counter() - start) * 1000
+
+    def rerank(
+        self,
+        query: str,
+        candidates: List[Dict[str, Any]],
+        text_key: str = "term",
+        budget_ms: Optional[float] = None
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """Reordenar los top-N candidatos; devuelve (candidatos, si se reordenaron)"""
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        head = candidates[:self.top_n]
+        tail = candidates[self.top_n:]
+
+        with self._lock:
+            self._stats['calls'] += 1
+
+        if len(head) < 2:
+            return candidates, False
+
+        future = self._executor.submit(self._score, query, [str(c[text_key]) for c in head])
+        try:
+            scores, elapsed_ms = future.result(timeout=budget_ms / 1000)
+        except FutureTimeoutError:
+            with self._lock:
+                self._stats['over_budget'] += 1
+            logger.warning(f"Reranker exceeded {budget_ms:.0f} ms budget for '{query}', keeping FAISS order")
+            return candidates, False
+        except Exception as e:
+            with self._lock:
+                self._stats['errors'] += 1
+            logger.error(f"Reranker error for '{query}': {e}")
+            return candidates, False
+
+        with self._lock:
+            self._stats['reranked'] += 1
+            self._stats['pairs_scored'] += len(head)
+            self._stats['total_ms'] += elapsed_ms
+
+        reranked = []
+        for candidate, score in zip(head, scores):
+            item = dict(candidate)
+            item["rerank_score"] = round(score, 4)
+            reranked.append(item)
+        reranked.sort(key=lambda x: x["rerank_score"], reverse=True)
+
+        return reranked + tail, True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        reranked = stats['reranked']
+        stats['avg_ms'] = round(stats['total_ms'] / reranked, 2) if reranked else 0.0
+        stats['total_ms'] = round(stats['total_ms'], 2)
+        stats.update({
+            'model': self.model_name,
+            'top_n': self.top_n,
+            'budget_ms': self.budget_ms
+        })
+        return stats
+
+
+_reranker = None
+_reranker_error: Optional[str] = None
+_reranker_lock = threading.Lock()
+
+def get_reranker() -> Optional[CrossEncoderReranker]:
+    """
+    Reranker compartido; None si el modelo no se pudo cargar (sin red, RERANK_MODEL
+    erróneo...). Tras un fallo no se reintenta: el re-ranking queda desactivado y
+    las búsquedas devuelven el orden FAISS.
+    """
+    global _reranker, _reranker_error
+    if _reranker is None and _reranker_error is None:
+        with _reranker_lock:
+            if _reranker is None and _reranker_error is None:
+                try:
+                    _reranker = CrossEncoderReranker()
+                except Exception as e:
+                    _reranker_error = str(e) or type(e).__name__
+                    logger.error(f"Could not load cross-encoder {RERANK_MODEL}, reranking disabled: {e}")
+    return _reranker
+
+def get_reranker_stats() -> Optional[Dict[str, Any]]:
+    if _reranker_error is not None:
+        return {'model': RERANK_MODEL, 'disabled': True, 'error': _reranker_error}
+    return _reranker.get_stats() if _reranker is not None else None
@@ -3,12 +3,15 @@ import pandas as pd
 import numpy as np
 import faiss
 import pickle
-from sentence_transformers import SentenceTransformer
 from typing import List, Tuple, Optional, Dict, Any
-import os
 import logging
 from pathlib import Path
 
+from app.core.config import RERANK_ENABLED, EMBED_MODEL_NAME
+from app.core.embeddings import get_embedding_service
+from app.core.artifacts import get_artifact_locator
+from app.medical.reranker import get_reranker, get_reranker_stats
+
 logger = logging.getLogger(__name__)
 class MedicalEntityLinker:
     
@@ -24,21 +27,19 @@ class MedicalEntityLinker:
         if self._initialized:
             return
             
-        self.BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        locator = get_artifact_locator()
         
-        self.MODEL_NAME = "pritamdeka/BioBERT-mnli-snli-scinli-scitail-mednli-stsb"
-        self.FAISS_INDEX_PATH = os.path.join(self.BASE_DIR, "app/OMOP_SNOMED/faiss_snomed.index")
-        self.ID_MAPPING_PATH = os.path.join(self.BASE_DIR, "app/OMOP_SNOMED/concept_ids.pkl")
-        self.SYNONYMS_PATH = os.path.join(self.BASE_DIR, "app/OMOP_SNOMED/synonyms.parquet")
-        self.DB_PATH = os.path.join(self.BASE_DIR, "app/OMOP_SNOMED/omop_snomed.db")
-
-        self.embedding_cache = {}
+        self.MODEL_NAME = EMBED_MODEL_NAME
+        self.FAISS_INDEX_PATH = str(locator.snomed_path("faiss_snomed.index"))
+        self.ID_MAPPING_PATH = str(locator.snomed_path("concept_ids.pkl"))
+        self.SYNONYMS_PATH = str(locator.snomed_path("synonyms.parquet"))
+        self.DB_PATH = str(locator.snomed_path("omop_snomed.db"))
         
         try:
             logger.info("Initializing MedicalEntityLinker")
             
-            logger.info("Loading SentenceTransformer model")
-            self.model = SentenceTransformer(self.MODEL_NAME)
+            logger.info("Attaching shared embedding service")
+            self.embedder = get_embedding_service(self.MODEL_NAME)
             
             logger.info("Loading FAISS indexes")
             self._load_vector_index()
@@ -71,9 +72,7 @@ class MedicalEntityLinker:
             logger.info(f"OMOP database contains {count:,} concepts")
     
     def _get_embedding(self, text: str) -> np.ndarray:
-        if text not in self.embedding_cache:
-            self.embedding_cache[text] = self.model.encode([text]).astype("float32")
-        return self.embedding_cache[text]
+        return self.embedder.encode_query(text)
     
     def search_synonym(self, text: str, k: int = 10) -> List[Tuple[int, str, float]]:
         query_vec = self._get_embedding(text)
@@ -105,10 +104,17 @@ class MedicalEntityLinker:
             df = pd.read_sql_query(query, conn, params=concept_ids)
             return df.set_index('concept_id').to_dict('index')
     
-    def get_similar_terms_optimized(self, term: str, k: int = 50) -> List[Dict[str, Any]]:
+    def get_similar_terms_optimized(self, term: str, k: int = 50, rerank: Optional[bool] = None) -> List[Dict[str, Any]]:
         logger.info(f"Searching similar terms for: '{term}'")
         
-        similar_results = self.search_synonym(term, k=k)
+        if rerank is None:
+            rerank = RERANK_ENABLED
+        
+        # Sin modelo (no se pudo cargar) se devuelve el orden FAISS
+        reranker = get_reranker() if rerank else None
+        # Con re-ranking se buscan al menos top_n candidatos aunque se devuelvan menos
+        search_k = max(k, reranker.top_n) if reranker else k
+        similar_results = self.search_synonym(term, k=search_k)
         
         if not similar_results:
             logger.warning(f"No results found for: '{term}'")
@@ -136,20 +142,28 @@ class MedicalEntityLinker:
                 "concept_class": str(concept_info.get('concept_class_id', ''))
             })
         
+        if reranker and results:
+            results, reranked = reranker.rerank(term, results, text_key="term")
+            if reranked:
+                logger.info(f"Reranked top {min(len(results), reranker.top_n)} candidates for '{term}'")
+        
+        results = results[:k]
+        
         logger.info(f"Found {len(results)} valid terms for '{term}'")
         return results
     
     def get_cache_stats(self) -> Dict[str, Any]:
-        cache_size_mb = sum(arr.nbytes for arr in self.embedding_cache.values()) / (1024*1024)
+        embedder_stats = self.embedder.get_stats()
         return {
-            'cached_terms': len(self.embedding_cache),
-            'cache_size_mb': round(cache_size_mb, 2),
-            'total_vectors': self.index.ntotal if hasattr(self, 'index') else 0
+            'cached_terms': embedder_stats['cached_texts'],
+            'cache_size_mb': embedder_stats['cache_size_mb'],
+            'embedding_service': embedder_stats,
+            'total_vectors': self.index.ntotal if hasattr(self, 'index') else 0,
+            'reranker': get_reranker_stats()
         }
     
     def clear_cache(self):
-        old_size = len(self.embedding_cache)
-        self.embedding_cache.clear()
+        old_size = self.embedder.clear_cache()
         logger.info(f"Cache cleared: {old_size} terms removed")
 
 
@@ -161,9 +175,9 @@ def get_entity_linker() -> MedicalEntityLinker:
         _entity_linker = MedicalEntityLinker()
     return _entity_linker
 
-def get_similar_terms_bd(term: str, k: int = 50) -> List[Dict[str, Any]]:
+def get_similar_terms_bd(term: str, k: int = 50, rerank: Optional[bool] = None) -> List[Dict[str, Any]]:
     linker = get_entity_linker()
-    return linker.get_similar_terms_optimized(term, k=k)
+    return linker.get_similar_terms_optimized(term, k=k, rerank=rerank)
 
 def get_similarity_stats() -> Dict[str, Any]:
     try:
@@ -0,0 +1,30 @@
+"""
+Construcción offline del índice RAG.
+
+Uso (desde cortex_back/):
+    python -m app.sql_generation.build_index [--dataset RUTA] [--index-dir RUTA] [--workers N]
+"""
+import argparse
+import json
+import logging
+from pathlib import Path
+
+from app.core.artifacts import get_artifact_locator
+from app.core.config import RAG_BUILD_WORKERS
+from .rag_retriever import MedicalSQLRetriever
+
+def main():
+    locator = get_artifact_locator()
+    parser = argparse.ArgumentParser(description="Construir el índice RAG de ejemplos text2sql")
+    parser.add_argument("--dataset", type=Path, default=locator.dataset_path)
+    parser.add_argument("--index-dir", type=Path, default=locator.rag_index_dir)
+    parser.add_argument("--workers", type=int, default=RAG_BUILD_WORKERS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    retriever = MedicalSQLRetriever(artifact_dir=args.index_dir)
+    stats = retriever.build(args.dataset, workers=args.workers)
+    print(json.dumps(stats, indent=2))
+
+if __name__ == "__main__":
+    main()
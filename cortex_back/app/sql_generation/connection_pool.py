@@ -0,0 +1,241 @@
+import os
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Iterator, Optional, Tuple
+
+from app.core.config import (
+    OMOP_POOL_SIZE, OMOP_DB_IMMUTABLE, OMOP_CACHE_SIZE_KB, OMOP_MMAP_SIZE, OMOP_POOL_HEALTH_INTERVAL
+)
+
+from .sql_execution import connect_read_only
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """No se liberó ninguna conexión del pool a tiempo"""
+
+
+def file_fingerprint(path: Path) -> Tuple[int, int, int]:
+    """Identidad del fichero (inodo, tamaño, mtime): cambia si se reconstruye la base de datos"""
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "generation", "last_used")
+
+    def __init__(self, conn: sqlite3.Connection, generation: int):
+        self.conn = conn
+        self.generation = generation
+        self.last_used = time.monotonic()
+
+
+class ReadOnlyConnectionPool:
+    """
+    Pool de conexiones de solo lectura a una base de datos SQLite.
+
+    Las conexiones se abren con mode=ro (e immutable=1 si la base de datos no
+    cambia mientras corre el servidor, lo que evita bloqueos y comprobaciones de
+    cambios), con cache_size y mmap_size ajustados, y se reutilizan entre
+    peticiones e hilos: el esquema ya está parseado y la caché de páginas caliente.
+
+    Antes de entregar una conexión inactiva más de `health_interval` segundos se
+    comprueba con SELECT 1 y se verifica que el fichero no haya cambiado; si se
+    reconstruyó, se descartan todas las conexiones abiertas sobre el anterior.
+
+    `connect` permite abrir las conexiones con otro motor (ver engines.py); por
+    defecto son conexiones sqlite3 de solo lectura.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        size: int = OMOP_POOL_SIZE,
+        immutable: bool = OMOP_DB_IMMUTABLE,
+        cache_size_kb: int = OMOP_CACHE_SIZE_KB,
+        mmap_size: int = OMOP_MMAP_SIZE,
+        health_interval: float = OMOP_POOL_HEALTH_INTERVAL,
+        connect: Optional[Callable[[], Any]] = None
+    ):
+        self.db_path = Path(db_path)
+        self.size = max(1, size)
+        self.immutable = immutable
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.health_interval = health_interval
+        self._connect_fn = connect
+
+        self._idle: "queue.LifoQueue[_PooledConnection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._generation = 0
+        self._fingerprint: Optional[Tuple[int, int, int]] = None
+        self._fingerprint_checked_at = 0.0
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'discarded': 0,
+            'health_checks': 0,
+            'health_failures': 0,
+            'file_changes': 0,
+            'waits': 0,
+            'wait_time_s': 0.0,
+        }
+
+    def _connect(self) -> _PooledConnection:
+        if self._connect_fn is not None:
+            conn = self._connect_fn()
+        else:
+            conn = connect_read_only(self.db_path, self.immutable, self.cache_size_kb, self.mmap_size)
+        with self._lock:
+            self._stats['created'] += 1
+            generation = self._generation
+        return _PooledConnection(conn, generation)
+
+    def _check_file(self):
+        """Invalidar el pool si el fichero de la base de datos cambió"""
+        now = time.monotonic()
+        with self._lock:
+            if self._fingerprint is not None and now - self._fingerprint_checked_at < self.health_interval:
+                return
+            self._fingerprint_checked_at = now
+        fingerprint = file_fingerprint(self.db_path)
+        with self._lock:
+            if self._fingerprint is not None and fingerprint != self._fingerprint:
+                self._generation += 1
+                self._stats['file_changes'] += 1
+                logger.info(f"{self.db_path} ha cambiado: se descartan las conexiones abiertas")
+            self._fingerprint = fingerprint
+
+    def _healthy(self, pooled: _PooledConnection) -> bool:
+        with self._lock:
+            if pooled.generation != self._generation:
+                return False
+        if time.monotonic() - pooled.last_used < self.health_interval:
+            return True
+        with self._lock:
+            self._stats['health_checks'] += 1
+        try:
+            pooled.conn.execute("SELECT 1").fetchone()
+            return True
+        except Exception as e:
+            logger.warning(f"Conexión del pool no válida, se descarta: {e}")
+            with self._lock:
+                self._stats['health_failures'] += 1
+            return False
+
+    def _discard(self, pooled: _PooledConnection):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+            self._stats['discarded'] += 1
+
+    def _acquire(self, timeout: float) -> _PooledConnection:
+        self._check_file()
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_open = self._open < self.size
+                    if can_open:
+                        self._open += 1
+                if can_open:
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._open -= 1
+                        raise
+                # Pool agotado: esperar a que se libere una conexión
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(f"Sin conexiones libres a {self.db_path.name} tras {timeout:g} s")
+                if not waited:
+                    waited = True
+                    with self._lock:
+                        self._stats['waits'] += 1
+                start = time.monotonic()
+                try:
+                    pooled = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                finally:
+                    with self._lock:
+                        self._stats['wait_time_s'] += time.monotonic() - start
+
+            if self._healthy(pooled):
+                with self._lock:
+                    self._stats['reused'] += 1
+                return pooled
+            self._discard(pooled)
+
+    def _release(self, pooled: _PooledConnection, broken: bool):
+        try:
+            # Dejar la conexión limpia para el siguiente uso (las de DuckDB no tienen progress handler)
+            if isinstance(pooled.conn, sqlite3.Connection):
+                pooled.conn.set_progress_handler(None, 0)
+                if pooled.conn.in_transaction:
+                    pooled.conn.rollback()
+        except sqlite3.Error:
+            broken = True
+        if broken:
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        self._idle.put(pooled)
+
+    @contextmanager
+    def connection(self, timeout: float = 30.0) -> Iterator[sqlite3.Connection]:
+        """Conexión prestada del pool; se devuelve (o se descarta si quedó inservible) al salir"""
+        pooled = self._acquire(timeout)
+        broken = False
+        try:
+            yield pooled.conn
+        except sqlite3.OperationalError:
+            # Errores de la consulta (tabla inexistente, interrupción...) no invalidan la conexión
+            raise
+        except (sqlite3.ProgrammingError, sqlite3.InterfaceError, sqlite3.DatabaseError):
+            broken = True
+            raise
+        finally:
+            self._release(pooled, broken)
+
+    def close(self):
+        """Cerrar las conexiones inactivas (las prestadas se cierran al devolverse)"""
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def get_stats(self) -> Dict[str, Any]:
+        idle = self._idle.qsize()
+        with self._lock:
+            stats = dict(self._stats)
+            open_connections = self._open
+        return {
+            **stats,
+            'wait_time_s': round(stats['wait_time_s'], 3),
+            'db_path': str(self.db_path),
+            'size': self.size,
+            'open': open_connections,
+            'idle': idle,
+            'in_use': open_connections - idle,
+            'immutable': self.immutable,
+            'cache_size_kb': self.cache_size_kb,
+            'mmap_size': self.mmap_size,
+        }
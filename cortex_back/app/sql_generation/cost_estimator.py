@@ -0,0 +1,281 @@
+import re
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from app.core.config import SQL_COST_MAX_ROWS, SQL_COST_LARGE_TABLE_ROWS
+from .connection_pool import file_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Sin sqlite_stat1 (ANALYZE), SQLite supone ~10 filas por valor de un índice y
+# que una condición de rango deja 1/4 de la tabla; se usan las mismas hipótesis
+DEFAULT_ROWS_PER_KEY = 10
+RANGE_SELECTIVITY = 4
+
+# Columnas hacia las que se orienta al modelo cuando lee una tabla entera
+PREFERRED_COLUMN_RE = re.compile(r"(concept_id|^person_id)$")
+
+_LOOP_RE = re.compile(r"^(SCAN|SEARCH) (\S+)(?: USING (.*))?$")
+_INDEX_RE = re.compile(r"\bINDEX (\S+)")
+_CONSTRAINTS_RE = re.compile(r"\(([^()]*)\)\s*$")
+_EQ_RE = re.compile(r"(\w+)=\?")
+_SUBQUERY_RE = re.compile(r"^(CO-ROUTINE|MATERIALIZE) (\S+)")
+
+
+class TableStats:
+    """
+    Estadísticas de la base de datos OMOP para el estimador de coste.
+
+    Filas por tabla (de sqlite_stat1 si se ejecutó ANALYZE; si no, MAX(rowid),
+    que es inmediato y coincide con COUNT(*) en tablas sin borrados), columnas
+    iniciales de cada índice y filas medias por clave de cada índice.
+    """
+
+    def __init__(
+        self,
+        rows: Dict[str, int],
+        indexes: Dict[str, Dict[str, List[str]]],
+        columns: Dict[str, List[str]],
+        index_stats: Optional[Dict[str, List[int]]] = None
+    ):
+        self.rows = rows
+        self.indexes = indexes              # tabla -> {índice: columnas}
+        self.columns = columns              # tabla -> columnas
+        self.index_stats = index_stats or {}
+
+    @classmethod
+    def from_sqlite(cls, db_path) -> "TableStats":
+        conn = sqlite3.connect(f"file:{Path(db_path).resolve()}?mode=ro", uri=True)
+        try:
+            tables = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            )]
+            index_stats: Dict[str, List[int]] = {}
+            table_rows: Dict[str, int] = {}
+            has_stat1 = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+            ).fetchone()
+            if has_stat1:
+                for table, index, stat in conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1"):
+                    numbers = [int(n) for n in str(stat).split() if n.isdigit()]
+                    if not numbers:
+                        continue
+                    table_rows[table.lower()] = numbers[0]
+                    if index:
+                        index_stats[index.lower()] = numbers[1:]
+
+            rows, indexes, columns = {}, {}, {}
+            for table in tables:
+                key = table.lower()
+                info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+                columns[key] = [col[1].lower() for col in info]
+                table_indexes = {}
+                pk = [col for col in info if col[5]]
+                if len(pk) == 1 and (pk[0][2] or "").upper() == "INTEGER":
+                    table_indexes['integer primary key'] = [pk[0][1].lower()]
+                for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+                    index_columns = conn.execute(f'PRAGMA index_info("{index[1]}")').fetchall()
+                    table_indexes[index[1].lower()] = [str(col[2]).lower() for col in index_columns]
+                indexes[key] = table_indexes
+                if key in table_rows:
+                    rows[key] = table_rows[key]
+                else:
+                    try:
+                        rows[key] = conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+                    except sqlite3.OperationalError:
+                        # WITHOUT ROWID
+                        rows[key] = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+        finally:
+            conn.close()
+        return cls(rows, indexes, columns, index_stats)
+
+    def indexed_columns(self, table: str) -> List[str]:
+        """Columnas por las que se puede buscar con un índice (la primera de cada índice)"""
+        seen = []
+        for index_columns in self.indexes.get(table, {}).values():
+            if index_columns and index_columns[0] not in seen:
+                seen.append(index_columns[0])
+        return seen
+
+    def rows_per_key(self, index: str, n_columns: int) -> Optional[int]:
+        stats = self.index_stats.get(index.lower())
+        if not stats:
+            return None
+        return stats[min(n_columns, len(stats)) - 1]
+
+
+class CostEstimator:
+    """
+    Estimación del coste de una consulta a partir de su plan (EXPLAIN QUERY PLAN)
+    y de las estadísticas de las tablas, antes de ejecutarla.
+
+    Los bucles de un mismo SELECT se anidan en el orden del plan, así que cada
+    SCAN/SEARCH se multiplica por las filas de los bucles exteriores: un producto
+    cartesiano o un JOIN sin índice dispara la estimación. Se señalan los
+    recorridos completos de tablas grandes y los índices automáticos (JOIN por
+    una columna sin índice) y se sugieren las columnas indexadas *_concept_id y
+    person_id de esas tablas.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        max_rows: int = SQL_COST_MAX_ROWS,
+        large_table_rows: int = SQL_COST_LARGE_TABLE_ROWS,
+        stats: Optional[TableStats] = None
+    ):
+        self.db_path = Path(db_path)
+        self.max_rows = max_rows
+        self.large_table_rows = large_table_rows
+        # Con `stats` dadas no se lee la base de datos
+        self._stats = stats
+        self._fixed_stats = stats is not None
+        self._fingerprint: Optional[Tuple[int, int, int]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> TableStats:
+        """Estadísticas de la base de datos (se recargan si el fichero cambia)"""
+        if self._fixed_stats:
+            return self._stats
+        fingerprint = file_fingerprint(self.db_path)
+        with self._lock:
+            if self._stats is None or fingerprint != self._fingerprint:
+                self._stats = TableStats.from_sqlite(self.db_path)
+                logger.info(f"Estadísticas de coste cargadas: {len(self._stats.rows)} tablas")
+            self._fingerprint = fingerprint
+            return self._stats
+
+    @staticmethod
+    def _aliases(sql: str) -> Dict[str, str]:
+        """Alias -> tabla (el plan de SQLite nombra las tablas por su alias)"""
+        try:
+            tree = sqlglot.parse_one(sql, read="sqlite")
+        except SqlglotError:
+            return {}
+        return {table.alias_or_name.lower(): table.name.lower() for table in tree.find_all(exp.Table)}
+
+    def estimate(self, sql: str, plan: List[str]) -> Dict[str, Any]:
+        stats = self.stats
+        state = {
+            'aliases': self._aliases(sql),
+            'derived': {},
+            'full_scans': [],
+            'unindexed_joins': [],
+        }
+        estimated_rows, _ = self._cost(self._tree(plan), stats, state)
+        estimated_rows = int(estimated_rows)
+
+        full_scans = {}
+        for scan in state['full_scans']:
+            full_scans.setdefault(scan['table'], scan)
+        estimate = {
+            'estimated_rows': estimated_rows,
+            'full_scans': list(full_scans.values()),
+            'unindexed_joins': state['unindexed_joins'],
+            'max_rows': self.max_rows,
+            'exceeds_threshold': bool(self.max_rows) and estimated_rows > self.max_rows,
+        }
+        estimate['hints'] = self._hints(estimate, stats)
+        return estimate
+
+    @staticmethod
+    def _tree(plan: List[str]) -> List[dict]:
+        """Árbol del plan a partir de la sangría (dos espacios por nivel)"""
+        root = {'text': "", 'children': []}
+        stack = [(-1, root)]
+        for line in plan:
+            depth = (len(line) - len(line.lstrip(" "))) // 2
+            node = {'text': line.strip(), 'children': []}
+            while stack[-1][0] >= depth:
+                stack.pop()
+            stack[-1][1]['children'].append(node)
+            stack.append((depth, node))
+        return root['children']
+
+    def _cost(self, nodes: List[dict], stats: TableStats, state: dict) -> Tuple[float, float]:
+        """(filas leídas, filas producidas) por los bucles anidados de un nivel del plan"""
+        rows_read, outer = 0.0, 1.0
+        for node in nodes:
+            text = node['text']
+            loop = _LOOP_RE.match(text)
+            if text == "SCAN CONSTANT ROW":
+                continue
+            if loop:
+                loop_rows, build = self._loop_rows(loop.group(1), loop.group(2), loop.group(3) or "", stats, state)
+                rows_read += build + outer * loop_rows
+                outer *= max(loop_rows, 1)
+            elif text.startswith("MULTI-INDEX OR"):
+                loop_rows = 0.0
+                for part in node['children']:
+                    sub_read, _ = self._cost(part['children'], stats, state)
+                    loop_rows += sub_read
+                rows_read += outer * loop_rows
+                outer *= max(loop_rows, 1)
+            else:
+                sub_read, sub_out = self._cost(node['children'], stats, state)
+                subquery = _SUBQUERY_RE.match(text)
+                if subquery:
+                    state['derived'][subquery.group(2).lower()] = sub_out
+                # Una subconsulta correlacionada se repite por cada fila exterior
+                rows_read += outer * sub_read if text.startswith("CORRELATED") else sub_read
+        return rows_read, outer
+
+    def _loop_rows(self, kind: str, name: str, using: str, stats: TableStats, state: dict) -> Tuple[float, float]:
+        """(filas por iteración del bucle, coste único de construir un índice automático)"""
+        table = state['aliases'].get(name.lower(), name.lower())
+        if table not in stats.rows:
+            # CTE o subconsulta: sus filas ya se estimaron al recorrer su rama
+            return state['derived'].get(name.lower(), 1), 0
+        rows = stats.rows[table]
+        index = _INDEX_RE.search(using)
+
+        if kind == 'SCAN':
+            if rows >= self.large_table_rows:
+                state['full_scans'].append({'table': table, 'rows': rows, 'index': index.group(1) if index else None})
+            return rows, 0
+
+        constraints = _CONSTRAINTS_RE.search(using)
+        constraints = constraints.group(1) if constraints else ""
+        eq_columns = _EQ_RE.findall(constraints)
+        if "AUTOMATIC" in using:
+            # SQLite crea un índice temporal: recorre la tabla entera una vez
+            state['unindexed_joins'].append({'table': table, 'columns': [c.lower() for c in eq_columns]})
+            if rows >= self.large_table_rows:
+                state['full_scans'].append({'table': table, 'rows': rows, 'index': None})
+            return min(rows, DEFAULT_ROWS_PER_KEY), rows
+        if not eq_columns:
+            return max(1, rows // RANGE_SELECTIVITY), 0
+        if "PRIMARY KEY" in using:
+            return 1, 0
+        per_key = stats.rows_per_key(index.group(1), len(eq_columns)) if index else None
+        return min(rows, per_key if per_key is not None else DEFAULT_ROWS_PER_KEY), 0
+
+    def _hints(self, estimate: Dict[str, Any], stats: TableStats) -> List[str]:
+        """Indicaciones para el prompt de corrección (en inglés, como el resto del prompt)"""
+        hints = []
+        for scan in estimate['full_scans']:
+            indexed = [c for c in stats.indexed_columns(scan['table']) if PREFERRED_COLUMN_RE.search(c)]
+            candidates = indexed or [c for c in stats.columns.get(scan['table'], []) if PREFERRED_COLUMN_RE.search(c)]
+            hint = f"full scan of {scan['table']} ({scan['rows']:,} rows)"
+            if candidates:
+                hint += f"; filter on {'indexed ' if indexed else ''}{' or '.join(candidates[:2])}"
+            hints.append(hint)
+        for join in estimate['unindexed_joins']:
+            if join['columns']:
+                hints.append(f"no index on {join['table']}.{', '.join(join['columns'])}; join on person_id or *_concept_id")
+        return hints
+
+
+def cost_feedback(estimate: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Resumen del estimador para el prompt de corrección (None si no hay nada que sugerir)"""
+    if not estimate or not estimate.get('hints'):
+        return None
+    return f"Too expensive (~{estimate['estimated_rows']:,} rows read): {estimate['hints'][0]}"
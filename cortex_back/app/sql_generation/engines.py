@@ -0,0 +1,254 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import sqlglot
+from sqlglot.errors import SqlglotError
+
+from app.core.config import (
+    SQL_ENGINE, DUCKDB_SOURCE, DUCKDB_PARQUET_DIR, DUCKDB_THREADS,
+    OMOP_DB_IMMUTABLE, OMOP_CACHE_SIZE_KB, OMOP_MMAP_SIZE
+)
+from .sql_execution import connect_read_only, explain_sql, install_budget, pause_budget, resume_budget
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ('sqlite', 'duckdb')
+DUCKDB_SOURCES = ('attach', 'parquet')
+
+
+class EngineUnavailableError(Exception):
+    """El motor configurado necesita una dependencia opcional que no está instalada"""
+
+
+def require_duckdb():
+    """duckdb es opcional: solo se necesita con SQL_ENGINE=duckdb"""
+    try:
+        import duckdb
+    except ImportError:
+        raise EngineUnavailableError("SQL_ENGINE=duckdb requiere el paquete duckdb (pip install duckdb)")
+    return duckdb
+
+
+class SQLiteEngine:
+    """Motor por defecto: conexiones de solo lectura de sqlite3 sobre la base de datos OMOP"""
+
+    name = "sqlite"
+
+    def __init__(
+        self,
+        db_path,
+        immutable: bool = OMOP_DB_IMMUTABLE,
+        cache_size_kb: int = OMOP_CACHE_SIZE_KB,
+        mmap_size: int = OMOP_MMAP_SIZE
+    ):
+        self.db_path = Path(db_path)
+        self.immutable = immutable
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+
+    def connect(self):
+        return connect_read_only(self.db_path, self.immutable, self.cache_size_kb, self.mmap_size)
+
+    def prepare(self, sql: str) -> str:
+        return sql
+
+    def explain(self, conn, sql: str) -> List[str]:
+        return explain_sql(conn, sql)
+
+    def install_budget(self, conn, time_budget: float, step_budget: int) -> dict:
+        return install_budget(conn, time_budget, step_budget)
+
+    def pause_budget(self, conn, budget: dict):
+        pause_budget(budget)
+
+    def resume_budget(self, conn, budget: dict):
+        resume_budget(budget)
+
+    def clear_budget(self, conn, budget: Optional[dict]):
+        conn.set_progress_handler(None, 0)
+
+    def interrupt(self, conn):
+        conn.interrupt()
+
+    def get_info(self) -> Dict[str, Any]:
+        return {'engine': self.name, 'db_path': str(self.db_path), 'immutable': self.immutable}
+
+
+class DuckDBEngine:
+    """
+    Motor analítico: DuckDB ejecuta las consultas en paralelo y por columnas.
+
+    source='attach' adjunta el mismo fichero SQLite en solo lectura (extensión
+    sqlite de DuckDB); source='parquet' crea una vista por cada tabla OMOP
+    convertida a Parquet (ver convert_sqlite_to_parquet), que es lo más rápido
+    para agregaciones. El SQL se genera para SQLite y se traduce con sqlglot
+    antes de ejecutarlo. DuckDB no tiene progress handler: el presupuesto de
+    tiempo se aplica con un temporizador que llama a interrupt(); el de pasos
+    de la VM no existe en este motor.
+    """
+
+    name = "duckdb"
+
+    def __init__(
+        self,
+        db_path,
+        source: str = DUCKDB_SOURCE,
+        parquet_dir=DUCKDB_PARQUET_DIR,
+        threads: int = DUCKDB_THREADS
+    ):
+        if source not in DUCKDB_SOURCES:
+            raise ValueError(f"Origen de DuckDB desconocido: {source} (usar {', '.join(DUCKDB_SOURCES)})")
+        require_duckdb()
+        self.db_path = Path(db_path)
+        self.source = source
+        self.parquet_dir = Path(parquet_dir)
+        self.threads = threads
+
+    def connect(self):
+        duckdb = require_duckdb()
+        config = {'threads': self.threads} if self.threads > 0 else {}
+        conn = duckdb.connect(":memory:", config=config)
+        try:
+            conn.execute("SET enable_progress_bar = false")
+            if self.source == 'parquet':
+                files = sorted(self.parquet_dir.glob("*.parquet"))
+                if not files:
+                    raise FileNotFoundError(f"No hay tablas Parquet en {self.parquet_dir}")
+                for path in files:
+                    conn.execute(f"CREATE VIEW \"{path.stem}\" AS SELECT * FROM read_parquet('{path.as_posix()}')")
+            else:
+                conn.execute(f"ATTACH '{self.db_path.resolve().as_posix()}' AS omop (TYPE sqlite, READ_ONLY)")
+                conn.execute("USE omop")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def prepare(self, sql: str) -> str:
+        """Traducir del dialecto SQLite (el que genera el modelo) al de DuckDB"""
+        try:
+            return sqlglot.transpile(sql.strip().rstrip(";"), read="sqlite", write="duckdb")[0]
+        except (SqlglotError, IndexError) as e:
+            logger.debug(f"No se pudo traducir a DuckDB, se usa el SQL original: {e}")
+            return sql
+
+    def explain(self, conn, sql: str) -> List[str]:
+        """
+        Operadores del plan físico: 'SEQ_SCAN person [year_of_birth>1980] (~200 filas)'.
+        Con source='parquet' los recorridos aparecen como READ_PARQUET (la vista no
+        conserva el nombre de la tabla).
+        """
+        rows = conn.execute(f"EXPLAIN (FORMAT json) {sql}").fetchall()
+        lines: List[str] = []
+
+        def walk(node, depth):
+            info = node.get('extra_info') or {}
+            detail = info.get('Table') or ""
+            cardinality = info.get('Estimated Cardinality')
+            text = node.get('name', "").strip() + (f" {detail.split('.')[-1]}" if detail else "")
+            if info.get('Filters'):
+                text += f" [{' '.join(str(info['Filters']).split())}]"
+            if cardinality:
+                text += f" (~{cardinality} filas)"
+            lines.append("  " * depth + text)
+            for child in node.get('children', ()):
+                walk(child, depth + 1)
+
+        for _, plan in rows:
+            for node in json.loads(plan):
+                walk(node, 0)
+        return lines
+
+    def install_budget(self, conn, time_budget: float, step_budget: int) -> dict:
+        state = {'exceeded': None, 'limit': None, 'timer': None, 'remaining': time_budget or None, 'deadline': None}
+
+        def expire():
+            state['exceeded'] = f"más de {time_budget:g} s de ejecución"
+            state['limit'] = 'time'
+            conn.interrupt()
+
+        state['expire'] = expire
+        self.resume_budget(conn, state)
+        return state
+
+    def pause_budget(self, conn, budget: dict):
+        """Parar el temporizador guardando el tiempo que quedaba"""
+        if budget.get('timer'):
+            budget['timer'].cancel()
+            budget['timer'] = None
+            budget['remaining'] = max(budget['deadline'] - time.monotonic(), 0.0)
+            budget['deadline'] = None
+
+    def resume_budget(self, conn, budget: dict):
+        if budget.get('remaining') is not None and budget.get('timer') is None:
+            budget['deadline'] = time.monotonic() + budget['remaining']
+            budget['timer'] = threading.Timer(budget['remaining'], budget['expire'])
+            budget['timer'].daemon = True
+            budget['timer'].start()
+
+    def clear_budget(self, conn, budget: Optional[dict]):
+        if budget and budget.get('timer'):
+            budget['timer'].cancel()
+
+    def interrupt(self, conn):
+        conn.interrupt()
+
+    def get_info(self) -> Dict[str, Any]:
+        info = {'engine': self.name, 'db_path': str(self.db_path), 'source': self.source, 'threads': self.threads}
+        if self.source == 'parquet':
+            info['parquet_dir'] = str(self.parquet_dir)
+        return info
+
+
+def create_engine(name: Optional[str], db_path, **kwargs):
+    """Motor de ejecución por nombre (SQL_ENGINE)"""
+    name = (name or SQL_ENGINE).lower()
+    if name == 'sqlite':
+        return SQLiteEngine(db_path, **kwargs)
+    if name == 'duckdb':
+        return DuckDBEngine(db_path, **kwargs)
+    raise ValueError(f"Motor SQL desconocido: {name} (usar {', '.join(ENGINES)})")
+
+
+def convert_sqlite_to_parquet(db_path, out_dir, batch_size: int = 100_000) -> Dict[str, int]:
+    """
+    Convertir cada tabla de la base de datos SQLite en out_dir/<tabla>.parquet
+    (por lotes, un row group por lote). Devuelve las filas escritas por tabla.
+    """
+    from .result_export import ArrowBatches, declared_arrow_type, require_pyarrow
+    pa = require_pyarrow()
+    import pyarrow.parquet as pq
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written = {}
+    conn = sqlite3.connect(f"file:{Path(db_path).resolve()}?mode=ro", uri=True)
+    try:
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        for table in tables:
+            info = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+            schema = pa.schema([pa.field(col[1].lower(), declared_arrow_type(pa, col[2]) or pa.string()) for col in info])
+            batches = ArrowBatches(pa, schema.names, schema=schema)
+            cursor = conn.execute(f'SELECT * FROM "{table}"')
+            count = 0
+            tmp_path = out_dir / f"{table.lower()}.parquet.tmp"
+            with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    writer.write_table(pa.Table.from_batches([batches.batch(rows)]))
+                    count += len(rows)
+            tmp_path.replace(out_dir / f"{table.lower()}.parquet")
+            written[table.lower()] = count
+            logger.info(f"{table}: {count} filas -> {out_dir / (table.lower() + '.parquet')}")
+    finally:
+        conn.close()
+    return written
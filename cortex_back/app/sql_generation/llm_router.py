@@ -0,0 +1,252 @@
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Iterator, AsyncIterator
+
+from app.core.config import OLLAMA_TIERS
+from .ollama_client import OllamaClient, AsyncOllamaClient
+from .ollama_health import OllamaHealthMonitor, OPEN
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BackendSpec:
+    url: str
+    model: str
+    weight: float = 1.0
+    tier: str = "main"
+
+
+def parse_backends(spec: str, default_url: str, default_model: str) -> List[BackendSpec]:
+    """
+    Backends de OLLAMA_BACKENDS: entradas `url|modelo|peso|nivel` separadas por comas
+    (peso y nivel opcionales). Vacío: un único backend con OLLAMA_BASE_URL y OLLAMA_MODEL.
+
+    Ejemplo: http://gpu0:11434|qwen2.5-coder:7b|1|fast,http://gpu0:11434|deepseek-coder-v2:16b|1|main
+    """
+    backends = []
+    for entry in (spec or "").split(","):
+        fields = [f.strip() for f in entry.split("|")]
+        if not fields[0]:
+            continue
+        if len(fields) < 2 or not fields[1]:
+            raise ValueError(f"Backend de Ollama sin modelo: '{entry}' (formato url|modelo|peso|nivel)")
+        weight = float(fields[2]) if len(fields) > 2 and fields[2] else 1.0
+        tier = fields[3] if len(fields) > 3 and fields[3] else "main"
+        backends.append(BackendSpec(fields[0].rstrip("/"), fields[1], weight, tier))
+    return backends or [BackendSpec(default_url, default_model)]
+
+
+class Backend:
+    """Un modelo en una instancia de Ollama, con su monitor de salud y sus estadísticas"""
+
+    def __init__(
+        self,
+        spec: BackendSpec,
+        client: OllamaClient,
+        async_client: AsyncOllamaClient,
+        health: OllamaHealthMonitor,
+        latency_window: int = 200
+    ):
+        self.spec = spec
+        self.client = client
+        self.async_client = async_client
+        self.health = health
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=latency_window)
+        self._ewma_s: Optional[float] = None
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self._stats = {'requests': 0, 'failures': 0, 'rejected': 0}
+
+    @property
+    def model_name(self) -> str:
+        return self.spec.model
+
+    @property
+    def name(self) -> str:
+        return f"{self.spec.model}@{self.spec.url}"
+
+    def available(self) -> bool:
+        # Sin efectos: elegir un backend no ocupa la petición de prueba del circuito
+        return self.health.accepting_requests() and self.health.model_available()
+
+    def _admit(self) -> bool:
+        """Admisión por el circuit breaker justo antes de llamar a Ollama"""
+        if self.health.allow_request():
+            return True
+        with self._lock:
+            self._stats['rejected'] += 1
+        return False
+
+    def load(self) -> float:
+        """Carga relativa a la capacidad: peticiones en curso / peso"""
+        with self._lock:
+            return self.in_flight / max(self.spec.weight, 1e-6)
+
+    def latency_s(self) -> float:
+        with self._lock:
+            return self._ewma_s if self._ewma_s is not None else 0.0
+
+    @contextmanager
+    def _track(self):
+        with self._lock:
+            self.in_flight += 1
+            self._stats['requests'] += 1
+        start = time.perf_counter()
+        outcome = {'ok': False}
+        try:
+            yield outcome
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.in_flight -= 1
+                if outcome['ok']:
+                    self._latencies.append(elapsed)
+                    self._ewma_s = elapsed if self._ewma_s is None else 0.8 * self._ewma_s + 0.2 * elapsed
+                    self.consecutive_failures = 0
+                else:
+                    self._stats['failures'] += 1
+                    self.consecutive_failures += 1
+            # Fallos y éxitos alimentan el circuit breaker de este backend
+            if outcome['ok']:
+                self.health.record_success()
+            else:
+                self.health.record_failure()
+
+    def generate(self, prompt: str, **kwargs) -> Optional[str]:
+        if not self._admit():
+            return None
+        with self._track() as outcome:
+            text = self.client.generate(model_name=self.model_name, prompt=prompt, **kwargs)
+            outcome['ok'] = bool(text)
+            return text
+
+    async def agenerate(self, prompt: str, **kwargs) -> Optional[str]:
+        if not self._admit():
+            return None
+        with self._track() as outcome:
+            text = await self.async_client.generate(model_name=self.model_name, prompt=prompt, **kwargs)
+            outcome['ok'] = bool(text)
+            return text
+
+    def generate_stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        if not self._admit():
+            return
+        with self._track() as outcome:
+            for token in self.client.generate_stream(model_name=self.model_name, prompt=prompt, **kwargs):
+                outcome['ok'] = True
+                yield token
+
+    async def agenerate_stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        if not self._admit():
+            return
+        with self._track() as outcome:
+            async for token in self.async_client.generate_stream(model_name=self.model_name, prompt=prompt, **kwargs):
+                outcome['ok'] = True
+                yield token
+
+    def get_stats(self) -> Dict[str, Any]:
+        monitor = self.health.status()
+        with self._lock:
+            ordered = sorted(self._latencies)
+            stats = dict(self._stats)
+            in_flight, ewma, consecutive = self.in_flight, self._ewma_s, self.consecutive_failures
+
+        def pct(p):
+            return round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))], 3) if ordered else None
+
+        return {
+            'name': self.name,
+            'url': self.spec.url,
+            'model': self.spec.model,
+            'tier': self.spec.tier,
+            'weight': self.spec.weight,
+            'in_flight': in_flight,
+            'consecutive_failures': consecutive,
+            **stats,
+            'latency_ewma_s': round(ewma, 3) if ewma is not None else None,
+            'latency_p50_s': pct(50),
+            'latency_p95_s': pct(95),
+            'healthy': monitor['ollama_running'] and monitor['model_available'] and monitor['circuit_state'] != OPEN,
+            'monitor': monitor,
+        }
+
+
+class LLMRouter:
+    """
+    Reparto de generaciones entre varios backends de Ollama.
+
+    Los backends se agrupan por nivel (`tiers`, del más rápido al más capaz):
+    el intento N usa el nivel N-1, de modo que el primer intento va al modelo
+    pequeño y las correcciones escalan al grande. Dentro de un nivel se elige el
+    backend disponible menos cargado (peticiones en curso / peso; a igualdad, el
+    de menor latencia), dejando al final los que acaban de fallar: un fallo no
+    cambia carga ni latencia y sin esto el reintento volvería al mismo backend.
+    Si un nivel no tiene backends sanos se usa el siguiente.
+    """
+
+    def __init__(self, backends: List[Backend], tiers: Optional[List[str]] = None):
+        if not backends:
+            raise ValueError("El router necesita al menos un backend")
+        self.backends = backends
+        order = list(tiers or OLLAMA_TIERS)
+        # Niveles configurados en el orden dado; los desconocidos, al final
+        self.tiers = [t for t in order if any(b.spec.tier == t for b in backends)]
+        self.tiers += sorted({b.spec.tier for b in backends} - set(self.tiers))
+
+    @property
+    def primary(self) -> Backend:
+        """Backend de referencia: el primero del nivel más capaz"""
+        top = self.tiers[-1]
+        return next(b for b in self.backends if b.spec.tier == top)
+
+    @property
+    def model_names(self) -> List[str]:
+        return list(dict.fromkeys(b.model_name for b in self.backends))
+
+    def start(self):
+        for backend in self.backends:
+            backend.health.start()
+
+    def stop(self):
+        for backend in self.backends:
+            backend.health.stop()
+
+    def available(self) -> List[Backend]:
+        return [b for b in self.backends if b.available()]
+
+    def select(self, iteration: int = 1, exclude: Optional[Backend] = None) -> Backend:
+        """
+        Backend para el intento `iteration`, distinto de `exclude` (el que acaba
+        de fallar) si hay otro. Sin ninguno disponible devuelve el principal: la
+        generación fallará y se registrará como GenerationError.
+        """
+        available = [b for b in self.available() if b is not exclude]
+        if not available:
+            return self.primary
+
+        start = min(max(iteration, 1) - 1, len(self.tiers) - 1)
+        # Escalar desde el nivel del intento y, si no hay ninguno sano, bajar
+        preference = self.tiers[start:] + list(reversed(self.tiers[:start]))
+        for tier in preference:
+            candidates = [b for b in available if b.spec.tier == tier]
+            if candidates:
+                return min(candidates, key=lambda b: (
+                    b.consecutive_failures > 0, b.load(), b.latency_s(), -b.spec.weight
+                ))
+        return available[0]
+
+    def has_fallback(self, backend: Backend) -> bool:
+        """¿Hay otro backend disponible al que escalar si este no responde?"""
+        return any(b is not backend for b in self.available())
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'tiers': self.tiers,
+            'backends': [b.get_stats() for b in self.backends],
+        }
@@ -14,6 +14,19 @@ class SimilarExample(BaseModel):
     sql: str
     score: float
 
+class AttemptMetrics(BaseModel):
+    """Tokens y tiempos de Ollama de un intento de generación"""
+    iteration: int
+    model_name: Optional[str] = None
+    prompt_eval_count: Optional[int] = None
+    eval_count: Optional[int] = None
+    prompt_eval_ms: Optional[float] = None
+    eval_ms: Optional[float] = None
+    load_ms: Optional[float] = None
+    total_ms: Optional[float] = None
+    tokens_per_s: Optional[float] = None
+    truncated: bool = False
+
 class SQLGenerationResponse(BaseModel):
     question: str
     generated_sql: str
@@ -21,11 +34,45 @@ class SQLGenerationResponse(BaseModel):
     error_message: Optional[str] = None
     attempts_count: int
     similar_example: Optional[SimilarExample] = None
+    similar_examples: List[SimilarExample] = []
+    cached: bool = False
+    model_name: Optional[str] = None
+    attempt_metrics: List[AttemptMetrics] = []
 
 
 class SQLValidationRequest(BaseModel):
     sql_query: str
     question: Optional[str] = None
+    execute: bool = False                 # además de preparar la consulta, ejecutarla
+    max_rows: Optional[int] = None        # límite de filas al ejecutar
+
+class SQLExecutionRequest(BaseModel):
+    sql_query: str
+    cursor: Optional[str] = None          # next_cursor de la página anterior
+    max_rows: Optional[int] = None        # filas de esta página (por defecto SQL_EXECUTION_PAGE_SIZE)
+
+class SQLExportRequest(BaseModel):
+    sql_query: str
+    format: str = "csv"                   # csv, arrow (IPC stream) o parquet
+    max_rows: Optional[int] = None        # por defecto SQL_EXPORT_MAX_ROWS
+
+class TableScan(BaseModel):
+    table: str
+    rows: int
+    index: Optional[str] = None           # índice recorrido entero (COVERING INDEX), si lo hay
+
+class UnindexedJoin(BaseModel):
+    table: str
+    columns: List[str]
+
+class QueryCostEstimate(BaseModel):
+    """Coste estimado con el plan de SQLite y las estadísticas de las tablas OMOP"""
+    estimated_rows: int                   # filas leídas estimadas
+    full_scans: List[TableScan] = []      # recorridos completos de tablas grandes
+    unindexed_joins: List[UnindexedJoin] = []
+    max_rows: int
+    exceeds_threshold: bool = False
+    hints: List[str] = []
 
 class SQLValidationResponse(BaseModel):
     sql_query: str
@@ -35,4 +82,9 @@ class SQLValidationResponse(BaseModel):
     execution_error: Optional[str] = None
     execution_time: Optional[float] = None
     row_count: Optional[int] = None
-    question: Optional[str] = None
\ No newline at end of file
+    question: Optional[str] = None
+    validation_mode: Optional[str] = None
+    truncated: bool = False
+    query_plan: Optional[List[str]] = None
+    cached: bool = False
+    cost_estimate: Optional[QueryCostEstimate] = None
\ No newline at end of file
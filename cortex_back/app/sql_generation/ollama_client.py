@@ -1,11 +1,227 @@
 import requests
+import httpx
 import json
 import time
-from typing import Optional
+import bisect
+import threading
+from collections import deque
+from typing import Optional, Iterator, AsyncIterator, Callable, Dict, Any
 import logging
 
+from app.core.config import OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX
+
 logger = logging.getLogger(__name__)
 
+# load_duration por encima de este umbral indica que Ollama tuvo que cargar el modelo
+COLD_LOAD_MS = 500
+
+
+def build_payload(model_name: str, prompt: str, stream: bool, **kwargs) -> dict:
+    """Cuerpo de /api/generate común a los clientes síncrono y asíncrono"""
+    options = {
+        "temperature": kwargs.get("temperature", 0.05),
+        "top_p": kwargs.get("top_p", 0.9),
+        "repeat_penalty": kwargs.get("repeat_penalty", 1.1),
+        "num_predict": kwargs.get("max_tokens", 400),
+    }
+    num_ctx = kwargs.get("num_ctx", OLLAMA_NUM_CTX)
+    if num_ctx:
+        # Sin num_ctx suficiente Ollama trunca el prompt por el principio (el prefijo común)
+        options["num_ctx"] = num_ctx
+    payload = {
+        "model": model_name,
+        "prompt": prompt,
+        "stream": stream,
+        "options": options,
+    }
+    # Mantener el modelo cargado entre consultas (evita recargar 16B en la siguiente);
+    # keep_alive=None deja el valor por defecto del servidor
+    keep_alive = kwargs.get("keep_alive", OLLAMA_KEEP_ALIVE)
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    return payload
+
+
+class TTFTRecorder:
+    """
+    Tiempo hasta el primer token de las últimas generaciones, en dos series que
+    no se mezclan porque no miden lo mismo:
+
+    - 'server': duraciones de Ollama (carga + evaluación del prompt) de las
+      generaciones sin streaming; no incluyen red ni cola del cliente.
+    - 'client': reloj del cliente hasta el primer token de los streams.
+    """
+
+    SERIES = ('server', 'client')
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {series: deque(maxlen=window) for series in self.SERIES}
+        self._counts = {series: 0 for series in self.SERIES}
+        self._cold_loads = 0
+
+    def record(self, series: str, ttft_ms: float, load_ms: Optional[float] = None):
+        with self._lock:
+            self._samples[series].append(ttft_ms)
+            self._counts[series] += 1
+            if load_ms is not None and load_ms > COLD_LOAD_MS:
+                self._cold_loads += 1
+
+    def record_response(self, data: Dict[str, Any]):
+        """TTFT a partir de las duraciones (ns) que devuelve Ollama: carga + evaluación del prompt"""
+        load_ns = data.get("load_duration")
+        prompt_ns = data.get("prompt_eval_duration")
+        if isinstance(load_ns, (int, float)) and isinstance(prompt_ns, (int, float)):
+            self.record('server', (load_ns + prompt_ns) / 1e6, load_ns / 1e6)
+
+    def record_first_token(self, start: float, first_token_at: float):
+        """TTFT de un stream medido con el reloj del cliente (time.perf_counter)"""
+        self.record('client', (first_token_at - start) * 1000)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ordered = {series: sorted(samples) for series, samples in self._samples.items()}
+            counts, cold = dict(self._counts), self._cold_loads
+
+        def pct(values, p):
+            return round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))], 1) if values else None
+
+        stats = {'cold_loads': cold}
+        for series in self.SERIES:
+            stats[series] = {
+                'generations': counts[series],
+                'ttft_p50_ms': pct(ordered[series], 50),
+                'ttft_p95_ms': pct(ordered[series], 95),
+            }
+        return stats
+
+
+# Compartido por ambos clientes: un registro de TTFT por proceso
+ttft_recorder = TTFTRecorder()
+
+def get_ttft_stats() -> Dict[str, Any]:
+    return ttft_recorder.get_stats()
+
+
+def response_metrics(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Conteos de tokens y duraciones (ns -> ms) de la respuesta final de Ollama"""
+    def ms(key):
+        value = data.get(key)
+        return round(value / 1e6, 1) if isinstance(value, (int, float)) else None
+
+    eval_count = data.get("eval_count")
+    eval_ms = ms("eval_duration")
+    return {
+        'prompt_eval_count': data.get("prompt_eval_count"),
+        'eval_count': eval_count,
+        'prompt_eval_ms': ms("prompt_eval_duration"),
+        'eval_ms': eval_ms,
+        'load_ms': ms("load_duration"),
+        'total_ms': ms("total_duration"),
+        'tokens_per_s': round(eval_count / (eval_ms / 1000), 2) if eval_count and eval_ms else None,
+    }
+
+
+def stream_metrics(tokens: int, start: float, first_token_at: Optional[float]) -> Dict[str, Any]:
+    """
+    Métricas de un stream cortado antes de la respuesta final (sin duraciones de
+    Ollama): se aproximan con el reloj del cliente
+    """
+    now = time.perf_counter()
+    eval_ms = round((now - first_token_at) * 1000, 1) if first_token_at else None
+    return {
+        'prompt_eval_count': None,
+        'eval_count': tokens,
+        'prompt_eval_ms': round((first_token_at - start) * 1000, 1) if first_token_at else None,
+        'eval_ms': eval_ms,
+        'load_ms': None,
+        'total_ms': round((now - start) * 1000, 1),
+        'tokens_per_s': round(tokens / (eval_ms / 1000), 2) if tokens and eval_ms else None,
+        'truncated': True,
+    }
+
+
+class Histogram:
+    """Histograma de buckets fijos (límite superior inclusivo, el último es +inf)"""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{b:g}" for b in self.bounds] + ["le_inf"]
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 2) if self.count else None,
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+class GenerationTelemetry:
+    """
+    Histogramas por modelo de velocidad de generación, tiempo de evaluación del
+    prompt, carga del modelo y tokens de entrada/salida de cada generación.
+    """
+
+    BOUNDS = {
+        'tokens_per_s': (5, 10, 20, 40, 80, 160),
+        'prompt_eval_ms': (50, 100, 250, 500, 1000, 2500, 5000, 10000),
+        'eval_ms': (250, 500, 1000, 2500, 5000, 10000, 30000, 60000),
+        'load_ms': (10, 100, COLD_LOAD_MS, 2000, 10000, 30000),
+        'prompt_eval_count': (256, 512, 1024, 2048, 4096, 8192),
+        'eval_count': (32, 64, 128, 256, 512, 1024),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, model_name: str, metrics: Dict[str, Any]):
+        with self._lock:
+            entry = self._models.get(model_name)
+            if entry is None:
+                entry = {'generations': 0, 'truncated': 0, 'cold_loads': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                         'histograms': {name: Histogram(bounds) for name, bounds in self.BOUNDS.items()}}
+                self._models[model_name] = entry
+            entry['generations'] += 1
+            entry['truncated'] += bool(metrics.get('truncated'))
+            entry['cold_loads'] += (metrics.get('load_ms') or 0) > COLD_LOAD_MS
+            entry['prompt_tokens'] += metrics.get('prompt_eval_count') or 0
+            entry['completion_tokens'] += metrics.get('eval_count') or 0
+            for name, histogram in entry['histograms'].items():
+                value = metrics.get(name)
+                if isinstance(value, (int, float)):
+                    histogram.observe(value)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                model: {
+                    **{k: v for k, v in entry.items() if k != 'histograms'},
+                    'histograms': {name: h.snapshot() for name, h in entry['histograms'].items()},
+                }
+                for model, entry in self._models.items()
+            }
+
+
+generation_telemetry = GenerationTelemetry()
+
+def get_generation_telemetry() -> Dict[str, Any]:
+    return generation_telemetry.get_stats()
+
+
+def _report(model_name: str, metrics: Dict[str, Any], target: Optional[Dict[str, Any]]):
+    generation_telemetry.record(model_name, metrics)
+    if target is not None:
+        target.update(metrics)
+
 class OllamaClient:
     def __init__(self, base_url: str = "http://localhost:11434"):
         self.base_url = base_url
@@ -31,20 +247,20 @@ class OllamaClient:
             logger.error(f"Error listando modelos: {e}")
             return []
     
-    def generate(self, model_name: str, prompt: str, **kwargs) -> Optional[str]:
-        """Generar texto con el modelo especificado"""
+    def generate(
+        self,
+        model_name: str,
+        prompt: str,
+        metrics: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> Optional[str]:
+        """
+        Generar texto con el modelo especificado.
+        
+        Si se pasa `metrics` (dict) se rellena con los tokens y duraciones de la generación.
+        """
         try:
-            payload = {
-                "model": model_name,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": kwargs.get("temperature", 0.05),
-                    "top_p": kwargs.get("top_p", 0.9),
-                    "repeat_penalty": kwargs.get("repeat_penalty", 1.1),
-                    "num_predict": kwargs.get("max_tokens", 400),
-                }
-            }
+            payload = build_payload(model_name, prompt, stream=False, **kwargs)
             
             response = self.session.post(
                 f"{self.base_url}/api/generate",
@@ -54,6 +270,8 @@ class OllamaClient:
             
             if response.status_code == 200:
                 data = response.json()
+                ttft_recorder.record_response(data)
+                _report(model_name, response_metrics(data), metrics)
                 return data.get("response", "").strip()
             else:
                 logger.error(f"Error en Ollama: {response.status_code} - {response.text}")
@@ -63,7 +281,218 @@ class OllamaClient:
             logger.error(f"Error generando con Ollama: {e}")
             return None
     
-    def check_model_availability(self, model_name: str) -> bool:
-        """Verificar si un modelo específico está disponible"""
-        available_models = self.list_models()
-        return any(model_name in model for model in available_models)
\ No newline at end of file
+    def generate_stream(
+        self,
+        model_name: str,
+        prompt: str,
+        stop_condition: Optional[Callable[[str], bool]] = None,
+        metrics: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> Iterator[str]:
+        """
+        Generar texto en streaming, token a token.
+        
+        Si stop_condition(texto_acumulado) devuelve True se deja de leer y se cierra
+        la conexión, lo que aborta la generación en Ollama (no se pagan tokens extra).
+        `metrics` se rellena como en generate; si el stream se corta, con el reloj local.
+        """
+        payload = build_payload(model_name, prompt, stream=True, **kwargs)
+        start = time.perf_counter()
+        
+        try:
+            with self.session.post(
+                f"{self.base_url}/api/generate",
+                json=payload,
+                timeout=kwargs.get("timeout", 120),
+                stream=True
+            ) as response:
+                if response.status_code != 200:
+                    logger.error(f"Error en Ollama: {response.status_code} - {response.text}")
+                    return
+                
+                text = ""
+                tokens, first_token_at = 0, None
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        logger.error(f"Error en Ollama: {chunk['error']}")
+                        return
+                    
+                    token = chunk.get("response", "")
+                    if token:
+                        if not text:
+                            first_token_at = time.perf_counter()
+                            ttft_recorder.record_first_token(start, first_token_at)
+                        text += token
+                        tokens += 1
+                        yield token
+                    
+                    if chunk.get("done"):
+                        _report(model_name, response_metrics(chunk), metrics)
+                        return
+                    if stop_condition and stop_condition(text):
+                        logger.debug(f"Streaming detenido tras {len(text)} caracteres: sentencia completa")
+                        _report(model_name, stream_metrics(tokens, start, first_token_at), metrics)
+                        return
+                        
+        except Exception as e:
+            logger.error(f"Error generando con Ollama (streaming): {e}")
+    
+    def warmup(self, model_name: str, prompt: str = "", **kwargs) -> Optional[Dict[str, float]]:
+        """
+        Cargar el modelo y evaluar un prefijo de prompt sin generar (num_predict=1).
+        
+        Ollama reutiliza la caché KV del prefijo común en las siguientes peticiones.
+        Devuelve las duraciones de carga y de evaluación del prompt en ms.
+        """
+        try:
+            payload = build_payload(model_name, prompt, stream=False, max_tokens=1, **kwargs)
+            response = self.session.post(
+                f"{self.base_url}/api/generate",
+                json=payload,
+                timeout=kwargs.get("timeout", 600)
+            )
+            if response.status_code != 200:
+                logger.error(f"Error en el warmup de Ollama: {response.status_code} - {response.text}")
+                return None
+            data = response.json()
+            return {
+                'load_ms': round(data.get("load_duration", 0) / 1e6, 1),
+                'prompt_eval_ms': round(data.get("prompt_eval_duration", 0) / 1e6, 1),
+                'prompt_eval_count': data.get("prompt_eval_count", 0),
+            }
+        except Exception as e:
+            logger.error(f"Error en el warmup de Ollama: {e}")
+            return None
+    
+    def check_model_availability(self, model_name: str, available_models: Optional[list] = None) -> bool:
+        """Verificar si un modelo específico está disponible (en la lista dada o consultando Ollama)"""
+        if available_models is None:
+            available_models = self.list_models()
+        return any(model_name in model for model in available_models)
+
+
+class AsyncOllamaClient:
+    """
+    Cliente asíncrono de Ollama (httpx) para las rutas async.
+    
+    Mientras espera al modelo no ocupa ningún hilo del threadpool de FastAPI.
+    """
+    def __init__(self, base_url: str = "http://localhost:11434", max_connections: int = 10):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Se crea en el primer uso, dentro del event loop de la aplicación
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_connections=self.max_connections)
+            )
+        return self._client
+    
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def is_ollama_running(self) -> bool:
+        """Verificar si Ollama está ejecutándose"""
+        try:
+            response = await self.client.get("/api/tags", timeout=5)
+            return response.status_code == 200
+        except Exception:
+            return False
+    
+    async def list_models(self) -> list:
+        """Listar modelos disponibles en Ollama"""
+        try:
+            response = await self.client.get("/api/tags", timeout=10)
+            if response.status_code == 200:
+                return [model['name'] for model in response.json().get('models', [])]
+            return []
+        except Exception as e:
+            logger.error(f"Error listando modelos: {e}")
+            return []
+    
+    async def generate(
+        self,
+        model_name: str,
+        prompt: str,
+        metrics: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> Optional[str]:
+        """Generar texto con el modelo especificado (`metrics` como en OllamaClient.generate)"""
+        try:
+            response = await self.client.post(
+                "/api/generate",
+                json=build_payload(model_name, prompt, stream=False, **kwargs),
+                timeout=kwargs.get("timeout", 120)
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                ttft_recorder.record_response(data)
+                _report(model_name, response_metrics(data), metrics)
+                return data.get("response", "").strip()
+            logger.error(f"Error en Ollama: {response.status_code} - {response.text}")
+            return None
+            
+        except Exception as e:
+            logger.error(f"Error generando con Ollama: {e}")
+            return None
+    
+    async def generate_stream(
+        self,
+        model_name: str,
+        prompt: str,
+        stop_condition: Optional[Callable[[str], bool]] = None,
+        metrics: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """Generar texto en streaming; se corta al cumplirse stop_condition (ver OllamaClient)"""
+        start = time.perf_counter()
+        try:
+            async with self.client.stream(
+                "POST",
+                "/api/generate",
+                json=build_payload(model_name, prompt, stream=True, **kwargs),
+                timeout=kwargs.get("timeout", 120)
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    logger.error(f"Error en Ollama: {response.status_code} - {response.text}")
+                    return
+                
+                text = ""
+                tokens, first_token_at = 0, None
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        logger.error(f"Error en Ollama: {chunk['error']}")
+                        return
+                    
+                    token = chunk.get("response", "")
+                    if token:
+                        if not text:
+                            first_token_at = time.perf_counter()
+                            ttft_recorder.record_first_token(start, first_token_at)
+                        text += token
+                        tokens += 1
+                        yield token
+                    
+                    if chunk.get("done"):
+                        _report(model_name, response_metrics(chunk), metrics)
+                        return
+                    if stop_condition and stop_condition(text):
+                        _report(model_name, stream_metrics(tokens, start, first_token_at), metrics)
+                        return
+                        
+        except Exception as e:
+            logger.error(f"Error generando con Ollama (streaming): {e}")
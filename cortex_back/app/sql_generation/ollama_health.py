@@ -0,0 +1,227 @@
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+
+from app.core.config import (
+    OLLAMA_HEALTH_INTERVAL, OLLAMA_MODELS_TTL, OLLAMA_FAILURE_THRESHOLD, OLLAMA_CIRCUIT_RESET
+)
+from .ollama_client import OllamaClient
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class OllamaHealthMonitor:
+    """
+    Estado de Ollama mantenido en segundo plano.
+
+    Un hilo sondea Ollama cada `interval` segundos y la lista de modelos se
+    refresca solo cuando caduca su TTL, de modo que la ruta de cada petición
+    lee un estado en memoria en lugar de hacer dos peticiones HTTP.
+
+    Circuit breaker: tras `failure_threshold` fallos consecutivos (sondeos o
+    generaciones fallidas notificadas con record_failure) el circuito se abre y
+    las peticiones fallan de inmediato; pasado `reset_timeout` se prueba de nuevo
+    (half-open) con una única petición: las demás se rechazan hasta que
+    record_success o record_failure resuelven la prueba (o un sondeo correcto
+    cierra el circuito). Una prueba sin resolver caduca a los `reset_timeout` s.
+    """
+
+    def __init__(
+        self,
+        client: OllamaClient,
+        model_name: str,
+        interval: float = OLLAMA_HEALTH_INTERVAL,
+        models_ttl: float = OLLAMA_MODELS_TTL,
+        failure_threshold: int = OLLAMA_FAILURE_THRESHOLD,
+        reset_timeout: float = OLLAMA_CIRCUIT_RESET
+    ):
+        self.client = client
+        self.model_name = model_name
+        self.interval = interval
+        self.models_ttl = models_ttl
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._running = False
+        self._model_available = False
+        self._models: Optional[List[str]] = None
+        self._models_checked_at = 0.0
+        self._checked_at = 0.0
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_started: Optional[float] = None
+        self._consecutive_failures = 0
+        self._stats = {
+            'probes': 0,
+            'probe_failures': 0,
+            'model_list_refreshes': 0,
+            'circuit_opened': 0,
+            'rejected': 0,
+        }
+
+    def start(self):
+        """Arrancar el hilo de sondeo (idempotente)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ollama-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self._next_wait()):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error en el monitor de Ollama: {e}")
+
+    def _next_wait(self) -> float:
+        with self._lock:
+            if self._state == OPEN:
+                # Con el circuito abierto no tiene sentido sondear más rápido que el reset
+                remaining = self.reset_timeout - (time.monotonic() - self._opened_at)
+                return max(remaining, 0.0) or self.interval
+            return self.interval
+
+    def refresh(self):
+        """Sondear Ollama y, si ha caducado, refrescar la lista de modelos"""
+        running = self.client.is_ollama_running()
+        now = time.monotonic()
+
+        models, available, refreshed = self._models, self._model_available, False
+        if running:
+            with self._lock:
+                stale = (
+                    self._models is None
+                    or not self._running  # recuperación: los modelos pueden haber cambiado
+                    or now - self._models_checked_at >= self.models_ttl
+                )
+            if stale:
+                models = self.client.list_models()
+                available = self.client.check_model_availability(self.model_name, available_models=models)
+                refreshed = True
+
+        with self._lock:
+            self._stats['probes'] += 1
+            self._checked_at = now
+            if running:
+                if refreshed:
+                    self._stats['model_list_refreshes'] += 1
+                    self._models_checked_at = now
+                self._models, self._model_available = models, available
+                # Un sondeo correcto no cierra el circuito antes del reset: Ollama
+                # puede responder a /api/tags y seguir agotando los timeouts de generación
+                if self._state != OPEN or now - self._opened_at >= self.reset_timeout:
+                    if self._state != CLOSED:
+                        logger.info("Ollama disponible de nuevo: circuito cerrado")
+                    self._state = CLOSED
+                    self._trial_started = None
+                    self._consecutive_failures = 0
+            else:
+                self._stats['probe_failures'] += 1
+                self._register_failure(now)
+            self._running = running
+
+    def _register_failure(self, now: float):
+        self._consecutive_failures += 1
+        if self._state == HALF_OPEN or (
+            self._state == CLOSED and self._consecutive_failures >= self.failure_threshold
+        ):
+            if self._state == CLOSED:
+                self._stats['circuit_opened'] += 1
+                logger.warning(f"Ollama: {self._consecutive_failures} fallos consecutivos, circuito abierto")
+            self._state = OPEN
+            self._opened_at = now
+        self._trial_started = None
+
+    def record_failure(self):
+        """Notificar una generación fallida (timeout, error HTTP...)"""
+        with self._lock:
+            self._register_failure(time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._state = CLOSED
+            self._trial_started = None
+
+    def _ensure_checked(self):
+        # Primera petición antes del primer sondeo del hilo: comprobar en línea una vez
+        with self._lock:
+            checked = self._checked_at > 0
+        if not checked:
+            self.refresh()
+
+    def _trial_pending(self, now: float) -> bool:
+        return self._trial_started is not None and now - self._trial_started < self.reset_timeout
+
+    def allow_request(self) -> bool:
+        """
+        Admisión de una petición a Ollama. En half-open solo se admite la petición
+        de prueba: quien recibe True debe notificar el resultado con
+        record_success/record_failure. Para consultar sin ocupar la prueba, accepting_requests.
+        """
+        self._ensure_checked()
+        now = time.monotonic()
+        with self._lock:
+            if self._state == OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    self._stats['rejected'] += 1
+                    return False
+                self._state = HALF_OPEN
+                self._trial_started = None
+            if self._state == HALF_OPEN:
+                if self._trial_pending(now):
+                    self._stats['rejected'] += 1
+                    return False
+                if self._running:
+                    self._trial_started = now
+            return self._running
+
+    def accepting_requests(self) -> bool:
+        """Lectura del estado cacheado: ¿admitiría ahora allow_request una petición? (sin efectos)"""
+        self._ensure_checked()
+        now = time.monotonic()
+        with self._lock:
+            if self._state == OPEN and now - self._opened_at < self.reset_timeout:
+                return False
+            if self._state == HALF_OPEN and self._trial_pending(now):
+                return False
+            return self._running
+
+    def is_running(self) -> bool:
+        self._ensure_checked()
+        with self._lock:
+            return self._running
+
+    def model_available(self) -> bool:
+        self._ensure_checked()
+        with self._lock:
+            return self._model_available
+
+    def status(self) -> Dict[str, Any]:
+        self._ensure_checked()
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'ollama_running': self._running,
+                'model_available': self._model_available,
+                'models': list(self._models or []),
+                'circuit_state': self._state,
+                'trial_in_flight': self._state == HALF_OPEN and self._trial_pending(now),
+                'consecutive_failures': self._consecutive_failures,
+                'last_check_age_s': round(now - self._checked_at, 2),
+                'models_age_s': round(now - self._models_checked_at, 2) if self._models is not None else None,
+                **self._stats,
+            }
@@ -0,0 +1,308 @@
+import json
+import base64
+import datetime
+import decimal
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from app.core.config import (
+    SQL_EXECUTION_PAGE_SIZE, SQL_EXECUTION_MAX_ROWS, SQL_EXECUTION_BATCH_SIZE,
+    SQL_EXECUTION_TIME_BUDGET, SQL_EXECUTION_MAX_STREAMS, SQL_EXPORT_MAX_ROWS, SQL_EXPORT_BATCH_SIZE
+)
+from .sql_execution import record_error, new_result
+from .engines import create_engine
+from .validation_cache import sql_key
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidCursorError(ValueError):
+    """Cursor de paginación mal formado o de otra consulta"""
+
+
+class ExecutorBusyError(Exception):
+    """Se alcanzó el máximo de ejecuciones simultáneas"""
+
+
+def encode_cursor(sql: str, offset: int) -> str:
+    """
+    Cursor opaco: posición de la siguiente página ligada al SQL normalizado.
+
+    Es un OFFSET: cada página vuelve a ejecutar la consulta y descarta las
+    filas anteriores (coste O(offset), con la ordenación repetida). Solo se
+    emite para consultas con ORDER BY; sin orden las páginas no serían estables.
+    """
+    payload = json.dumps({'o': offset, 'h': sql_key(sql)[:16]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], sql: str) -> int:
+    """Offset del cursor (0 sin cursor); InvalidCursorError si no corresponde a este SQL"""
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        offset = int(payload['o'])
+        digest = payload['h']
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursorError(f"Cursor no válido: {e}")
+    if offset < 0 or digest != sql_key(sql)[:16]:
+        raise InvalidCursorError("El cursor no corresponde a esta consulta")
+    return offset
+
+
+def is_ordered(sql: str) -> bool:
+    """¿Tiene la consulta un ORDER BY exterior? (solo entonces las páginas son estables)"""
+    try:
+        tree = sqlglot.parse_one(sql, read="sqlite")
+    except SqlglotError:
+        return False
+    return isinstance(tree, exp.Query) and tree.args.get("order") is not None
+
+
+def json_value(value: Any) -> Any:
+    """Valores serializables en JSON (los BLOB en hexadecimal; fechas y DECIMAL de DuckDB)"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    return value
+
+
+class QueryPage:
+    """
+    Una página de resultados abierta sobre su propia conexión de solo lectura
+    (del motor configurado, que traduce el SQL y aplica el presupuesto de tiempo).
+
+    La consulta se envuelve en SELECT * FROM (...) LIMIT/OFFSET y las filas se
+    leen por lotes con fetchmany: nunca se materializa el resultado completo.
+    Al abrir solo se obtienen las columnas (LIMIT 0); la ejecución empieza en el
+    primer fetch(), y cancel() la interrumpe desde otro hilo (cliente desconectado).
+    El presupuesto de tiempo solo cuenta mientras se leen filas: entre lotes (el
+    cliente todavía consume el anterior) el reloj está parado.
+
+    Sin ORDER BY exterior no hay next_cursor: el orden de las filas no está
+    garantizado entre ejecuciones y el OFFSET podría repetir u omitir filas.
+    El ORDER BY debe ser total (p. ej. acabar en la clave primaria) para que
+    las filas con el mismo valor tampoco cambien de página.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        sql: str,
+        offset: int,
+        limit: int,
+        batch_size: int,
+        time_budget: float,
+        engine,
+        on_close=None
+    ):
+        self.conn = conn
+        self.engine = engine
+        self.sql = sql
+        self.offset = offset
+        self.limit = limit
+        self.batch_size = batch_size
+        self.returned = 0
+        self.has_more = False
+        self.done = False
+        self.cancelled = False
+        self._on_close = on_close
+        self._closed = False
+        self.ordered = is_ordered(sql)
+
+        self._body = self.engine.prepare(sql).strip().rstrip(";").strip()
+        self.budget = self.engine.install_budget(conn, time_budget, 0)
+        description = conn.execute(f"SELECT * FROM ({self._body}) LIMIT 0").description or ()
+        self.columns = [d[0] for d in description]
+        # Tipos de las columnas según el motor (DuckDB); sqlite3 no los da
+        self.column_types = [str(d[1]) if d[1] is not None else None for d in description]
+        self.cursor = None
+        self.engine.pause_budget(conn, self.budget)
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        if not self.has_more or not self.ordered:
+            return None
+        return encode_cursor(self.sql, self.offset + self.returned)
+
+    @property
+    def warning(self) -> Optional[str]:
+        if self.has_more and not self.ordered:
+            return "Resultado truncado: añade ORDER BY (por una clave única) para paginar"
+        return None
+
+    def fetch(self) -> List[list]:
+        """Siguiente lote de filas serializables en JSON (lista vacía al terminar la página)"""
+        return [[json_value(v) for v in row] for row in self.fetch_rows()]
+
+    def fetch_rows(self) -> List[tuple]:
+        """Siguiente lote de filas tal como las devuelve el motor"""
+        if self.done or self.cancelled:
+            return []
+        self.engine.resume_budget(self.conn, self.budget)
+        try:
+            if self.cursor is None:
+                # Una fila de más para saber si hay página siguiente
+                self.cursor = self.conn.execute(
+                    f"SELECT * FROM ({self._body}) LIMIT ? OFFSET ?", (self.limit + 1, self.offset)
+                )
+            remaining = self.limit - self.returned
+            # En el último lote se pide una fila más para saber si hay otra página
+            wanted = min(self.batch_size, remaining + 1)
+            rows = self.cursor.fetchmany(wanted)
+            if len(rows) > remaining:
+                self.has_more = True
+                self.done = True
+                rows = rows[:remaining]
+            elif len(rows) < wanted:
+                self.done = True
+            self.returned += len(rows)
+            return rows
+        finally:
+            self.engine.pause_budget(self.conn, self.budget)
+
+    def error_info(self, error: Exception) -> Dict[str, Any]:
+        result = record_error(new_result('execute'), error, self.budget)
+        if self.cancelled:
+            result['error'] = "Ejecución cancelada"
+            result['error_type'] = 'Cancelled'
+        return {'error': result['error'], 'error_type': result['error_type']}
+
+    def cancel(self):
+        self.cancelled = True
+        try:
+            self.engine.interrupt(self.conn)
+        except Exception:
+            pass
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self.engine.clear_budget(self.conn, self.budget)
+            self.conn.close()
+        finally:
+            if self._on_close:
+                self._on_close(self)
+
+
+class QueryExecutor:
+    """
+    Ejecución de consultas ya validadas devolviendo sus filas por páginas.
+
+    Cada ejecución abre una conexión propia (no ocupa el pool de validación) y
+    el número de ejecuciones simultáneas está limitado por `max_streams`. La
+    paginación usa cursores opacos con el offset de la siguiente página, así
+    que pedir la página N repite la consulta y salta las filas anteriores: está
+    pensada para hojear los primeros resultados, no para recorrer resultados
+    enteros (para eso, /export lee todo en una sola ejecución).
+    """
+
+    def __init__(
+        self,
+        db_path,
+        page_size: int = SQL_EXECUTION_PAGE_SIZE,
+        max_rows: int = SQL_EXECUTION_MAX_ROWS,
+        batch_size: int = SQL_EXECUTION_BATCH_SIZE,
+        time_budget: float = SQL_EXECUTION_TIME_BUDGET,
+        max_streams: int = SQL_EXECUTION_MAX_STREAMS,
+        export_max_rows: int = SQL_EXPORT_MAX_ROWS,
+        export_batch_size: int = SQL_EXPORT_BATCH_SIZE,
+        engine=None
+    ):
+        self.db_path = Path(db_path)
+        # Mismo motor que la validación (SQL_ENGINE) salvo que se indique otro
+        self.engine = engine or create_engine(None, self.db_path)
+        self.page_size = page_size
+        self.max_rows = max_rows
+        self.batch_size = max(1, batch_size)
+        self.time_budget = time_budget
+        self.max_streams = max(1, max_streams)
+        self.export_max_rows = export_max_rows
+        self.export_batch_size = max(1, export_batch_size)
+        self._slots = threading.BoundedSemaphore(self.max_streams)
+        self._lock = threading.Lock()
+        self._stats = {'executions': 0, 'active': 0, 'rejected_busy': 0, 'rows_streamed': 0, 'cancelled': 0}
+
+    def page_limit(self, requested: Optional[int]) -> int:
+        """Filas de la página: las pedidas (o page_size) sin superar max_rows"""
+        return max(1, min(requested or self.page_size, self.max_rows))
+
+    def open(
+        self,
+        sql: str,
+        cursor: Optional[str] = None,
+        max_rows: Optional[int] = None,
+        export: bool = False
+    ) -> QueryPage:
+        """
+        Abrir la página indicada por `cursor`; hay que llamar a close() al terminar.
+        Con export=True la página admite hasta export_max_rows filas leídas en lotes mayores.
+        """
+        offset = decode_cursor(cursor, sql)
+        if offset and not is_ordered(sql):
+            raise InvalidCursorError("La paginación requiere una consulta con ORDER BY")
+        if not self.db_path.exists():
+            raise FileNotFoundError(f"Base de datos OMOP no encontrada: {self.db_path}")
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected_busy'] += 1
+            raise ExecutorBusyError(f"Máximo de {self.max_streams} ejecuciones simultáneas alcanzado")
+
+        conn = None
+        try:
+            conn = self.engine.connect()
+            if export:
+                limit = max(1, min(max_rows or self.export_max_rows, self.export_max_rows))
+                batch_size = self.export_batch_size
+            else:
+                limit, batch_size = self.page_limit(max_rows), self.batch_size
+            page = QueryPage(
+                conn, sql, offset, limit, batch_size, self.time_budget, self.engine, on_close=self._release
+            )
+        except Exception:
+            if conn is not None:
+                conn.close()
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats['executions'] += 1
+            self._stats['active'] += 1
+        return page
+
+    def _release(self, page: QueryPage):
+        with self._lock:
+            self._stats['active'] -= 1
+            self._stats['rows_streamed'] += page.returned
+            if page.cancelled:
+                self._stats['cancelled'] += 1
+        self._slots.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            **stats,
+            'engine': self.engine.name,
+            'max_streams': self.max_streams,
+            'page_size': self.page_size,
+            'max_rows': self.max_rows,
+            'batch_size': self.batch_size,
+            'time_budget_s': self.time_budget,
+            'export_max_rows': self.export_max_rows,
+            'export_batch_size': self.export_batch_size,
+        }
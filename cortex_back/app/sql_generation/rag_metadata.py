@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import json
+import mmap
+import pickle
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Versión del formato en disco; incrementar ante cualquier cambio incompatible
+SCHEMA_VERSION = 1
+
+HEADER_FILE = "metadata.json"
+ROWS_FILE = "examples.jsonl"
+ROW_OFFSETS_FILE = "examples.offsets.npy"
+VARIANTS_FILE = "variants.npy"
+LEGACY_PICKLE_FILE = "metadata.pkl"
+
+
+class MetadataFormatError(ValueError):
+    """Metadatos RAG ausentes, corruptos o con versión de esquema no soportada"""
+
+
+class RAGMetadataStore:
+    """
+    Metadatos del índice RAG en formato versionado y sin pickle.
+
+    - examples.jsonl: una línea JSON por fila del dataset (row_id, pregunta canónica, SQL)
+    - examples.offsets.npy: offsets en bytes de cada línea (n_rows + 1)
+    - variants.npy: para cada vector FAISS, la posición de su fila en examples.jsonl
+
+    Los .npy se abren con mmap y examples.jsonl se mapea en memoria, de modo que
+    cargar el índice no deserializa nada y solo se decodifican las filas recuperadas.
+    """
+
+    def __init__(self, directory: Path, header: Dict[str, Any], row_offsets: np.ndarray,
+                 variant_rows: np.ndarray, data: Optional[mmap.mmap]):
+        self.directory = directory
+        self.header = header
+        self._row_offsets = row_offsets
+        self._variant_rows = variant_rows
+        self._data = data
+        self._decoded: Dict[int, Dict[str, Any]] = {}
+
+    @staticmethod
+    def exists(directory: Path) -> bool:
+        return (Path(directory) / HEADER_FILE).exists()
+
+    @classmethod
+    def write(cls, directory: Path, rows: List[Dict[str, Any]], variant_rows: List[int],
+              **extra: Any) -> Dict[str, Any]:
+        """Escribir filas de-duplicadas y el mapeo variante → fila"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        offsets = [0]
+        with (directory / ROWS_FILE).open("wb") as fp:
+            for row in rows:
+                line = json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n"
+                fp.write(line)
+                offsets.append(offsets[-1] + len(line))
+
+        np.save(directory / ROW_OFFSETS_FILE, np.asarray(offsets, dtype=np.int64))
+        np.save(directory / VARIANTS_FILE, np.asarray(variant_rows, dtype=np.int32))
+
+        header = {
+            "schema_version": SCHEMA_VERSION,
+            "n_rows": len(rows),
+            "n_variants": len(variant_rows),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            **extra,
+        }
+        # La cabecera se escribe al final: su presencia marca un artefacto completo
+        with (directory / HEADER_FILE).open("w", encoding="utf-8") as fp:
+            json.dump(header, fp, indent=2, ensure_ascii=False)
+        return header
+
+    @classmethod
+    def open(cls, directory: Path) -> "RAGMetadataStore":
+        directory = Path(directory)
+        header_path = directory / HEADER_FILE
+        if not header_path.exists():
+            raise FileNotFoundError(f"RAG metadata not found at {header_path}")
+
+        with header_path.open("r", encoding="utf-8") as fp:
+            header = json.load(fp)
+
+        version = header.get("schema_version")
+        if version != SCHEMA_VERSION:
+            raise MetadataFormatError(
+                f"Unsupported RAG metadata schema_version {version} (expected {SCHEMA_VERSION}); rebuild the index"
+            )
+
+        row_offsets = np.load(directory / ROW_OFFSETS_FILE, mmap_mode="r")
+        variant_rows = np.load(directory / VARIANTS_FILE, mmap_mode="r")
+        if len(row_offsets) != header["n_rows"] + 1 or len(variant_rows) != header["n_variants"]:
+            raise MetadataFormatError(f"RAG metadata at {directory} is inconsistent with its header")
+
+        data = None
+        if header["n_rows"]:
+            with (directory / ROWS_FILE).open("rb") as fp:
+                data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return cls(directory, header, row_offsets, variant_rows, data)
+
+    @property
+    def n_rows(self) -> int:
+        return self.header["n_rows"]
+
+    def __len__(self) -> int:
+        return self.header["n_variants"]
+
+    def row_position(self, variant_idx: int) -> int:
+        return int(self._variant_rows[variant_idx])
+
+    def row(self, position: int) -> Dict[str, Any]:
+        """Fila del dataset (row_id, canonical_question, sql) por posición"""
+        if position not in self._decoded:
+            start, end = int(self._row_offsets[position]), int(self._row_offsets[position + 1])
+            self._decoded[position] = json.loads(self._data[start:end])
+        return self._decoded[position]
+
+    def __getitem__(self, variant_idx: int) -> Dict[str, Any]:
+        if variant_idx < 0 or variant_idx >= len(self):
+            raise IndexError(variant_idx)
+        return self.row(self.row_position(variant_idx))
+
+    def close(self) -> None:
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._decoded.clear()
+
+
+def rows_from_records(records: List[Dict[str, Any]]) -> tuple[List[Dict[str, Any]], List[int]]:
+    """De-duplicar registros por variante (row_id, pregunta, sql) en filas + mapeo variante → fila"""
+    rows: List[Dict[str, Any]] = []
+    positions: Dict[Any, int] = {}
+    variant_rows: List[int] = []
+    for record in records:
+        row_id = record.get("row_id")
+        key = row_id if row_id is not None else (record["canonical_question"], record["sql"])
+        if key not in positions:
+            positions[key] = len(rows)
+            rows.append({
+                "row_id": row_id,
+                "canonical_question": record["canonical_question"],
+                "sql": record["sql"],
+            })
+        variant_rows.append(positions[key])
+    return rows, variant_rows
+
+
+def migrate_legacy_pickle(directory: Path, **extra: Any) -> Dict[str, Any]:
+    """Convertir un metadata.pkl antiguo (lista de dicts por variante) al formato versionado"""
+    directory = Path(directory)
+    legacy_path = directory / LEGACY_PICKLE_FILE
+    logger.info(f"Migrating legacy RAG metadata {legacy_path}")
+    with legacy_path.open("rb") as fp:
+        records = pickle.load(fp)
+
+    rows, variant_rows = rows_from_records(records)
+    header = RAGMetadataStore.write(directory, rows, variant_rows, migrated_from=LEGACY_PICKLE_FILE, **extra)
+    logger.info(f"Migrated {len(variant_rows)} variants into {len(rows)} rows")
+    return header
@@ -1,91 +1,206 @@
 from __future__ import annotations
 
-import pickle
+import hashlib
+import json
+import time
 from pathlib import Path
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Any
 import logging
 
 import faiss
 import numpy as np
 import pandas as pd
-from sentence_transformers import SentenceTransformer
+
+from app.core.config import EMBED_MODEL_NAME, RAG_BUILD_WORKERS, RAG_ALLOW_RUNTIME_BUILD
+from app.core.artifacts import ArtifactError, get_artifact_locator, file_sha256
+from app.core.embeddings import get_embedding_service
+from .rag_metadata import RAGMetadataStore, LEGACY_PICKLE_FILE, migrate_legacy_pickle
 
 logger = logging.getLogger(__name__)
 
 # Configuración por defecto
-EMBED_MODEL_NAME = "pritamdeka/BioBERT-mnli-snli-scinli-scitail-mednli-stsb"
 K_NEIGHBOURS = 5
+CHARS_PER_TOKEN = 4  # estimación conservadora para SQL/inglés sin tokenizer del LLM
+
+def estimate_tokens(text: str) -> int:
+    """Estimación aproximada de tokens de un texto"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+DATASET_CACHE_FILE = "dataset_columns.json"
+EMBEDDING_CACHE_FILE = "embedding_cache.npz"
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _row_key(metadata: dict):
+    row_id = metadata.get("row_id")
+    return row_id if row_id is not None else (metadata.get("canonical_question"), metadata.get("sql"))
 
 class MedicalSQLRetriever:
     """Retriever para buscar ejemplos similares de SQL usando embeddings semánticos"""
 
-    def __init__(self, model_name: str = EMBED_MODEL_NAME):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name: str = EMBED_MODEL_NAME, artifact_dir: Path | None = None):
+        self.model_name = model_name
+        self.embedder = get_embedding_service(model_name)
         self.index: faiss.Index | None = None
-        self.metadata: List[dict] | None = None  # one dict per vector
-        self.artifact_dir = Path("rag_index")
+        self.metadata: RAGMetadataStore | None = None  # variante FAISS → fila del dataset
+        self.artifact_dir = Path(artifact_dir) if artifact_dir else get_artifact_locator().rag_index_dir
         self.index_file = self.artifact_dir / "faiss.index"
-        self.meta_file = self.artifact_dir / "metadata.pkl"
+        self.legacy_meta_file = self.artifact_dir / LEGACY_PICKLE_FILE
+
+    def _read_dataset_columns(self, dataset_path: Path) -> Tuple[Dict[str, list], str, bool]:
+        """Leer la hoja una sola vez a un intermedio columnar, cacheado por hash del Excel"""
+        source_sha = file_sha256(dataset_path)
+        cache_file = self.artifact_dir / DATASET_CACHE_FILE
+        if cache_file.exists():
+            with cache_file.open("r", encoding="utf-8") as fp:
+                cached = json.load(fp)
+            if cached.get("source_sha256") == source_sha:
+                return cached["columns"], source_sha, True
 
-    def build(self, dataset_path: Path, question_cols: list[str] | None = None) -> None:
-        """Construir el índice RAG desde el dataset"""
-        logger.info(f"Loading dataset from {dataset_path}")
         df = pd.read_excel(dataset_path)
+        df = df.astype(object).where(df.notna(), None)
+        columns = {str(c): df[c].tolist() for c in df.columns}
+
+        self.artifact_dir.mkdir(parents=True, exist_ok=True)
+        with cache_file.open("w", encoding="utf-8") as fp:
+            json.dump({"source_sha256": source_sha, "columns": columns}, fp, ensure_ascii=False, default=str)
+        return columns, source_sha, False
+
+    def _encode_with_cache(self, texts: List[str], workers: int) -> Tuple[np.ndarray, int]:
+        """Embeddings de las variantes reutilizando los ya calculados (clave: hash del texto)"""
+        cache_file = self.artifact_dir / EMBEDDING_CACHE_FILE
+        cache: Dict[str, np.ndarray] = {}
+        if cache_file.exists():
+            with np.load(cache_file, allow_pickle=False) as data:
+                if str(data["model"]) == self.model_name:
+                    cache = dict(zip(data["hashes"].tolist(), data["vectors"]))
+
+        hashes = [text_hash(t) for t in texts]
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in cache and h not in missing:
+                missing[h] = t
+
+        if missing:
+            logger.info(f"Encoding {len(missing):,} new or changed variants ({len(cache):,} cached)")
+            encoded = self.embedder.encode_batch(list(missing.values()), show_progress_bar=True, workers=workers)
+            cache.update(zip(missing.keys(), encoded))
+
+        embeds = np.vstack([cache[h] for h in hashes]).astype("float32")
+
+        # Solo se conservan los embeddings de las variantes actuales
+        current = list(dict.fromkeys(hashes))
+        np.savez(
+            cache_file,
+            model=np.array(self.model_name),
+            hashes=np.array(current),
+            vectors=np.vstack([cache[h] for h in current]).astype("float32"),
+        )
+        return embeds, len(missing)
+
+    def build(
+        self,
+        dataset_path: Path,
+        question_cols: list[str] | None = None,
+        workers: int = RAG_BUILD_WORKERS
+    ) -> Dict[str, Any]:
+        """Construir el índice RAG desde el dataset (incremental: solo codifica variantes nuevas)"""
+        build_start = time.perf_counter()
+        logger.info(f"Loading dataset from {dataset_path}")
+        columns, source_sha, from_cache = self._read_dataset_columns(Path(dataset_path))
+        read_seconds = time.perf_counter() - build_start
 
         if question_cols is None:
-            question_cols = [c for c in df.columns if c.upper().startswith("QUESTION")]
+            question_cols = [c for c in columns if c.upper().startswith("QUESTION")]
             if not question_cols:
                 raise ValueError("No QUESTION* columns found; pass question_cols parameter.")
         else:
-            missing = [c for c in question_cols if c not in df.columns]
+            missing = [c for c in question_cols if c not in columns]
             if missing:
                 raise ValueError(f"Columns not found: {missing}")
 
-        sql_col_candidates = [c for c in df.columns if "QUERY" in c.upper() and "RUNNABLE" in c.upper()]
+        sql_col_candidates = [c for c in columns if "QUERY" in c.upper() and "RUNNABLE" in c.upper()]
         if not sql_col_candidates:
             raise ValueError("Couldn't spot a *_RUNNABLE SQL column.")
         sql_col = sql_col_candidates[0]
 
-        questions, metadatas = [], []
-        for _, row in df.iterrows():
-            variants = [str(row[c]) for c in question_cols if pd.notna(row[c])]
+        ids = columns["ID"] if "ID" in columns else [None] * len(columns[sql_col])
+        question_values = [columns[c] for c in question_cols]
+
+        questions, rows, variant_rows = [], [], []
+        for row_id, sql, *row_questions in zip(ids, columns[sql_col], *question_values):
+            variants = [str(q) for q in row_questions if q is not None]
+            if not variants:
+                continue
+            # El SQL se guarda una vez por fila; las variantes solo referencian su posición
+            rows.append(
+                {
+                    "row_id": int(row_id) if row_id is not None else None,
+                    "canonical_question": str(row_questions[0]),
+                    "sql": str(sql),
+                }
+            )
             for variant in variants:
                 questions.append(variant)
-                metadatas.append(
-                    {
-                        "row_id": int(row["ID"]) if "ID" in row else None,
-                        "canonical_question": str(row[question_cols[0]]),
-                        "sql": str(row[sql_col]),
-                    }
-                )
+                variant_rows.append(len(rows) - 1)
 
-        logger.info(f"Total question variants: {len(questions):,}")
-        logger.info("Computing embeddings...")
-        embeds = self.model.encode(questions, show_progress_bar=True, convert_to_numpy=True)
+        logger.info(f"Total question variants: {len(questions):,} ({len(rows):,} rows)")
+        encode_start = time.perf_counter()
+        embeds, encoded = self._encode_with_cache(questions, workers)
+        encode_seconds = time.perf_counter() - encode_start
         dim = embeds.shape[1]
         faiss.normalize_L2(embeds)
 
         self.index = faiss.IndexFlatIP(dim)
         self.index.add(embeds)
-        self.metadata = metadatas
+
+        total_seconds = time.perf_counter() - build_start
+        stats = {
+            "variants": len(questions),
+            "rows": len(rows),
+            "encoded": encoded,
+            "reused": len(questions) - encoded,
+            "dataset_from_cache": from_cache,
+            "read_seconds": round(read_seconds, 3),
+            "encode_seconds": round(encode_seconds, 3),
+            "total_seconds": round(total_seconds, 3),
+            "variants_per_second": round(len(questions) / total_seconds, 1) if total_seconds else None,
+            "encoded_per_second": round(encoded / encode_seconds, 1) if encoded and encode_seconds else None,
+        }
 
         # Guardar índice
         self.artifact_dir.mkdir(parents=True, exist_ok=True)
         faiss.write_index(self.index, str(self.index_file))
-        with self.meta_file.open("wb") as fp:
-            pickle.dump(self.metadata, fp)
-        logger.info(f"Index built – vectors: {self.index.ntotal}")
+        if self.metadata is not None:
+            self.metadata.close()
+        RAGMetadataStore.write(
+            self.artifact_dir, rows, variant_rows,
+            embed_model=self.model_name, dataset_sha256=source_sha, build_stats=stats
+        )
+        self.metadata = RAGMetadataStore.open(self.artifact_dir)
+        logger.info(
+            f"Index built – vectors: {self.index.ntotal}, encoded {encoded}/{len(questions)} "
+            f"in {total_seconds:.2f}s ({stats['variants_per_second']} variants/s)"
+        )
+        return stats
 
     def load(self) -> None:
         """Cargar índice pre-construido"""
         if not self.index_file.exists():
             raise FileNotFoundError(f"Index not found at {self.index_file}; run build() first.")
         
+        if not RAGMetadataStore.exists(self.artifact_dir) and self.legacy_meta_file.exists():
+            migrate_legacy_pickle(self.artifact_dir, embed_model=self.model_name)
+        
         logger.info(f"Loading RAG index from {self.index_file}")
         self.index = faiss.read_index(str(self.index_file))
-        with self.meta_file.open("rb") as fp:
-            self.metadata = pickle.load(fp)
-        logger.info(f"Index loaded – vectors: {self.index.ntotal}")
+        self.metadata = RAGMetadataStore.open(self.artifact_dir)
+        if len(self.metadata) != self.index.ntotal:
+            raise ValueError(
+                f"RAG metadata has {len(self.metadata)} variants but index has {self.index.ntotal} vectors"
+            )
+        logger.info(f"Index loaded – vectors: {self.index.ntotal}, rows: {self.metadata.n_rows}")
 
     def query(self, text: str, k: int = K_NEIGHBOURS) -> List[Tuple[float, dict]]:
         """Buscar ejemplos similares"""
@@ -97,7 +212,7 @@ class MedicalSQLRetriever:
                 logger.error("RAG index not found. Build it first with build() method.")
                 return []
 
-        q_emb = self.model.encode([text], convert_to_numpy=True)
+        q_emb = self.embedder.encode_query(text)
         faiss.normalize_L2(q_emb)
         scores, idxs = self.index.search(q_emb, k)
         results = []
@@ -107,35 +222,94 @@ class MedicalSQLRetriever:
             results.append((float(score), self.metadata[idx]))
         return results
 
+    def query_diverse(
+        self,
+        text: str,
+        k: int = K_NEIGHBOURS,
+        fetch_k: int = 20,
+        mmr_lambda: float = 0.7
+    ) -> List[Tuple[float, dict]]:
+        """Top-k ejemplos de filas distintas seleccionados con MMR sobre fetch_k variantes"""
+        if self.index is None or self.metadata is None:
+            try:
+                self.load()
+            except FileNotFoundError:
+                logger.error("RAG index not found. Build it first with build() method.")
+                return []
+
+        q_emb = self.embedder.encode_query(text)
+        faiss.normalize_L2(q_emb)
+        scores, idxs = self.index.search(q_emb, max(k, fetch_k))
+
+        # De-duplicar por fila: varias variantes de la misma pregunta comparten SQL
+        best: Dict[object, Tuple[float, int]] = {}
+        for score, idx in zip(scores[0], idxs[0]):
+            if idx == -1:
+                continue
+            key = _row_key(self.metadata[idx])
+            if key not in best or score > best[key][0]:
+                best[key] = (float(score), int(idx))
+
+        candidates = sorted(best.values(), reverse=True)
+        if len(candidates) <= 1 or mmr_lambda >= 1.0:
+            return [(score, self.metadata[idx]) for score, idx in candidates[:k]]
+
+        # Vectores normalizados: el producto escalar es la similitud coseno
+        vectors = np.vstack([self.index.reconstruct(idx) for _, idx in candidates])
+        relevance = np.array([score for score, _ in candidates])
+        selected: List[int] = []
+        remaining = list(range(len(candidates)))
+        while remaining and len(selected) < k:
+            if selected:
+                redundancy = (vectors[remaining] @ vectors[selected].T).max(axis=1)
+            else:
+                redundancy = np.zeros(len(remaining))
+            mmr = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy
+            chosen = remaining[int(np.argmax(mmr))]
+            selected.append(chosen)
+            remaining.remove(chosen)
+
+        return [(candidates[i][0], self.metadata[candidates[i][1]]) for i in selected]
+
 
 class RAGRetriever:
     """Wrapper más simple para usar en el servicio de generación SQL"""
     
-    def __init__(self, dataset_path: str = "text2sql_epi_dataset_omop.xlsx"):
-        self.dataset_path = Path(dataset_path)
+    def __init__(
+        self,
+        dataset_path: Optional[str] = None,
+        index_dir: Optional[str] = None,
+        allow_build: bool = RAG_ALLOW_RUNTIME_BUILD
+    ):
+        locator = get_artifact_locator()
+        self.dataset_path = Path(dataset_path) if dataset_path else locator.dataset_path
+        self.index_dir = Path(index_dir) if index_dir else locator.rag_index_dir
+        self.allow_build = allow_build
         self.retriever: Optional[MedicalSQLRetriever] = None
         self._index_built = False
         
     def _ensure_index_built(self):
-        """Asegurar que el índice RAG esté construido"""
+        """Asegurar que el índice RAG esté cargado"""
         if not self._index_built:
             self._build_index()
             
     def _build_index(self):
-        """Construir el índice RAG con todo el dataset"""
+        """Cargar el índice RAG pre-construido (solo se construye si allow_build)"""
         try:
-            if not self.dataset_path.exists():
-                raise FileNotFoundError(f"Dataset no encontrado: {self.dataset_path}")
-            
-            logger.info(f"Construyendo índice RAG desde {self.dataset_path}")
-            self.retriever = MedicalSQLRetriever()
+            self.retriever = MedicalSQLRetriever(artifact_dir=self.index_dir)
             
-            # Intentar cargar primero, si no existe, construir
             try:
                 self.retriever.load()
                 logger.info("Índice RAG cargado desde disco")
-            except FileNotFoundError:
-                logger.info("Construyendo nuevo índice RAG...")
+            except FileNotFoundError as e:
+                if not self.allow_build:
+                    raise ArtifactError(
+                        f"Índice RAG no encontrado en {self.index_dir}; "
+                        "ejecuta `python -m app.sql_generation.build_index`"
+                    ) from e
+                if not self.dataset_path.exists():
+                    raise FileNotFoundError(f"Dataset no encontrado: {self.dataset_path}")
+                logger.warning(f"Construyendo índice RAG desde {self.dataset_path} en tiempo de ejecución")
                 self.retriever.build(self.dataset_path)
             
             self._index_built = True
@@ -145,18 +319,36 @@ class RAGRetriever:
             logger.error(f"Error con índice RAG: {e}")
             raise
     
-    def get_similar_examples(self, question: str, k: int = 1) -> List[Dict]:
-        """Obtener ejemplos similares del RAG"""
+    def get_similar_examples(
+        self,
+        question: str,
+        k: int = 1,
+        fetch_k: Optional[int] = None,
+        mmr_lambda: Optional[float] = None,
+        token_budget: Optional[int] = None
+    ) -> List[Dict]:
+        """Obtener ejemplos similares del RAG (una entrada por fila del dataset)"""
         self._ensure_index_built()
         
         if not self.retriever:
             return []
             
         try:
-            results = self.retriever.query(question, k=k)
+            if fetch_k is None:
+                results = self.retriever.query(question, k=k)
+            else:
+                results = self.retriever.query_diverse(
+                    question, k=k, fetch_k=fetch_k,
+                    mmr_lambda=1.0 if mmr_lambda is None else mmr_lambda
+                )
             
             similar_examples = []
+            seen_rows = set()
             for score, metadata in results:
+                key = _row_key(metadata)
+                if key in seen_rows:
+                    continue
+                seen_rows.add(key)
                 similar_examples.append({
                     'question': metadata['canonical_question'],
                     'sql': metadata['sql'],
@@ -164,12 +356,48 @@ class RAGRetriever:
                     'row_id': metadata.get('row_id')
                 })
             
+            if token_budget is not None:
+                similar_examples = self.fit_to_token_budget(similar_examples, token_budget)
+            
             return similar_examples
             
         except Exception as e:
             logger.error(f"Error recuperando ejemplos similares: {e}")
             return []
     
+    def fit_to_token_budget(self, examples: List[Dict], token_budget: int) -> List[Dict]:
+        """
+        Seleccionar ejemplos en orden de relevancia mientras quepan en el presupuesto de tokens.
+        Si ni el más relevante cabe, se incluye con la pregunta recortada: el prompt nunca
+        se queda sin ejemplos y el SQL siempre va completo (aunque exceda el presupuesto).
+        """
+        selected = []
+        used = 0
+        for example in examples:
+            cost = estimate_tokens(self.format_similar_example(example))
+            if used + cost > token_budget:
+                continue
+            selected.append(example)
+            used += cost
+        if examples and not selected:
+            selected = [self.truncate_example(examples[0], token_budget)]
+            logger.info(f"Presupuesto de {token_budget} tokens: se incluye el ejemplo más relevante "
+                        f"con la pregunta recortada (~{estimate_tokens(self.format_similar_example(selected[0]))} tokens)")
+        elif len(selected) < len(examples):
+            logger.info(f"Presupuesto de {token_budget} tokens: {len(selected)}/{len(examples)} ejemplos incluidos")
+        return selected
+    
+    def truncate_example(self, example: Dict, token_budget: int) -> Dict:
+        """
+        Recortar la pregunta de un ejemplo hasta el presupuesto. El SQL nunca se recorta:
+        un SQL incompleto en el prompt es un mal ejemplo a imitar.
+        """
+        excess = len(self.format_similar_example(example)) - max(token_budget, 0) * CHARS_PER_TOKEN
+        if excess <= 0:
+            return example
+        question = example['question']
+        return {**example, 'question': question[:max(len(question) - excess, 0)]}
+    
     def format_similar_example(self, example: Dict) -> str:
         """Formatear un ejemplo similar para incluir en el prompt"""
         if not example:
@@ -0,0 +1,174 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Any, AsyncIterator, Optional
+
+from app.core.config import OLLAMA_PARALLEL_SLOTS, OLLAMA_MAX_QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Cola de generación llena: la petición se rechaza (load shedding)"""
+
+    def __init__(self, depth: int, retry_after: int):
+        super().__init__(f"Cola de generación SQL llena ({depth} peticiones en espera)")
+        self.depth = depth
+        self.retry_after = retry_after
+
+
+@dataclass(eq=False)
+class Ticket:
+    enqueued_at: float = field(default_factory=time.monotonic)
+    granted: Optional[asyncio.Future] = None  # None: slot concedido sin esperar
+    started_at: Optional[float] = None
+    released: bool = False
+
+
+class GenerationQueue:
+    """
+    Control de admisión para las generaciones con Ollama.
+
+    Como mucho `max_concurrency` peticiones (los slots paralelos del servidor
+    del modelo) se procesan a la vez; el resto espera en orden FIFO sin ocupar
+    hilos del threadpool. Con `max_depth` peticiones esperando, las nuevas se
+    rechazan de inmediato en lugar de acumular latencia.
+    """
+
+    def __init__(self, max_concurrency: int = OLLAMA_PARALLEL_SLOTS, max_depth: int = OLLAMA_MAX_QUEUE_DEPTH):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_depth = max_depth
+        self._active = 0
+        self._waiters: Deque[Ticket] = deque()
+        self._avg_service_s: Optional[float] = None
+        self._stats = {
+            'admitted': 0,
+            'queued': 0,
+            'shed': 0,
+            'cancelled': 0,
+            'completed': 0,
+            'granted_after_wait': 0,
+            'total_wait_s': 0.0,
+        }
+
+    def _estimate_wait(self, position: int) -> int:
+        service_s = self._avg_service_s or 30.0
+        return max(1, round(service_s * position / self.max_concurrency))
+
+    def enqueue(self) -> Ticket:
+        """Reservar un slot o un puesto en la cola; lanza QueueFullError si no cabe"""
+        ticket = Ticket()
+        if self._active < self.max_concurrency and not self._waiters:
+            self._active += 1
+            ticket.started_at = ticket.enqueued_at
+            self._stats['admitted'] += 1
+            return ticket
+
+        if len(self._waiters) >= self.max_depth:
+            self._stats['shed'] += 1
+            depth = len(self._waiters)
+            logger.warning(f"Cola de generación llena ({depth} en espera): petición rechazada")
+            raise QueueFullError(depth, self._estimate_wait(depth + 1))
+
+        ticket.granted = asyncio.get_running_loop().create_future()
+        self._waiters.append(ticket)
+        self._stats['queued'] += 1
+        return ticket
+
+    def position(self, ticket: Ticket) -> int:
+        """Puesto en la cola (1 = siguiente); 0 si ya tiene slot"""
+        if ticket.started_at is not None:
+            return 0
+        try:
+            return self._waiters.index(ticket) + 1
+        except ValueError:
+            return 0
+
+    async def wait_turn(self, ticket: Ticket, poll_interval: float = 1.0) -> AsyncIterator[int]:
+        """Esperar el slot emitiendo el puesto en la cola cada vez que cambia"""
+        last = None
+        while ticket.started_at is None:
+            current = self.position(ticket)
+            if current != last:
+                last = current
+                yield current
+            try:
+                await asyncio.wait_for(asyncio.shield(ticket.granted), timeout=poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait(self, ticket: Ticket) -> None:
+        if ticket.started_at is None:
+            await asyncio.shield(ticket.granted)
+
+    def release(self, ticket: Ticket) -> None:
+        """
+        Liberar el slot (o abandonar la cola si aún no se había concedido); idempotente.
+
+        Solo desde el event loop: modifica la cola y resuelve futures de asyncio,
+        que no son thread-safe (para BackgroundTask usar arelease).
+        """
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.started_at is None:
+            # Cancelada mientras esperaba: solo sale de la cola
+            if ticket in self._waiters:
+                self._waiters.remove(ticket)
+                self._stats['cancelled'] += 1
+            return
+
+        elapsed = time.monotonic() - ticket.started_at
+        self._avg_service_s = elapsed if self._avg_service_s is None else 0.8 * self._avg_service_s + 0.2 * elapsed
+        self._stats['completed'] += 1
+
+        # El slot pasa directamente al primero de la cola (orden FIFO estricto)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if waiter.granted.done():
+                continue
+            waiter.started_at = time.monotonic()
+            self._stats['admitted'] += 1
+            self._stats['granted_after_wait'] += 1
+            self._stats['total_wait_s'] += waiter.started_at - waiter.enqueued_at
+            waiter.granted.set_result(None)
+            return
+        self._active -= 1
+
+    async def arelease(self, ticket: Ticket) -> None:
+        """release como corrutina: Starlette ejecuta las tareas síncronas en el threadpool"""
+        self.release(ticket)
+
+    @asynccontextmanager
+    async def slot(self):
+        ticket = self.enqueue()
+        try:
+            await self.wait(ticket)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def get_stats(self) -> Dict[str, Any]:
+        waited = self._stats['granted_after_wait']
+        return {
+            **self._stats,
+            'total_wait_s': round(self._stats['total_wait_s'], 3),
+            'active': self._active,
+            'waiting': len(self._waiters),
+            'max_concurrency': self.max_concurrency,
+            'max_depth': self.max_depth,
+            'avg_service_s': round(self._avg_service_s, 3) if self._avg_service_s is not None else None,
+            'avg_wait_s': round(self._stats['total_wait_s'] / waited, 3) if waited else 0.0,
+        }
+
+
+_queue: Optional[GenerationQueue] = None
+
+def get_generation_queue() -> GenerationQueue:
+    global _queue
+    if _queue is None:
+        _queue = GenerationQueue()
+    return _queue
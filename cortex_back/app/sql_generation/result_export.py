@@ -0,0 +1,224 @@
+import io
+import csv
+import logging
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Formato -> (content type, extensión)
+EXPORT_FORMATS = {
+    'csv': ("text/csv; charset=utf-8", "csv"),
+    'arrow': ("application/vnd.apache.arrow.stream", "arrows"),
+    'parquet': ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class ExportUnavailableError(Exception):
+    """El formato pedido necesita una dependencia opcional que no está instalada"""
+
+
+def require_pyarrow():
+    """pyarrow es opcional: solo lo necesitan las exportaciones Arrow y Parquet"""
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportUnavailableError("La exportación Arrow/Parquet requiere pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def check_format(fmt: str):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato de exportación desconocido: {fmt} (usar {', '.join(EXPORT_FORMATS)})")
+    if fmt in ('arrow', 'parquet'):
+        require_pyarrow()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Destino de escritura de pyarrow que acumula bytes hasta que se recogen con drain()"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# Marca del tipo declarado -> tipo Arrow (reglas de afinidad de SQLite, en orden)
+_DECLARED_TYPES = (("INTERVAL", "string"), ("INT", "int64"), ("BOOL", "int64"), ("REAL", "float64"),
+                   ("FLOA", "float64"), ("DOUB", "float64"), ("NUMERIC", "float64"), ("DECIMAL", "float64"),
+                   ("BLOB", "binary"), ("BINARY", "binary"))
+
+
+def declared_arrow_type(pa, declared: Optional[str]):
+    """Tipo Arrow de un tipo declarado (de SQLite, DuckDB o sqlglot); None si no se declara"""
+    declared = (declared or "").upper()
+    if not declared or declared in ("UNKNOWN", "NULL"):
+        return None
+    for marker, arrow_type in _DECLARED_TYPES:
+        if marker in declared:
+            return getattr(pa, arrow_type)()
+    return pa.string()
+
+
+def _infer_type(pa, values: List[Any]):
+    """Tipo Arrow de una columna sin tipo declarado a partir del primer lote"""
+    kinds = {type(v) for v in values if v is not None}
+    if not kinds:
+        return pa.string()
+    if kinds <= {int, bool}:
+        return pa.int64()
+    if kinds <= {int, bool, float}:
+        return pa.float64()
+    if kinds <= {bytes}:
+        return pa.binary()
+    return pa.string()
+
+
+def _coercer(pa, arrow_type) -> Callable[[Any], Any]:
+    """Conversión de valores que no encajan en el tipo elegido con el primer lote"""
+    if arrow_type == pa.string():
+        return lambda v: v if v is None or isinstance(v, str) else (v.hex() if isinstance(v, bytes) else str(v))
+    if arrow_type == pa.float64():
+        return lambda v: None if v is None else float(v)
+    if arrow_type == pa.int64():
+        def to_int(v):
+            if v is None or isinstance(v, int):
+                return v
+            if isinstance(v, float) and v.is_integer():
+                return int(v)
+            raise ValueError(f"Valor {v!r} no entero en una columna entera")
+        return to_int
+    return lambda v: v
+
+
+class ArrowBatches:
+    """
+    Convierte lotes de filas (tuplas de sqlite3) en RecordBatch con un esquema
+    fijo: el indicado o, si no, el de los tipos declarados de las columnas
+    (`types`), completado con lo que se infiere del primer lote.
+
+    Un valor que no cabe en el tipo fijado se convierte o, si la conversión
+    perdería datos (un decimal en una columna entera), lanza ValueError: nunca
+    se trunca en silencio.
+    """
+
+    def __init__(self, pa, columns: List[str], schema=None, types: Optional[List[Optional[str]]] = None):
+        self.pa = pa
+        self.columns = columns
+        self.schema = schema
+        self.types = types if types and len(types) == len(columns) else [None] * len(columns)
+        self._coercers = [_coercer(pa, field.type) for field in schema] if schema is not None else None
+
+    def batch(self, rows: List[tuple]):
+        pa = self.pa
+        columns = list(zip(*rows)) if rows else [()] * len(self.columns)
+        if self.schema is None:
+            self.schema = pa.schema([
+                pa.field(name, declared_arrow_type(pa, declared) or _infer_type(pa, list(values)))
+                for name, declared, values in zip(self.columns, self.types, columns)
+            ])
+            self._coercers = [_coercer(pa, field.type) for field in self.schema]
+        arrays = []
+        for values, field, coerce in zip(columns, self.schema, self._coercers):
+            if field.type == pa.int64() and any(isinstance(v, float) for v in values):
+                # pa.array truncaría los decimales sin avisar
+                arrays.append(pa.array([coerce(v) for v in values], type=field.type))
+                continue
+            try:
+                arrays.append(pa.array(values, type=field.type))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+                arrays.append(pa.array([coerce(v) for v in values], type=field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+def _csv_chunks(page) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(page.columns)
+    while not page.done:
+        rows = page.fetch_rows()
+        writer.writerows(tuple(v.hex() if isinstance(v, bytes) else v for v in row) for row in rows)
+        chunk = buffer.getvalue()
+        if chunk:
+            yield chunk.encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.getvalue():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _arrow_chunks(page, fmt: str, column_types: Optional[List[Optional[str]]]) -> Iterator[bytes]:
+    pa = require_pyarrow()
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    # Tipos del motor (DuckDB los da; SQLite no) o, en su defecto, los deducidos del SQL
+    engine_types = page.column_types or [None] * len(page.columns)
+    hints = column_types if column_types and len(column_types) == len(page.columns) else [None] * len(page.columns)
+    sink = _ChunkSink()
+    converter = ArrowBatches(pa, page.columns, types=[e or h for e, h in zip(engine_types, hints)])
+    writer = None
+    try:
+        while writer is None or not page.done:
+            # El primer lote (aunque sea vacío) fija el esquema
+            record_batch = converter.batch(page.fetch_rows())
+            if writer is None:
+                writer = (
+                    pyarrow.ipc.new_stream(sink, converter.schema) if fmt == 'arrow'
+                    else pyarrow.parquet.ParquetWriter(sink, converter.schema, compression="zstd")
+                )
+            if record_batch.num_rows:
+                if fmt == 'arrow':
+                    writer.write_batch(record_batch)
+                else:
+                    # Cada lote es un row group: la memoria no crece con el número de filas
+                    writer.write_table(pa.Table.from_batches([record_batch]))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    finally:
+        if writer is not None:
+            writer.close()
+    chunk = sink.drain()
+    if chunk:
+        yield chunk
+
+
+def export_chunks(page, fmt: str, column_types: Optional[List[Optional[str]]] = None) -> Iterator[bytes]:
+    """
+    Bytes del resultado en el formato pedido, lote a lote desde el cursor.
+
+    Solo hay en memoria el lote actual (page.batch_size filas) y lo que el
+    escritor aún no ha emitido; el cliente recibe la respuesta por trozos.
+    `column_types` (SQLAnalyzer.column_types) fija el esquema Arrow/Parquet de
+    las columnas cuyo tipo no da el motor.
+    """
+    check_format(fmt)
+    if fmt == 'csv':
+        return _csv_chunks(page)
+    return _arrow_chunks(page, fmt, column_types)
+
+
+def export_headers(fmt: str, stem: str = "query_result") -> Dict[str, str]:
+    return {
+        "Content-Disposition": f'attachment; filename="{stem}.{EXPORT_FORMATS[fmt][1]}"',
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    }
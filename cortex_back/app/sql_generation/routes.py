@@ -1,16 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
+import anyio
+from typing import List, Optional
+import json
+import asyncio
 import logging
+import threading
 import time
 
 from .models import (
     SQLGenerationRequest, SQLGenerationResponse,
-    SQLValidationRequest, SQLValidationResponse
+    SQLValidationRequest, SQLValidationResponse, SQLExecutionRequest, SQLExportRequest, QueryCostEstimate
 )
 from .service import SQLGenerationService
+from .ollama_client import get_ttft_stats, get_generation_telemetry
+from .query_executor import InvalidCursorError, ExecutorBusyError
+from .result_export import ExportUnavailableError, check_format, export_chunks, export_headers, EXPORT_FORMATS
+from .request_queue import GenerationQueue, QueueFullError, get_generation_queue
 from app.auth.routes import get_current_user
-from app.auth.database import get_auth_db
+from app.auth.database import get_auth_db, SessionLocal
 from app.auth.models import QueryLog
 
 logger = logging.getLogger(__name__)
@@ -19,20 +30,25 @@ router = APIRouter(prefix="/sql-generation", tags=["sql-generation"])
 
 # Instancia global del servicio (se inicializa una vez)
 sql_service = None
+# El warmup de arranque (hilo aparte) y las primeras peticiones pueden llegar a la vez
+_sql_service_lock = threading.Lock()
 
 def get_sql_service() -> SQLGenerationService:
     """Dependencia para obtener el servicio de generación SQL"""
     global sql_service
-    if sql_service is None:
-        try:
-            sql_service = SQLGenerationService()
-            logger.info("Servicio de generación SQL inicializado")
-        except Exception as e:
-            logger.error(f"Error inicializando servicio SQL: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail="Error inicializando el servicio de generación SQL"
-            )
+    if sql_service is not None:
+        return sql_service
+    with _sql_service_lock:
+        if sql_service is None:
+            try:
+                sql_service = SQLGenerationService()
+                logger.info("Servicio de generación SQL inicializado")
+            except Exception as e:
+                logger.error(f"Error inicializando servicio SQL: {e}")
+                raise HTTPException(
+                    status_code=500,
+                    detail="Error inicializando el servicio de generación SQL"
+                )
     return sql_service
 
 def generate_title(question: str, max_length: int = 80) -> str:
@@ -41,59 +57,94 @@ def generate_title(question: str, max_length: int = 80) -> str:
         return question
     return question[:max_length-3] + "..."
 
+def medical_terms_for_log(request: SQLGenerationRequest) -> Optional[List[str]]:
+    """Convertir medical_terms a lista de strings para el log"""
+    medical_terms_list = None
+    if request.medical_terms:
+        # Asumir que medical_terms puede ser una lista de objetos o strings
+        if isinstance(request.medical_terms, list):
+            if request.medical_terms and isinstance(request.medical_terms[0], dict):
+                # Si son objetos con términos, extraer los términos
+                medical_terms_list = [term.get('term', str(term)) for term in request.medical_terms]
+            else:
+                # Si ya son strings
+                medical_terms_list = [str(term) for term in request.medical_terms]
+    return medical_terms_list
+
+def telemetry_for_log(result: SQLGenerationResponse) -> dict:
+    """Columnas de telemetría de QueryLog a partir de las métricas por intento"""
+    metrics = result.attempt_metrics
+    load_ms = [m.load_ms for m in metrics if m.load_ms is not None]
+    return {
+        'model_name': result.model_name,
+        'prompt_tokens': sum(m.prompt_eval_count or 0 for m in metrics) if metrics else None,
+        'completion_tokens': sum(m.eval_count or 0 for m in metrics) if metrics else None,
+        'load_time': round(sum(load_ms) / 1000, 3) if load_ms else None,
+        'generation_metrics': [m.model_dump() for m in metrics] or None,
+    }
+
+def save_query_log(
+    db: Session,
+    user_id: int,
+    request: SQLGenerationRequest,
+    result: SQLGenerationResponse,
+    processing_time: float
+):
+    """Registrar la consulta en QueryLog (bloqueante: desde las rutas async, con run_in_threadpool)"""
+    try:
+        db.add(QueryLog(
+            user_id=user_id,
+            title=generate_title(request.question),
+            question=request.question,
+            medical_terms=medical_terms_for_log(request),
+            generated_sql=result.generated_sql,
+            is_executable=result.is_executable,
+            attempts_count=result.attempts_count,
+            error_message=result.error_message,
+            processing_time=processing_time,
+            **telemetry_for_log(result),
+        ))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+def queue_full_exception(e: QueueFullError) -> HTTPException:
+    """503 con Retry-After estimado cuando la cola de generación está llena"""
+    return HTTPException(
+        status_code=503,
+        detail=f"{e}. Reintenta en {e.retry_after} s.",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
 @router.post("/", response_model=SQLGenerationResponse)
-def generate_sql(
+async def generate_sql(
     request: SQLGenerationRequest,
     current_user=Depends(get_current_user),
     db: Session = Depends(get_auth_db),
-    service: SQLGenerationService = Depends(get_sql_service)
+    service: SQLGenerationService = Depends(get_sql_service),
+    queue: GenerationQueue = Depends(get_generation_queue)
 ):
     """
     Generar consulta SQL desde lenguaje natural.
     
     Requiere autenticación JWT y registra la consulta completa en los logs del usuario.
+    Las peticiones esperan turno en la cola de generación; si está llena se responde 503.
     """
     start_time = time.time()
     
     try:
         # Generar SQL
         logger.info(f"Generando SQL para usuario {current_user.id}: {request.question}")
-        result = service.generate_sql(request)
+        async with queue.slot():
+            result = await service.generate_sql_async(request)
         
         # Calcular tiempo de procesamiento
         processing_time = time.time() - start_time
         
-        # Generar título automáticamente
-        title = generate_title(request.question)
-        
-        # Convertir medical_terms a lista si es necesario
-        medical_terms_list = None
-        if request.medical_terms:
-            # Asumir que medical_terms puede ser una lista de objetos o strings
-            if isinstance(request.medical_terms, list):
-                if request.medical_terms and isinstance(request.medical_terms[0], dict):
-                    # Si son objetos con términos, extraer los términos
-                    medical_terms_list = [term.get('term', str(term)) for term in request.medical_terms]
-                else:
-                    # Si ya son strings
-                    medical_terms_list = [str(term) for term in request.medical_terms]
-        
-        # Registrar la consulta completa en el log del usuario
-        query_log = QueryLog(
-            user_id=current_user.id,
-            title=title,
-            question=request.question,
-            medical_terms=medical_terms_list,
-            generated_sql=result.generated_sql,
-            is_executable=result.is_executable,
-            attempts_count=result.attempts_count,
-            error_message=result.error_message,
-            processing_time=processing_time,
-        )
-        
-        db.add(query_log)
-        db.commit()
-        db.refresh(query_log)
+        # Registrar la consulta completa en el log del usuario (SQLAlchemy es
+        # síncrono: en un hilo para no bloquear el event loop)
+        await run_in_threadpool(save_query_log, db, current_user.id, request, result, processing_time)
         
         # Log del resultado
         if result.is_executable:
@@ -103,14 +154,289 @@ def generate_sql(
         
         return result
         
+    except QueueFullError as e:
+        raise queue_full_exception(e)
     except Exception as e:
         logger.error(f"Error generando SQL: {e}")
-        db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error interno generando SQL: {str(e)}"
         )
 
+@router.post("/stream")
+async def generate_sql_stream(
+    request: SQLGenerationRequest,
+    current_user=Depends(get_current_user),
+    service: SQLGenerationService = Depends(get_sql_service),
+    queue: GenerationQueue = Depends(get_generation_queue)
+):
+    """
+    Generar consulta SQL emitiendo Server-Sent Events.
+    
+    Eventos: queued (puesto en la cola mientras espera), attempt, token, validation
+    y result (misma forma que POST /sql-generation/). La generación de cada intento
+    se detiene en cuanto el modelo completa la sentencia.
+    """
+    user_id = current_user.id
+    
+    try:
+        # Reservar antes de abrir el stream para poder responder 503 si no hay sitio
+        ticket = queue.enqueue()
+    except QueueFullError as e:
+        raise queue_full_exception(e)
+    
+    def sse(event: str, data) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    def log_query(result: SQLGenerationResponse, processing_time: float):
+        # La sesión de la dependencia ya está cerrada cuando se emite la respuesta
+        db = SessionLocal()
+        try:
+            save_query_log(db, user_id, request, result, processing_time)
+        except Exception as e:
+            logger.error(f"Error registrando consulta (streaming): {e}")
+        finally:
+            db.close()
+    
+    async def event_stream():
+        start_time = time.time()
+        result = None
+        try:
+            async for position in queue.wait_turn(ticket):
+                yield sse("queued", {"position": position})
+            
+            logger.info(f"Generando SQL (streaming) para usuario {user_id}: {request.question}")
+            async for event in service.generate_sql_stream_async(request):
+                if event["event"] == "result":
+                    result = SQLGenerationResponse(**event["data"])
+                yield sse(event["event"], event["data"])
+        except Exception as e:
+            logger.error(f"Error generando SQL (streaming): {e}")
+            yield sse("error", {"detail": f"Error interno generando SQL: {str(e)}"})
+            return
+        finally:
+            # También si el cliente se desconecta mientras espera o genera
+            queue.release(ticket)
+        
+        if result is not None:
+            await run_in_threadpool(log_query, result, time.time() - start_time)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Red de seguridad si el stream no llega a iterarse
+        background=BackgroundTask(queue.arelease, ticket)
+    )
+
+@router.get("/queue")
+def queue_status(queue: GenerationQueue = Depends(get_generation_queue)):
+    """Estado de la cola de generación (slots ocupados, peticiones en espera, rechazos)"""
+    return queue.get_stats()
+
+@router.get("/db-pool")
+def db_pool_status(service: SQLGenerationService = Depends(get_sql_service)):
+    """Estadísticas del pool de conexiones de solo lectura a la base de datos OMOP"""
+    return service.sql_validator.pool.get_stats()
+
+async def validated_sql(service: SQLGenerationService, sql_query: str) -> str:
+    """SQL limpio que pasa el análisis estático y EXPLAIN; HTTP 400 si no"""
+    validator = service.sql_validator
+    cleaned_sql = validator.clean_generated_sql(sql_query)
+    
+    syntax_error = validator.validate_sql_syntax(cleaned_sql)
+    if syntax_error:
+        raise HTTPException(status_code=400, detail=syntax_error)
+    
+    validation = await run_in_threadpool(validator.test_sql_execution, cleaned_sql, mode="explain")
+    if not validation['executable']:
+        raise HTTPException(status_code=400, detail=validation['error'])
+    return cleaned_sql
+
+class PageReader:
+    """
+    Lecturas de una página en el threadpool sin perder de vista la que está en curso.
+
+    Si la tarea de la respuesta se cancela (cliente desconectado) con un fetch en
+    marcha, el hilo sigue usando la conexión: close() espera a que termine (tras
+    page.cancel() acaba enseguida) antes de cerrarla y liberar el slot.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self._pending: Optional[asyncio.Future] = None
+
+    async def run(self, func, *args):
+        self._pending = asyncio.ensure_future(run_in_threadpool(func, *args))
+        return await asyncio.shield(self._pending)
+
+    async def close(self, cleanup=None):
+        if not self.page.done:
+            self.page.cancel()
+        pending = self._pending
+        if pending is not None:
+            # La tarea puede estar cancelada (anyio repite la cancelación en cada await)
+            with anyio.CancelScope(shield=True):
+                await asyncio.wait([pending])
+            if not pending.cancelled():
+                pending.exception()  # ya registrada por quien esperaba la lectura
+        if cleanup is not None:
+            cleanup()
+        self.page.close()
+
+async def open_page(service: SQLGenerationService, sql: str, **kwargs):
+    """Abrir la ejecución traduciendo los errores del ejecutor a HTTP"""
+    try:
+        return await run_in_threadpool(service.query_executor.open, sql, **kwargs)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+@router.post("/execute")
+async def execute_sql(
+    request: SQLExecutionRequest,
+    http_request: Request,
+    current_user=Depends(get_current_user),
+    service: SQLGenerationService = Depends(get_sql_service)
+):
+    """
+    Ejecutar una consulta validada y devolver sus filas como NDJSON.
+    
+    Requiere autenticación JWT. Primera línea: {"type": "meta", "columns": [...]};
+    después una línea por fila (lista de valores) y al final {"type": "end",
+    "row_count", "truncated", "next_cursor", "warning"}. Para la página siguiente
+    se repite la petición con cursor=next_cursor; solo hay cursor si la consulta
+    tiene ORDER BY (cada página repite la consulta con OFFSET). Si falla a mitad
+    se emite {"type": "error"}. La consulta se interrumpe si el cliente se desconecta.
+    """
+    cleaned_sql = await validated_sql(service, request.sql_query)
+    page = await open_page(service, cleaned_sql, cursor=request.cursor, max_rows=request.max_rows)
+    
+    def line(data) -> str:
+        return json.dumps(data, ensure_ascii=False) + "\n"
+    
+    logger.info(f"Ejecutando SQL para usuario {current_user.id} (offset {page.offset}, máx. {page.limit} filas)")
+    
+    async def row_stream():
+        reader = PageReader(page)
+        try:
+            yield line({"type": "meta", "columns": page.columns, "offset": page.offset, "max_rows": page.limit})
+            while not page.done:
+                if await http_request.is_disconnected():
+                    page.cancel()
+                    logger.info("Cliente desconectado: ejecución cancelada")
+                    return
+                rows = await reader.run(page.fetch)
+                if rows:
+                    yield "".join(line(row) for row in rows)
+            yield line({
+                "type": "end",
+                "row_count": page.returned,
+                "truncated": page.has_more,
+                "next_cursor": page.next_cursor,
+                "warning": page.warning
+            })
+        except Exception as e:
+            logger.error(f"Error ejecutando SQL: {e}")
+            error = page.error_info(e)
+            page.done = True
+            yield line({"type": "error", **error})
+        finally:
+            # También si la tarea se cancela por desconexión con una lectura en curso
+            await reader.close()
+    
+    return StreamingResponse(
+        row_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/export")
+async def export_sql(
+    request: SQLExportRequest,
+    current_user=Depends(get_current_user),
+    service: SQLGenerationService = Depends(get_sql_service)
+):
+    """
+    Exportar el resultado de una consulta validada como CSV, Arrow IPC (stream) o Parquet.
+    
+    Requiere autenticación JWT. Las filas se leen del cursor por lotes y cada lote
+    se escribe y se envía en cuanto está listo (respuesta por trozos), así que la
+    memoria no depende del tamaño del resultado. Arrow y Parquet requieren pyarrow.
+    """
+    fmt = request.format.lower()
+    try:
+        check_format(fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExportUnavailableError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    
+    cleaned_sql = await validated_sql(service, request.sql_query)
+    page = await open_page(service, cleaned_sql, max_rows=request.max_rows, export=True)
+    logger.info(f"Exportando SQL ({fmt}) para usuario {current_user.id} (máx. {page.limit} filas)")
+    
+    column_types = service.sql_validator.analyzer.column_types(cleaned_sql)
+    
+    async def byte_stream():
+        chunks = export_chunks(page, fmt, column_types)
+        reader = PageReader(page)
+        try:
+            while True:
+                chunk = await reader.run(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        except Exception as e:
+            # Con la respuesta ya empezada no se puede cambiar el estado HTTP: se
+            # relanza para abortar la conexión sin el trozo final, y el cliente ve
+            # una transferencia incompleta en lugar de un fichero truncado con 200
+            logger.error(f"Error exportando SQL: {page.error_info(e)}")
+            page.done = True
+            raise
+        finally:
+            await reader.close(chunks.close)
+    
+    return StreamingResponse(
+        byte_stream(),
+        media_type=EXPORT_FORMATS[fmt][0],
+        headers=export_headers(fmt)
+    )
+
+@router.get("/executions")
+def execution_status(service: SQLGenerationService = Depends(get_sql_service)):
+    """Ejecuciones activas, filas emitidas y cancelaciones de POST /sql-generation/execute"""
+    return service.query_executor.get_stats()
+
+@router.get("/sandbox")
+def sandbox_status(service: SQLGenerationService = Depends(get_sql_service)):
+    """Estadísticas de los procesos aislados que ejecutan el SQL de validación"""
+    if service.sql_validator.sandbox_workers <= 0:
+        return {"enabled": False}
+    return {"enabled": True, **service.sql_validator.sandbox.get_stats()}
+
+@router.get("/validation-cache")
+def validation_cache_status(service: SQLGenerationService = Depends(get_sql_service)):
+    """Aciertos y fallos de la caché de resultados de validación (positivos y negativos)"""
+    if service.sql_validator.cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **service.sql_validator.cache.get_stats()}
+
+@router.get("/telemetry")
+def generation_telemetry():
+    """Histogramas por modelo de tokens/s, evaluación del prompt, carga y tokens por generación"""
+    return {'models': get_generation_telemetry(), 'ttft': get_ttft_stats()}
+
+@router.get("/cache")
+def cache_status(service: SQLGenerationService = Depends(get_sql_service)):
+    """Estadísticas de la caché semántica de SQL"""
+    if service.sql_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **service.sql_cache.get_stats()}
+
 @router.post("/validate", response_model=SQLValidationResponse)
 def validate_sql(
     request: SQLValidationRequest,
@@ -121,7 +447,10 @@ def validate_sql(
     """
     Validar una consulta SQL existente.
     
-    Requiere autenticación JWT y valida tanto sintaxis como ejecución.
+    Requiere autenticación JWT. Valida la sintaxis y prepara la consulta con
+    EXPLAIN QUERY PLAN; con execute=true además la ejecuta, leyendo como mucho
+    max_rows filas. cost_estimate resume el coste estimado con el plan (filas
+    leídas, recorridos completos de tablas grandes y sugerencias).
     """
     start_time = time.time()
     
@@ -144,14 +473,24 @@ def validate_sql(
             question=request.question
         )
         
-        # Si la sintaxis es válida, probar ejecución
+        # Si la sintaxis es válida, preparar (y si se pide, ejecutar) la consulta
         if is_valid:
-            exec_result = service.sql_validator.test_sql_execution(cleaned_sql)
+            exec_result = service.sql_validator.test_sql_execution(
+                cleaned_sql,
+                mode="execute" if request.execute else "explain",
+                max_rows=request.max_rows
+            )
             
             response.is_executable = exec_result['executable']
             response.execution_error = exec_result['error']
             response.execution_time = exec_result['execution_time']
             response.row_count = exec_result['row_count']
+            response.validation_mode = exec_result.get('validation_mode')
+            response.truncated = exec_result.get('truncated', False)
+            response.query_plan = exec_result.get('plan')
+            response.cached = exec_result.get('cached', False)
+            if exec_result.get('cost'):
+                response.cost_estimate = QueryCostEstimate(**exec_result['cost'])
         
         # Calcular tiempo total de validación
         processing_time = time.time() - start_time
@@ -210,18 +549,25 @@ def health_check(service: SQLGenerationService = Depends(get_sql_service)):
                 "error": "Service not initialized"
             }
         
-        # Verificar Ollama
-        ollama_running = service.ollama_client.is_ollama_running()
-        model_available = service.ollama_client.check_model_availability(service.model_name)
+        # Estado de Ollama según el monitor en segundo plano (sin sondear aquí)
+        monitor = service.health_monitor.status()
+        ollama_running = monitor["ollama_running"]
+        model_available = monitor["model_available"]
         
-        status = "healthy" if ollama_running and model_available else "unhealthy"
+        router_stats = service.router.get_stats()
+        # Con varios backends basta con que uno pueda generar
+        healthy = any(b["healthy"] for b in router_stats["backends"])
+        status = "healthy" if healthy else "unhealthy"
         
         return {
             "status": status,
             "service": "sql_generation",
             "model": service.model_name if hasattr(service, 'model_name') else "unknown",
             "ollama_running": ollama_running,
-            "model_available": model_available
+            "model_available": model_available,
+            "ollama_monitor": monitor,
+            "backends": router_stats["backends"],
+            "ttft": get_ttft_stats()
         }
         
     except Exception as e:
@@ -0,0 +1,266 @@
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+import itertools
+import subprocess
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+from app.core.config import (
+    SQL_SANDBOX_WORKERS, SQL_SANDBOX_MEMORY_MB, SQL_SANDBOX_KILL_GRACE,
+    OMOP_DB_IMMUTABLE, OMOP_CACHE_SIZE_KB, OMOP_MMAP_SIZE
+)
+from .connection_pool import PoolTimeoutError, file_fingerprint
+from .sql_execution import new_result
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = Path(__file__).with_name("sql_execution.py")
+
+# Espera máxima por la respuesta de un worker cuando no hay presupuesto de tiempo
+# ni `timeout` del llamador: un worker colgado nunca bloquea el hilo indefinidamente
+DEFAULT_HARD_LIMIT = 60.0
+
+
+class _SandboxWorker:
+    """Proceso hijo que ejecuta sql_execution.py; un hilo lee sus respuestas de stdout"""
+
+    def __init__(self, args, generation: int):
+        self.generation = generation
+        self.tasks = 0
+        self.proc = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+        )
+        self.responses: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            self.responses.put(line)
+        # EOF: el proceso ha terminado (o lo hemos matado)
+        self.responses.put(None)
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def send(self, request: Dict[str, Any]):
+        self.proc.stdin.write(json.dumps(request) + "\n")
+        self.proc.stdin.flush()
+
+    def kill(self):
+        if self.alive():
+            self.proc.kill()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"El worker aislado {self.proc.pid} no terminó tras kill()")
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except (OSError, ValueError):
+                pass
+
+
+class SandboxPool:
+    """
+    Pool de procesos aislados para ejecutar el SQL de validación.
+
+    Cada worker es un intérprete aparte (sql_execution.py, solo biblioteca
+    estándar) con su propia conexión de solo lectura y un límite de memoria
+    (RLIMIT_AS). Una consulta patológica no puede agotar la memoria de la API
+    ni retener el GIL dentro del código C de SQLite, y varias validaciones
+    corren en paralelo en distintos núcleos.
+
+    El presupuesto de tiempo/pasos se aplica dentro del worker; si aun así no
+    responde en time_budget + kill_grace segundos, el proceso se mata y se
+    sustituye por otro en la siguiente petición. Sin presupuesto de tiempo el
+    límite es el `timeout` de run() (o DEFAULT_HARD_LIMIT) más kill_grace.
+    """
+
+    def __init__(
+        self,
+        db_path,
+        size: int = SQL_SANDBOX_WORKERS,
+        memory_mb: int = SQL_SANDBOX_MEMORY_MB,
+        kill_grace: float = SQL_SANDBOX_KILL_GRACE,
+        immutable: bool = OMOP_DB_IMMUTABLE,
+        cache_size_kb: int = OMOP_CACHE_SIZE_KB,
+        mmap_size: int = OMOP_MMAP_SIZE
+    ):
+        self.db_path = Path(db_path)
+        self.size = max(1, size)
+        self.memory_mb = memory_mb
+        self.kill_grace = kill_grace
+        self.immutable = immutable
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+
+        self._idle: "queue.LifoQueue[_SandboxWorker]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._open = 0
+        self._generation = 0
+        self._fingerprint: Optional[Tuple[int, int, int]] = None
+        self._stats = {
+            'spawned': 0,
+            'tasks': 0,
+            'timeouts_killed': 0,
+            'crashes': 0,
+            'file_changes': 0,
+            'waits': 0,
+        }
+
+    def _command(self):
+        args = [
+            sys.executable, str(WORKER_SCRIPT), str(self.db_path),
+            "--memory-mb", str(self.memory_mb),
+            "--cache-size-kb", str(self.cache_size_kb),
+            "--mmap-size", str(self.mmap_size),
+        ]
+        return args + ["--immutable"] if self.immutable else args
+
+    def _spawn(self) -> _SandboxWorker:
+        with self._lock:
+            generation = self._generation
+            self._stats['spawned'] += 1
+        return _SandboxWorker(self._command(), generation)
+
+    def _retire(self, worker: _SandboxWorker):
+        worker.kill()
+        with self._lock:
+            self._open -= 1
+
+    def _check_file(self):
+        """Si la base de datos se reconstruyó, los workers abiertos sobre la anterior se retiran"""
+        fingerprint = file_fingerprint(self.db_path)
+        with self._lock:
+            if self._fingerprint is not None and fingerprint != self._fingerprint:
+                self._generation += 1
+                self._stats['file_changes'] += 1
+                logger.info(f"{self.db_path} ha cambiado: se reinician los workers aislados")
+            self._fingerprint = fingerprint
+
+    def _acquire(self, timeout: float) -> _SandboxWorker:
+        self._check_file()
+        deadline = time.monotonic() + timeout
+        waited = False
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_spawn = self._open < self.size
+                    if can_spawn:
+                        self._open += 1
+                if can_spawn:
+                    try:
+                        return self._spawn()
+                    except Exception:
+                        with self._lock:
+                            self._open -= 1
+                        raise
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(f"Sin workers aislados libres tras {timeout:g} s")
+                if not waited:
+                    waited = True
+                    with self._lock:
+                        self._stats['waits'] += 1
+                try:
+                    worker = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+
+            with self._lock:
+                current = worker.generation == self._generation
+            if current and worker.alive():
+                return worker
+            self._retire(worker)
+
+    def run(
+        self,
+        sql: str,
+        mode: str,
+        max_rows: int,
+        time_budget: float,
+        step_budget: int,
+        timeout: float = 30.0
+    ) -> Dict[str, Any]:
+        """
+        Ejecutar la consulta en un worker y devolver el mismo dict que
+        SQLValidator.test_sql_execution. `timeout` es la espera máxima por un worker
+        libre y, si no hay time_budget, también por su respuesta.
+        """
+        worker = self._acquire(timeout)
+        request_id = next(self._ids)
+        hard_limit = (time_budget or timeout or DEFAULT_HARD_LIMIT) + self.kill_grace
+
+        try:
+            worker.send({
+                'id': request_id, 'sql': sql, 'mode': mode, 'max_rows': max_rows,
+                'time_budget': time_budget, 'step_budget': step_budget,
+            })
+            line = worker.responses.get(timeout=hard_limit)
+        except queue.Empty:
+            self._retire(worker)
+            with self._lock:
+                self._stats['timeouts_killed'] += 1
+            logger.warning(f"Worker aislado {worker.proc.pid} sin respuesta en {hard_limit:g} s: terminado")
+            result = new_result(mode)
+            result['error'] = f"Consulta demasiado costosa: el proceso aislado no respondió en {hard_limit:g} s y se ha terminado"
+            result['error_type'] = 'BudgetExceeded'
+            result['budget_limit'] = 'time'
+            return result
+        except OSError:
+            line = None
+
+        if line is None:
+            # El worker murió (p. ej. por el límite de memoria) o se cerró su tubería
+            self._retire(worker)
+            with self._lock:
+                self._stats['crashes'] += 1
+            result = new_result(mode)
+            result['error'] = "El proceso aislado de validación terminó inesperadamente"
+            result['error_type'] = 'SandboxCrashed'
+            return result
+
+        worker.tasks += 1
+        with self._lock:
+            self._stats['tasks'] += 1
+        self._idle.put(worker)
+        return json.loads(line)['result']
+
+    def close(self):
+        """Terminar los workers inactivos (los ocupados se retiran al devolverse)"""
+        with self._lock:
+            self._generation += 1
+        while True:
+            try:
+                self._retire(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def get_stats(self) -> Dict[str, Any]:
+        idle = self._idle.qsize()
+        with self._lock:
+            stats = dict(self._stats)
+            open_workers = self._open
+        return {
+            **stats,
+            'db_path': str(self.db_path),
+            'size': self.size,
+            'open': open_workers,
+            'idle': idle,
+            'busy': open_workers - idle,
+            'memory_mb': self.memory_mb,
+            'kill_grace_s': self.kill_grace,
+        }
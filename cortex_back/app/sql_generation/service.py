@@ -1,137 +1,320 @@
+import asyncio
 import logging
-from typing import List, Dict, Optional
-from pathlib import Path
+from typing import List, Dict, Optional, Iterator, AsyncIterator, Tuple
 
-from .models import SQLGenerationRequest, SQLGenerationResponse, SimilarExample, MedicalTerm
-from .ollama_client import OllamaClient
+from app.core.config import (
+    RAG_TOP_K, RAG_FETCH_K, RAG_MMR_LAMBDA, RAG_PROMPT_TOKEN_BUDGET, SQL_CACHE_ENABLED,
+    SQL_PARALLEL_CANDIDATES, SQL_CANDIDATE_TEMPERATURES, PROMPT_INCLUDE_SCHEMA, OLLAMA_BACKENDS
+)
+from app.core.artifacts import get_artifact_locator
+from .models import SQLGenerationRequest, SQLGenerationResponse, SimilarExample, MedicalTerm, AttemptMetrics
+from .ollama_client import OllamaClient, AsyncOllamaClient
+from .ollama_health import OllamaHealthMonitor
+from .llm_router import LLMRouter, Backend, BackendSpec, parse_backends
 from .sql_validator import SQLValidator
+from .query_executor import QueryExecutor
+from .cost_estimator import cost_feedback
 from .rag_retriever import RAGRetriever
+from .sql_cache import SemanticSQLCache, cache_version
 
 logger = logging.getLogger(__name__)
 
+BUDGET_FEEDBACK = (
+    "Query too expensive (execution budget exceeded). Avoid cartesian products: "
+    "join on keys, filter early and aggregate."
+)
+
+class _CorrectionLoop:
+    """
+    Estado del bucle de corrección, común a generate_sql, generate_sql_async y
+    los dos streams (que solo difieren en cómo llaman al modelo y a la validación).
+    
+    next_attempt prepara cada intento: prompt con el SQL y el error del anterior
+    y backend del nivel del intento, distinto del que acaba de fallar. record
+    guarda el resultado y decide si seguir.
+    """
+    
+    def __init__(self, service: "SQLGenerationService", request: SQLGenerationRequest, similar_examples: List[Dict]):
+        self.service = service
+        self.request = request
+        self.similar_examples = similar_examples
+        self.attempts: List[Dict] = []
+        self.current_sql: Optional[str] = None
+        self.error_context = ""
+        self.failed_backend: Optional[Backend] = None
+        self.first_iteration = 1
+    
+    def iterations(self) -> range:
+        return range(self.first_iteration, self.service.max_attempts + 1)
+    
+    def seed(self, candidates: List[Dict]):
+        """
+        Partir de los candidatos del muestreo paralelo, que cuentan como primera iteración.
+        Si todos fallaron al generar (GenerationError) se sigue con el reintento normal
+        desde el prompt inicial; el router ya relega los backends que acaban de fallar.
+        """
+        self.attempts = list(candidates)
+        if any(a['executable'] for a in candidates):
+            self.first_iteration = self.service.max_attempts + 1
+            return
+        failed = [a for a in candidates if a['error_type'] != 'GenerationError']
+        if failed:
+            # Sin ganador: se corrige el primer candidato que llegó
+            self.current_sql, self.error_context = failed[0]['sql'], failed[0]['feedback']
+        self.first_iteration = 2
+    
+    def next_attempt(self, iteration: int) -> Tuple[str, Backend]:
+        prompt = self.service._create_prompt(
+            question=self.request.question,
+            medical_terms=self.request.medical_terms,
+            similar_example=self.similar_examples[0] if self.similar_examples else None,
+            similar_examples=self.similar_examples,
+            iteration=iteration,
+            previous_sql=self.current_sql,
+            error_msg=self.error_context
+        )
+        # El reintento tras un fallo del modelo va a otro backend si lo hay
+        backend = self.service.router.select(iteration, exclude=self.failed_backend)
+        return prompt, backend
+    
+    def record(self, result: Dict, backend: Backend) -> bool:
+        """Guardar el intento; True si hay que terminar"""
+        self.attempts.append(result)
+        # Si es ejecutable o el modelo no respondió (y no hay otro), terminar
+        if self.service._should_stop(result, backend):
+            return True
+        if result['error_type'] == 'GenerationError':
+            self.failed_backend = backend
+            return False
+        self.failed_backend = None
+        self.current_sql = result['sql']
+        self.error_context = result['feedback']
+        return False
+
 class SQLGenerationService:
     def __init__(
         self,
         ollama_url: str = "http://localhost:11434",
         model_name: str = "deepseek-coder-v2:16b-lite-instruct-q4_K_M",
-        dataset_path: str = "data/text2sql_epi_dataset_omop.xlsx",
-        omop_db_path: str = "omop_testing/omop_complete.db",
+        dataset_path: Optional[str] = None,
+        omop_db_path: Optional[str] = None,
         max_attempts: int = 3,
-        timeout: int = 180
+        timeout: int = 180,
+        rag_top_k: int = RAG_TOP_K,
+        rag_fetch_k: int = RAG_FETCH_K,
+        rag_mmr_lambda: float = RAG_MMR_LAMBDA,
+        rag_token_budget: int = RAG_PROMPT_TOKEN_BUDGET,
+        sql_cache_enabled: bool = SQL_CACHE_ENABLED,
+        parallel_candidates: int = SQL_PARALLEL_CANDIDATES,
+        candidate_temperatures: Optional[List[float]] = None,
+        backends: Optional[List[BackendSpec]] = None
     ):
-        self.ollama_client = OllamaClient(ollama_url)
-        self.model_name = model_name
-        self.sql_validator = SQLValidator(omop_db_path)
+        locator = get_artifact_locator()
+        self.router = self._build_router(backends or parse_backends(OLLAMA_BACKENDS, ollama_url, model_name))
+        self.router.start()
+        # Backend principal (modelo más capaz): warmup, caché y estado por defecto
+        primary = self.router.primary
+        self.ollama_client = primary.client
+        self.async_ollama_client = primary.async_client
+        self.model_name = primary.model_name
+        self.health_monitor = primary.health
+        # En el bucle de generación basta con preparar la consulta (modo explain por defecto)
+        self.sql_validator = SQLValidator(str(omop_db_path or locator.omop_db_path))
+        self._query_executor: Optional[QueryExecutor] = None
         self.rag_retriever = RAGRetriever(dataset_path)
         self.max_attempts = max_attempts
         self.timeout = timeout
+        self.rag_top_k = rag_top_k
+        self.rag_fetch_k = rag_fetch_k
+        self.rag_mmr_lambda = rag_mmr_lambda
+        self.rag_token_budget = rag_token_budget
+        self.parallel_candidates = parallel_candidates
+        self.candidate_temperatures = candidate_temperatures or SQL_CANDIDATE_TEMPERATURES
+        if self.parallel_candidates > len(self.candidate_temperatures):
+            # Más candidatos que temperaturas configuradas: repetir la escala
+            reps = -(-self.parallel_candidates // len(self.candidate_temperatures))
+            self.candidate_temperatures = (self.candidate_temperatures * reps)[:self.parallel_candidates]
         
         # Schema OMOP (cargar desde archivo si existe)
-        schema_path = Path("omop_schema_stub.txt")
+        schema_path = locator.omop_schema_path
         if schema_path.exists():
             with open(schema_path, "r") as f:
                 self.omop_schema = f.read()
         else:
             self.omop_schema = "OMOP CDM v5.3 schema not available"
-    
-    def generate_sql(self, request: SQLGenerationRequest) -> SQLGenerationResponse:
-        """Generar SQL desde lenguaje natural"""
+        self.schema_available = schema_path.exists()
+        
+        # Prefijo estático (instrucciones y, con PROMPT_INCLUDE_SCHEMA, el esquema) al principio de todos los prompts:
+        # Ollama reutiliza su caché KV entre consultas y solo evalúa la parte variable
+        self.prompt_includes_schema = PROMPT_INCLUDE_SCHEMA and self.schema_available
+        self.prompt_prefix = self._build_prompt_prefix(include_schema=self.prompt_includes_schema)
         
-        # Verificar que Ollama esté funcionando
-        if not self.ollama_client.is_ollama_running():
+        # Caché semántica: se invalida sola si cambia el modelo o el esquema
+        self.sql_cache = SemanticSQLCache(
+            cache_version(",".join(self.router.model_names), self.omop_schema)
+        ) if sql_cache_enabled else None
+    
+    @property
+    def query_executor(self) -> QueryExecutor:
+        """Ejecución paginada de consultas sobre la misma base de datos de validación"""
+        if self._query_executor is None:
+            self._query_executor = QueryExecutor(self.sql_validator.omop_db_path, engine=self.sql_validator.engine)
+        return self._query_executor
+    
+    @staticmethod
+    def _build_router(specs: List[BackendSpec]) -> LLMRouter:
+        """Un backend por (url, modelo); los clientes HTTP se comparten por url"""
+        clients, backends = {}, []
+        for spec in specs:
+            if spec.url not in clients:
+                clients[spec.url] = (OllamaClient(spec.url), AsyncOllamaClient(spec.url))
+            client, async_client = clients[spec.url]
+            backends.append(Backend(spec, client, async_client, OllamaHealthMonitor(client, spec.model)))
+        if len(backends) > 1:
+            logger.info(f"Router LLM con {len(backends)} backends: {', '.join(b.name for b in backends)}")
+        return LLMRouter(backends)
+    
+    def _should_stop(self, result: Dict, backend: Backend) -> bool:
+        """Fin del bucle de intentos: SQL ejecutable, o el modelo no respondió y no hay a quién escalar"""
+        if result['executable']:
+            return True
+        return result['error_type'] == 'GenerationError' and not self.router.has_fallback(backend)
+    
+    def _check_ollama(self, request: SQLGenerationRequest) -> Optional[SQLGenerationResponse]:
+        """Respuesta de error si Ollama o el modelo no están disponibles"""
+        # Estado cacheado por los monitores: sin peticiones HTTP en la ruta de la consulta
+        backends = self.router.backends
+        if not any(b.health.accepting_requests() for b in backends):
+            if any(b.health.is_running() for b in backends):
+                error_message = "Ollama no responde tras varios fallos consecutivos. Reintenta en unos segundos."
+            else:
+                error_message = "Ollama no está ejecutándose. Asegúrate de que esté iniciado."
             return SQLGenerationResponse(
                 question=request.question,
                 generated_sql="",
                 is_executable=False,
-                error_message="Ollama no está ejecutándose. Asegúrate de que esté iniciado.",
+                error_message=error_message,
                 attempts_count=0
             )
         
         # Verificar que el modelo esté disponible
-        if not self.ollama_client.check_model_availability(self.model_name):
+        if not any(b.health.model_available() for b in backends):
             return SQLGenerationResponse(
                 question=request.question,
                 generated_sql="",
                 is_executable=False,
-                error_message=f"Modelo {self.model_name} no está disponible en Ollama",
+                error_message=f"Modelo {', '.join(self.router.model_names)} no está disponible en Ollama",
                 attempts_count=0
             )
+        return None
+    
+    def _cached_response(self, request: SQLGenerationRequest) -> Optional[SQLGenerationResponse]:
+        """SQL ya validado para una pregunta equivalente con los mismos conceptos"""
+        if self.sql_cache is None:
+            return None
+        try:
+            hit = self.sql_cache.lookup(request.question, [t.concept_id for t in request.medical_terms])
+        except Exception as e:
+            logger.warning(f"Error consultando la caché de SQL: {e}")
+            return None
+        if not hit:
+            return None
         
-        # Obtener ejemplo similar del RAG
-        similar_examples = self.rag_retriever.get_similar_examples(request.question, k=1)
-        similar_example = similar_examples[0] if similar_examples else None
+        logger.info(f"SQL servido desde caché (similitud {hit['similarity']:.3f} con '{hit['question']}')")
+        return SQLGenerationResponse(
+            question=request.question,
+            generated_sql=hit['sql'],
+            is_executable=True,
+            attempts_count=0,
+            cached=True
+        )
+    
+    def _store_in_cache(self, request: SQLGenerationRequest, response: SQLGenerationResponse):
+        if self.sql_cache is None or not response.is_executable:
+            return
+        try:
+            self.sql_cache.store(request.question, [t.concept_id for t in request.medical_terms], response.generated_sql)
+        except Exception as e:
+            logger.warning(f"Error guardando en la caché de SQL: {e}")
+    
+    def _retrieve_examples(self, question: str) -> List[Dict]:
+        """Ejemplos similares del RAG (filas distintas, MMR, dentro del presupuesto)"""
+        return self.rag_retriever.get_similar_examples(
+            question,
+            k=self.rag_top_k,
+            fetch_k=max(self.rag_fetch_k, self.rag_top_k),
+            mmr_lambda=self.rag_mmr_lambda,
+            token_budget=self.rag_token_budget
+        )
+    
+    def _validate_candidate(
+        self,
+        generated_text: Optional[str],
+        iteration: int,
+        metrics: Optional[Dict] = None,
+        model_name: Optional[str] = None
+    ) -> Dict:
+        """Limpiar y validar la salida del modelo; devuelve el registro del intento"""
+        result = self._check_candidate(generated_text, iteration)
+        result['metrics'] = metrics or {}
+        result['model'] = model_name or self.model_name
+        return result
+    
+    def _check_candidate(self, generated_text: Optional[str], iteration: int) -> Dict:
+        # El éxito o fallo de la llamada lo registra el backend en su circuit breaker
+        if not generated_text:
+            return {
+                'iteration': iteration,
+                'sql': "",
+                'executable': False,
+                'error': "No se pudo generar respuesta del modelo",
+                'error_type': 'GenerationError'
+            }
         
-        # Generar SQL con corrección iterativa
-        attempts = []
-        current_sql = None
-        error_context = ""
+        # Limpiar y validar SQL
+        sql = self.sql_validator.clean_generated_sql(generated_text)
         
-        for attempt in range(self.max_attempts):
-            prompt = self._create_prompt(
-                question=request.question,
-                medical_terms=request.medical_terms,
-                similar_example=similar_example,
-                iteration=attempt + 1,
-                previous_sql=current_sql,
-                error_msg=error_context
-            )
-            
-            # Generar SQL con Ollama
-            generated_text = self.ollama_client.generate(
-                model_name=self.model_name,
-                prompt=prompt,
-                temperature=0.05,
-                max_tokens=700,
-                timeout=self.timeout // self.max_attempts
-            )
-            
-            if not generated_text:
-                attempts.append({
-                    'iteration': attempt + 1,
-                    'sql': "",
-                    'executable': False,
-                    'error': "No se pudo generar respuesta del modelo",
-                    'error_type': 'GenerationError'
-                })
-                break
-            
-            # Limpiar y validar SQL
-            current_sql = self.sql_validator.clean_generated_sql(generated_text)
-            
-            # Validación sintáctica básica
-            syntax_error = self.sql_validator.validate_sql_syntax(current_sql)
-            if syntax_error:
-                attempts.append({
-                    'iteration': attempt + 1,
-                    'sql': current_sql,
-                    'executable': False,
-                    'error': f"Error de sintaxis: {syntax_error}",
-                    'error_type': 'SyntaxError'
-                })
-                error_context = syntax_error
-                continue
-            
-            # Probar ejecución en base de datos
-            exec_result = self.sql_validator.test_sql_execution(current_sql)
-            
-            attempts.append({
-                'iteration': attempt + 1,
-                'sql': current_sql,
-                'executable': exec_result['executable'],
-                'error': exec_result['error'],
-                'error_type': exec_result['error_type']
-            })
-            
-            # Si es ejecutable, terminar
-            if exec_result['executable']:
-                break
-            
-            # Preparar contexto de error para siguiente iteración
-            error_context = exec_result['error'] if exec_result['error'] else "Error desconocido"
-            if len(error_context) > 150:
-                error_context = error_context[:150] + "..."
+        # Validación sintáctica básica
+        syntax_error = self.sql_validator.validate_sql_syntax(sql)
+        if syntax_error:
+            return {
+                'iteration': iteration,
+                'sql': sql,
+                'executable': False,
+                'error': f"Error de sintaxis: {syntax_error}",
+                'error_type': 'SyntaxError',
+                'feedback': syntax_error
+            }
+        
+        # Probar ejecución en base de datos
+        exec_result = self.sql_validator.test_sql_execution(sql)
+        
+        # Contexto de error para la siguiente iteración
+        feedback = exec_result['error'] if exec_result['error'] else "Error desconocido"
+        if exec_result['error_type'] in ('BudgetExceeded', 'CostExceeded'):
+            # El SQL es válido pero demasiado caro: pedir al modelo una consulta más barata,
+            # con las tablas recorridas enteras y las columnas indexadas si hay estimación
+            feedback = cost_feedback(exec_result.get('cost')) or BUDGET_FEEDBACK
+        if len(feedback) > 150:
+            feedback = feedback[:150] + "..."
         
-        # Preparar respuesta
+        return {
+            'iteration': iteration,
+            'sql': sql,
+            'executable': exec_result['executable'],
+            'error': exec_result['error'],
+            'error_type': exec_result['error_type'],
+            'feedback': feedback
+        }
+    
+    def _build_response(
+        self,
+        request: SQLGenerationRequest,
+        attempts: List[Dict],
+        similar_examples: List[Dict]
+    ) -> SQLGenerationResponse:
+        """Respuesta final a partir de los intentos realizados"""
+        similar_example = similar_examples[0] if similar_examples else None
         successful_attempts = [a for a in attempts if a['executable']]
         final_attempt = successful_attempts[0] if successful_attempts else attempts[-1] if attempts else {
             'sql': '', 'executable': False, 'error': 'No se realizaron intentos'
@@ -143,8 +326,254 @@ class SQLGenerationService:
             is_executable=final_attempt['executable'],
             error_message=final_attempt['error'] if not final_attempt['executable'] else None,
             attempts_count=len(attempts),
-            similar_example=SimilarExample(**similar_example) if similar_example else None
+            similar_example=SimilarExample(**similar_example) if similar_example else None,
+            similar_examples=[SimilarExample(**example) for example in similar_examples],
+            model_name=final_attempt.get('model', self.model_name),
+            attempt_metrics=[
+                AttemptMetrics(iteration=a['iteration'], model_name=a.get('model'), **a['metrics'])
+                for a in attempts if a.get('metrics')
+            ]
+        )
+    
+    def _generation_options(self, metrics: Dict, temperature: float = 0.05) -> Dict:
+        """Parámetros comunes de cada llamada al modelo (el tiempo total se reparte entre los intentos)"""
+        return {
+            'temperature': temperature,
+            'max_tokens': 700,
+            'timeout': self.timeout // self.max_attempts,
+            'metrics': metrics,
+        }
+    
+    def generate_sql(self, request: SQLGenerationRequest) -> SQLGenerationResponse:
+        """
+        Generar SQL desde lenguaje natural.
+        
+        Versión síncrona (scripts y pruebas): los intentos son secuenciales. El
+        muestreo paralelo de candidatos (SQL_PARALLEL_CANDIDATES) solo se aplica
+        en generate_sql_async, donde los candidatos perdedores se pueden cancelar.
+        """
+        
+        cached = self._cached_response(request)
+        if cached:
+            return cached
+        
+        unavailable = self._check_ollama(request)
+        if unavailable:
+            return unavailable
+        
+        similar_examples = self._retrieve_examples(request.question)
+        
+        # Generar SQL con corrección iterativa
+        loop = _CorrectionLoop(self, request, similar_examples)
+        for iteration in loop.iterations():
+            # Modelo según el intento y la carga de cada backend
+            prompt, backend = loop.next_attempt(iteration)
+            metrics = {}
+            generated_text = backend.generate(prompt=prompt, **self._generation_options(metrics))
+            result = self._validate_candidate(generated_text, iteration, metrics, backend.model_name)
+            if loop.record(result, backend):
+                break
+        
+        response = self._build_response(request, loop.attempts, similar_examples)
+        self._store_in_cache(request, response)
+        return response
+    
+    async def generate_sql_async(self, request: SQLGenerationRequest) -> SQLGenerationResponse:
+        """
+        Versión asíncrona de generate_sql para las rutas async.
+        
+        Las llamadas al modelo usan el cliente httpx y no ocupan hilos mientras
+        esperan; RAG y validación (bloqueantes) se ejecutan en un hilo aparte.
+        """
+        cached = await asyncio.to_thread(self._cached_response, request)
+        if cached:
+            return cached
+        
+        unavailable = await asyncio.to_thread(self._check_ollama, request)
+        if unavailable:
+            return unavailable
+        
+        similar_examples = await asyncio.to_thread(self._retrieve_examples, request.question)
+        
+        loop = _CorrectionLoop(self, request, similar_examples)
+        # Modo paralelo: la primera iteración lanza N candidatos a la vez
+        if self.parallel_candidates > 1:
+            loop.seed(await self._sample_candidates_async(request, similar_examples))
+        
+        for iteration in loop.iterations():
+            prompt, backend = loop.next_attempt(iteration)
+            metrics = {}
+            generated_text = await backend.agenerate(prompt=prompt, **self._generation_options(metrics))
+            result = await asyncio.to_thread(
+                self._validate_candidate, generated_text, iteration, metrics, backend.model_name
+            )
+            if loop.record(result, backend):
+                break
+        
+        response = self._build_response(request, loop.attempts, similar_examples)
+        await asyncio.to_thread(self._store_in_cache, request, response)
+        return response
+    
+    async def _sample_candidates_async(
+        self,
+        request: SQLGenerationRequest,
+        similar_examples: List[Dict]
+    ) -> List[Dict]:
+        """
+        Pedir N candidatos en paralelo a distintas temperaturas y validarlos según llegan.
+        
+        Devuelve los intentos en orden de llegada; en cuanto uno es ejecutable se
+        cancelan los demás (al cerrar su conexión Ollama deja de generarlos).
+        """
+        prompt = self._create_prompt(
+            question=request.question,
+            medical_terms=request.medical_terms,
+            similar_example=similar_examples[0] if similar_examples else None,
+            similar_examples=similar_examples
         )
+        
+        async def candidate(index: int, temperature: float) -> Dict:
+            # Cada candidato va al backend menos cargado en ese momento
+            backend = self.router.select(1)
+            metrics = {}
+            generated_text = await backend.agenerate(prompt=prompt, **self._generation_options(metrics, temperature))
+            result = await asyncio.to_thread(self._validate_candidate, generated_text, 1, metrics, backend.model_name)
+            result.update({'candidate': index, 'temperature': temperature})
+            return result
+        
+        temperatures = self.candidate_temperatures[:self.parallel_candidates]
+        tasks = [asyncio.create_task(candidate(i, t)) for i, t in enumerate(temperatures)]
+        attempts = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                attempts.append(result)
+                if result['executable']:
+                    logger.info(f"Candidato {result['candidate']} (T={result['temperature']}) ejecutable; "
+                                f"cancelando {len(tasks) - len(attempts)} restantes")
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return attempts
+    
+    def generate_sql_stream(self, request: SQLGenerationRequest) -> Iterator[Dict]:
+        """
+        Generar SQL emitiendo eventos a medida que el modelo produce tokens.
+        
+        Eventos: attempt, token, validation y result (SQLGenerationResponse serializada).
+        La generación se corta en cuanto el modelo completa una sentencia SQL.
+        """
+        cached = self._cached_response(request)
+        if cached:
+            yield {"event": "result", "data": cached.model_dump()}
+            return
+        
+        unavailable = self._check_ollama(request)
+        if unavailable:
+            yield {"event": "result", "data": unavailable.model_dump()}
+            return
+        
+        similar_examples = self._retrieve_examples(request.question)
+        
+        loop = _CorrectionLoop(self, request, similar_examples)
+        for iteration in loop.iterations():
+            yield {"event": "attempt", "data": {"iteration": iteration}}
+            
+            prompt, backend = loop.next_attempt(iteration)
+            tokens, metrics = [], {}
+            for token in backend.generate_stream(
+                prompt=prompt,
+                stop_condition=self.sql_validator.is_statement_complete,
+                **self._generation_options(metrics)
+            ):
+                tokens.append(token)
+                yield {"event": "token", "data": {"iteration": iteration, "text": token}}
+            
+            result = self._validate_candidate("".join(tokens).strip(), iteration, metrics, backend.model_name)
+            yield {"event": "validation", "data": {k: v for k, v in result.items() if k != 'feedback'}}
+            if loop.record(result, backend):
+                break
+        
+        response = self._build_response(request, loop.attempts, similar_examples)
+        self._store_in_cache(request, response)
+        yield {"event": "result", "data": response.model_dump()}
+    
+    async def generate_sql_stream_async(self, request: SQLGenerationRequest) -> AsyncIterator[Dict]:
+        """
+        Versión asíncrona de generate_sql_stream para la ruta SSE.
+        
+        Los tokens llegan por el cliente httpx sin ocupar un hilo durante toda la
+        generación; RAG, validación y caché (bloqueantes) van a un hilo aparte.
+        """
+        cached = await asyncio.to_thread(self._cached_response, request)
+        if cached:
+            yield {"event": "result", "data": cached.model_dump()}
+            return
+        
+        unavailable = await asyncio.to_thread(self._check_ollama, request)
+        if unavailable:
+            yield {"event": "result", "data": unavailable.model_dump()}
+            return
+        
+        similar_examples = await asyncio.to_thread(self._retrieve_examples, request.question)
+        
+        loop = _CorrectionLoop(self, request, similar_examples)
+        for iteration in loop.iterations():
+            yield {"event": "attempt", "data": {"iteration": iteration}}
+            
+            prompt, backend = loop.next_attempt(iteration)
+            tokens, metrics = [], {}
+            async for token in backend.agenerate_stream(
+                prompt=prompt,
+                stop_condition=self.sql_validator.is_statement_complete,
+                **self._generation_options(metrics)
+            ):
+                tokens.append(token)
+                yield {"event": "token", "data": {"iteration": iteration, "text": token}}
+            
+            result = await asyncio.to_thread(
+                self._validate_candidate, "".join(tokens).strip(), iteration, metrics, backend.model_name
+            )
+            yield {"event": "validation", "data": {k: v for k, v in result.items() if k != 'feedback'}}
+            if loop.record(result, backend):
+                break
+        
+        response = self._build_response(request, loop.attempts, similar_examples)
+        await asyncio.to_thread(self._store_in_cache, request, response)
+        yield {"event": "result", "data": response.model_dump()}
+    
+    def _build_prompt_prefix(self, include_schema: bool = True) -> str:
+        """Parte común a todos los prompts; no debe depender de la petición"""
+        prefix = """You are a SQL expert. Generate ONLY valid SQL for OMOP CDM v5.3.
+
+Instructions:
+- Generate ONLY SQL code, no explanations
+- Use the provided concept IDs in your WHERE clauses
+- Use standard OMOP table names (PERSON, CONDITION_OCCURRENCE, DRUG_EXPOSURE, etc.)
+- End with semicolon
+"""
+        if include_schema:
+            prefix += f"""
+OMOP CDM v5.3 schema:
+{self.omop_schema.strip()}
+"""
+        return prefix + "\n---\n\n"
+    
+    def warmup(self) -> Optional[Dict[str, float]]:
+        """Cargar los modelos en Ollama y precalcular el prefijo estático del prompt"""
+        primary_timings = None
+        for backend in self.router.backends:
+            timings = backend.client.warmup(backend.model_name, self.prompt_prefix)
+            if timings:
+                logger.info(
+                    f"Warmup de {backend.name}: carga {timings['load_ms']:.0f} ms, "
+                    f"prefijo de {timings['prompt_eval_count']} tokens en {timings['prompt_eval_ms']:.0f} ms"
+                )
+            if backend is self.router.primary:
+                primary_timings = timings
+        return primary_timings
     
     def _create_prompt(
         self,
@@ -153,9 +582,10 @@ class SQLGenerationService:
         similar_example: Optional[Dict],
         iteration: int = 1,
         previous_sql: Optional[str] = None,
-        error_msg: str = ""
+        error_msg: str = "",
+        similar_examples: Optional[List[Dict]] = None
     ) -> str:
-        """Crear prompt para la generación SQL"""
+        """Crear prompt para la generación SQL (prefijo estático + parte de la petición)"""
         
         if iteration > 1 and previous_sql:
             # Prompt de corrección
@@ -175,31 +605,31 @@ Error: {error_brief}
 Fixed SQL:"""
         else:
             # Prompt inicial
+            examples = similar_examples or ([similar_example] if similar_example else [])
             similar_text = ""
-            if similar_example:
+            if len(examples) == 1:
                 similar_text = f"""
 Similar example:
-Question: {similar_example['question']}
-SQL: {similar_example['sql']}
+Question: {examples[0]['question']}
+SQL: {examples[0]['sql']}
+"""
+            elif examples:
+                formatted = "\n\n".join(
+                    f"Question: {example['question']}\nSQL: {example['sql']}" for example in examples
+                )
+                similar_text = f"""
+Similar examples:
+{formatted}
 """
             
-            prompt = f"""You are a SQL expert. Generate ONLY valid SQL for OMOP CDM v5.3.
-
-Question: {question}
+            prompt = f"""Question: {question}
 
 Medical codes to use:
 {self._format_medical_terms(medical_terms)}
 {similar_text}
-
-Instructions:
-- Generate ONLY SQL code, no explanations
-- Use the provided concept IDs in your WHERE clauses
-- Use standard OMOP table names (PERSON, CONDITION_OCCURRENCE, DRUG_EXPOSURE, etc.)
-- End with semicolon
-
 SQL:"""
         
-        return prompt
+        return self.prompt_prefix + prompt
     
     def _format_medical_terms(self, medical_terms: List[MedicalTerm]) -> str:
         """Formatear términos médicos para el prompt"""
@@ -0,0 +1,276 @@
+import re
+import sqlite3
+import logging
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, TokenError, OptimizeError
+from sqlglot.optimizer.annotate_types import annotate_types
+from sqlglot.optimizer.qualify import qualify
+from sqlglot.tokens import TokenType
+
+logger = logging.getLogger(__name__)
+
+# Palabras clave que nunca aparecen en una consulta de solo lectura (comparadas por
+# token, no por subcadena: created_at o last_update son identificadores válidos)
+PROHIBITED_TOKENS = {
+    TokenType.CREATE: "CREATE",
+    TokenType.DROP: "DROP",
+    TokenType.INSERT: "INSERT",
+    TokenType.UPDATE: "UPDATE",
+    TokenType.DELETE: "DELETE",
+    TokenType.TRUNCATE: "TRUNCATE",
+    TokenType.ALTER: "ALTER",
+    TokenType.PRAGMA: "PRAGMA",
+}
+
+# Nodos del AST que modifican la base de datos o su configuración
+WRITE_NODES = (exp.Insert, exp.Update, exp.Delete, exp.Create, exp.Drop, exp.Alter, exp.Command, exp.TruncateTable)
+
+# Tipos de resultado que se pueden ensanchar a DOUBLE si dos ramas de un UNION difieren
+NUMERIC_TYPES = {"INT", "TINYINT", "SMALLINT", "BIGINT", "FLOAT", "DOUBLE", "DECIMAL"}
+
+MAX_SQL_LENGTH = 5000
+MAX_SELECTS = 20
+
+# Tablas y columnas estándar de OMOP CDM v5.3 que el resumen enviado al modelo
+# omite por brevedad pero que las consultas del dataset usan
+OMOP_CDM_SUPPLEMENT: Dict[str, Dict[str, str]] = {
+    "person": {
+        "birth_datetime": "DATETIME", "person_source_value": "TEXT", "gender_source_value": "TEXT",
+        "gender_source_concept_id": "INTEGER", "race_source_value": "TEXT", "race_source_concept_id": "INTEGER",
+        "ethnicity_source_value": "TEXT", "ethnicity_source_concept_id": "INTEGER",
+    },
+    "observation_period": {
+        "observation_period_id": "INTEGER", "person_id": "INTEGER", "observation_period_start_date": "DATE",
+        "observation_period_end_date": "DATE", "period_type_concept_id": "INTEGER",
+    },
+    "condition_occurrence": {
+        "condition_start_datetime": "DATETIME", "condition_end_datetime": "DATETIME", "stop_reason": "TEXT",
+        "visit_detail_id": "INTEGER", "condition_source_value": "TEXT", "condition_source_concept_id": "INTEGER",
+        "condition_status_source_value": "TEXT", "condition_status_concept_id": "INTEGER",
+    },
+    "drug_exposure": {
+        "drug_exposure_start_datetime": "DATETIME", "drug_exposure_end_datetime": "DATETIME",
+        "verbatim_end_date": "DATE", "stop_reason": "TEXT", "refills": "INTEGER", "sig": "TEXT",
+        "route_concept_id": "INTEGER", "lot_number": "TEXT", "visit_detail_id": "INTEGER",
+        "drug_source_value": "TEXT", "drug_source_concept_id": "INTEGER", "route_source_value": "TEXT",
+        "dose_unit_source_value": "TEXT",
+    },
+    "procedure_occurrence": {
+        "procedure_datetime": "DATETIME", "modifier_concept_id": "INTEGER", "quantity": "INTEGER",
+        "visit_detail_id": "INTEGER", "procedure_source_value": "TEXT", "procedure_source_concept_id": "INTEGER",
+        "modifier_source_value": "TEXT",
+    },
+    "measurement": {
+        "measurement_datetime": "DATETIME", "measurement_time": "TEXT", "operator_concept_id": "INTEGER",
+        "visit_detail_id": "INTEGER", "measurement_source_value": "TEXT",
+        "measurement_source_concept_id": "INTEGER", "unit_source_value": "TEXT", "value_source_value": "TEXT",
+    },
+    "observation": {
+        "observation_datetime": "DATETIME", "qualifier_concept_id": "INTEGER", "unit_concept_id": "INTEGER",
+        "visit_detail_id": "INTEGER", "observation_source_value": "TEXT",
+        "observation_source_concept_id": "INTEGER", "unit_source_value": "TEXT", "qualifier_source_value": "TEXT",
+    },
+    "visit_occurrence": {
+        "visit_start_datetime": "DATETIME", "visit_end_datetime": "DATETIME", "visit_source_value": "TEXT",
+        "visit_source_concept_id": "INTEGER", "admitting_source_concept_id": "INTEGER",
+        "admitting_source_value": "TEXT", "discharge_to_concept_id": "INTEGER",
+        "discharge_to_source_value": "TEXT", "preceding_visit_occurrence_id": "INTEGER",
+    },
+    "death": {
+        "death_datetime": "DATETIME", "cause_source_value": "TEXT", "cause_source_concept_id": "INTEGER",
+    },
+    "provider": {
+        "npi": "TEXT", "dea": "TEXT", "year_of_birth": "INTEGER", "provider_source_value": "TEXT",
+        "specialty_source_value": "TEXT", "specialty_source_concept_id": "INTEGER",
+        "gender_source_value": "TEXT", "gender_source_concept_id": "INTEGER",
+    },
+    "care_site": {"care_site_source_value": "TEXT", "place_of_service_source_value": "TEXT"},
+    "location": {"address_2": "TEXT", "location_source_value": "TEXT"},
+    "concept_relationship": {"invalid_reason": "TEXT"},
+}
+
+_TABLE_RE = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*)\s*\(\s*$")
+_COLUMN_RE = re.compile(r"^\s+([A-Za-z_][A-Za-z0-9_]*)\s+([A-Za-z]+)")
+
+
+@lru_cache(maxsize=8)
+def load_omop_catalog(schema_path: str) -> Dict[str, Dict[str, str]]:
+    """
+    Catálogo {tabla: {columna: tipo}} (en minúsculas) a partir del resumen del
+    esquema OMOP CDM que también se envía al modelo (omop_schema_stub.txt)
+    """
+    catalog: Dict[str, Dict[str, str]] = {}
+    table = None
+    with open(schema_path, "r", encoding="utf-8") as fp:
+        for line in fp:
+            if line.lstrip().startswith("--"):
+                continue
+            match = _TABLE_RE.match(line.strip())
+            if match:
+                table = match.group(1).lower()
+                catalog[table] = {}
+                continue
+            if table is None:
+                continue
+            if line.strip().startswith(")"):
+                table = None
+                continue
+            match = _COLUMN_RE.match(line)
+            if match:
+                catalog[table][match.group(1).lower()] = match.group(2).upper()
+    return catalog
+
+
+def load_sqlite_catalog(db_path: str) -> Dict[str, Dict[str, str]]:
+    """Catálogo real de la base de datos SQLite (tablas y vistas), leído en solo lectura"""
+    catalog: Dict[str, Dict[str, str]] = {}
+    conn = sqlite3.connect(f"file:{Path(db_path).resolve()}?mode=ro", uri=True)
+    try:
+        names = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        for (name,) in names:
+            columns = conn.execute(f'PRAGMA table_info("{name}")').fetchall()
+            catalog[name.lower()] = {col[1].lower(): (col[2] or "TEXT").upper() for col in columns}
+    finally:
+        conn.close()
+    return catalog
+
+
+class SQLAnalyzer:
+    """
+    Análisis estático del SQL generado, sin acceder a la base de datos.
+
+    Tokeniza y parsea la consulta (dialecto SQLite), exige una única sentencia
+    de solo lectura y, si hay catálogo, resuelve tablas y columnas contra el
+    esquema OMOP CDM. Devuelve el primer error encontrado o None.
+    """
+
+    def __init__(self, catalog: Optional[Dict[str, Dict[str, str]]] = None, dialect: str = "sqlite"):
+        self.catalog = catalog
+        self.dialect = dialect
+
+    @classmethod
+    def from_schema_file(cls, schema_path: Optional[str], db_path: Optional[str] = None) -> "SQLAnalyzer":
+        """
+        Analizador con el catálogo del fichero dado; sin fichero solo se comprueba la sintaxis.
+
+        El resumen del esquema no incluye todas las tablas y columnas del CDM: se
+        completa con OMOP_CDM_SUPPLEMENT y, si existe la base de datos de validación,
+        con su esquema real para no rechazar consultas que sí ejecutan.
+        """
+        if not schema_path or not Path(schema_path).exists():
+            return cls()
+        catalog = {table: dict(columns) for table, columns in load_omop_catalog(str(schema_path)).items()}
+        for table, columns in OMOP_CDM_SUPPLEMENT.items():
+            catalog.setdefault(table, {}).update(columns)
+        if db_path and Path(db_path).exists():
+            try:
+                for table, columns in load_sqlite_catalog(str(db_path)).items():
+                    catalog.setdefault(table, {}).update(columns)
+            except sqlite3.Error as e:
+                logger.warning(f"No se pudo leer el esquema de {db_path}: {e}")
+        return cls(catalog)
+
+    def check(self, sql: str) -> Optional[str]:
+        if not sql or sql.strip() == ';':
+            return "SQL vacío"
+
+        try:
+            tokens = sqlglot.tokenize(sql, read=self.dialect)
+        except TokenError as e:
+            return f"SQL no válido: {e}"
+
+        types = {token.token_type for token in tokens}
+        if TokenType.SELECT not in types or TokenType.FROM not in types:
+            return "SQL debe contener SELECT y FROM"
+
+        for token in tokens:
+            if token.token_type in PROHIBITED_TOKENS:
+                return f"Operación prohibida: {PROHIBITED_TOKENS[token.token_type]}"
+
+        if len(sql) > MAX_SQL_LENGTH:
+            return "SQL demasiado largo"
+
+        if sum(token.token_type == TokenType.SELECT for token in tokens) > MAX_SELECTS:
+            return "Demasiados SELECT anidados"
+
+        try:
+            statements = [s for s in sqlglot.parse(sql, read=self.dialect) if s is not None]
+        except ParseError as e:
+            return self._parse_error_message(e)
+
+        if len(statements) != 1:
+            return "Solo se permite una sentencia SQL"
+        tree = statements[0]
+
+        if not isinstance(tree, exp.Query):
+            return f"Operación prohibida: {tree.key.upper()}"
+        for node in tree.find_all(*WRITE_NODES):
+            return f"Operación prohibida: {node.key.upper()}"
+
+        if self.catalog:
+            return self._check_schema(tree)
+        return None
+
+    @staticmethod
+    def _parse_error_message(error: ParseError) -> str:
+        details = error.errors[0] if error.errors else {}
+        description = details.get("description") or str(error).splitlines()[0]
+        if details.get("line"):
+            return f"{description} (línea {details['line']}, columna {details['col']})"
+        return description
+
+    def _check_schema(self, tree: exp.Expression) -> Optional[str]:
+        # Tablas: las definidas en CTE no están en el catálogo
+        cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        unknown = sorted({
+            table.name.lower() for table in tree.find_all(exp.Table)
+            if table.name and table.name.lower() not in cte_names and table.name.lower() not in self.catalog
+        })
+        if unknown:
+            return f"Tabla no encontrada en OMOP CDM: {', '.join(unknown)}"
+
+        # Columnas: qualify resuelve alias, subconsultas y CTE y falla si alguna no existe
+        try:
+            qualify(tree.copy(), schema=self.catalog, dialect=self.dialect, validate_qualify_columns=True)
+        except OptimizeError as e:
+            return f"Columna no encontrada en OMOP CDM: {str(e).splitlines()[0]}"
+        except Exception as e:
+            # Un fallo del analizador no debe rechazar SQL que quizá sea válido
+            logger.debug(f"No se pudieron resolver las columnas: {e}")
+        return None
+
+    def column_types(self, sql: str) -> Optional[List[Optional[str]]]:
+        """
+        Tipo declarado de cada columna del resultado ('INT', 'FLOAT', 'TEXT'...)
+        según el catálogo; None en las columnas cuyo tipo no se puede deducir y
+        None del todo si no hay catálogo o el SQL no se puede analizar.
+        """
+        if not self.catalog:
+            return None
+        try:
+            tree = qualify(sqlglot.parse_one(sql, read=self.dialect), schema=self.catalog, dialect=self.dialect)
+            tree = annotate_types(tree, schema=self.catalog, dialect=self.dialect)
+        except Exception as e:
+            logger.debug(f"No se pudieron deducir los tipos del resultado: {e}")
+            return None
+        return self._select_types(tree)
+
+    def _select_types(self, tree: exp.Expression) -> List[Optional[str]]:
+        if isinstance(tree, exp.SetOperation):
+            left, right = self._select_types(tree.left), self._select_types(tree.right)
+            return [a if a == b else ("DOUBLE" if {a, b} <= NUMERIC_TYPES else None) for a, b in zip(left, right)]
+        types = []
+        for select in tree.selects:
+            data_type = select.type
+            if data_type is None or data_type.this in (exp.DataType.Type.UNKNOWN, exp.DataType.Type.NULL):
+                types.append(None)
+            else:
+                types.append(data_type.this.value)
+        return types
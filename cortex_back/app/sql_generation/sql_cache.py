@@ -0,0 +1,175 @@
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import SQL_CACHE_PATH, SQL_CACHE_THRESHOLD, SQL_CACHE_MAX_ENTRIES
+from app.core.embeddings import get_embedding_service
+
+logger = logging.getLogger(__name__)
+
+
+def concept_key(concept_ids: List[str]) -> str:
+    """Clave exacta del conjunto de conceptos (ordenado y sin duplicados)"""
+    return ",".join(sorted({str(c).strip() for c in concept_ids if str(c).strip()}))
+
+
+def cache_version(model_name: str, schema_text: str) -> str:
+    """Versión de la caché: cambia si cambia el modelo LLM o el esquema OMOP"""
+    schema_hash = hashlib.sha256(schema_text.encode("utf-8")).hexdigest()[:16]
+    return f"{model_name}|{schema_hash}"
+
+
+class SemanticSQLCache:
+    """
+    Caché de SQL ya validado para preguntas parafraseadas.
+
+    Una entrada coincide si su conjunto de concept ids es exactamente el de la
+    petición y la similitud coseno de las preguntas supera `threshold`. Solo se
+    guardan resultados ejecutables. Las entradas se persisten en SQLite junto a
+    la versión (modelo + hash del esquema); al abrir con otra versión se descartan.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        path: Optional[Path] = SQL_CACHE_PATH,
+        threshold: float = SQL_CACHE_THRESHOLD,
+        max_entries: int = SQL_CACHE_MAX_ENTRIES
+    ):
+        self.version = version
+        self.path = Path(path) if path else None
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._embedder = None
+        # concept_key -> [(id, question, sql, vector)]
+        self._buckets: Dict[str, List[Tuple[int, str, str, np.ndarray]]] = {}
+        self._size = 0
+        self._stats = {'lookups': 0, 'hits': 0, 'stores': 0, 'evictions': 0}
+
+        self._conn = self._open() if self.path else None
+
+    def _open(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, concept_key TEXT NOT NULL, "
+            "question TEXT NOT NULL, sql TEXT NOT NULL, embedding BLOB NOT NULL, created_at REAL NOT NULL)"
+        )
+
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != self.version:
+            if row is not None:
+                logger.info(f"SQL cache version changed ({row[0]} -> {self.version}): invalidating entries")
+            conn.execute("DELETE FROM entries")
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (self.version,))
+        conn.commit()
+
+        for entry_id, key, question, sql, blob in conn.execute(
+            "SELECT id, concept_key, question, sql, embedding FROM entries ORDER BY id"
+        ):
+            self._buckets.setdefault(key, []).append((entry_id, question, sql, np.frombuffer(blob, dtype=np.float32)))
+            self._size += 1
+        logger.info(f"SQL cache loaded: {self._size} entries from {self.path}")
+        return conn
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = get_embedding_service()
+        return self._embedder
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = self.embedder.encode_query(question)[0]
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).astype(np.float32)
+
+    def lookup(self, question: str, concept_ids: List[str]) -> Optional[Dict[str, Any]]:
+        """SQL cacheado para una pregunta equivalente con los mismos conceptos, o None"""
+        key = concept_key(concept_ids)
+        with self._lock:
+            self._stats['lookups'] += 1
+            bucket = list(self._buckets.get(key, ()))
+        if not bucket:
+            return None
+
+        vector = self._embed(question)
+        scores = np.stack([entry[3] for entry in bucket]) @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+
+        with self._lock:
+            self._stats['hits'] += 1
+        _, cached_question, sql, _ = bucket[best]
+        return {'question': cached_question, 'sql': sql, 'similarity': float(scores[best])}
+
+    def store(self, question: str, concept_ids: List[str], sql: str) -> None:
+        """Guardar un SQL ejecutable (si ya hay uno casi idéntico no se duplica)"""
+        key = concept_key(concept_ids)
+        vector = self._embed(question)
+
+        with self._lock:
+            bucket = self._buckets.setdefault(key, [])
+            if bucket and float(np.max(np.stack([e[3] for e in bucket]) @ vector)) >= 0.999:
+                return
+
+            entry_id = None
+            if self._conn is not None:
+                cursor = self._conn.execute(
+                    "INSERT INTO entries (concept_key, question, sql, embedding, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, question, sql, vector.tobytes(), time.time())
+                )
+                self._conn.commit()
+                entry_id = cursor.lastrowid
+            bucket.append((entry_id if entry_id is not None else self._stats['stores'], question, sql, vector))
+            self._size += 1
+            self._stats['stores'] += 1
+
+            if self._size > self.max_entries:
+                self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        # Entrada más antigua entre las cabezas de cada bucket (ids crecientes)
+        key = min((k for k, b in self._buckets.items() if b), key=lambda k: self._buckets[k][0][0])
+        entry_id = self._buckets[key].pop(0)[0]
+        if not self._buckets[key]:
+            del self._buckets[key]
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+            self._conn.commit()
+        self._size -= 1
+        self._stats['evictions'] += 1
+
+    def invalidate(self) -> int:
+        """Vaciar la caché; devuelve el número de entradas eliminadas"""
+        with self._lock:
+            removed = self._size
+            self._buckets.clear()
+            self._size = 0
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM entries")
+                self._conn.commit()
+        logger.info(f"SQL cache invalidated: {removed} entries removed")
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'entries': self._size,
+                'concept_sets': len(self._buckets),
+                'version': self.version,
+                'threshold': self.threshold,
+                'hit_rate': round(stats['hits'] / stats['lookups'], 4) if stats['lookups'] else 0.0,
+            })
+        return stats
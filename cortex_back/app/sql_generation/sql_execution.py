@@ -0,0 +1,215 @@
+"""
+Ejecución de una consulta de validación sobre una conexión SQLite.
+
+Solo usa la biblioteca estándar: lo importa SQLValidator (ejecución en el
+proceso de la API) y también se lanza como script en los procesos aislados de
+SandboxPool, que así arrancan en milisegundos sin cargar la aplicación.
+
+Uso como worker: python sql_execution.py DB_PATH [--memory-mb N] [--immutable] ...
+Lee peticiones JSON (una por línea) de stdin y escribe cada resultado en stdout.
+"""
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from pathlib import Path
+from urllib.parse import quote
+from typing import Callable, List, Optional
+
+# El progress handler de SQLite se invoca cada N instrucciones de la VM
+PROGRESS_INTERVAL = 10_000
+
+
+def new_result(mode: str) -> dict:
+    return {
+        'executable': False,
+        'error': None,
+        'execution_time': None,
+        'row_count': None,
+        'error_type': None,
+        'validation_mode': mode,
+        'plan': None,
+        'truncated': False,
+        'cached': False,
+        'cost': None,
+        'budget_limit': None
+    }
+
+
+def explain_sql(conn: sqlite3.Connection, sql: str) -> List[str]:
+    """
+    Preparar la sentencia con EXPLAIN QUERY PLAN sin ejecutarla.
+
+    SQLite resuelve tablas y columnas al preparar, así que los errores de
+    esquema y de sintaxis aparecen aquí sin leer ninguna fila. Los pasos
+    anidados (subconsultas, CTE) van sangrados dos espacios por nivel.
+    """
+    cursor = conn.execute(f"EXPLAIN QUERY PLAN {sql}")
+    depth = {0: -1}
+    plan = []
+    for node_id, parent, _, detail in cursor.fetchall():
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node_id] + detail)
+    return plan
+
+
+def install_budget(conn: sqlite3.Connection, time_budget: float, step_budget: int) -> dict:
+    """
+    Límites reales de ejecución. El progress handler aborta la consulta
+    (OperationalError 'interrupted') al agotar el tiempo de reloj o los pasos
+    de la VM; el motivo queda en state['exceeded'] y el límite agotado ('steps'
+    o 'time') en state['limit']. El reloj se puede detener
+    entre lotes con pause_budget/resume_budget.
+    """
+    state = {'exceeded': None, 'limit': None, 'steps': 0, 'remaining': time_budget or None, 'deadline': None}
+    resume_budget(state)
+
+    def handler():
+        state['steps'] += PROGRESS_INTERVAL
+        if step_budget and state['steps'] > step_budget:
+            state['exceeded'] = f"más de {step_budget:,} pasos de la VM de SQLite"
+            state['limit'] = 'steps'
+            return 1
+        if state['deadline'] is not None and time.monotonic() > state['deadline']:
+            state['exceeded'] = f"más de {time_budget:g} s de ejecución"
+            state['limit'] = 'time'
+            return 1
+        return 0
+
+    conn.set_progress_handler(handler, PROGRESS_INTERVAL)
+    return state
+
+
+def pause_budget(state: dict):
+    """Detener el reloj del presupuesto (mientras no se ejecuta nada, p. ej. entre lotes)"""
+    if state.get('deadline') is not None:
+        state['remaining'] = max(state['deadline'] - time.monotonic(), 0.0)
+        state['deadline'] = None
+
+
+def resume_budget(state: dict):
+    """Reanudar el reloj con el tiempo que quedaba"""
+    if state.get('remaining') is not None and state.get('deadline') is None:
+        state['deadline'] = time.monotonic() + state['remaining']
+
+
+def execute_query(
+    conn: sqlite3.Connection,
+    sql: str,
+    mode: str,
+    max_rows: int,
+    result: dict,
+    explain: Callable[..., List[str]] = explain_sql
+):
+    """
+    Obtener el plan y, en modo 'execute', leer como mucho max_rows filas.
+    Rellena `result`; los errores del motor se propagan (ver record_error).
+    `explain` obtiene el plan con la sintaxis del motor (DuckDB usa la suya).
+    """
+    start_time = time.time()
+    result['plan'] = explain(conn, sql)
+
+    if mode == 'execute':
+        # conn.execute y no conn.cursor(): en DuckDB cursor() abre otra conexión
+        # a la que no llegaría el interrupt() del presupuesto
+        cursor = conn.execute(sql)
+
+        if cursor.description is not None:
+            rows = cursor.fetchmany(max_rows + 1)
+            result['truncated'] = len(rows) > max_rows
+            result['row_count'] = min(len(rows), max_rows)
+        else:
+            result['row_count'] = cursor.rowcount
+
+    result['executable'] = True
+    result['execution_time'] = time.time() - start_time
+
+
+def record_error(result: dict, error: Exception, budget: Optional[dict] = None) -> dict:
+    """
+    Traducir una excepción al error_type del resultado de validación. En los
+    BudgetExceeded, budget_limit indica el límite agotado: solo 'steps' depende
+    únicamente de la consulta; 'time' y 'memory' también de la carga del momento.
+    """
+    if budget and budget.get('exceeded'):
+        # La interrupción llega como OperationalError en SQLite e InterruptException en DuckDB
+        result['error'] = f"Consulta demasiado costosa: abortada tras {budget['exceeded']}"
+        result['error_type'] = 'BudgetExceeded'
+        result['budget_limit'] = budget.get('limit')
+    elif isinstance(error, sqlite3.OperationalError) or type(error).__module__ in ('duckdb', '_duckdb'):
+        # Los errores de DuckDB (binder, parser, catálogo...) equivalen a los OperationalError de SQLite
+        result['error'] = str(error)
+        result['error_type'] = 'OperationalError'
+    elif isinstance(error, MemoryError):
+        # Límite de memoria del proceso aislado (RLIMIT_AS)
+        result['error'] = "Consulta demasiado costosa: superó el límite de memoria"
+        result['error_type'] = 'BudgetExceeded'
+        result['budget_limit'] = 'memory'
+    elif isinstance(error, sqlite3.DatabaseError):
+        result['error'] = str(error)
+        result['error_type'] = 'DatabaseError'
+    else:
+        result['error'] = str(error) or type(error).__name__
+        result['error_type'] = type(error).__name__
+    return result
+
+
+def connect_read_only(db_path, immutable: bool, cache_size_kb: int, mmap_size: int) -> sqlite3.Connection:
+    uri = f"file:{quote(str(Path(db_path).resolve()))}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA cache_size = -{int(cache_size_kb)}")
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def _limit_memory(memory_mb: int):
+    """Límite de espacio de direcciones del proceso (solo en sistemas POSIX)"""
+    if memory_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:
+        return
+    limit = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def worker_main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Worker aislado de validación de SQL")
+    parser.add_argument("db_path")
+    parser.add_argument("--memory-mb", type=int, default=0)
+    parser.add_argument("--immutable", action="store_true")
+    parser.add_argument("--cache-size-kb", type=int, default=65536)
+    parser.add_argument("--mmap-size", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    _limit_memory(args.memory_mb)
+    conn = connect_read_only(args.db_path, args.immutable, args.cache_size_kb, args.mmap_size)
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        result = new_result(request['mode'])
+        budget = None
+        try:
+            budget = install_budget(conn, request['time_budget'], request['step_budget'])
+            execute_query(conn, request['sql'], request['mode'], request['max_rows'], result)
+        except Exception as e:
+            record_error(result, e, budget)
+        finally:
+            conn.set_progress_handler(None, 0)
+            if conn.in_transaction:
+                conn.rollback()
+        sys.stdout.write(json.dumps({'id': request['id'], 'result': result}) + "\n")
+        sys.stdout.flush()
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    worker_main()
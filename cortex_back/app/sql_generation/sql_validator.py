@@ -1,42 +1,128 @@
 import re
 from typing import Optional
 from pathlib import Path
-import sqlite3
 import logging
 
+from app.core.config import (
+    SQL_VALIDATION_MAX_ROWS, SQL_VALIDATION_TIME_BUDGET, SQL_VALIDATION_STEP_BUDGET,
+    OMOP_SCHEMA_PATH, SQL_SCHEMA_CHECK, SQL_VALIDATION_CACHE_SIZE, SQL_SANDBOX_WORKERS, SQL_ENGINE,
+    SQL_COST_ACTION, SQL_VALIDATION_MODE
+)
+from .connection_pool import ReadOnlyConnectionPool, file_fingerprint
+from .sql_analyzer import SQLAnalyzer
+from .validation_cache import ValidationCache, sql_key
+from .sql_execution import new_result, execute_query, record_error
+from .sandbox import SandboxPool
+from .engines import create_engine
+from .cost_estimator import CostEstimator
+
 logger = logging.getLogger(__name__)
 
+# explain: preparar + EXPLAIN QUERY PLAN (sin leer filas); execute: además ejecutar con límite de filas
+VALIDATION_MODES = ('explain', 'execute')
+# off: sin estimación; flag: se devuelve la estimación; reject: además se rechaza lo que supere el umbral
+COST_ACTIONS = ('off', 'flag', 'reject')
+
 class SQLValidator:
-    def __init__(self, omop_db_path: str = "omop_testing/omop_test.db"):
+    def __init__(
+        self,
+        omop_db_path: str = "omop_testing/omop_test.db",
+        mode: str = SQL_VALIDATION_MODE,
+        max_rows: int = SQL_VALIDATION_MAX_ROWS,
+        time_budget: float = SQL_VALIDATION_TIME_BUDGET,
+        step_budget: int = SQL_VALIDATION_STEP_BUDGET,
+        schema_path: Optional[str] = OMOP_SCHEMA_PATH if SQL_SCHEMA_CHECK else None,
+        cache_size: int = SQL_VALIDATION_CACHE_SIZE,
+        sandbox_workers: int = SQL_SANDBOX_WORKERS,
+        engine: str = SQL_ENGINE,
+        cost_action: str = SQL_COST_ACTION
+    ):
         self.omop_db_path = Path(omop_db_path)
+        if mode not in VALIDATION_MODES:
+            raise ValueError(f"Modo de validación desconocido: {mode} (usar {', '.join(VALIDATION_MODES)})")
+        if cost_action not in COST_ACTIONS:
+            raise ValueError(f"Acción de coste desconocida: {cost_action} (usar {', '.join(COST_ACTIONS)})")
+        self.mode = mode
+        self.max_rows = max_rows
+        self.time_budget = time_budget
+        self.step_budget = step_budget
+        # Motor de ejecución (sqlite o duckdb); el SQL se sigue generando y analizando en dialecto SQLite
+        self.engine = create_engine(engine, self.omop_db_path)
+        self._pool: Optional[ReadOnlyConnectionPool] = None
+        # Con sandbox_workers > 0 las consultas se ejecutan en procesos aislados
+        self.sandbox_workers = sandbox_workers
+        self._sandbox: Optional[SandboxPool] = None
+        # Sin fichero de esquema solo se comprueban sintaxis y solo-lectura
+        self.analyzer = SQLAnalyzer.from_schema_file(schema_path, self.omop_db_path)
+        # Resultados de test_sql_execution por SQL normalizado y huella de la BD
+        self.cache = ValidationCache(cache_size) if cache_size > 0 else None
+        # Coste estimado con el plan de SQLite (las estadísticas se leen en el primer uso)
+        self.cost_action = cost_action
+        self.cost_estimator = CostEstimator(self.omop_db_path) if cost_action != 'off' else None
+    
+    @property
+    def pool(self) -> ReadOnlyConnectionPool:
+        """Pool de conexiones de solo lectura (se crea en el primer uso)"""
+        if self._pool is None:
+            self._pool = ReadOnlyConnectionPool(self.omop_db_path, connect=self.engine.connect)
+        return self._pool
+    
+    @property
+    def sandbox(self) -> SandboxPool:
+        """Pool de procesos aislados (se crea en el primer uso)"""
+        if self._sandbox is None:
+            self._sandbox = SandboxPool(self.omop_db_path, size=self.sandbox_workers)
+        return self._sandbox
+    
+    def close(self):
+        """Cerrar las conexiones y terminar los procesos aislados"""
+        if self._pool is not None:
+            self._pool.close()
+        if self._sandbox is not None:
+            self._sandbox.close()
         
     def validate_sql_syntax(self, sql: str) -> Optional[str]:
-        """Validación básica de sintaxis SQL"""
-        if not sql or sql.strip() == ';':
-            return "SQL vacío"
-        
-        sql_upper = sql.upper()
-        
-        # Verificar que tenga keywords básicos
-        required_keywords = ['SELECT', 'FROM']
-        if not all(keyword in sql_upper for keyword in required_keywords):
-            return "SQL debe contener SELECT y FROM"
-        
-        # Verificar operaciones prohibidas
-        prohibited = ['CREATE', 'DROP', 'INSERT', 'UPDATE', 'DELETE', 'TRUNCATE', 'ALTER']
-        for op in prohibited:
-            if op in sql_upper:
-                return f"Operación prohibida: {op}"
-        
-        # Verificar longitud razonable
-        if len(sql) > 5000:
-            return "SQL demasiado largo"
+        """
+        Validación estática (parser + esquema OMOP), sin acceder a la base de datos.
+        Devuelve el mensaje del primer error o None.
+        """
+        return self.analyzer.check(sql)
+    
+    def is_statement_complete(self, text: str) -> bool:
+        """
+        Indica si el texto generado ya contiene una sentencia SQL completa:
+        un bloque de código cerrado o un SELECT/WITH terminado en ';' fuera de literales
+        y de comentarios (-- y /* */).
+        """
+        fences = [m.start() for m in re.finditer(r'```', text)]
+        if len(fences) >= 2:
+            return True
         
-        # Verificar número excesivo de SELECT anidados
-        if sql.count('SELECT') > 20:
-            return "Demasiados SELECT anidados"
+        body = text[fences[0] + 3:] if fences else text
+        start = re.search(r'\b(SELECT|WITH)\b', body, re.IGNORECASE)
+        if not start:
+            return False
         
-        return None
+        in_quote = None
+        i = start.start()
+        while i < len(body):
+            char = body[i]
+            if in_quote:
+                if char == in_quote:
+                    in_quote = None
+            elif char in ("'", '"'):
+                in_quote = char
+            elif body.startswith('--', i) or body.startswith('/*', i):
+                # Un ';' dentro de un comentario no termina la sentencia
+                end = body.find('\n' if char == '-' else '*/', i + 2)
+                if end == -1:
+                    return False
+                i = end + (1 if char == '-' else 2)
+                continue
+            elif char == ';':
+                return True
+            i += 1
+        return False
     
     def clean_generated_sql(self, generated_text: str) -> str:
         """Limpiar el texto generado para extraer solo el SQL"""
@@ -106,46 +192,95 @@ class SQLValidator:
         
         return sql
     
-    def test_sql_execution(self, sql: str, timeout: int = 30) -> dict:
-        """Probar la ejecución del SQL en la base de datos OMOP de prueba"""
-        result = {
-            'executable': False,
-            'error': None,
-            'execution_time': None,
-            'row_count': None,
-            'error_type': None
-        }
+    def test_sql_execution(
+        self,
+        sql: str,
+        timeout: int = 30,
+        mode: Optional[str] = None,
+        max_rows: Optional[int] = None
+    ) -> dict:
+        """
+        Probar el SQL en la base de datos OMOP de prueba.
+        
+        mode='explain' solo prepara la consulta y obtiene su plan; mode='execute'
+        además la ejecuta leyendo como mucho max_rows filas (row_count se queda en
+        el límite y truncated=True si había más). Si se agota el presupuesto de
+        tiempo o de pasos el error_type es 'BudgetExceeded'.
+        
+        Los resultados se cachean (cached=True en los aciertos) mientras la base
+        de datos no cambie.
+        
+        Con el estimador activo, 'cost' lleva las filas leídas estimadas según el
+        plan y los recorridos completos de tablas grandes; con cost_action='reject'
+        lo que supera el umbral no se ejecuta (error_type 'CostExceeded').
+        """
+        mode = mode or self.mode
+        max_rows = self.max_rows if max_rows is None else max_rows
         
+        if self.cost_action == 'reject' and mode == 'execute':
+            # Decidir con el plan (sin ejecutar) antes de lanzar la consulta
+            planned = self.test_sql_execution(sql, timeout, mode='explain')
+            if planned['error_type'] == 'CostExceeded':
+                return planned
+        
+        if self.cache is None or not self.omop_db_path.exists():
+            return self._estimate_cost(sql, self._run_sql(sql, timeout, mode, max_rows))
+        
+        key = (sql_key(sql), mode, max_rows if mode == 'execute' else None)
+        fingerprint = file_fingerprint(self.omop_db_path)
+        cached = self.cache.get(key, fingerprint)
+        if cached is not None:
+            cached['cached'] = True
+            return cached
+        
+        result = self._estimate_cost(sql, self._run_sql(sql, timeout, mode, max_rows))
+        self.cache.put(key, fingerprint, result)
+        return result
+    
+    def _estimate_cost(self, sql: str, result: dict) -> dict:
+        """Añadir la estimación de coste (solo con el plan de SQLite) y aplicar el umbral"""
+        if self.cost_estimator is None or self.engine.name != 'sqlite' or not result['plan']:
+            return result
+        try:
+            cost = self.cost_estimator.estimate(sql, result['plan'])
+        except Exception as e:
+            logger.warning(f"No se pudo estimar el coste de la consulta: {e}")
+            return result
+        result['cost'] = cost
+        if cost['exceeds_threshold'] and self.cost_action == 'reject' and result['executable']:
+            result['executable'] = False
+            result['error'] = (
+                f"Consulta demasiado costosa: se estiman {cost['estimated_rows']:,} filas leídas "
+                f"(máximo {cost['max_rows']:,})"
+            )
+            result['error_type'] = 'CostExceeded'
+        return result
+    
+    def _run_sql(self, sql: str, timeout: int, mode: str, max_rows: int) -> dict:
         if not self.omop_db_path.exists():
+            result = new_result(mode)
             result['error'] = f"Base de datos OMOP no encontrada: {self.omop_db_path}"
             result['error_type'] = 'DatabaseNotFound'
             return result
         
+        # Los procesos aislados solo ejecutan SQLite
+        if self.sandbox_workers > 0 and self.engine.name == 'sqlite':
+            try:
+                return self.sandbox.run(sql, mode, max_rows, self.time_budget, self.step_budget, timeout=timeout)
+            except Exception as e:
+                return record_error(new_result(mode), e)
+        
+        # `timeout` solo cubre la espera de una conexión libre del pool; los
+        # límites de ejecución los pone el motor (progress handler en SQLite)
+        result = new_result(mode)
+        budget = None
         try:
-            import time
-            start_time = time.time()
-            
-            with sqlite3.connect(self.omop_db_path, timeout=timeout) as conn:
-                cursor = conn.cursor()
-                cursor.execute(sql)
-                
-                if sql.strip().upper().startswith('SELECT'):
-                    rows = cursor.fetchall()
-                    result['row_count'] = len(rows)
-                else:
-                    result['row_count'] = cursor.rowcount
-                    
-                result['executable'] = True
-                result['execution_time'] = time.time() - start_time
-                
-        except sqlite3.OperationalError as e:
-            result['error'] = str(e)
-            result['error_type'] = 'OperationalError'
-        except sqlite3.DatabaseError as e:
-            result['error'] = str(e)
-            result['error_type'] = 'DatabaseError'
+            with self.pool.connection(timeout=timeout) as conn:
+                budget = self.engine.install_budget(conn, self.time_budget, self.step_budget)
+                try:
+                    execute_query(conn, self.engine.prepare(sql), mode, max_rows, result, explain=self.engine.explain)
+                finally:
+                    self.engine.clear_budget(conn, budget)
         except Exception as e:
-            result['error'] = str(e)
-            result['error_type'] = type(e).__name__
-            
-        return result
\ No newline at end of file
+            record_error(result, e, budget)
+        return result
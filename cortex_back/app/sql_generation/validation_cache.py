@@ -0,0 +1,166 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import sqlglot
+from sqlglot.errors import TokenError
+from sqlglot.tokens import TokenType
+
+from app.core.config import SQL_VALIDATION_CACHE_SIZE, SQL_VALIDATION_CACHE_TTL, SQL_VALIDATION_CACHE_TIMEOUT_TTL
+
+logger = logging.getLogger(__name__)
+
+# Errores que dependen del momento (pool agotado, BD ausente...) y no de la consulta: no se cachean
+CACHEABLE_ERRORS = {'OperationalError', 'DatabaseError', 'CostExceeded'}
+# De los presupuestos agotados solo es determinista el de pasos de la VM; el
+# tiempo de reloj y la memoria dependen de la carga (se cachean con timeout_ttl)
+DETERMINISTIC_BUDGET_LIMITS = {'steps'}
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+
+def normalize_sql(sql: str, dialect: str = "sqlite") -> str:
+    """
+    Forma canónica del SQL para usarla como clave: sin comentarios, espacios ni
+    ';' final, y con palabras clave e identificadores en minúsculas (SQLite no
+    distingue mayúsculas en ellos). Los literales de texto se conservan tal cual.
+    """
+    try:
+        tokens = sqlglot.tokenize(sql, read=dialect)
+    except TokenError:
+        text = " ".join(_COMMENT_RE.sub(" ", sql).split())
+        return text.rstrip("; ").lower()
+
+    parts = []
+    for token in tokens:
+        if token.token_type == TokenType.SEMICOLON:
+            continue
+        if token.token_type == TokenType.STRING:
+            parts.append("'" + token.text.replace("'", "''") + "'")
+        else:
+            parts.append(token.text.lower())
+    return " ".join(parts)
+
+
+def sql_key(sql: str) -> str:
+    return hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+class ValidationCache:
+    """
+    Caché LRU en memoria de resultados de test_sql_execution.
+
+    La clave es el SQL normalizado más el modo y el límite de filas; cada entrada
+    guarda además la huella de la base de datos (file_fingerprint) con la que se
+    obtuvo. Si la huella cambia se vacía la caché. Se guardan tanto los resultados
+    ejecutables como los errores deterministas (CACHEABLE_ERRORS y los pasos de
+    la VM agotados), para no repetir consultas que ya se sabe que fallan. Los
+    tiempos agotados solo se guardan `timeout_ttl` segundos: un momento de carga
+    no debe invalidar una consulta correcta durante toda la caducidad.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = SQL_VALIDATION_CACHE_SIZE,
+        ttl: float = SQL_VALIDATION_CACHE_TTL,
+        timeout_ttl: float = SQL_VALIDATION_CACHE_TIMEOUT_TTL
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.timeout_ttl = timeout_ttl
+        self._lock = threading.Lock()
+        # clave -> (instante de caducidad o None, resultado)
+        self._entries: "OrderedDict[Tuple, Tuple[Optional[float], Dict[str, Any]]]" = OrderedDict()
+        self._fingerprint: Optional[Tuple] = None
+        self._stats = {
+            'lookups': 0,
+            'hits': 0,
+            'positive_hits': 0,
+            'negative_hits': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expired': 0,
+            'invalidations': 0,
+        }
+
+    def entry_ttl(self, result: Dict[str, Any]) -> Optional[float]:
+        """Caducidad de un resultado en segundos (0 sin caducidad); None si no se cachea"""
+        if result.get('executable') or result.get('error_type') in CACHEABLE_ERRORS:
+            return self.ttl
+        if result.get('error_type') == 'BudgetExceeded':
+            if result.get('budget_limit') in DETERMINISTIC_BUDGET_LIMITS:
+                return self.ttl
+            return self.timeout_ttl or None
+        return None
+
+    def cacheable(self, result: Dict[str, Any]) -> bool:
+        return self.entry_ttl(result) is not None
+
+    def _check_fingerprint(self, fingerprint: Tuple):
+        # Llamar con el lock tomado
+        if self._fingerprint is not None and fingerprint != self._fingerprint:
+            logger.info(f"La base de datos OMOP ha cambiado: se descartan {len(self._entries)} validaciones cacheadas")
+            self._entries.clear()
+            self._stats['invalidations'] += 1
+        self._fingerprint = fingerprint
+
+    def get(self, key: Tuple, fingerprint: Tuple) -> Optional[Dict[str, Any]]:
+        """Resultado cacheado (copia) o None"""
+        with self._lock:
+            self._stats['lookups'] += 1
+            self._check_fingerprint(fingerprint)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if expires_at is not None and time.monotonic() > expires_at:
+                del self._entries[key]
+                self._stats['expired'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            self._stats['positive_hits' if result['executable'] else 'negative_hits'] += 1
+        return dict(result)
+
+    def put(self, key: Tuple, fingerprint: Tuple, result: Dict[str, Any]):
+        ttl = self.entry_ttl(result)
+        if self.max_entries <= 0 or ttl is None:
+            return
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            self._entries[key] = (time.monotonic() + ttl if ttl else None, dict(result))
+            self._entries.move_to_end(key)
+            self._stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self) -> int:
+        """Vaciar la caché; devuelve el número de entradas eliminadas"""
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            self._stats['invalidations'] += 1
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            entries = len(self._entries)
+            negatives = sum(1 for _, result in self._entries.values() if not result['executable'])
+        lookups = stats['lookups']
+        return {
+            **stats,
+            'entries': entries,
+            'negative_entries': negatives,
+            'max_entries': self.max_entries,
+            'ttl_s': self.ttl,
+            'timeout_ttl_s': self.timeout_ttl,
+            'hit_rate': round(stats['hits'] / lookups, 4) if lookups else 0.0,
+            'positive_hit_rate': round(stats['positive_hits'] / lookups, 4) if lookups else 0.0,
+            'negative_hit_rate': round(stats['negative_hits'] / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,106 @@
+"""
+Benchmark de los motores de ejecución (SQL_ENGINE) con las consultas del dataset.
+
+Ejecuta el SQL de referencia de cada fila del dataset (RAGMetadataStore) en
+SQLite y en DuckDB, leyendo el resultado completo, y compara la mediana de
+cada consulta. Las consultas que fallan en un motor (p. ej. funciones de SQLite
+que sqlglot no traduce a DuckDB) se cuentan aparte y no entran en la comparación.
+
+Uso (desde cortex_back/):
+    python -m benchmarks.bench_engines --convert --repeat 3
+    python -m benchmarks.bench_engines --source attach --limit 50
+"""
+import sys
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.core.config import RAG_INDEX_DIR, OMOP_DB_PATH, DUCKDB_PARQUET_DIR
+from app.sql_generation.engines import SQLiteEngine, DuckDBEngine, convert_sqlite_to_parquet
+from app.sql_generation.rag_metadata import RAGMetadataStore
+from benchmarks.bench_parallel_sampling import percentile
+
+def load_queries(limit):
+    store = RAGMetadataStore.open(RAG_INDEX_DIR)
+    try:
+        return [store.row(i)["sql"] for i in range(min(limit, store.n_rows)) if store.row(i)["sql"]]
+    finally:
+        store.close()
+
+def time_query(engine, conn, sql, repeat):
+    """Mediana de `repeat` ejecuciones completas (tras una de calentamiento); None si falla"""
+    prepared = engine.prepare(sql)
+    try:
+        conn.execute(prepared).fetchall()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(prepared).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+    except Exception as e:
+        return None, str(e).splitlines()[0]
+    return statistics.median(timings), None
+
+def run_engine(engine, queries, repeat):
+    conn = engine.connect()
+    try:
+        return [time_query(engine, conn, sql, repeat) for sql in queries]
+    finally:
+        conn.close()
+
+def run_benchmark(queries, db_path, source, parquet_dir, repeat, threads):
+    sqlite_engine = SQLiteEngine(db_path)
+    duckdb_engine = DuckDBEngine(db_path, source=source, parquet_dir=parquet_dir, threads=threads)
+
+    results = {}
+    for engine in (sqlite_engine, duckdb_engine):
+        start = time.perf_counter()
+        results[engine.name] = run_engine(engine, queries, repeat)
+        print(f"{engine.name}: {len(queries)} consultas en {time.perf_counter() - start:.1f} s")
+
+    both = [(s[0], d[0]) for s, d in zip(results['sqlite'], results['duckdb'])
+            if s[0] is not None and d[0] is not None]
+
+    print(f"\n{'='*60}")
+    print(f"ENGINE BENCHMARK (duckdb source={source}, repeat={repeat})")
+    print(f"{'='*60}")
+    for name, timings in results.items():
+        failures = [err for t, err in timings if t is None]
+        ok = [t for t, _ in timings if t is not None]
+        print(f"{name:<7} ok={len(ok):4d}  fallos={len(failures):4d}  "
+              f"p50={percentile(ok, 50):8.2f} ms  p95={percentile(ok, 95):8.2f} ms  total={sum(ok):9.1f} ms")
+        for err in sorted(set(failures))[:5]:
+            print(f"          · {err[:100]}")
+    if both:
+        speedups = [s / d for s, d in both if d > 0]
+        print(f"\nConsultas válidas en ambos motores: {len(both)}")
+        print(f"Total SQLite={sum(s for s, _ in both):.1f} ms  DuckDB={sum(d for _, d in both):.1f} ms")
+        print(f"Aceleración por consulta (SQLite/DuckDB): p50={percentile(speedups, 50):.2f}x  "
+              f"p5={percentile(speedups, 5):.2f}x  p95={percentile(speedups, 95):.2f}x")
+        print(f"DuckDB más rápido en {sum(1 for x in speedups if x > 1)}/{len(speedups)} consultas")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de SQLite frente a DuckDB con las consultas del dataset")
+    parser.add_argument("--db", default=OMOP_DB_PATH, help="Base de datos OMOP (SQLite)")
+    parser.add_argument("--source", choices=("attach", "parquet"), default="parquet")
+    parser.add_argument("--parquet-dir", default=DUCKDB_PARQUET_DIR)
+    parser.add_argument("--convert", action="store_true", help="Convertir antes las tablas a Parquet")
+    parser.add_argument("--limit", type=int, default=1000, help="Máximo de consultas del dataset")
+    parser.add_argument("--repeat", type=int, default=3, help="Ejecuciones medidas por consulta")
+    parser.add_argument("--threads", type=int, default=0, help="Hilos de DuckDB (0: todos los núcleos)")
+    args = parser.parse_args()
+
+    if args.convert:
+        start = time.perf_counter()
+        written = convert_sqlite_to_parquet(args.db, args.parquet_dir)
+        print(f"Convertidas {len(written)} tablas ({sum(written.values()):,} filas) "
+              f"en {time.perf_counter() - start:.1f} s -> {args.parquet_dir}")
+
+    queries = load_queries(args.limit)
+    run_benchmark(queries, args.db, args.source, args.parquet_dir, args.repeat, args.threads)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Benchmark del muestreo paralelo de candidatos frente al bucle secuencial.
+
+Para cada pregunta del dataset se genera SQL dos veces:
+  - secuencial: generar, validar y re-preguntar hasta max_attempts
+  - paralelo: N candidatos a distintas temperaturas, gana el primero ejecutable
+Se mide la tasa de SQL ejecutable, la latencia p50/p95, los intentos validados y
+las llamadas al modelo emitidas (incluidos los candidatos cancelados a mitad).
+
+Requiere Ollama (o el servidor simulado) en --ollama-url. La caché semántica se
+desactiva para que cada pregunta recorra el pipeline completo.
+
+Uso (desde cortex_back/):
+    python -m benchmarks.bench_parallel_sampling --limit 20 --candidates 3
+"""
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.core.config import OLLAMA_BASE_URL, OLLAMA_MODEL, RAG_INDEX_DIR
+from app.sql_generation.models import SQLGenerationRequest
+from app.sql_generation.rag_metadata import RAGMetadataStore
+from app.sql_generation.service import SQLGenerationService
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+def load_questions(limit):
+    store = RAGMetadataStore.open(RAG_INDEX_DIR)
+    try:
+        return [store.row(i)["canonical_question"] for i in range(min(limit, store.n_rows))]
+    finally:
+        store.close()
+
+def generation_calls(service):
+    """Llamadas al modelo emitidas por todos los backends (attempts_count no cuenta las canceladas)"""
+    return sum(backend.get_stats()['requests'] for backend in service.router.backends)
+
+async def run_mode(service, questions, candidates):
+    service.parallel_candidates = candidates
+    latencies, attempts, calls, successes = [], [], [], 0
+    for question in questions:
+        request = SQLGenerationRequest(question=question, medical_terms=[])
+        issued = generation_calls(service)
+        start = time.perf_counter()
+        result = await service.generate_sql_async(request)
+        latencies.append(time.perf_counter() - start)
+        attempts.append(result.attempts_count)
+        calls.append(generation_calls(service) - issued)
+        successes += result.is_executable
+    return latencies, attempts, calls, successes
+
+def report(name, questions, latencies, attempts, calls, successes):
+    print(f"{name:<12} éxito={successes / len(questions):6.1%}  "
+          f"p50={percentile(latencies, 50):6.2f} s  p95={percentile(latencies, 95):6.2f} s  "
+          f"intentos/pregunta={statistics.mean(attempts):.2f}  llamadas/pregunta={statistics.mean(calls):.2f}")
+
+async def run_benchmark(questions, candidates, ollama_url, model):
+    service = SQLGenerationService(ollama_url=ollama_url, model_name=model, sql_cache_enabled=False)
+    service.router.stop()
+
+    print(f"\n{'='*70}")
+    print(f"PARALLEL SAMPLING BENCHMARK ({len(questions)} preguntas, {candidates} candidatos, "
+          f"T={service.candidate_temperatures[:candidates]})")
+    print(f"{'='*70}")
+
+    sequential = await run_mode(service, questions, 1)
+    report("secuencial", questions, *sequential)
+    parallel = await run_mode(service, questions, candidates)
+    report("paralelo", questions, *parallel)
+
+    seq_p95, par_p95 = percentile(sequential[0], 95), percentile(parallel[0], 95)
+    if par_p95:
+        print(f"Mejora p95: {seq_p95 / par_p95:.2f}x")
+    await service.async_ollama_client.aclose()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de muestreo paralelo de candidatos SQL")
+    parser.add_argument("--limit", type=int, default=20, help="Preguntas del dataset a usar")
+    parser.add_argument("--candidates", type=int, default=3, help="Candidatos en paralelo")
+    parser.add_argument("--ollama-url", default=OLLAMA_BASE_URL)
+    parser.add_argument("--model", default=OLLAMA_MODEL)
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(load_questions(args.limit), args.candidates, args.ollama_url, args.model))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark de carga del pipeline completo POST /sql-generation/ contra el Ollama simulado.
+
+Levanta benchmarks.fake_ollama con la latencia, velocidad y tasa de errores
+indicadas y lanza peticiones concurrentes a la API (cola de generación, RAG,
+validación y registro en QueryLog incluidos) mediante un transporte ASGI, sin
+servidor HTTP ni GPU. Con la misma semilla los resultados son reproducibles.
+
+La autenticación se sustituye por un usuario fijo y los logs se escriben en una
+base SQLite en memoria. La caché semántica se desactiva.
+
+Uso (desde cortex_back/):
+    python -m benchmarks.bench_pipeline --requests 50 --concurrency 8 --latency-ms 300 --tokens-per-s 40
+"""
+import sys
+import time
+import asyncio
+import argparse
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.core.config import OLLAMA_MODEL
+from app.auth.database import Base as AuthBase, get_auth_db
+from app.auth.models import User
+from app.auth.routes import get_current_user
+from app.sql_generation import routes as sql_routes
+from app.sql_generation.request_queue import GenerationQueue, get_generation_queue
+from app.sql_generation.service import SQLGenerationService
+from app.sql_generation.llm_router import BackendSpec
+from benchmarks.fake_ollama import FakeOllamaServer, FakeOllamaConfig
+from benchmarks.bench_parallel_sampling import percentile, load_questions
+
+def build_app(service, queue):
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    AuthBase.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    with Session() as db:
+        db.add(User(id=1, email="bench@cortex.local", hashed_password="-"))
+        db.commit()
+
+    def auth_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.include_router(sql_routes.router)
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id=1, email="bench@cortex.local")
+    app.dependency_overrides[get_auth_db] = auth_db
+    app.dependency_overrides[sql_routes.get_sql_service] = lambda: service
+    app.dependency_overrides[get_generation_queue] = lambda: queue
+    return app
+
+async def fire(client, questions, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def one(question):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/sql-generation/", json={"question": question, "medical_terms": []})
+            elapsed = time.perf_counter() - start
+            body = response.json() if response.status_code == 200 else {}
+            results.append((response.status_code, elapsed, body.get("is_executable", False), body.get("attempts_count", 0)))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(q) for q in questions))
+    return results, time.perf_counter() - start
+
+async def run_benchmark(args):
+    config = FakeOllamaConfig(
+        models=[args.model],
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        latency_distribution=args.latency_distribution,
+        tokens_per_s=args.tokens_per_s,
+        error_rate=args.error_rate,
+        empty_rate=args.empty_rate,
+        seed=args.seed,
+    )
+    questions = load_questions(args.limit)
+    questions = [questions[i % len(questions)] for i in range(args.requests)]
+
+    with FakeOllamaServer(config) as server:
+        service = SQLGenerationService(backends=[BackendSpec(server.url, args.model)], sql_cache_enabled=False)
+        queue = GenerationQueue(max_concurrency=args.slots, max_depth=args.max_depth)
+        app = build_app(service, queue)
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            results, wall = await fire(client, questions, args.concurrency)
+
+        service.router.stop()
+        await service.async_ollama_client.aclose()
+        fake_stats = server.stats
+
+    ok = [r for r in results if r[0] == 200]
+    latencies = [r[1] for r in ok]
+    print(f"\n{'='*70}")
+    print(f"PIPELINE BENCHMARK ({len(results)} peticiones, concurrencia {args.concurrency}, "
+          f"{args.slots} slots, latencia {args.latency_ms:.0f} ms, {args.tokens_per_s:.0f} tok/s)")
+    print(f"{'='*70}")
+    print(f"Throughput:       {len(ok) / wall:8.2f} req/s ({wall:.2f} s)")
+    print(f"Latencia p50/p95: {percentile(latencies, 50):8.3f} / {percentile(latencies, 95):.3f} s")
+    print(f"HTTP 200:         {len(ok):8d}   503: {sum(r[0] == 503 for r in results)}   "
+          f"otros: {sum(r[0] not in (200, 503) for r in results)}")
+    if ok:
+        print(f"SQL ejecutable:   {sum(r[2] for r in ok) / len(ok):8.1%}   "
+              f"intentos medios: {sum(r[3] for r in ok) / len(ok):.2f}")
+    print(f"Fake Ollama:      {fake_stats}")
+    print(f"Cola:             {queue.get_stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga del pipeline de generación SQL")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--limit", type=int, default=20, help="Preguntas distintas del dataset")
+    parser.add_argument("--slots", type=int, default=1, help="Generaciones simultáneas (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--max-depth", type=int, default=16, help="Profundidad máxima de la cola")
+    parser.add_argument("--model", default=OLLAMA_MODEL)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--latency-distribution", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--tokens-per-s", type=float, default=40.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(run_benchmark(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark del re-ranking con cross-encoder frente a la reducción de k.
+
+Para cada término se obtiene el orden FAISS de los top-N candidatos y se
+reordena con el cross-encoder. Se mide:
+  - latencia de FAISS y del reranker (p50/p95)
+  - k FAISS necesario para que el cliente muestre los m mejores candidatos
+    del reranker (rango máximo en el orden FAISS de esos m candidatos)
+
+Uso (desde cortex_back/):
+    python -m benchmarks.bench_reranker --top-n 20 --m 5 diabetes asthma ...
+"""
+import sys
+import time
+import argparse
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.medical.similarity_bd import get_entity_linker
+from app.medical.reranker import CrossEncoderReranker
+
+DEFAULT_TERMS = [
+    "diabetes", "type 2 diabetes", "hypertension", "heart attack", "asthma",
+    "atopic dermatitis", "breast cancer", "copd", "kidney failure", "depression",
+    "metformin", "stroke", "obesity", "pneumonia", "rheumatoid arthritis",
+]
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+def run_benchmark(terms, top_n, m, budget_ms):
+    linker = get_entity_linker()
+    reranker = CrossEncoderReranker(top_n=top_n, budget_ms=budget_ms)
+
+    faiss_ms, rerank_ms, needed_k = [], [], []
+    over_budget = 0
+
+    for term in terms:
+        start = time.perf_counter()
+        candidates = linker.get_similar_terms_optimized(term, k=top_n, rerank=False)
+        faiss_ms.append((time.perf_counter() - start) * 1000)
+
+        if len(candidates) < 2:
+            continue
+
+        faiss_rank = {id(c): pos for pos, c in enumerate(candidates, 1)}
+        start = time.perf_counter()
+        reranked, ok = reranker.rerank(term, [dict(c, _ref=id(c)) for c in candidates])
+        rerank_ms.append((time.perf_counter() - start) * 1000)
+
+        if not ok:
+            over_budget += 1
+            continue
+
+        top_m = reranked[:m]
+        needed_k.append(max(faiss_rank[c["_ref"]] for c in top_m))
+
+    print(f"\n{'='*60}")
+    print(f"RERANKER BENCHMARK (top_n={top_n}, m={m}, budget={budget_ms:.0f} ms)")
+    print(f"{'='*60}")
+    print(f"Términos: {len(terms)}  |  fuera de presupuesto: {over_budget}")
+    print(f"FAISS     p50={percentile(faiss_ms, 50):8.1f} ms  p95={percentile(faiss_ms, 95):8.1f} ms")
+    print(f"Reranker  p50={percentile(rerank_ms, 50):8.1f} ms  p95={percentile(rerank_ms, 95):8.1f} ms")
+    if needed_k:
+        print(f"k FAISS necesario para cubrir el top-{m} del reranker:")
+        print(f"  media={statistics.mean(needed_k):.1f}  p50={percentile(needed_k, 50)}  "
+              f"p95={percentile(needed_k, 95)}  max={max(needed_k)}")
+        print(f"Reducción de k con reranker: {percentile(needed_k, 95)} -> {m}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del reranker de términos médicos")
+    parser.add_argument("terms", nargs="*", default=DEFAULT_TERMS)
+    parser.add_argument("--top-n", type=int, default=50, help="Candidatos FAISS a reordenar")
+    parser.add_argument("--m", type=int, default=5, help="Resultados que mostraría el cliente")
+    parser.add_argument("--budget-ms", type=float, default=10_000, help="Presupuesto de latencia del reranker")
+    args = parser.parse_args()
+
+    run_benchmark(args.terms, args.top_n, args.m, args.budget_ms)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark del tiempo hasta el primer token (TTFT) antes y después de
+keep_alive + warmup + prefijo estático del prompt.
+
+  - antes: prompt con la parte variable primero, keep_alive por defecto del
+    servidor y sin warmup (la primera consulta paga la carga del modelo)
+  - después: prefijo estático (instrucciones + esquema) primero, keep_alive
+    configurado y warmup del prefijo antes de la primera consulta
+
+Antes de cada modo se descarga el modelo (keep_alive=0) para partir del mismo
+estado. El TTFT se mide en streaming, cortando tras el primer token.
+
+Uso (desde cortex_back/):
+    python -m benchmarks.bench_ttft --limit 10
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.core.config import OLLAMA_BASE_URL, OLLAMA_MODEL, OLLAMA_KEEP_ALIVE, RAG_INDEX_DIR
+from app.sql_generation.rag_metadata import RAGMetadataStore
+from app.sql_generation.service import SQLGenerationService
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+def load_questions(limit):
+    store = RAGMetadataStore.open(RAG_INDEX_DIR)
+    try:
+        return [store.row(i)["canonical_question"] for i in range(min(limit, store.n_rows))]
+    finally:
+        store.close()
+
+def legacy_prompt(service, question):
+    """
+    Orden anterior: la pregunta antes que las instrucciones (sin prefijo reutilizable).
+    Mismo contenido que el prompt actual, esquema incluido o no, para medir solo el orden.
+    """
+    static = service._build_prompt_prefix(include_schema=service.prompt_includes_schema)
+    dynamic = service._create_prompt(question, [], None)[len(service.prompt_prefix):]
+    return dynamic.replace("\nSQL:", "") + "\n\n" + static + "SQL:"
+
+def unload(service):
+    service.ollama_client.session.post(
+        f"{service.ollama_client.base_url}/api/generate",
+        json={"model": service.model_name, "keep_alive": 0},
+        timeout=60
+    )
+
+def measure(service, prompts, keep_alive):
+    ttfts = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        for _ in service.ollama_client.generate_stream(
+            service.model_name, prompt, stop_condition=lambda text: True, keep_alive=keep_alive
+        ):
+            ttfts.append((time.perf_counter() - start) * 1000)
+            break
+    return ttfts
+
+def report(name, ttfts):
+    if not ttfts:
+        print(f"{name:<8} sin respuestas")
+        return
+    print(f"{name:<8} primera={ttfts[0]:8.0f} ms  p50={percentile(ttfts, 50):8.0f} ms  "
+          f"p95={percentile(ttfts, 95):8.0f} ms  (n={len(ttfts)})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de TTFT con keep_alive y warmup")
+    parser.add_argument("--limit", type=int, default=10, help="Preguntas del dataset a usar")
+    parser.add_argument("--ollama-url", default=OLLAMA_BASE_URL)
+    parser.add_argument("--model", default=OLLAMA_MODEL)
+    args = parser.parse_args()
+
+    service = SQLGenerationService(ollama_url=args.ollama_url, model_name=args.model, sql_cache_enabled=False)
+    service.router.stop()
+    questions = load_questions(args.limit)
+
+    print(f"\n{'='*70}")
+    print(f"TTFT BENCHMARK ({len(questions)} preguntas, modelo {args.model})")
+    print(f"{'='*70}")
+
+    unload(service)
+    before = measure(service, [legacy_prompt(service, q) for q in questions], keep_alive=None)
+    report("antes", before)
+
+    unload(service)
+    service.warmup()
+    after = measure(service, [service._create_prompt(q, [], None) for q in questions], keep_alive=OLLAMA_KEEP_ALIVE)
+    report("después", after)
+
+if __name__ == "__main__":
+    main()
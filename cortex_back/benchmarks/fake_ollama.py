@@ -0,0 +1,314 @@
+"""
+Servidor HTTP que imita la API de Ollama para tests de integración y carga sin GPU.
+
+Implementa GET /api/tags y POST /api/generate (con y sin streaming) con:
+  - latencia configurable (fija, uniforme o lognormal) antes del primer token
+  - velocidad de generación en tokens/s
+  - inyección de errores (HTTP 500 o respuestas vacías) con una tasa dada
+  - respuestas SQL guionizadas: patrón de la pregunta -> lista de SQL por intento
+
+Las respuestas incluyen los mismos campos de duración y conteo que Ollama
+(load_duration, prompt_eval_count, eval_count...). Con la misma semilla el
+comportamiento es reproducible.
+
+Uso como proceso (desde cortex_back/):
+    python -m benchmarks.fake_ollama --port 11435 --latency-ms 200 --tokens-per-s 40
+
+Uso en código:
+    with FakeOllamaServer(FakeOllamaConfig(latency_ms=50)) as server:
+        client = OllamaClient(server.url)
+"""
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional, Tuple
+
+DEFAULT_SQL = "SELECT COUNT(DISTINCT person_id) FROM person;"
+
+
+@dataclass
+class FakeOllamaConfig:
+    models: List[str] = field(default_factory=lambda: ["deepseek-coder-v2:16b-lite-instruct-q4_K_M"])
+    latency_ms: float = 0.0               # tiempo hasta el primer token
+    latency_jitter_ms: float = 0.0
+    latency_distribution: str = "fixed"   # fixed | uniform | lognormal
+    tokens_per_s: float = 0.0             # 0 = sin espera entre tokens
+    error_rate: float = 0.0               # HTTP 500
+    empty_rate: float = 0.0               # respuesta vacía (el servicio la trata como GenerationError)
+    load_ms: float = 0.0                  # load_duration simulado en la primera petición
+    scripts: List[Tuple[str, List[str]]] = field(default_factory=list)  # (regex de la pregunta, SQL por intento)
+    default_sql: str = DEFAULT_SQL
+    fenced: bool = True                   # envolver el SQL en ```sql ... ``` como hacen los modelos
+    seed: Optional[int] = 0
+
+
+def tokenize(text: str) -> List[str]:
+    """Trozos de ~1 palabra conservando los espacios, como los tokens que emite Ollama"""
+    return re.findall(r"\s*\S+", text) or [text]
+
+
+class _State:
+    def __init__(self, config: FakeOllamaConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.attempts: Dict[str, int] = {}
+        self.loaded = False
+        self.requests: List[Dict[str, Any]] = []
+        self.stats = {'tags': 0, 'generate': 0, 'stream': 0, 'errors': 0, 'empty': 0, 'disconnects': 0}
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def latency_s(self) -> float:
+        c = self.config
+        with self.lock:
+            if c.latency_distribution == "uniform":
+                value = self.random.uniform(c.latency_ms - c.latency_jitter_ms, c.latency_ms + c.latency_jitter_ms)
+            elif c.latency_distribution == "lognormal" and c.latency_ms > 0:
+                sigma = c.latency_jitter_ms / c.latency_ms if c.latency_jitter_ms else 0.25
+                value = c.latency_ms * self.random.lognormvariate(0, sigma)
+            else:
+                value = c.latency_ms
+        return max(value, 0.0) / 1000
+
+    def roll(self, rate: float) -> bool:
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def question_of(self, prompt: str) -> str:
+        # Última pregunta del prompt (el prefijo estático no la contiene)
+        matches = re.findall(r"Question:\s*(.+)", prompt)
+        return matches[-1].strip() if matches else prompt[-200:]
+
+    def next_sql(self, prompt: str) -> str:
+        question = self.question_of(prompt)
+        with self.lock:
+            attempt = self.attempts.get(question, 0)
+            self.attempts[question] = attempt + 1
+        for pattern, sqls in self.config.scripts:
+            if re.search(pattern, question, re.IGNORECASE):
+                return sqls[min(attempt, len(sqls) - 1)]
+        return self.config.default_sql
+
+    def load_ns(self) -> int:
+        with self.lock:
+            cold = not self.loaded
+            self.loaded = True
+        return int((self.config.load_ms if cold else 1.0) * 1e6)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeOllama/1.0"
+    state: _State  # asignado por FakeOllamaServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data: Dict[str, Any]):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/api/tags":
+            self.state.count('tags')
+            self._send_json(200, {"models": [{"name": m, "model": m} for m in self.state.config.models]})
+        elif self.path == "/":
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"Ollama is running")
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/api/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        state, config = self.state, self.state.config
+        model = payload.get("model", "")
+        prompt = payload.get("prompt", "")
+        stream = payload.get("stream", True)
+        with state.lock:
+            state.requests.append(payload)
+
+        if model not in config.models:
+            self._send_json(404, {"error": f"model '{model}' not found"})
+            return
+
+        start = time.perf_counter()
+        load_ns = state.load_ns()
+        latency = state.latency_s()
+        time.sleep(latency)
+
+        if state.roll(config.error_rate):
+            state.count('errors')
+            self._send_json(500, {"error": "injected failure"})
+            return
+
+        if not prompt:
+            # Carga del modelo sin generar (como Ollama con prompt vacío)
+            text = ""
+        elif state.roll(config.empty_rate):
+            state.count('empty')
+            text = ""
+        else:
+            sql = state.next_sql(prompt)
+            text = f"```sql\n{sql}\n```" if config.fenced else sql
+
+        num_predict = payload.get("options", {}).get("num_predict", -1)
+        tokens = tokenize(text) if text else []
+        if num_predict and num_predict > 0:
+            tokens = tokens[:num_predict]
+        interval = 1 / config.tokens_per_s if config.tokens_per_s > 0 else 0.0
+        prompt_eval_count = max(1, len(prompt) // 4)
+
+        def final_fields(eval_s: float) -> Dict[str, Any]:
+            return {
+                "done": True,
+                "done_reason": "stop",
+                "total_duration": int((time.perf_counter() - start) * 1e9) + load_ns,
+                "load_duration": load_ns,
+                "prompt_eval_count": prompt_eval_count,
+                "prompt_eval_duration": int(latency * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int(eval_s * 1e9),
+            }
+
+        created_at = datetime.now(timezone.utc).isoformat()
+        if not stream:
+            state.count('generate')
+            eval_start = time.perf_counter()
+            time.sleep(interval * len(tokens))
+            self._send_json(200, {
+                "model": model, "created_at": created_at, "response": "".join(tokens),
+                **final_fields(time.perf_counter() - eval_start),
+            })
+            return
+
+        state.count('stream')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        eval_start = time.perf_counter()
+        try:
+            for token in tokens:
+                line = {"model": model, "created_at": created_at, "response": token, "done": False}
+                self.wfile.write(json.dumps(line).encode("utf-8") + b"\n")
+                self.wfile.flush()
+                time.sleep(interval)
+            final = {"model": model, "created_at": created_at, "response": ""}
+            final.update(final_fields(time.perf_counter() - eval_start))
+            self.wfile.write(json.dumps(final).encode("utf-8") + b"\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cortó el stream (p. ej. sentencia completa)
+            state.count('disconnects')
+
+
+class FakeOllamaServer:
+    """Servidor Ollama simulado en un hilo; usable como context manager"""
+
+    def __init__(self, config: Optional[FakeOllamaConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeOllamaConfig()
+        self.state = _State(self.config)
+        handler = type("FakeOllamaHandler", (_Handler,), {"state": self.state})
+        self._httpd = ThreadingHTTPServer((host, port), handler)
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return dict(self.state.stats)
+
+    @property
+    def requests(self) -> List[Dict[str, Any]]:
+        return list(self.state.requests)
+
+    def start(self) -> "FakeOllamaServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def load_scripts(path: str) -> List[Tuple[str, List[str]]]:
+    """Fichero JSON {"regex de la pregunta": ["SQL intento 1", "SQL intento 2", ...]}"""
+    with open(path, "r", encoding="utf-8") as fp:
+        data = json.load(fp)
+    return [(pattern, sqls if isinstance(sqls, list) else [sqls]) for pattern, sqls in data.items()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor Ollama simulado")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--model", action="append", help="Modelo disponible (repetible)")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--latency-distribution", choices=["fixed", "uniform", "lognormal"], default="fixed")
+    parser.add_argument("--tokens-per-s", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--empty-rate", type=float, default=0.0)
+    parser.add_argument("--load-ms", type=float, default=0.0)
+    parser.add_argument("--script", help="JSON con SQL guionizado por patrón de pregunta")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = FakeOllamaConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        latency_distribution=args.latency_distribution,
+        tokens_per_s=args.tokens_per_s,
+        error_rate=args.error_rate,
+        empty_rate=args.empty_rate,
+        load_ms=args.load_ms,
+        scripts=load_scripts(args.script) if args.script else [],
+        seed=args.seed,
+    )
+    if args.model:
+        config.models = args.model
+
+    server = FakeOllamaServer(config, host=args.host, port=args.port)
+    print(f"Fake Ollama escuchando en {server.url} (modelos: {', '.join(config.models)})")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import json
+import pytest
+from app.core.artifacts import ArtifactLocator, ArtifactError, file_sha256
+
+@pytest.fixture
+def artifact_tree(tmp_path):
+    """Create a minimal artifact tree outside the working directory"""
+    dataset = tmp_path / "data" / "dataset.xlsx"
+    dataset.parent.mkdir()
+    dataset.write_bytes(b"dataset v1")
+    
+    schema = tmp_path / "data" / "omop_schema_stub.txt"
+    schema.write_text("PERSON (person_id INTEGER);")
+    
+    index_dir = tmp_path / "rag_index"
+    index_dir.mkdir()
+    (index_dir / "faiss.index").write_bytes(b"index")
+    (index_dir / "metadata.json").write_text(json.dumps({
+        "schema_version": 1,
+        "embed_model": "test-model",
+        "dataset_sha256": file_sha256(dataset)
+    }))
+    
+    return ArtifactLocator(
+        rag_index_dir=index_dir,
+        dataset_path=dataset,
+        omop_schema_path=schema,
+        omop_db_path=tmp_path / "omop.db",
+        snomed_dir=tmp_path / "snomed",
+        embed_model="test-model"
+    )
+
+def test_preflight_ok(artifact_tree):
+    """Test that present and fresh artifacts pass strict preflight"""
+    statuses = {s.name: s for s in artifact_tree.preflight(strict=True)}
+    
+    assert statuses["rag_index"].ok is True
+    assert statuses["rag_index"].fresh is True
+    assert statuses["omop_test_db"].exists is False  # opcional: solo aviso
+
+def test_preflight_missing_index_fails(artifact_tree):
+    """Test that a missing RAG index fails fast"""
+    (artifact_tree.rag_index_dir / "faiss.index").unlink()
+    
+    with pytest.raises(ArtifactError, match="rag_index"):
+        artifact_tree.preflight(strict=True)
+    
+    statuses = {s.name: s for s in artifact_tree.preflight(strict=False)}
+    assert statuses["rag_index"].ok is False
+
+def test_preflight_stale_index_after_dataset_change(artifact_tree):
+    """Test that an index built from an older dataset is reported stale"""
+    artifact_tree.dataset_path.write_bytes(b"dataset v2")
+    
+    with pytest.raises(ArtifactError):
+        artifact_tree.preflight(strict=True)
+    
+    status = artifact_tree.check()[0]
+    assert status.fresh is False
+    assert "rebuild" in status.detail
+
+def test_preflight_model_mismatch_is_stale(artifact_tree):
+    """Test that an index built with another embedding model is stale"""
+    artifact_tree.embed_model = "other-model"
+    
+    status = artifact_tree.check()[0]
+    assert status.fresh is False
+
+def test_locator_paths_are_absolute():
+    """Test that default paths do not depend on the process CWD"""
+    locator = ArtifactLocator()
+    
+    assert locator.rag_index_dir.is_absolute()
+    assert locator.omop_schema_path.is_absolute()
+    assert locator.dataset_path.is_absolute()
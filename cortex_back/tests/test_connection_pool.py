@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+import pytest
+from app.sql_generation.connection_pool import ReadOnlyConnectionPool, PoolTimeoutError
+
+@pytest.fixture
+def omop_db(tmp_path):
+    """Small OMOP-like database"""
+    db_path = tmp_path / "omop.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE person (person_id INTEGER PRIMARY KEY, year_of_birth INTEGER)")
+    conn.executemany("INSERT INTO person VALUES (?, ?)", [(1, 1980), (2, 1975)])
+    conn.commit()
+    conn.close()
+    return db_path
+
+def test_connections_are_reused(omop_db):
+    """Test the same connection is handed out again instead of reconnecting"""
+    pool = ReadOnlyConnectionPool(omop_db, size=2)
+    
+    with pool.connection() as conn:
+        first = conn
+        assert conn.execute("SELECT COUNT(*) FROM person").fetchone()[0] == 2
+    with pool.connection() as conn:
+        assert conn is first
+    
+    stats = pool.get_stats()
+    assert stats["created"] == 1
+    assert stats["reused"] == 1
+    assert stats["idle"] == 1
+    assert stats["in_use"] == 0
+
+@pytest.mark.parametrize("immutable", [True, False])
+def test_connections_are_read_only(omop_db, immutable):
+    """Test pooled connections reject writes"""
+    pool = ReadOnlyConnectionPool(omop_db, immutable=immutable)
+    
+    with pytest.raises(sqlite3.OperationalError):
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO person VALUES (3, 1990)")
+    
+    # Un error de la consulta no invalida la conexión
+    assert pool.get_stats()["discarded"] == 0
+
+def test_pragmas_applied(omop_db):
+    """Test cache and mmap settings are applied to each connection"""
+    pool = ReadOnlyConnectionPool(omop_db, cache_size_kb=2048, mmap_size=1 << 20)
+    
+    with pool.connection() as conn:
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -2048
+        assert conn.execute("PRAGMA mmap_size").fetchone()[0] == 1 << 20
+
+def test_pool_exhaustion_times_out(omop_db):
+    """Test waiting for a connection is bounded"""
+    pool = ReadOnlyConnectionPool(omop_db, size=1)
+    
+    with pool.connection():
+        with pytest.raises(PoolTimeoutError):
+            with pool.connection(timeout=0.05):
+                pass
+    
+    assert pool.get_stats()["waits"] == 1
+
+def test_pool_shared_across_threads(omop_db):
+    """Test connections are shared between threads up to the pool size"""
+    pool = ReadOnlyConnectionPool(omop_db, size=2)
+    errors = []
+    
+    def worker():
+        try:
+            for _ in range(20):
+                with pool.connection() as conn:
+                    conn.execute("SELECT * FROM person").fetchall()
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert errors == []
+    assert pool.get_stats()["created"] <= 2
+
+def test_rebuilt_database_discards_connections(omop_db):
+    """Test connections opened on a replaced database file are discarded"""
+    pool = ReadOnlyConnectionPool(omop_db, health_interval=0)
+    with pool.connection() as conn:
+        conn.execute("SELECT 1")
+    
+    rebuilt = omop_db.with_name("rebuilt.db")
+    conn = sqlite3.connect(rebuilt)
+    conn.execute("CREATE TABLE person (person_id INTEGER PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+    os.replace(rebuilt, omop_db)
+    
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM person").fetchone()[0] == 0
+    
+    stats = pool.get_stats()
+    assert stats["file_changes"] == 1
+    assert stats["discarded"] == 1
+
+def test_progress_handler_reset_on_release(omop_db):
+    """Test a budget installed by one user does not leak to the next"""
+    pool = ReadOnlyConnectionPool(omop_db)
+    
+    with pool.connection() as conn:
+        conn.set_progress_handler(lambda: 1, 1)
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM person").fetchone()[0] == 2
@@ -0,0 +1,122 @@
+import sqlite3
+
+import pytest
+
+from app.sql_generation.cost_estimator import CostEstimator, TableStats, cost_feedback
+from app.sql_generation.sql_execution import explain_sql
+from app.sql_generation.sql_validator import SQLValidator
+
+N_PERSONS = 200
+N_CONDITIONS = 2000
+
+@pytest.fixture
+def omop_db(tmp_path):
+    db_path = tmp_path / "omop.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE person (person_id INTEGER PRIMARY KEY, year_of_birth INTEGER, gender_concept_id INTEGER)")
+    conn.execute("CREATE TABLE condition_occurrence (condition_occurrence_id INTEGER PRIMARY KEY, person_id INTEGER, "
+                 "condition_concept_id INTEGER, condition_start_date TEXT, condition_source_value TEXT)")
+    conn.execute("CREATE INDEX idx_condition_concept ON condition_occurrence (condition_concept_id)")
+    conn.execute("CREATE INDEX idx_condition_person ON condition_occurrence (person_id)")
+    conn.executemany("INSERT INTO person VALUES (?, ?, ?)",
+                     [(i, 1950 + i % 50, 8507 if i % 2 else 8532) for i in range(1, N_PERSONS + 1)])
+    conn.executemany("INSERT INTO condition_occurrence VALUES (?, ?, ?, ?, ?)",
+                     [(i, i % N_PERSONS + 1, 201826 + i % 20, f"20{10 + i % 10}-01-15", f"C{i}")
+                      for i in range(1, N_CONDITIONS + 1)])
+    conn.commit()
+    conn.close()
+    return db_path
+
+@pytest.fixture
+def estimator(omop_db):
+    # condition_occurrence counts as a large table; person does not
+    return CostEstimator(omop_db, max_rows=100_000, large_table_rows=1000)
+
+def estimate(estimator, sql):
+    conn = sqlite3.connect(estimator.db_path)
+    try:
+        plan = explain_sql(conn, sql)
+    finally:
+        conn.close()
+    return estimator.estimate(sql, plan)
+
+def test_table_stats(omop_db):
+    stats = TableStats.from_sqlite(omop_db)
+    assert stats.rows == {"person": N_PERSONS, "condition_occurrence": N_CONDITIONS}
+    assert set(stats.indexed_columns("condition_occurrence")) == {
+        "condition_occurrence_id", "condition_concept_id", "person_id"
+    }
+
+def test_analyze_statistics_are_used(omop_db):
+    conn = sqlite3.connect(omop_db)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    stats = TableStats.from_sqlite(omop_db)
+    assert stats.rows["condition_occurrence"] == N_CONDITIONS
+    assert stats.rows_per_key("idx_condition_concept", 1) == N_CONDITIONS // 20
+
+def test_indexed_predicate_is_cheap(estimator):
+    cost = estimate(estimator, "SELECT COUNT(*) FROM condition_occurrence co JOIN person p "
+                               "ON p.person_id = co.person_id WHERE co.condition_concept_id = 201826")
+    assert cost['full_scans'] == []
+    assert cost['estimated_rows'] < 100
+    assert not cost['exceeds_threshold']
+
+def test_full_scan_of_large_table_is_flagged(estimator):
+    cost = estimate(estimator, "SELECT COUNT(*) FROM condition_occurrence WHERE condition_start_date > '2015'")
+    assert cost['full_scans'] == [{'table': 'condition_occurrence', 'rows': N_CONDITIONS, 'index': None}]
+    assert cost['estimated_rows'] == N_CONDITIONS
+    assert "filter on indexed" in cost['hints'][0]
+    assert "condition_concept_id" in cost['hints'][0]
+
+def test_cartesian_product_exceeds_threshold(estimator):
+    cost = estimate(estimator, "SELECT COUNT(*) FROM person p, condition_occurrence c")
+    assert cost['estimated_rows'] >= N_PERSONS * N_CONDITIONS
+    assert cost['exceeds_threshold']
+
+def test_join_without_index(estimator):
+    cost = estimate(estimator, "SELECT COUNT(*) FROM person p JOIN condition_occurrence co "
+                               "ON co.condition_source_value = p.year_of_birth")
+    assert cost['unindexed_joins'] == [{'table': 'person', 'columns': ['year_of_birth']}]
+    assert cost['full_scans'][0]['table'] == 'condition_occurrence'
+    assert any("join on person_id" in hint for hint in cost['hints'])
+
+def test_subquery_branches_are_counted(estimator):
+    cost = estimate(estimator, "WITH x AS (SELECT person_id, COUNT(*) AS n FROM condition_occurrence "
+                               "GROUP BY person_id) SELECT COUNT(*) FROM x WHERE n > 3")
+    assert cost['estimated_rows'] >= N_CONDITIONS
+
+def test_cost_feedback_fits_correction_prompt(estimator):
+    cost = estimate(estimator, "SELECT COUNT(*) FROM condition_occurrence WHERE condition_start_date > '2015'")
+    feedback = cost_feedback(cost)
+    assert feedback.startswith("Too expensive")
+    assert len(feedback) <= 150
+    assert cost_feedback(None) is None
+
+def test_validator_flags_and_rejects(omop_db):
+    cartesian = "SELECT COUNT(*) FROM person p, condition_occurrence c"
+
+    validator = SQLValidator(str(omop_db), schema_path=None, cost_action="flag")
+    validator.cost_estimator = CostEstimator(omop_db, max_rows=100_000, large_table_rows=1000)
+    result = validator.test_sql_execution(cartesian, mode="explain")
+    assert result['executable']
+    assert result['cost']['exceeds_threshold']
+
+    validator = SQLValidator(str(omop_db), schema_path=None, cost_action="reject")
+    validator.cost_estimator = CostEstimator(omop_db, max_rows=100_000, large_table_rows=1000)
+    result = validator.test_sql_execution(cartesian, mode="execute")
+    assert not result['executable']
+    assert result['error_type'] == 'CostExceeded'
+    assert result['row_count'] is None
+    # Cheap queries still run
+    result = validator.test_sql_execution("SELECT COUNT(*) FROM person WHERE person_id = 3", mode="execute")
+    assert result['executable'] and result['row_count'] == 1
+    assert not result['cost']['exceeds_threshold']
+
+def test_cost_estimation_can_be_disabled(omop_db):
+    validator = SQLValidator(str(omop_db), schema_path=None, cost_action="off")
+    result = validator.test_sql_execution("SELECT COUNT(*) FROM person", mode="explain")
+    assert result['cost'] is None
+    with pytest.raises(ValueError):
+        SQLValidator(str(omop_db), schema_path=None, cost_action="block")
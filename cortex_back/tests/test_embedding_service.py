@@ -0,0 +1,81 @@
+import threading
+import numpy as np
+import pytest
+from unittest.mock import patch, MagicMock
+from app.core.embeddings import EmbeddingService
+
+@pytest.fixture
+def mock_model():
+    """Mock SentenceTransformer returning one row per input text"""
+    model = MagicMock()
+    model.encode.side_effect = lambda texts, **kwargs: np.array(
+        [[float(len(t)), 1.0, 0.0] for t in texts], dtype="float32"
+    )
+    return model
+
+@pytest.fixture
+def embedding_service(mock_model):
+    """Create embedding service with mocked model"""
+    with patch('app.core.embeddings.SentenceTransformer', return_value=mock_model):
+        yield EmbeddingService("test-model", max_batch_size=8, max_wait_ms=50, cache_size=2)
+
+def test_encode_query_shape_and_copy(embedding_service):
+    """Test that query embeddings are (1, dim) writable copies"""
+    emb = embedding_service.encode_query("diabetes")
+    assert emb.shape == (1, 3)
+    assert emb.dtype == np.float32
+    
+    emb[0, 0] = -1.0  # faiss.normalize_L2 modifica en sitio
+    again = embedding_service.encode_query("diabetes")
+    assert again[0, 0] == float(len("diabetes"))
+
+def test_query_cache_shared_between_callers(embedding_service, mock_model):
+    """Test that a text embedded once is reused by other callers"""
+    embedding_service.encode_query("How many patients have diabetes?")
+    embedding_service.encode_query("How many patients have diabetes?")
+    
+    assert mock_model.encode.call_count == 1
+    stats = embedding_service.get_stats()
+    assert stats["cache_hits"] == 1
+    assert stats["requests"] == 2
+
+def test_concurrent_queries_are_batched(embedding_service, mock_model):
+    """Test that concurrent callers are encoded in a single batch"""
+    texts = [f"term {i}" for i in range(6)]
+    barrier = threading.Barrier(len(texts))
+    results = {}
+    
+    def worker(text):
+        barrier.wait()
+        results[text] = embedding_service.encode_query(text)
+    
+    threads = [threading.Thread(target=worker, args=(t,)) for t in texts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert len(results) == 6
+    assert embedding_service.get_stats()["batches"] < 6
+
+def test_cache_is_bounded(embedding_service):
+    """Test LRU eviction when cache is full"""
+    for text in ["a", "bb", "ccc"]:
+        embedding_service.encode_query(text)
+    
+    assert embedding_service.get_stats()["cached_texts"] == 2
+
+def test_encode_batch_bypasses_cache(embedding_service, mock_model):
+    """Test bulk encoding for index builds"""
+    embeds = embedding_service.encode_batch(["a", "b", "c"])
+    
+    assert embeds.shape == (3, 3)
+    assert embedding_service.get_stats()["cached_texts"] == 0
+
+def test_clear_cache(embedding_service):
+    """Test clearing the shared cache"""
+    embedding_service.encode_query("diabetes")
+    removed = embedding_service.clear_cache()
+    
+    assert removed == 1
+    assert embedding_service.get_stats()["cached_texts"] == 0
@@ -101,7 +101,7 @@ def test_complete_workflow_mock_services(client):
         ]
     }
     
-    with patch('app.sql_generation.service.SQLGenerationService.generate_sql', 
+    with patch('app.sql_generation.service.SQLGenerationService.generate_sql_async', 
                return_value=type('MockResponse', (), mock_sql_response)()):
         sql_response = client.post("/sql-generation/", json=sql_request, headers=headers)
         assert sql_response.status_code == 200
@@ -165,7 +165,7 @@ def test_error_scenarios_workflow(client, auth_headers):
         "medical_terms": []
     }
     
-    with patch('app.sql_generation.service.SQLGenerationService.generate_sql',
+    with patch('app.sql_generation.service.SQLGenerationService.generate_sql_async',
                return_value=type('MockResponse', (), mock_failed_sql)()):
         failed_response = client.post("/sql-generation/", json=failed_request, headers=auth_headers)
         assert failed_response.status_code == 200
@@ -241,7 +241,7 @@ def test_concurrent_users_simulation(client):
     ]
     
     # Each user generates SQL
-    with patch('app.sql_generation.service.SQLGenerationService.generate_sql') as mock_generate:
+    with patch('app.sql_generation.service.SQLGenerationService.generate_sql_async') as mock_generate:
         mock_generate.side_effect = [
             type('MockResponse', (), response)() for response in mock_sql_responses
         ]
@@ -312,7 +312,7 @@ def test_sql_generation_patterns(client, auth_headers, sql_scenario):
         "medical_terms": []
     }
     
-    with patch('app.sql_generation.service.SQLGenerationService.generate_sql',
+    with patch('app.sql_generation.service.SQLGenerationService.generate_sql_async',
                return_value=type('MockResponse', (), mock_response)()):
         response = client.post("/sql-generation/", json=request, headers=auth_headers)
         assert response.status_code == 200
@@ -0,0 +1,147 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+pytest.importorskip("pyarrow")
+
+from app.sql_generation.engines import (
+    SQLiteEngine, DuckDBEngine, create_engine, convert_sqlite_to_parquet
+)
+from app.sql_generation.query_executor import QueryExecutor
+from app.sql_generation.sql_validator import SQLValidator
+
+@pytest.fixture
+def omop_db(tmp_path):
+    db_path = tmp_path / "omop.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE person (person_id INTEGER PRIMARY KEY, year_of_birth INTEGER, "
+                 "gender_concept_id INTEGER, birth_datetime TEXT)")
+    conn.execute("CREATE TABLE condition_occurrence (condition_occurrence_id INTEGER PRIMARY KEY, "
+                 "person_id INTEGER, condition_concept_id INTEGER, condition_start_date TEXT, value REAL)")
+    conn.executemany("INSERT INTO person VALUES (?, ?, ?, ?)",
+                     [(i, 1950 + i % 50, 8507 if i % 2 else 8532, f"{1950 + i % 50}-03-01") for i in range(1, 101)])
+    conn.executemany("INSERT INTO condition_occurrence VALUES (?, ?, ?, ?, ?)",
+                     [(i, i % 100 + 1, 201826 if i % 3 else 316866, f"20{10 + i % 10}-01-15", i / 4)
+                      for i in range(1, 301)])
+    conn.commit()
+    conn.close()
+    return db_path
+
+@pytest.fixture
+def parquet_dir(omop_db, tmp_path):
+    out = tmp_path / "parquet"
+    convert_sqlite_to_parquet(omop_db, out, batch_size=64)
+    return out
+
+@pytest.fixture
+def duck(omop_db, parquet_dir):
+    return DuckDBEngine(omop_db, source="parquet", parquet_dir=parquet_dir, threads=2)
+
+QUERIES = [
+    "SELECT COUNT(DISTINCT person_id) FROM condition_occurrence WHERE condition_concept_id = 201826;",
+    "SELECT p.gender_concept_id, COUNT(*) FROM person p JOIN condition_occurrence co "
+    "ON p.person_id = co.person_id GROUP BY p.gender_concept_id ORDER BY 1",
+    "SELECT strftime('%Y', condition_start_date) AS y, COUNT(*) FROM condition_occurrence GROUP BY y ORDER BY y",
+]
+
+def test_conversion_writes_one_file_per_table(omop_db, tmp_path):
+    written = convert_sqlite_to_parquet(omop_db, tmp_path / "out", batch_size=64)
+    assert written == {"condition_occurrence": 300, "person": 100}
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["condition_occurrence.parquet", "person.parquet"]
+
+@pytest.mark.parametrize("sql", QUERIES)
+def test_duckdb_matches_sqlite(omop_db, duck, sql):
+    sqlite_engine = SQLiteEngine(omop_db)
+    expected = sqlite_engine.connect().execute(sql).fetchall()
+    conn = duck.connect()
+    try:
+        assert conn.execute(duck.prepare(sql)).fetchall() == expected
+    finally:
+        conn.close()
+
+def test_explain_lists_scanned_tables(duck):
+    conn = duck.connect()
+    try:
+        plan = duck.explain(conn, "SELECT COUNT(*) FROM person WHERE year_of_birth > 1980")
+    finally:
+        conn.close()
+    assert any("READ_PARQUET [year_of_birth>1980]" in line for line in plan)
+
+def test_validator_with_duckdb(omop_db, duck):
+    validator = SQLValidator(str(omop_db), schema_path=None, cache_size=0)
+    # El pool se crea en el primer uso, con las conexiones del motor asignado
+    validator.engine = duck
+    result = validator.test_sql_execution(QUERIES[2], mode="execute")
+    assert result['executable'], result['error']
+    assert result['row_count'] == 10
+    assert result['plan']
+
+    result = validator.test_sql_execution("SELECT missing_column FROM person", mode="explain")
+    assert not result['executable']
+    assert result['error_type'] == 'OperationalError'
+    validator.close()
+
+def test_time_budget_interrupts_duckdb(omop_db, duck):
+    validator = SQLValidator(str(omop_db), schema_path=None, cache_size=0, time_budget=0.2)
+    validator.engine = duck
+    runaway = "SELECT SUM(a.range * 2) FROM range(10000000000) a"
+    result = validator.test_sql_execution(runaway, mode="execute")
+    assert result['error_type'] == 'BudgetExceeded'
+    validator.close()
+
+def test_executor_pages_with_duckdb(omop_db, duck):
+    executor = QueryExecutor(omop_db, page_size=10, batch_size=4, engine=duck)
+    page = executor.open("SELECT person_id, birth_datetime FROM person ORDER BY person_id")
+    rows = []
+    try:
+        while not page.done:
+            rows.extend(page.fetch())
+    finally:
+        page.close()
+    assert rows[0] == [1, "1951-03-01"]
+    assert len(rows) == 10 and page.has_more
+    assert executor.get_stats()['engine'] == "duckdb"
+
+def test_executor_budget_pauses_with_duckdb(omop_db, duck):
+    executor = QueryExecutor(omop_db, page_size=50, batch_size=10, time_budget=0.3, engine=duck)
+    page = executor.open("SELECT person_id FROM person ORDER BY person_id")
+    rows = []
+    try:
+        while not page.done:
+            rows.extend(page.fetch())
+            time.sleep(0.1)
+    finally:
+        page.close()
+    assert len(rows) == 50
+    assert page.budget['exceeded'] is None
+
+def test_executor_cancel_with_duckdb(omop_db, duck):
+    executor = QueryExecutor(omop_db, time_budget=30, engine=duck)
+    page = executor.open("SELECT SUM(a.range * 2) FROM range(10000000000) a")
+    timer = threading.Timer(0.2, page.cancel)
+    timer.start()
+    with pytest.raises(duckdb.Error) as exc_info:
+        page.fetch()
+    assert page.error_info(exc_info.value)['error_type'] == 'Cancelled'
+    page.close()
+
+def test_attach_source(omop_db):
+    engine = DuckDBEngine(omop_db, source="attach")
+    try:
+        conn = engine.connect()
+    except duckdb.Error as e:
+        pytest.skip(f"Extensión sqlite de DuckDB no disponible: {e}")
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM person").fetchone() == (100,)
+    finally:
+        conn.close()
+
+def test_create_engine(omop_db):
+    assert create_engine("sqlite", omop_db).name == "sqlite"
+    with pytest.raises(ValueError):
+        create_engine("postgres", omop_db)
+    with pytest.raises(ValueError):
+        DuckDBEngine(omop_db, source="csv")
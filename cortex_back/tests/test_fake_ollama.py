@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+from benchmarks.fake_ollama import FakeOllamaServer, FakeOllamaConfig, tokenize
+from app.sql_generation.ollama_client import OllamaClient, AsyncOllamaClient
+from app.sql_generation.sql_validator import SQLValidator
+
+MODEL = "deepseek-coder-v2:16b-lite-instruct-q4_K_M"
+
+@pytest.fixture
+def server():
+    config = FakeOllamaConfig(scripts=[
+        ("diabetes", ["SELECT bad FROM person;", "SELECT COUNT(*) FROM condition_occurrence;"]),
+    ])
+    with FakeOllamaServer(config) as fake:
+        yield fake
+
+def test_tokenize_round_trip():
+    """Test tokens concatenate back to the original text"""
+    text = "SELECT COUNT(*)\nFROM person;"
+    assert "".join(tokenize(text)) == text
+
+def test_tags_and_model_availability(server):
+    """Test the client sees the configured models"""
+    client = OllamaClient(server.url)
+    
+    assert client.is_ollama_running() is True
+    assert client.list_models() == [MODEL]
+    assert client.check_model_availability("deepseek-coder-v2") is True
+
+def test_generate_default_sql(server):
+    """Test non-streaming generation returns the default SQL with Ollama fields"""
+    client = OllamaClient(server.url)
+    
+    text = client.generate(MODEL, "Question: How many patients?\nSQL:")
+    
+    assert "SELECT COUNT(DISTINCT person_id) FROM person;" in text
+    assert server.requests[-1]["stream"] is False
+
+def test_scripted_sql_per_attempt(server):
+    """Test scripted responses advance with each attempt for the same question"""
+    client = OllamaClient(server.url)
+    prompt = "Question: Patients with diabetes\nSQL:"
+    
+    first = client.generate(MODEL, prompt)
+    second = client.generate(MODEL, prompt)
+    
+    assert "SELECT bad" in first
+    assert "condition_occurrence" in second
+
+def test_streaming_stops_at_complete_statement():
+    """Test streaming generation is cut at the first complete statement"""
+    config = FakeOllamaConfig(default_sql="SELECT 1; -- trailing explanation that should not be generated", fenced=False)
+    with FakeOllamaServer(config) as fake:
+        client = OllamaClient(fake.url)
+        validator = SQLValidator()
+        
+        tokens = list(client.generate_stream(MODEL, "Question: q", stop_condition=validator.is_statement_complete))
+    
+    assert "".join(tokens) == "SELECT 1;"
+
+def test_error_injection():
+    """Test injected failures surface as client errors"""
+    with FakeOllamaServer(FakeOllamaConfig(error_rate=1.0)) as fake:
+        client = OllamaClient(fake.url)
+        
+        assert client.generate(MODEL, "Question: q") is None
+        assert fake.stats["errors"] == 1
+
+def test_unknown_model(server):
+    """Test generating with a missing model fails like Ollama"""
+    client = OllamaClient(server.url)
+    assert client.generate("missing-model", "Question: q") is None
+
+def test_latency_and_token_rate():
+    """Test latency and token rate are applied"""
+    import time
+    config = FakeOllamaConfig(latency_ms=50, tokens_per_s=200, default_sql="SELECT a, b, c FROM person;", fenced=False)
+    with FakeOllamaServer(config) as fake:
+        client = OllamaClient(fake.url)
+        start = time.perf_counter()
+        client.generate(MODEL, "Question: q")
+        elapsed = time.perf_counter() - start
+    
+    # 50 ms de latencia + 6 tokens a 200 tokens/s
+    assert elapsed >= 0.05 + 6 / 200
+
+def test_async_client_against_fake(server):
+    """Test the async client streams and generates against the fake server"""
+    async def scenario():
+        client = AsyncOllamaClient(server.url)
+        try:
+            text = await client.generate(MODEL, "Question: How many patients?")
+            tokens = [t async for t in client.generate_stream(MODEL, "Question: How many patients?")]
+            return text, "".join(tokens)
+        finally:
+            await client.aclose()
+    
+    text, streamed = asyncio.run(scenario())
+    
+    assert text == streamed.strip()
+    assert server.stats["stream"] == 1
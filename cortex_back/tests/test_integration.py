@@ -51,7 +51,7 @@ def test_full_user_flow_basic(client):
         "medical_terms": [{"term": "diabetes", "concept_id": "201826"}]
     }
     
-    with patch('app.sql_generation.service.SQLGenerationService.generate_sql', return_value=type('MockResponse', (), mock_sql_response)()):
+    with patch('app.sql_generation.service.SQLGenerationService.generate_sql_async', return_value=type('MockResponse', (), mock_sql_response)()):
         sql_response = client.post("/sql-generation/", json=sql_request, headers=headers)
         assert sql_response.status_code == 200
         sql_data = sql_response.json()
@@ -0,0 +1,126 @@
+import pytest
+from unittest.mock import MagicMock
+from app.sql_generation.llm_router import LLMRouter, Backend, BackendSpec, parse_backends
+
+def make_backend(model, tier="main", weight=1.0, url="http://localhost:11434", healthy=True, text="SELECT 1;"):
+    health = MagicMock()
+    health.allow_request.return_value = healthy
+    health.accepting_requests.return_value = healthy
+    health.model_available.return_value = healthy
+    health.status.return_value = {'ollama_running': healthy, 'model_available': healthy, 'circuit_state': 'closed'}
+    client = MagicMock()
+    client.generate.return_value = text
+    return Backend(BackendSpec(url, model, weight, tier), client, MagicMock(), health)
+
+def test_parse_backends():
+    """Test OLLAMA_BACKENDS parsing with optional weight and tier"""
+    specs = parse_backends(
+        "http://a:11434|qwen2.5-coder:7b|2|fast, http://b:11434/|deepseek-coder-v2:16b",
+        "http://default:11434", "default-model"
+    )
+    
+    assert specs[0] == BackendSpec("http://a:11434", "qwen2.5-coder:7b", 2.0, "fast")
+    assert specs[1] == BackendSpec("http://b:11434", "deepseek-coder-v2:16b", 1.0, "main")
+
+def test_parse_backends_default_and_invalid():
+    """Test the single default backend and entries without a model"""
+    assert parse_backends("", "http://default:11434", "m") == [BackendSpec("http://default:11434", "m")]
+    with pytest.raises(ValueError):
+        parse_backends("http://a:11434", "http://default:11434", "m")
+
+def test_select_escalates_by_attempt():
+    """Test the first attempt goes to the fast tier and corrections to the larger model"""
+    fast = make_backend("small", tier="fast")
+    main = make_backend("large", tier="main")
+    router = LLMRouter([main, fast], tiers=["fast", "main"])
+    
+    assert router.tiers == ["fast", "main"]
+    assert router.primary is main
+    assert router.select(1) is fast
+    assert router.select(2) is main
+    assert router.select(3) is main
+
+def test_select_skips_unhealthy_tier():
+    """Test an unhealthy tier falls through to the next available one"""
+    fast = make_backend("small", tier="fast", healthy=False)
+    main = make_backend("large", tier="main")
+    router = LLMRouter([fast, main], tiers=["fast", "main"])
+    
+    assert router.select(1) is main
+    assert router.has_fallback(main) is False
+
+def test_select_least_loaded_respects_weights():
+    """Test least-loaded routing across instances weighted by capacity"""
+    gpu0 = make_backend("large", url="http://gpu0:11434", weight=2.0)
+    gpu1 = make_backend("large", url="http://gpu1:11434", weight=1.0)
+    router = LLMRouter([gpu0, gpu1])
+    
+    gpu0.in_flight = 1   # carga 0.5
+    gpu1.in_flight = 1   # carga 1.0
+    assert router.select(1) is gpu0
+    
+    gpu0.in_flight = 3   # carga 1.5
+    assert router.select(1) is gpu1
+
+def test_retry_avoids_backend_that_just_failed():
+    """Test a failed backend is skipped on the retry even when load and latency tie"""
+    a = make_backend("large", url="http://a:11434", text=None)
+    b = make_backend("large", url="http://b:11434")
+    router = LLMRouter([a, b])
+    
+    assert router.select(1) is a
+    assert a.generate("prompt") is None
+    assert router.select(2, exclude=a) is b
+    # Without `exclude` the recent failure still ranks it last
+    assert router.select(2) is b
+    assert b.generate("prompt") == "SELECT 1;"
+    assert a.consecutive_failures == 1 and b.consecutive_failures == 0
+
+def test_select_without_available_backends_returns_primary():
+    """Test routing falls back to the primary backend when none is healthy"""
+    main = make_backend("large", healthy=False)
+    router = LLMRouter([main])
+    
+    assert router.select(1) is main
+
+def test_backend_tracks_latency_and_health():
+    """Test generation updates per-backend stats and the circuit breaker"""
+    backend = make_backend("large")
+    
+    assert backend.generate("prompt", temperature=0.05) == "SELECT 1;"
+    backend.client.generate.assert_called_once_with(model_name="large", prompt="prompt", temperature=0.05)
+    backend.health.record_success.assert_called_once()
+    
+    backend.client.generate.return_value = None
+    assert backend.generate("prompt") is None
+    backend.health.record_failure.assert_called_once()
+    
+    stats = backend.get_stats()
+    assert stats['requests'] == 2
+    assert stats['failures'] == 1
+    assert stats['in_flight'] == 0
+    assert stats['latency_p50_s'] is not None
+    assert stats['healthy'] is True
+
+def test_backend_rejected_by_circuit_skips_ollama():
+    """Test a backend refused by its circuit breaker fails without calling Ollama"""
+    backend = make_backend("large")
+    backend.health.allow_request.return_value = False
+    
+    assert backend.available() is True
+    assert backend.generate("prompt") is None
+    backend.client.generate.assert_not_called()
+    backend.health.record_failure.assert_not_called()
+    assert backend.get_stats()['rejected'] == 1
+
+def test_backend_stream_tracks_in_flight():
+    """Test streaming keeps the request in flight until the stream ends"""
+    backend = make_backend("large")
+    backend.client.generate_stream.return_value = iter(["SELECT ", "1;"])
+    
+    stream = backend.generate_stream("prompt")
+    assert next(stream) == "SELECT "
+    assert backend.in_flight == 1
+    assert list(stream) == ["1;"]
+    assert backend.in_flight == 0
+    backend.health.record_success.assert_called_once()
@@ -0,0 +1,104 @@
+import time
+import pytest
+from unittest.mock import patch, MagicMock
+from app.medical.reranker import CrossEncoderReranker
+
+@pytest.fixture
+def candidates():
+    """FAISS candidates in L2 order"""
+    return [
+        {"term": "diabetic foot", "concept_id": 1, "similarity": 0.9},
+        {"term": "diabetes insipidus", "concept_id": 2, "similarity": 0.8},
+        {"term": "diabetes mellitus", "concept_id": 3, "similarity": 0.7},
+        {"term": "tail term", "concept_id": 4, "similarity": 0.1},
+    ]
+
+def make_reranker(scores, delay=0.0, top_n=3, budget_ms=1000):
+    """Create reranker with a mocked cross-encoder"""
+    mock_model = MagicMock()
+    def predict(pairs, **kwargs):
+        time.sleep(delay)
+        return scores[:len(pairs)]
+    mock_model.predict.side_effect = predict
+    with patch('app.medical.reranker.CrossEncoder', return_value=mock_model):
+        return CrossEncoderReranker(model_name="test-cross-encoder", top_n=top_n, budget_ms=budget_ms)
+
+def test_rerank_reorders_top_n(candidates):
+    """Test that only the top-N candidates are reordered by cross-encoder score"""
+    reranker = make_reranker([0.1, 0.2, 0.9])
+    
+    results, reranked = reranker.rerank("diabetes", candidates)
+    
+    assert reranked is True
+    assert [r["concept_id"] for r in results] == [3, 2, 1, 4]
+    assert results[0]["rerank_score"] == 0.9
+    assert "rerank_score" not in results[3]
+    
+    pairs = reranker.model.predict.call_args[0][0]
+    assert len(pairs) == 3
+    assert pairs[0] == ("diabetes", "diabetic foot")
+
+def test_rerank_over_budget_keeps_faiss_order(candidates):
+    """Test that exceeding the latency budget returns the FAISS order"""
+    reranker = make_reranker([0.1, 0.2, 0.9], delay=0.2, budget_ms=20)
+    
+    results, reranked = reranker.rerank("diabetes", candidates)
+    
+    assert reranked is False
+    assert results == candidates
+    assert reranker.get_stats()["over_budget"] == 1
+
+def test_rerank_model_error_keeps_faiss_order(candidates):
+    """Test that cross-encoder errors fall back to the FAISS order"""
+    reranker = make_reranker([])
+    reranker.model.predict.side_effect = RuntimeError("boom")
+    
+    results, reranked = reranker.rerank("diabetes", candidates)
+    
+    assert reranked is False
+    assert results == candidates
+    assert reranker.get_stats()["errors"] == 1
+
+def test_rerank_stats(candidates):
+    """Test reranker statistics"""
+    reranker = make_reranker([0.3, 0.2, 0.1])
+    reranker.rerank("diabetes", candidates)
+    
+    stats = reranker.get_stats()
+    assert stats["calls"] == 1
+    assert stats["reranked"] == 1
+    assert stats["pairs_scored"] == 3
+    assert stats["model"] == "test-cross-encoder"
+
+@pytest.fixture
+def reset_reranker(monkeypatch):
+    """Start from an unloaded shared reranker"""
+    import app.medical.reranker as reranker_module
+    monkeypatch.setattr(reranker_module, "_reranker", None)
+    monkeypatch.setattr(reranker_module, "_reranker_error", None)
+    return reranker_module
+
+def test_failed_load_disables_reranking(reset_reranker):
+    """Test that a cross-encoder load failure disables reranking without retrying"""
+    with patch('app.medical.reranker.CrossEncoder', side_effect=OSError("no network")) as mock_cls:
+        assert reset_reranker.get_reranker() is None
+        assert reset_reranker.get_reranker() is None
+    
+    assert mock_cls.call_count == 1
+    stats = reset_reranker.get_reranker_stats()
+    assert stats["disabled"] is True
+    assert "no network" in stats["error"]
+
+def test_entity_linker_falls_back_to_faiss_order(reset_reranker, candidates):
+    """Test that similar-term search keeps the FAISS order when the reranker cannot load"""
+    from app.medical.similarity_bd import MedicalEntityLinker
+    linker = object.__new__(MedicalEntityLinker)
+    linker.search_synonym = MagicMock(return_value=[(c["concept_id"], c["term"], 0.1 * i)
+                                                    for i, c in enumerate(candidates)])
+    linker.get_omop_concepts_batch = MagicMock(return_value={})
+    
+    with patch('app.medical.reranker.CrossEncoder', side_effect=OSError("no network")):
+        results = linker.get_similar_terms_optimized("diabetes", k=3, rerank=True)
+    
+    assert [r["concept_id"] for r in results] == [1, 2, 3]
+    assert linker.search_synonym.call_args.kwargs["k"] == 3
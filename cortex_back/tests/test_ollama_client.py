@@ -162,3 +162,244 @@ def test_generate_with_default_options(ollama_client):
         assert payload["options"]["temperature"] == 0.05  # Default
         assert payload["options"]["top_p"] == 0.9  # Default
         assert payload["options"]["num_predict"] == 400  # Default
+
+def _stream_response(chunks, status_code=200):
+    """Mock de respuesta HTTP en streaming (una línea JSON por chunk)"""
+    import json
+    mock_response = MagicMock()
+    mock_response.status_code = status_code
+    mock_response.iter_lines.return_value = [json.dumps(c).encode() for c in chunks]
+    mock_response.__enter__.return_value = mock_response
+    return mock_response
+
+def test_generate_stream_yields_tokens(ollama_client):
+    """Test streaming generation yields tokens until done"""
+    chunks = [{"response": "SELECT "}, {"response": "1"}, {"response": "", "done": True}]
+    
+    with patch.object(ollama_client.session, 'post') as mock_post:
+        mock_post.return_value = _stream_response(chunks)
+        
+        tokens = list(ollama_client.generate_stream("test-model", "test prompt"))
+        
+        assert tokens == ["SELECT ", "1"]
+        assert mock_post.call_args[1]["json"]["stream"] is True
+        assert mock_post.call_args[1]["stream"] is True
+
+def test_generate_stream_stops_early(ollama_client):
+    """Test streaming stops as soon as the stop condition holds"""
+    chunks = [{"response": "SELECT 1"}, {"response": ";"}, {"response": " -- extra"}, {"done": True}]
+    
+    with patch.object(ollama_client.session, 'post') as mock_post:
+        mock_response = _stream_response(chunks)
+        mock_post.return_value = mock_response
+        
+        tokens = list(ollama_client.generate_stream(
+            "test-model", "test prompt", stop_condition=lambda text: text.endswith(";")
+        ))
+        
+        assert "".join(tokens) == "SELECT 1;"
+        mock_response.__exit__.assert_called_once()
+
+def test_generate_stream_http_error(ollama_client):
+    """Test streaming generation with HTTP error yields nothing"""
+    with patch.object(ollama_client.session, 'post') as mock_post:
+        mock_post.return_value = _stream_response([], status_code=500)
+        
+        assert list(ollama_client.generate_stream("test-model", "test prompt")) == []
+
+def test_generate_stream_connection_error(ollama_client):
+    """Test streaming generation with connection error yields nothing"""
+    with patch.object(ollama_client.session, 'post') as mock_post:
+        mock_post.side_effect = requests.exceptions.ConnectionError()
+        
+        assert list(ollama_client.generate_stream("test-model", "test prompt")) == []
+
+def test_check_model_availability_with_cached_list(ollama_client):
+    """Test checking a model against an already fetched model list"""
+    with patch.object(ollama_client, 'list_models') as mock_list:
+        result = ollama_client.check_model_availability("llama2", available_models=["llama2:7b"])
+        
+        assert result is True
+        mock_list.assert_not_called()
+
+def _async_client_with(handler):
+    """AsyncOllamaClient served by an in-process httpx transport"""
+    import httpx
+    from app.sql_generation.ollama_client import AsyncOllamaClient
+    client = AsyncOllamaClient("http://localhost:11434")
+    client._client = httpx.AsyncClient(base_url=client.base_url, transport=httpx.MockTransport(handler))
+    return client
+
+def test_async_generate_success():
+    """Test async generation returns the stripped response"""
+    import asyncio
+    import httpx
+    import json
+    
+    def handler(request):
+        payload = json.loads(request.content)
+        assert request.url.path == "/api/generate"
+        assert payload["stream"] is False
+        assert payload["options"]["num_predict"] == 700
+        return httpx.Response(200, json={"response": "  SELECT 1;  "})
+    
+    async def scenario():
+        client = _async_client_with(handler)
+        try:
+            return await client.generate("test-model", "prompt", max_tokens=700)
+        finally:
+            await client.aclose()
+    
+    assert asyncio.run(scenario()) == "SELECT 1;"
+
+def test_async_generate_error():
+    """Test async generation returns None on HTTP error"""
+    import asyncio
+    import httpx
+    
+    async def scenario():
+        client = _async_client_with(lambda request: httpx.Response(500, text="boom"))
+        try:
+            return await client.generate("test-model", "prompt")
+        finally:
+            await client.aclose()
+    
+    assert asyncio.run(scenario()) is None
+
+def test_async_generate_stream_stops_early():
+    """Test async streaming stops at the stop condition"""
+    import asyncio
+    import httpx
+    import json
+    
+    chunks = [{"response": "SELECT 1"}, {"response": ";"}, {"response": " extra"}, {"done": True}]
+    body = "\n".join(json.dumps(c) for c in chunks)
+    
+    async def scenario():
+        client = _async_client_with(lambda request: httpx.Response(200, text=body))
+        try:
+            return [t async for t in client.generate_stream(
+                "test-model", "prompt", stop_condition=lambda text: text.endswith(";")
+            )]
+        finally:
+            await client.aclose()
+    
+    assert "".join(asyncio.run(scenario())) == "SELECT 1;"
+
+def test_generate_sends_keep_alive_and_records_ttft(ollama_client):
+    """Test generation keeps the model loaded and records time to first token"""
+    from app.sql_generation.ollama_client import ttft_recorder
+    
+    mock_response_data = {
+        "response": "SELECT 1;",
+        "load_duration": 2_000_000_000,
+        "prompt_eval_duration": 500_000_000
+    }
+    before = ttft_recorder.get_stats()
+    
+    with patch.object(ollama_client.session, 'post') as mock_post:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = mock_response_data
+        mock_post.return_value = mock_response
+        
+        ollama_client.generate("test-model", "prompt", keep_alive="1h")
+        
+        payload = mock_post.call_args[1]["json"]
+        assert payload["keep_alive"] == "1h"
+    
+    after = ttft_recorder.get_stats()
+    assert after["server"]["generations"] == before["server"]["generations"] + 1
+    assert after["client"]["generations"] == before["client"]["generations"]
+    assert after["cold_loads"] == before["cold_loads"] + 1
+
+def test_stream_ttft_is_recorded_client_side(ollama_client):
+    """Test streamed first-token latency goes to the client series, not the server one"""
+    from app.sql_generation.ollama_client import ttft_recorder
+    
+    chunks = [{"response": "SELECT 1;"},
+              {"response": "", "done": True, "load_duration": 2_000_000_000, "prompt_eval_duration": 1}]
+    before = ttft_recorder.get_stats()
+    
+    with patch.object(ollama_client.session, 'post') as mock_post:
+        mock_post.return_value = _stream_response(chunks)
+        list(ollama_client.generate_stream("test-model", "prompt"))
+    
+    after = ttft_recorder.get_stats()
+    assert after["client"]["generations"] == before["client"]["generations"] + 1
+    assert after["server"]["generations"] == before["server"]["generations"]
+    assert after["client"]["ttft_p50_ms"] is not None
+
+def test_warmup(ollama_client):
+    """Test warmup loads the model evaluating only the prompt prefix"""
+    with patch.object(ollama_client.session, 'post') as mock_post:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "response": "",
+            "load_duration": 3_000_000_000,
+            "prompt_eval_duration": 400_000_000,
+            "prompt_eval_count": 850
+        }
+        mock_post.return_value = mock_response
+        
+        timings = ollama_client.warmup("test-model", "static prefix")
+        
+        payload = mock_post.call_args[1]["json"]
+        assert payload["prompt"] == "static prefix"
+        assert payload["options"]["num_predict"] == 1
+        assert timings == {'load_ms': 3000.0, 'prompt_eval_ms': 400.0, 'prompt_eval_count': 850}
+
+def test_generate_fills_metrics_and_telemetry(ollama_client):
+    """Test token counts and durations are returned per generation and aggregated per model"""
+    from app.sql_generation.ollama_client import get_generation_telemetry
+    
+    mock_response_data = {
+        "response": "SELECT 1;",
+        "prompt_eval_count": 900,
+        "prompt_eval_duration": 300_000_000,
+        "eval_count": 40,
+        "eval_duration": 1_000_000_000,
+        "load_duration": 5_000_000,
+        "total_duration": 1_400_000_000
+    }
+    
+    with patch.object(ollama_client.session, 'post') as mock_post:
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = mock_response_data
+        mock_post.return_value = mock_response
+        
+        metrics = {}
+        ollama_client.generate("telemetry-model", "prompt", metrics=metrics)
+        
+        assert "metrics" not in mock_post.call_args[1]["json"]
+    
+    assert metrics["prompt_eval_count"] == 900
+    assert metrics["eval_count"] == 40
+    assert metrics["prompt_eval_ms"] == 300.0
+    assert metrics["load_ms"] == 5.0
+    assert metrics["tokens_per_s"] == 40.0
+    
+    stats = get_generation_telemetry()["telemetry-model"]
+    assert stats["generations"] == 1
+    assert stats["prompt_tokens"] == 900
+    assert stats["cold_loads"] == 0
+    assert stats["histograms"]["tokens_per_s"]["buckets"]["le_40"] == 1
+    assert stats["histograms"]["prompt_eval_ms"]["count"] == 1
+
+def test_generate_stream_truncated_metrics(ollama_client):
+    """Test a stream cut by stop_condition still reports client-side metrics"""
+    chunks = [{"response": "SELECT 1;"}, {"response": " -- extra"}]
+    with patch.object(ollama_client.session, 'post') as mock_post:
+        mock_post.return_value = _stream_response(chunks)
+        
+        metrics = {}
+        tokens = list(ollama_client.generate_stream(
+            "test-model", "prompt", stop_condition=lambda text: text.endswith(";"), metrics=metrics
+        ))
+    
+    assert tokens == ["SELECT 1;"]
+    assert metrics["eval_count"] == 1
+    assert metrics["truncated"] is True
+    assert metrics["total_ms"] is not None
@@ -0,0 +1,153 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from app.sql_generation.ollama_health import OllamaHealthMonitor, CLOSED, OPEN, HALF_OPEN
+
+@pytest.fixture
+def mock_client():
+    """Ollama client mock with the model available"""
+    client = MagicMock()
+    client.is_ollama_running.return_value = True
+    client.list_models.return_value = ["deepseek-coder-v2:16b-lite-instruct-q4_K_M"]
+    client.check_model_availability.return_value = True
+    return client
+
+def make_monitor(client, **kwargs):
+    params = dict(interval=60, models_ttl=300, failure_threshold=3, reset_timeout=30)
+    params.update(kwargs)
+    return OllamaHealthMonitor(client, "deepseek-coder-v2", **params)
+
+def test_first_read_checks_inline(mock_client):
+    """Test the first read refreshes once when the poller has not run yet"""
+    monitor = make_monitor(mock_client)
+    
+    assert monitor.allow_request() is True
+    assert monitor.model_available() is True
+    assert mock_client.is_ollama_running.call_count == 1
+
+def test_hot_path_reads_cached_state(mock_client):
+    """Test repeated reads do not probe Ollama again"""
+    monitor = make_monitor(mock_client)
+    monitor.refresh()
+    
+    for _ in range(10):
+        assert monitor.allow_request() is True
+        assert monitor.model_available() is True
+    
+    assert mock_client.is_ollama_running.call_count == 1
+    assert mock_client.list_models.call_count == 1
+
+def test_model_list_ttl(mock_client):
+    """Test the model list is only refreshed after its TTL"""
+    monitor = make_monitor(mock_client, models_ttl=100)
+    
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1000.0):
+        monitor.refresh()
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1050.0):
+        monitor.refresh()
+    assert mock_client.list_models.call_count == 1
+    
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1101.0):
+        monitor.refresh()
+    assert mock_client.list_models.call_count == 2
+    mock_client.check_model_availability.assert_called_with(
+        "deepseek-coder-v2", available_models=mock_client.list_models.return_value
+    )
+
+def test_ollama_down(mock_client):
+    """Test a failed probe marks Ollama as not running"""
+    mock_client.is_ollama_running.return_value = False
+    monitor = make_monitor(mock_client)
+    monitor.refresh()
+    
+    assert monitor.allow_request() is False
+    assert monitor.is_running() is False
+    mock_client.list_models.assert_not_called()
+
+def test_circuit_opens_after_consecutive_failures(mock_client):
+    """Test the circuit opens after the failure threshold and fails fast"""
+    monitor = make_monitor(mock_client, failure_threshold=2)
+    monitor.refresh()
+    
+    monitor.record_failure()
+    assert monitor.status()["circuit_state"] == CLOSED
+    monitor.record_failure()
+    
+    status = monitor.status()
+    assert status["circuit_state"] == OPEN
+    assert status["circuit_opened"] == 1
+    assert monitor.allow_request() is False
+    assert monitor.status()["rejected"] == 1
+
+def test_circuit_half_open_and_close(mock_client):
+    """Test the circuit half-opens after the reset timeout and closes on success"""
+    monitor = make_monitor(mock_client, failure_threshold=1, reset_timeout=30)
+    
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1000.0):
+        monitor.refresh()
+        monitor.record_failure()
+        # Un sondeo correcto antes del reset no cierra el circuito
+        monitor.refresh()
+        assert monitor.allow_request() is False
+    
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1031.0):
+        assert monitor.allow_request() is True
+        assert monitor.status()["circuit_state"] == HALF_OPEN
+        monitor.record_success()
+        assert monitor.status()["circuit_state"] == CLOSED
+
+def test_half_open_failure_reopens(mock_client):
+    """Test a failure while half-open reopens the circuit immediately"""
+    monitor = make_monitor(mock_client, failure_threshold=3, reset_timeout=30)
+    
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1000.0):
+        monitor.refresh()
+        for _ in range(3):
+            monitor.record_failure()
+    
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1031.0):
+        assert monitor.allow_request() is True
+        monitor.record_failure()
+        assert monitor.status()["circuit_state"] == OPEN
+        assert monitor.allow_request() is False
+
+def test_half_open_admits_a_single_trial(mock_client):
+    """Test only one request probes a half-open circuit until its outcome is recorded"""
+    monitor = make_monitor(mock_client, failure_threshold=1, reset_timeout=30)
+    
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1000.0):
+        monitor.refresh()
+        monitor.record_failure()
+    
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1031.0):
+        assert monitor.accepting_requests() is True
+        assert monitor.allow_request() is True
+        assert monitor.status()["trial_in_flight"] is True
+        # The rest of the backlog is rejected while the trial runs
+        assert monitor.allow_request() is False
+        assert monitor.allow_request() is False
+        assert monitor.accepting_requests() is False
+        monitor.record_success()
+        assert monitor.allow_request() is True
+        assert monitor.allow_request() is True
+    
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1100.0):
+        monitor.record_failure()
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1131.0):
+        assert monitor.allow_request() is True
+    # A trial whose outcome never arrives expires after the reset timeout
+    with patch('app.sql_generation.ollama_health.time.monotonic', return_value=1162.0):
+        assert monitor.allow_request() is True
+        assert monitor.allow_request() is False
+
+def test_recovery_refreshes_models(mock_client):
+    """Test the model list is refreshed when Ollama comes back"""
+    monitor = make_monitor(mock_client)
+    monitor.refresh()
+    
+    mock_client.is_ollama_running.return_value = False
+    monitor.refresh()
+    mock_client.is_ollama_running.return_value = True
+    monitor.refresh()
+    
+    assert mock_client.list_models.call_count == 2
+    assert monitor.status()["model_list_refreshes"] == 2
@@ -0,0 +1,227 @@
+import json
+import asyncio
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.auth.routes import get_current_user
+from app.sql_generation import routes as sql_routes
+from app.sql_generation.query_executor import (
+    QueryExecutor, InvalidCursorError, ExecutorBusyError, encode_cursor, decode_cursor
+)
+from app.sql_generation.sql_validator import SQLValidator
+
+@pytest.fixture
+def omop_db(tmp_path):
+    db_path = tmp_path / "omop.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE person (person_id INTEGER PRIMARY KEY, year_of_birth INTEGER, photo BLOB)")
+    conn.executemany(
+        "INSERT INTO person VALUES (?, ?, ?)",
+        [(i, 1950 + i % 50, b"\x01\x02" if i == 1 else None) for i in range(1, 26)]
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+@pytest.fixture
+def executor(omop_db):
+    return QueryExecutor(omop_db, page_size=10, max_rows=20, batch_size=4, time_budget=5, max_streams=2)
+
+def read_page(page):
+    rows = []
+    try:
+        while not page.done:
+            rows.extend(page.fetch())
+    finally:
+        page.close()
+    return rows
+
+def test_pages_follow_cursor(executor):
+    sql = "SELECT person_id FROM person ORDER BY person_id;"
+    page = executor.open(sql)
+    assert page.columns == ["person_id"]
+    first = read_page(page)
+    assert [r[0] for r in first] == list(range(1, 11))
+    assert page.has_more
+
+    page = executor.open(sql, cursor=page.next_cursor)
+    second = read_page(page)
+    assert [r[0] for r in second] == list(range(11, 21))
+
+    page = executor.open(sql, cursor=page.next_cursor, max_rows=100)
+    third = read_page(page)
+    assert [r[0] for r in third] == list(range(21, 26))
+    assert not page.has_more and page.next_cursor is None
+
+def test_unordered_results_have_no_cursor(executor):
+    sql = "SELECT person_id FROM person"
+    page = executor.open(sql)
+    assert len(read_page(page)) == 10
+    assert page.has_more
+    assert page.next_cursor is None
+    assert "ORDER BY" in page.warning
+    with pytest.raises(InvalidCursorError):
+        executor.open(sql, cursor=encode_cursor(sql, 10))
+
+def test_page_size_is_capped(executor):
+    page = executor.open("SELECT * FROM person", max_rows=1000)
+    assert page.limit == 20
+    assert len(read_page(page)) == 20
+
+def test_exact_page_boundary(executor):
+    page = executor.open("SELECT person_id FROM person WHERE person_id <= 8", max_rows=8)
+    assert len(read_page(page)) == 8
+    assert not page.has_more
+
+def test_blob_values_are_json_safe(executor):
+    rows = read_page(executor.open("SELECT photo FROM person WHERE person_id = 1"))
+    assert rows == [["0102"]]
+
+def test_cursor_is_bound_to_query():
+    cursor = encode_cursor("SELECT * FROM person", 40)
+    assert decode_cursor(cursor, "select *\nfrom person;") == 40
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, "SELECT * FROM concept")
+    with pytest.raises(InvalidCursorError):
+        decode_cursor("not-a-cursor", "SELECT * FROM person")
+
+def test_concurrent_executions_are_limited(executor):
+    pages = [executor.open("SELECT * FROM person") for _ in range(2)]
+    with pytest.raises(ExecutorBusyError):
+        executor.open("SELECT * FROM person")
+    for page in pages:
+        page.close()
+    executor.open("SELECT * FROM person").close()
+    assert executor.get_stats()['rejected_busy'] == 1
+    assert executor.get_stats()['active'] == 0
+
+def test_cancel_interrupts_running_query(executor):
+    runaway = "WITH RECURSIVE r(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM r) SELECT COUNT(*) FROM r"
+    # Opening only fetches the columns; execution starts on the first fetch
+    page = executor.open(runaway)
+    assert page.columns == ["COUNT(*)"]
+    timer = threading.Timer(0.2, page.cancel)
+    timer.start()
+    with pytest.raises(sqlite3.OperationalError) as exc_info:
+        page.fetch()
+    assert page.error_info(exc_info.value)['error_type'] == 'Cancelled'
+    page.close()
+    assert executor.get_stats()['cancelled'] == 1
+
+def test_time_budget_stops_page(omop_db):
+    executor = QueryExecutor(omop_db, time_budget=0.2)
+    page = executor.open("WITH RECURSIVE r(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM r) SELECT COUNT(*) FROM r")
+    with pytest.raises(sqlite3.OperationalError) as exc_info:
+        page.fetch()
+    assert page.error_info(exc_info.value)['error_type'] == 'BudgetExceeded'
+    page.close()
+
+def test_time_budget_pauses_between_batches(omop_db):
+    """A slow consumer between batches does not use up the execution budget"""
+    executor = QueryExecutor(omop_db, page_size=30000, max_rows=30000, batch_size=10000, time_budget=0.5)
+    page = executor.open("WITH RECURSIVE r(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM r WHERE x < 30000) "
+                         "SELECT x FROM r")
+    try:
+        rows = page.fetch_rows()
+        for _ in range(2):
+            time.sleep(0.35)
+            rows += page.fetch_rows()
+    finally:
+        page.close()
+    assert len(rows) == 30000
+    assert page.budget['exceeded'] is None
+
+def build_app(omop_db):
+    service = SimpleNamespace(
+        sql_validator=SQLValidator(str(omop_db), schema_path=None),
+        query_executor=QueryExecutor(omop_db, page_size=10, max_rows=20, batch_size=4)
+    )
+    app = FastAPI()
+    app.include_router(sql_routes.router)
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id=1)
+    app.dependency_overrides[sql_routes.get_sql_service] = lambda: service
+    return app
+
+def post(app, body):
+    async def call():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/sql-generation/execute", json=body)
+    return asyncio.run(call())
+
+def test_execute_endpoint_streams_ndjson(omop_db):
+    app = build_app(omop_db)
+    response = post(app, {"sql_query": "SELECT person_id, year_of_birth FROM person ORDER BY person_id"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(l) for l in response.text.splitlines()]
+    assert lines[0] == {"type": "meta", "columns": ["person_id", "year_of_birth"], "offset": 0, "max_rows": 10}
+    assert lines[1] == [1, 1951]
+    assert len(lines) == 12
+    end = lines[-1]
+    assert end["type"] == "end" and end["row_count"] == 10 and end["truncated"]
+
+    response = post(app, {"sql_query": "SELECT person_id, year_of_birth FROM person ORDER BY person_id",
+                          "cursor": end["next_cursor"], "max_rows": 20})
+    lines = [json.loads(l) for l in response.text.splitlines()]
+    assert lines[1] == [11, 1961]
+    assert lines[-1]["row_count"] == 15 and lines[-1]["next_cursor"] is None
+
+def test_execute_endpoint_rejects_invalid_sql(omop_db):
+    app = build_app(omop_db)
+    assert post(app, {"sql_query": "DELETE FROM person"}).status_code == 400
+    response = post(app, {"sql_query": "SELECT missing FROM person"})
+    assert response.status_code == 400
+    assert "missing" in response.json()["detail"]
+    response = post(app, {"sql_query": "SELECT * FROM person", "cursor": "bogus"})
+    assert response.status_code == 400
+
+def test_disconnect_waits_for_running_fetch(omop_db):
+    """The connection is closed only after the fetch running in a worker thread returns"""
+    app = build_app(omop_db)
+    executor = app.dependency_overrides[sql_routes.get_sql_service]().query_executor
+    executor.time_budget = 30
+    events = []
+    open_page = executor.open
+
+    def tracked_open(*args, **kwargs):
+        page = open_page(*args, **kwargs)
+        fetch, close = page.fetch, page.close
+
+        def tracked_fetch():
+            events.append("fetch")
+            try:
+                return fetch()
+            finally:
+                events.append("fetch done")
+
+        def tracked_close():
+            events.append("close")
+            close()
+
+        page.fetch, page.close = tracked_fetch, tracked_close
+        return page
+
+    executor.open = tracked_open
+    runaway = "WITH RECURSIVE r(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM r) SELECT COUNT(*) FROM r"
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            request = asyncio.create_task(client.post("/sql-generation/execute", json={"sql_query": runaway}))
+            while "fetch" not in events:
+                await asyncio.sleep(0.01)
+            request.cancel()
+            await asyncio.gather(request, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert events == ["fetch", "fetch done", "close"]
+    assert executor.get_stats()['active'] == 0
+    assert executor.get_stats()['cancelled'] == 1
@@ -1,9 +1,13 @@
 import pytest
 import tempfile
+import numpy as np
 import pandas as pd
+import sqlglot
 from pathlib import Path
 from unittest.mock import patch, MagicMock
-from app.sql_generation.rag_retriever import RAGRetriever, MedicalSQLRetriever
+from app.sql_generation.rag_retriever import RAGRetriever, MedicalSQLRetriever, estimate_tokens
+from app.sql_generation.rag_metadata import RAGMetadataStore, MetadataFormatError
+from app.core.artifacts import ArtifactError
 
 @pytest.fixture
 def sample_dataset():
@@ -37,65 +41,110 @@ def test_dataset_file(sample_dataset):
         Path(tmp_file.name).unlink()
 
 @pytest.fixture
-def mock_sentence_transformer():
-    """Mock sentence transformer model"""
-    mock_model = MagicMock()
-    mock_model.encode.return_value = [[0.1, 0.2, 0.3], [0.4, 0.5, 0.6]]
-    return mock_model
+def mock_embedder():
+    """Mock shared embedding service"""
+    mock_service = MagicMock()
+    mock_service.encode_batch.side_effect = lambda texts, **kwargs: np.random.rand(len(texts), 3).astype("float32")
+    mock_service.encode_query.return_value = np.array([[0.1, 0.2, 0.3]], dtype="float32")
+    return mock_service
 
 def test_medical_sql_retriever_init():
     """Test MedicalSQLRetriever initialization"""
-    with patch('app.sql_generation.rag_retriever.SentenceTransformer') as mock_st:
+    with patch('app.sql_generation.rag_retriever.get_embedding_service') as mock_get:
         retriever = MedicalSQLRetriever()
-        assert retriever.model is not None
+        assert retriever.embedder is mock_get.return_value
         assert retriever.index is None
         assert retriever.metadata is None
 
-def test_medical_sql_retriever_build(test_dataset_file, mock_sentence_transformer):
+def test_medical_sql_retriever_build(test_dataset_file, mock_embedder, tmp_path):
     """Test building RAG index from dataset"""
-    with patch('app.sql_generation.rag_retriever.SentenceTransformer', return_value=mock_sentence_transformer):
-        with patch('faiss.IndexFlatIP') as mock_index:
-            with patch('faiss.normalize_L2'):
-                with patch('faiss.write_index'):
-                    mock_faiss_index = MagicMock()
-                    mock_index.return_value = mock_faiss_index
-                    
-                    retriever = MedicalSQLRetriever()
-                    retriever.build(test_dataset_file)
-                    
-                    assert retriever.index is not None
-                    assert retriever.metadata is not None
-                    assert len(retriever.metadata) == 6  # 3 questions × 2 languages
-
-def test_medical_sql_retriever_load():
+    with patch('app.sql_generation.rag_retriever.get_embedding_service', return_value=mock_embedder):
+        with patch('faiss.write_index'):
+            retriever = MedicalSQLRetriever()
+            retriever.artifact_dir = tmp_path
+            retriever.index_file = tmp_path / "faiss.index"
+            retriever.build(test_dataset_file)
+            
+            assert retriever.index is not None
+            assert retriever.metadata is not None
+            assert len(retriever.metadata) == 6  # 3 questions × 2 languages
+            assert retriever.metadata.n_rows == 3  # SQL stored once per row
+            assert retriever.metadata[1]["row_id"] == 1
+            assert retriever.metadata[1]["canonical_question"] == "How many patients have diabetes?"
+
+def test_medical_sql_retriever_load(tmp_path):
     """Test loading pre-built RAG index"""
-    with patch('app.sql_generation.rag_retriever.SentenceTransformer'):
+    RAGMetadataStore.write(
+        tmp_path,
+        rows=[{"row_id": 1, "canonical_question": "test", "sql": "SELECT 1;"}],
+        variant_rows=[0, 0]
+    )
+    (tmp_path / "faiss.index").touch()
+    
+    with patch('app.sql_generation.rag_retriever.get_embedding_service'):
         with patch('faiss.read_index') as mock_read:
-            with patch('pickle.load') as mock_pickle:
-                with patch('pathlib.Path.exists', return_value=True):
-                    mock_index = MagicMock()
-                    mock_index.ntotal = 100
-                    mock_read.return_value = mock_index
-                    mock_pickle.return_value = [{"test": "metadata"}]
-                    
-                    retriever = MedicalSQLRetriever()
-                    retriever.load()
-                    
-                    assert retriever.index is not None
-                    assert retriever.metadata is not None
+            mock_index = MagicMock()
+            mock_index.ntotal = 2
+            mock_read.return_value = mock_index
+            
+            retriever = MedicalSQLRetriever()
+            retriever.artifact_dir = tmp_path
+            retriever.index_file = tmp_path / "faiss.index"
+            retriever.load()
+            
+            assert retriever.index is not None
+            assert len(retriever.metadata) == 2
+            assert retriever.metadata[1]["sql"] == "SELECT 1;"
+
+def test_medical_sql_retriever_load_migrates_legacy_pickle(tmp_path):
+    """Test that a legacy metadata.pkl is converted on first load"""
+    import pickle
+    legacy = [
+        {"row_id": 7, "canonical_question": "q7", "sql": "SELECT 7;"},
+        {"row_id": 7, "canonical_question": "q7", "sql": "SELECT 7;"},
+        {"row_id": 8, "canonical_question": "q8", "sql": "SELECT 8;"},
+    ]
+    with (tmp_path / "metadata.pkl").open("wb") as fp:
+        pickle.dump(legacy, fp)
+    (tmp_path / "faiss.index").touch()
+    
+    with patch('app.sql_generation.rag_retriever.get_embedding_service'):
+        with patch('faiss.read_index') as mock_read:
+            mock_read.return_value = MagicMock(ntotal=3)
+            
+            retriever = MedicalSQLRetriever()
+            retriever.artifact_dir = tmp_path
+            retriever.index_file = tmp_path / "faiss.index"
+            retriever.legacy_meta_file = tmp_path / "metadata.pkl"
+            retriever.load()
+    
+    assert RAGMetadataStore.exists(tmp_path)
+    assert retriever.metadata.n_rows == 2
+    assert [retriever.metadata[i] for i in range(3)] == legacy
+
+def test_metadata_store_rejects_unknown_schema_version(tmp_path):
+    """Test that metadata written with another schema version is refused"""
+    import json
+    RAGMetadataStore.write(tmp_path, rows=[], variant_rows=[])
+    header = json.loads((tmp_path / "metadata.json").read_text())
+    header["schema_version"] = 999
+    (tmp_path / "metadata.json").write_text(json.dumps(header))
+    
+    with pytest.raises(MetadataFormatError):
+        RAGMetadataStore.open(tmp_path)
 
 def test_medical_sql_retriever_load_file_not_found():
     """Test loading when index file doesn't exist"""
-    with patch('app.sql_generation.rag_retriever.SentenceTransformer'):
+    with patch('app.sql_generation.rag_retriever.get_embedding_service'):
         with patch('pathlib.Path.exists', return_value=False):
             retriever = MedicalSQLRetriever()
             
             with pytest.raises(FileNotFoundError):
                 retriever.load()
 
-def test_medical_sql_retriever_query(mock_sentence_transformer):
+def test_medical_sql_retriever_query(mock_embedder):
     """Test querying the RAG index"""
-    with patch('app.sql_generation.rag_retriever.SentenceTransformer', return_value=mock_sentence_transformer):
+    with patch('app.sql_generation.rag_retriever.get_embedding_service', return_value=mock_embedder):
         retriever = MedicalSQLRetriever()
         
         # Mock the index and metadata
@@ -171,13 +220,23 @@ def test_rag_retriever_get_similar_examples_error():
         with pytest.raises(Exception):
             rag_retriever.get_similar_examples("test query")
 
-def test_rag_retriever_no_dataset_file():
-    """Test behavior when dataset file doesn't exist"""
-    nonexistent_file = "nonexistent_dataset.xlsx"
-    rag_retriever = RAGRetriever(nonexistent_file)
-    
-    with pytest.raises(FileNotFoundError):
-        rag_retriever.get_similar_examples("test query")
+def test_rag_retriever_no_dataset_file(tmp_path):
+    """Test behavior when the index is missing and the dataset doesn't exist"""
+    with patch('app.sql_generation.rag_retriever.get_embedding_service'):
+        rag_retriever = RAGRetriever("nonexistent_dataset.xlsx", index_dir=str(tmp_path), allow_build=True)
+        
+        with pytest.raises(FileNotFoundError):
+            rag_retriever.get_similar_examples("test query")
+
+def test_rag_retriever_missing_index_fails_fast(test_dataset_file, tmp_path):
+    """Test that a missing index is not rebuilt in the request path by default"""
+    with patch('app.sql_generation.rag_retriever.get_embedding_service'):
+        with patch.object(MedicalSQLRetriever, 'build') as mock_build:
+            rag_retriever = RAGRetriever(str(test_dataset_file), index_dir=str(tmp_path), allow_build=False)
+            
+            with pytest.raises(ArtifactError):
+                rag_retriever.get_similar_examples("test query")
+            mock_build.assert_not_called()
 
 def test_rag_retriever_format_similar_example():
     """Test formatting similar example for prompt"""
@@ -202,4 +261,130 @@ def test_rag_retriever_format_empty_example():
     assert formatted == "No similar examples found."
     
     formatted = rag_retriever.format_similar_example(None)
-    assert formatted == "No similar examples found."
\ No newline at end of file
+    assert formatted == "No similar examples found."
+
+def test_medical_sql_retriever_query_diverse_dedupes_rows(mock_embedder):
+    """Test that variants of the same row are collapsed and MMR favours diversity"""
+    with patch('app.sql_generation.rag_retriever.get_embedding_service', return_value=mock_embedder):
+        retriever = MedicalSQLRetriever()
+    
+    vectors = {
+        0: np.array([1.0, 0.0, 0.0], dtype="float32"),
+        1: np.array([1.0, 0.0, 0.0], dtype="float32"),    # otra variante de la fila 1
+        2: np.array([0.99, 0.14, 0.0], dtype="float32"),  # fila 2, casi idéntica a la 1
+        3: np.array([0.6, 0.0, 0.8], dtype="float32"),    # fila 3, distinta
+    }
+    mock_index = MagicMock()
+    mock_index.search.return_value = (np.array([[0.95, 0.94, 0.93, 0.80]]), np.array([[0, 1, 2, 3]]))
+    mock_index.reconstruct.side_effect = lambda idx: vectors[idx]
+    retriever.index = mock_index
+    retriever.metadata = [
+        {"row_id": 1, "canonical_question": "q1", "sql": "SELECT 1;"},
+        {"row_id": 1, "canonical_question": "q1", "sql": "SELECT 1;"},
+        {"row_id": 2, "canonical_question": "q2", "sql": "SELECT 2;"},
+        {"row_id": 3, "canonical_question": "q3", "sql": "SELECT 3;"},
+    ]
+    
+    relevance_only = retriever.query_diverse("q", k=2, fetch_k=4, mmr_lambda=1.0)
+    assert [m["row_id"] for _, m in relevance_only] == [1, 2]
+    
+    diverse = retriever.query_diverse("q", k=2, fetch_k=4, mmr_lambda=0.5)
+    assert [m["row_id"] for _, m in diverse] == [1, 3]
+
+def test_rag_retriever_get_similar_examples_dedupes_rows():
+    """Test that the plain top-k path returns one example per row"""
+    rag_retriever = RAGRetriever("test.xlsx")
+    rag_retriever._index_built = True
+    rag_retriever.retriever = MagicMock()
+    rag_retriever.retriever.query.return_value = [
+        (0.9, {"canonical_question": "q1", "sql": "SELECT 1;", "row_id": 1}),
+        (0.8, {"canonical_question": "q1", "sql": "SELECT 1;", "row_id": 1}),
+        (0.7, {"canonical_question": "q2", "sql": "SELECT 2;", "row_id": 2}),
+    ]
+    
+    results = rag_retriever.get_similar_examples("q", k=3)
+    
+    assert [r["row_id"] for r in results] == [1, 2]
+
+def test_rag_retriever_fit_to_token_budget():
+    """Test that examples are kept in rank order while they fit the token budget"""
+    rag_retriever = RAGRetriever("test.xlsx")
+    examples = [
+        {"question": "short", "sql": "SELECT 1;", "score": 0.9},
+        {"question": "long " * 100, "sql": "SELECT 2;", "score": 0.8},
+        {"question": "short too", "sql": "SELECT 3;", "score": 0.7},
+    ]
+    
+    selected = rag_retriever.fit_to_token_budget(examples, token_budget=30)
+    
+    assert [e["sql"] for e in selected] == ["SELECT 1;", "SELECT 3;"]
+
+def test_rag_retriever_fit_to_token_budget_keeps_best_example():
+    """Test that the best example keeps its full SQL, with a shortened question, when nothing fits"""
+    rag_retriever = RAGRetriever("test.xlsx")
+    examples = [
+        {"question": "long " * 100, "sql": "SELECT person_id FROM person;", "score": 0.9},
+        {"question": "longer " * 100, "sql": "SELECT 2;", "score": 0.8},
+    ]
+    
+    selected = rag_retriever.fit_to_token_budget(examples, token_budget=20)
+    
+    assert len(selected) == 1
+    assert selected[0]["score"] == 0.9
+    assert selected[0]["sql"] == "SELECT person_id FROM person;"
+    assert selected[0]["question"].startswith("long long")
+    assert estimate_tokens(rag_retriever.format_similar_example(selected[0])) <= 20
+    assert examples[0]["question"] == "long " * 100
+    
+    # With a tiny budget only the question is dropped; the SQL exceeds the budget whole
+    selected = rag_retriever.fit_to_token_budget(examples, token_budget=6)
+    assert len(selected) == 1
+    assert selected[0]["question"] == ""
+    assert selected[0]["sql"] == "SELECT person_id FROM person;"
+
+@pytest.mark.parametrize("token_budget", [0, 6, 20, 60, 1500])
+def test_rag_retriever_fit_to_token_budget_returns_parseable_sql(token_budget):
+    """Test that every example kept under any budget still parses as SQL"""
+    rag_retriever = RAGRetriever("test.xlsx")
+    examples = [
+        {"question": "How many women? " * 20,
+         "sql": "SELECT COUNT(DISTINCT person_id) FROM person WHERE gender_concept_id = 8532;", "score": 0.9},
+        {"question": "Conditions per year",
+         "sql": "SELECT strftime('%Y', condition_start_date) AS y, COUNT(*) FROM condition_occurrence GROUP BY y;",
+         "score": 0.8},
+        {"question": "Patients", "sql": "SELECT person_id FROM person;", "score": 0.7},
+    ]
+    
+    selected = rag_retriever.fit_to_token_budget(examples, token_budget=token_budget)
+    
+    assert selected
+    for example in selected:
+        assert example["sql"] in {e["sql"] for e in examples}
+        sqlglot.parse_one(example["sql"], read="sqlite")
+
+def test_medical_sql_retriever_rebuild_reuses_cached_embeddings(test_dataset_file, mock_embedder, tmp_path):
+    """Test that a second build only encodes new or changed variants"""
+    with patch('app.sql_generation.rag_retriever.get_embedding_service', return_value=mock_embedder):
+        retriever = MedicalSQLRetriever()
+        retriever.artifact_dir = tmp_path
+        retriever.index_file = tmp_path / "faiss.index"
+        
+        first = retriever.build(test_dataset_file)
+        assert first["encoded"] == 6
+        assert first["dataset_from_cache"] is False
+        
+        second = retriever.build(test_dataset_file)
+        assert second["encoded"] == 0
+        assert second["reused"] == 6
+        assert second["dataset_from_cache"] is True
+        assert "variants_per_second" in second
+        
+        # Una pregunta modificada solo recodifica esa variante
+        df = pd.read_excel(test_dataset_file)
+        df.loc[0, "QUESTION_EN"] = "How many adult patients have diabetes?"
+        df.to_excel(test_dataset_file, index=False)
+        
+        third = retriever.build(test_dataset_file)
+        assert third["encoded"] == 1
+        assert third["dataset_from_cache"] is False
+        assert retriever.metadata.header["dataset_sha256"] != ""
@@ -0,0 +1,132 @@
+import asyncio
+import pytest
+from app.sql_generation.request_queue import GenerationQueue, QueueFullError
+
+def test_admits_up_to_concurrency():
+    """Test tickets are granted immediately while slots are free"""
+    async def scenario():
+        queue = GenerationQueue(max_concurrency=2, max_depth=4)
+        first, second = queue.enqueue(), queue.enqueue()
+        third = queue.enqueue()
+        return queue, first, second, third
+    
+    queue, first, second, third = asyncio.run(scenario())
+    
+    assert queue.position(first) == 0
+    assert queue.position(second) == 0
+    assert queue.position(third) == 1
+    assert queue.get_stats()["active"] == 2
+    assert queue.get_stats()["waiting"] == 1
+
+def test_fifo_order():
+    """Test waiting requests are served in arrival order"""
+    async def scenario():
+        queue = GenerationQueue(max_concurrency=1, max_depth=10)
+        order = []
+        
+        async def job(name, hold):
+            async with queue.slot():
+                order.append(name)
+                await asyncio.sleep(hold)
+        
+        tasks = [asyncio.create_task(job("a", 0.02))]
+        await asyncio.sleep(0)
+        for name in "bcd":
+            tasks.append(asyncio.create_task(job(name, 0)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order, queue.get_stats()
+    
+    order, stats = asyncio.run(scenario())
+    
+    assert order == ["a", "b", "c", "d"]
+    assert stats["active"] == 0
+    assert stats["completed"] == 4
+    assert stats["granted_after_wait"] == 3
+
+def test_load_shedding():
+    """Test requests beyond the maximum queue depth are rejected"""
+    async def scenario():
+        queue = GenerationQueue(max_concurrency=1, max_depth=2)
+        queue.enqueue()
+        queue.enqueue()
+        queue.enqueue()
+        with pytest.raises(QueueFullError) as exc_info:
+            queue.enqueue()
+        return queue, exc_info.value
+    
+    queue, error = asyncio.run(scenario())
+    
+    assert error.depth == 2
+    assert error.retry_after >= 1
+    assert queue.get_stats()["shed"] == 1
+
+def test_position_reporting():
+    """Test wait_turn reports the queue position as it advances"""
+    async def scenario():
+        queue = GenerationQueue(max_concurrency=1, max_depth=10)
+        holder = queue.enqueue()
+        second = queue.enqueue()
+        third = queue.enqueue()
+        
+        async def release_in_turn():
+            await asyncio.sleep(0.02)
+            queue.release(holder)
+            await asyncio.sleep(0.02)
+            queue.release(second)
+        
+        releaser = asyncio.create_task(release_in_turn())
+        positions = [p async for p in queue.wait_turn(third, poll_interval=0.005)]
+        await releaser
+        return positions, queue.position(third)
+    
+    positions, final = asyncio.run(scenario())
+    
+    assert positions == [2, 1]
+    assert final == 0
+
+def test_cancelled_waiter_leaves_queue():
+    """Test a cancelled waiter does not keep its place or take a slot"""
+    async def scenario():
+        queue = GenerationQueue(max_concurrency=1, max_depth=10)
+        holder = queue.enqueue()
+        
+        async def waiter():
+            async with queue.slot():
+                pass
+        
+        task = asyncio.create_task(waiter())
+        await asyncio.sleep(0)
+        assert queue.get_stats()["waiting"] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        
+        queue.release(holder)
+        queue.release(holder)  # idempotente
+        return queue.get_stats()
+    
+    stats = asyncio.run(scenario())
+    
+    assert stats["waiting"] == 0
+    assert stats["active"] == 0
+    assert stats["cancelled"] == 1
+
+def test_background_release_runs_on_the_loop():
+    """Test the BackgroundTask safety net grants the next waiter from the event loop"""
+    from starlette.background import BackgroundTask
+    
+    async def scenario():
+        queue = GenerationQueue(max_concurrency=1, max_depth=4)
+        first, second = queue.enqueue(), queue.enqueue()
+        task = BackgroundTask(queue.arelease, first)
+        assert task.is_async
+        await task()
+        await asyncio.wait_for(queue.wait(second), timeout=1)
+        return queue.position(second), queue.get_stats()
+    
+    position, stats = asyncio.run(scenario())
+    
+    assert position == 0
+    assert stats["active"] == 1
+    assert stats["granted_after_wait"] == 1
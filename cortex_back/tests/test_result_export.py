@@ -0,0 +1,186 @@
+import io
+import csv
+import sys
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+from app.auth.routes import get_current_user
+from app.sql_generation import routes as sql_routes
+from app.sql_generation.query_executor import QueryExecutor
+from app.sql_generation.result_export import ArrowBatches, export_chunks, check_format, ExportUnavailableError
+from app.sql_generation.sql_analyzer import SQLAnalyzer, load_sqlite_catalog
+from app.sql_generation.sql_validator import SQLValidator
+
+N_ROWS = 1000
+
+@pytest.fixture
+def omop_db(tmp_path):
+    db_path = tmp_path / "omop.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE person (person_id INTEGER PRIMARY KEY, year_of_birth INTEGER, "
+                 "weight REAL, source_value TEXT, mixed)")
+    conn.executemany(
+        "INSERT INTO person VALUES (?, ?, ?, ?, ?)",
+        [(i, 1950 + i % 50, 60.5 + i % 7, f"P{i}", None if i < 600 else (i if i % 2 else f"x{i}"))
+         for i in range(1, N_ROWS + 1)]
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+@pytest.fixture
+def executor(omop_db):
+    return QueryExecutor(omop_db, export_max_rows=N_ROWS, export_batch_size=100)
+
+def export(executor, sql, fmt):
+    page = executor.open(sql, export=True)
+    try:
+        chunks = list(export_chunks(page, fmt))
+    finally:
+        page.close()
+    return chunks
+
+def test_csv_export(executor):
+    chunks = export(executor, "SELECT person_id, source_value FROM person ORDER BY person_id", "csv")
+    assert len(chunks) > 1
+    rows = list(csv.reader(io.StringIO(b"".join(chunks).decode("utf-8"))))
+    assert rows[0] == ["person_id", "source_value"]
+    assert rows[1] == ["1", "P1"]
+    assert len(rows) == N_ROWS + 1
+
+def test_arrow_export_streams_record_batches(executor):
+    chunks = export(executor, "SELECT person_id, year_of_birth, weight, source_value FROM person", "arrow")
+    assert len(chunks) > 1
+    reader = pyarrow.ipc.open_stream(b"".join(chunks))
+    table = reader.read_all()
+    assert table.num_rows == N_ROWS
+    assert table.schema.field("person_id").type == pa.int64()
+    assert table.schema.field("weight").type == pa.float64()
+    assert table.schema.field("source_value").type == pa.string()
+    assert len(table.to_batches()) == N_ROWS // 100
+
+def test_parquet_export(executor):
+    chunks = export(executor, "SELECT person_id, weight FROM person", "parquet")
+    parquet_file = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+    assert parquet_file.metadata.num_rows == N_ROWS
+    assert parquet_file.metadata.num_row_groups == N_ROWS // 100
+    assert parquet_file.read().column("person_id").to_pylist()[:3] == [1, 2, 3]
+
+def test_schema_fixed_by_first_batch(executor):
+    """Columns that are NULL in the first batch become strings; later values are coerced"""
+    chunks = export(executor, "SELECT person_id, mixed FROM person ORDER BY person_id", "arrow")
+    table = pyarrow.ipc.open_stream(b"".join(chunks)).read_all()
+    assert table.schema.field("mixed").type == pa.string()
+    values = table.column("mixed").to_pylist()
+    assert values[0] is None
+    assert values[600] == "601" and values[601] == "x602"
+
+def test_integer_column_never_truncates_later_floats():
+    converter = ArrowBatches(pa, ["value_as_number"])
+    assert converter.batch([(1,), (2,)]).column(0).to_pylist() == [1, 2]
+    with pytest.raises(ValueError):
+        converter.batch([(2.7,), (3.99,)])
+    # Whole floats still fit the integer column
+    assert converter.batch([(3.0,)]).column(0).to_pylist() == [3]
+
+def test_declared_types_fix_the_schema(tmp_path):
+    """NUMERIC affinity stores 2.0 as an integer: the declared type keeps the column float"""
+    db_path = tmp_path / "measurement.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE measurement (measurement_id INTEGER PRIMARY KEY, value_as_number NUMERIC)")
+    conn.executemany("INSERT INTO measurement VALUES (?, ?)", [(1, 1.0), (2, 2.0), (3, 2.7), (4, 3.99)])
+    conn.commit()
+    conn.close()
+
+    executor = QueryExecutor(db_path, export_batch_size=2)
+    sql = "SELECT measurement_id, value_as_number FROM measurement ORDER BY measurement_id"
+    types = SQLAnalyzer(load_sqlite_catalog(str(db_path))).column_types(sql)
+    assert types == ["INT", "DECIMAL"]
+    page = executor.open(sql, export=True)
+    try:
+        table = pyarrow.ipc.open_stream(b"".join(export_chunks(page, "arrow", types))).read_all()
+    finally:
+        page.close()
+    assert table.schema.field("value_as_number").type == pa.float64()
+    assert table.column("value_as_number").to_pylist() == [1.0, 2.0, 2.7, 3.99]
+
+def test_empty_result_has_schema(executor):
+    chunks = export(executor, "SELECT person_id FROM person WHERE person_id < 0", "arrow")
+    table = pyarrow.ipc.open_stream(b"".join(chunks)).read_all()
+    assert table.num_rows == 0
+    assert table.column_names == ["person_id"]
+
+def test_export_row_cap(executor):
+    page = executor.open("SELECT person_id FROM person", max_rows=250, export=True)
+    try:
+        data = b"".join(export_chunks(page, "csv"))
+    finally:
+        page.close()
+    assert len(data.decode("utf-8").splitlines()) == 251
+    assert page.has_more
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        check_format("xlsx")
+
+def test_pyarrow_is_optional(monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(ExportUnavailableError):
+        check_format("parquet")
+    check_format("csv")
+
+def test_export_endpoint(omop_db):
+    service = SimpleNamespace(
+        sql_validator=SQLValidator(str(omop_db), schema_path=None),
+        query_executor=QueryExecutor(omop_db, export_batch_size=100)
+    )
+    app = FastAPI()
+    app.include_router(sql_routes.router)
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id=1)
+    app.dependency_overrides[sql_routes.get_sql_service] = lambda: service
+
+    async def call(body):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/sql-generation/export", json=body)
+
+    response = asyncio.run(call({"sql_query": "SELECT person_id FROM person", "format": "parquet"}))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.apache.parquet"
+    assert "query_result.parquet" in response.headers["content-disposition"]
+    assert pq.read_table(io.BytesIO(response.content)).num_rows == N_ROWS
+
+    assert asyncio.run(call({"sql_query": "SELECT person_id FROM person", "format": "xlsx"})).status_code == 400
+    assert asyncio.run(call({"sql_query": "SELECT nope FROM person", "format": "csv"})).status_code == 400
+
+def test_export_error_aborts_response(omop_db):
+    """A failure after the first chunk must not end the response cleanly with 200"""
+    service = SimpleNamespace(
+        sql_validator=SQLValidator(str(omop_db), schema_path=None),
+        query_executor=QueryExecutor(omop_db, export_batch_size=100)
+    )
+    app = FastAPI()
+    app.include_router(sql_routes.router)
+    app.dependency_overrides[get_current_user] = lambda: SimpleNamespace(id=1)
+    app.dependency_overrides[sql_routes.get_sql_service] = lambda: service
+
+    async def call(body):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/sql-generation/export", json=body)
+
+    # abs() overflows on row 501, after several batches were already sent
+    sql = ("SELECT person_id, CASE WHEN person_id > 500 THEN abs(-9223372036854775807 - 1) ELSE 0 END AS v "
+           "FROM person ORDER BY person_id")
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(call({"sql_query": sql, "format": "csv"}))
+    assert service.query_executor.get_stats()['active'] == 0
@@ -0,0 +1,100 @@
+import sys
+import sqlite3
+
+import pytest
+
+from app.sql_generation.sandbox import SandboxPool
+from app.sql_generation.sql_validator import SQLValidator
+
+RUNAWAY_SQL = (
+    "WITH RECURSIVE r(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM r) "
+    "SELECT COUNT(*) FROM r;"
+)
+
+@pytest.fixture
+def omop_db(tmp_path):
+    db_path = tmp_path / "omop.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE person (person_id INTEGER PRIMARY KEY, year_of_birth INTEGER)")
+    conn.executemany("INSERT INTO person VALUES (?, ?)", [(1, 1980), (2, 1975), (3, 1990)])
+    conn.commit()
+    conn.close()
+    return db_path
+
+@pytest.fixture
+def sandbox(omop_db):
+    pool = SandboxPool(omop_db, size=2, memory_mb=512, kill_grace=0.5, mmap_size=0)
+    yield pool
+    pool.close()
+
+def test_query_runs_in_worker(sandbox):
+    result = sandbox.run("SELECT * FROM person;", "execute", 2, 5, 0)
+    assert result['executable']
+    assert result['row_count'] == 2
+    assert result['truncated']
+    assert result['plan'] == ["SCAN person"]
+    assert sandbox.get_stats()['spawned'] == 1
+
+def test_errors_come_back_over_ipc(sandbox):
+    result = sandbox.run("SELECT missing FROM person;", "explain", 10, 5, 0)
+    assert not result['executable']
+    assert result['error_type'] == 'OperationalError'
+    assert "missing" in result['error']
+
+def test_worker_is_reused_after_budget_abort(sandbox):
+    result = sandbox.run(RUNAWAY_SQL, "execute", 10, 5, 200_000)
+    assert result['error_type'] == 'BudgetExceeded'
+
+    assert sandbox.run("SELECT COUNT(*) FROM person;", "execute", 10, 5, 0)['executable']
+    stats = sandbox.get_stats()
+    assert stats['spawned'] == 1
+    assert stats['tasks'] == 2
+
+def test_memory_limit_is_contained(omop_db):
+    pool = SandboxPool(omop_db, size=1, memory_mb=256, mmap_size=0)
+    try:
+        result = pool.run("SELECT length(randomblob(600000000)) FROM person LIMIT 1;", "execute", 1, 10, 0)
+        assert result['error_type'] == 'BudgetExceeded'
+        assert "memoria" in result['error']
+        # El mismo worker sigue atendiendo peticiones
+        assert pool.run("SELECT 1 FROM person;", "execute", 1, 10, 0)['executable']
+        assert pool.get_stats()['spawned'] == 1
+    finally:
+        pool.close()
+
+def test_unresponsive_worker_is_killed(sandbox, monkeypatch):
+    monkeypatch.setattr(sandbox, "_command", lambda: [sys.executable, "-c", "import time; time.sleep(60)"])
+    result = sandbox.run("SELECT 1 FROM person;", "execute", 1, 0.5, 0)
+    assert result['error_type'] == 'BudgetExceeded'
+    assert "terminado" in result['error']
+
+    stats = sandbox.get_stats()
+    assert stats['timeouts_killed'] == 1
+    assert stats['open'] == 0
+
+def test_worker_without_time_budget_is_still_killed(sandbox):
+    # Neither a time nor a step budget: the caller's timeout bounds the wait
+    result = sandbox.run(RUNAWAY_SQL, "execute", 10, 0, 0, timeout=0.5)
+    assert result['error_type'] == 'BudgetExceeded'
+    assert result['budget_limit'] == 'time'
+    assert sandbox.get_stats()['timeouts_killed'] == 1
+
+def test_crashed_worker_is_replaced(sandbox, monkeypatch):
+    monkeypatch.setattr(sandbox, "_command", lambda: [sys.executable, "-c", "import sys; sys.exit(3)"])
+    result = sandbox.run("SELECT 1 FROM person;", "execute", 1, 5, 0)
+    assert result['error_type'] == 'SandboxCrashed'
+    assert sandbox.get_stats()['crashes'] == 1
+
+    monkeypatch.undo()
+    assert sandbox.run("SELECT 1 FROM person;", "execute", 1, 5, 0)['executable']
+
+def test_validator_uses_sandbox(omop_db):
+    validator = SQLValidator(str(omop_db), schema_path=None, sandbox_workers=1)
+    try:
+        result = validator.test_sql_execution("SELECT * FROM person;", mode="execute", max_rows=10)
+        assert result['executable']
+        assert result['row_count'] == 3
+        assert validator.sandbox.get_stats()['tasks'] == 1
+        assert validator._pool is None
+    finally:
+        validator.close()
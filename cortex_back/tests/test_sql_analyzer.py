@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+
+from app.core.config import OMOP_SCHEMA_PATH
+from app.sql_generation.sql_analyzer import SQLAnalyzer, load_omop_catalog, load_sqlite_catalog
+
+@pytest.fixture
+def analyzer():
+    """Analyzer with the OMOP CDM catalog from the schema summary"""
+    return SQLAnalyzer.from_schema_file(OMOP_SCHEMA_PATH)
+
+def test_load_omop_catalog():
+    catalog = load_omop_catalog(OMOP_SCHEMA_PATH)
+    assert "person" in catalog
+    assert catalog["person"]["year_of_birth"] == "INTEGER"
+    assert "concept_name" in catalog["concept"]
+
+def test_catalog_includes_cdm_supplement(analyzer):
+    """Standard CDM tables/columns missing from the summary are still known"""
+    assert "observation_period" in analyzer.catalog
+    assert "condition_source_concept_id" in analyzer.catalog["condition_occurrence"]
+    sql = ("SELECT COUNT(*) FROM observation_period op "
+           "JOIN condition_occurrence co ON co.person_id = op.person_id "
+           "WHERE co.condition_source_concept_id = 1;")
+    assert analyzer.check(sql) is None
+
+@pytest.mark.parametrize("sql", [
+    "SELECT created_at FROM audit_log;",
+    "SELECT last_update, deleted_flag FROM audit_log;",
+    "SELECT 'DROP TABLE person' AS txt FROM person;",
+])
+def test_identifiers_and_literals_are_not_keywords(sql):
+    """Keywords are matched by token, not by substring"""
+    assert SQLAnalyzer().check(sql) is None
+
+def test_unknown_table(analyzer):
+    error = analyzer.check("SELECT COUNT(*) FROM patients;")
+    assert error.startswith("Tabla no encontrada en OMOP CDM")
+    assert "patients" in error
+
+def test_unknown_column(analyzer):
+    error = analyzer.check("SELECT p.birth_year FROM person p;")
+    assert error.startswith("Columna no encontrada en OMOP CDM")
+    assert "birth_year" in error
+
+def test_cte_and_subquery_aliases_resolve(analyzer):
+    sql = """
+        WITH women AS (
+            SELECT person_id, year_of_birth AS yob FROM person WHERE gender_concept_id = 8532
+        )
+        SELECT t.yob, COUNT(*) AS n
+        FROM (SELECT w.yob FROM women w JOIN condition_occurrence co ON co.person_id = w.person_id) t
+        GROUP BY t.yob
+        ORDER BY n DESC;
+    """
+    assert analyzer.check(sql) is None
+
+def test_parse_error_reports_position(analyzer):
+    error = analyzer.check("SELECT person_id FROM person WHERE (year_of_birth > 1980;")
+    assert "línea 1" in error
+    assert "columna" in error
+
+def test_multiple_statements_rejected(analyzer):
+    error = analyzer.check("SELECT person_id FROM person; SELECT concept_id FROM concept;")
+    assert error == "Solo se permite una sentencia SQL"
+
+def test_prohibited_operation_in_statement(analyzer):
+    error = analyzer.check("WITH x AS (SELECT 1 FROM person) DELETE FROM person;")
+    assert error == "Operación prohibida: DELETE"
+
+def test_catalog_merges_database_schema(tmp_path):
+    """Tables that only exist in the validation database are accepted"""
+    db_path = tmp_path / "omop.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE cohort (cohort_definition_id INTEGER, subject_id INTEGER)")
+    conn.close()
+
+    assert load_sqlite_catalog(str(db_path)) == {
+        "cohort": {"cohort_definition_id": "INTEGER", "subject_id": "INTEGER"}
+    }
+    analyzer = SQLAnalyzer.from_schema_file(OMOP_SCHEMA_PATH, db_path)
+    assert analyzer.check("SELECT subject_id FROM cohort;") is None
+    assert analyzer.check("SELECT person_id FROM person;") is None
+
+def test_without_catalog_only_syntax_is_checked():
+    assert SQLAnalyzer.from_schema_file(None).check("SELECT anything FROM anywhere;") is None
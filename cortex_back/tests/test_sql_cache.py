@@ -0,0 +1,83 @@
+import pytest
+import numpy as np
+from unittest.mock import patch, MagicMock
+from app.sql_generation.sql_cache import SemanticSQLCache, concept_key, cache_version
+
+VECTORS = {
+    "How many patients have diabetes?": [1.0, 0.0, 0.0],
+    "Number of patients with diabetes": [0.99, 0.14, 0.0],
+    "Average age of diabetic patients": [0.0, 1.0, 0.0],
+}
+
+@pytest.fixture(autouse=True)
+def fake_embedder():
+    """Deterministic embeddings instead of the BioBERT model"""
+    embedder = MagicMock()
+    embedder.encode_query.side_effect = lambda text: np.array([VECTORS[text]], dtype=np.float32)
+    with patch('app.sql_generation.sql_cache.get_embedding_service', return_value=embedder):
+        yield embedder
+
+def test_concept_key_is_order_insensitive():
+    """Test the concept set key ignores order and duplicates"""
+    assert concept_key(["316866", "201820"]) == concept_key(["201820", "316866", "201820"])
+    assert concept_key([]) == ""
+
+def test_cache_version_changes_with_model_and_schema():
+    """Test the cache version depends on model and schema"""
+    base = cache_version("model-a", "schema v1")
+    assert base == cache_version("model-a", "schema v1")
+    assert base != cache_version("model-b", "schema v1")
+    assert base != cache_version("model-a", "schema v2")
+
+def test_hit_for_paraphrase_with_same_concepts():
+    """Test a paraphrase with the same concept ids hits the cache"""
+    cache = SemanticSQLCache("v1", path=None, threshold=0.95)
+    cache.store("How many patients have diabetes?", ["201820"], "SELECT COUNT(*) FROM person;")
+    
+    hit = cache.lookup("Number of patients with diabetes", ["201820"])
+    
+    assert hit is not None
+    assert hit["sql"] == "SELECT COUNT(*) FROM person;"
+    assert hit["similarity"] >= 0.95
+    assert cache.get_stats()["hits"] == 1
+
+def test_miss_on_different_concepts():
+    """Test concept ids must match exactly"""
+    cache = SemanticSQLCache("v1", path=None, threshold=0.95)
+    cache.store("How many patients have diabetes?", ["201820"], "SELECT 1;")
+    
+    assert cache.lookup("How many patients have diabetes?", ["201820", "316866"]) is None
+
+def test_miss_below_threshold():
+    """Test dissimilar questions do not hit"""
+    cache = SemanticSQLCache("v1", path=None, threshold=0.95)
+    cache.store("How many patients have diabetes?", ["201820"], "SELECT 1;")
+    
+    assert cache.lookup("Average age of diabetic patients", ["201820"]) is None
+    assert cache.get_stats()["hit_rate"] == 0.0
+
+def test_persistence_and_version_invalidation(tmp_path):
+    """Test entries survive a reopen and are dropped on version change"""
+    path = tmp_path / "sql_cache.db"
+    cache = SemanticSQLCache("model-a|schema", path=path)
+    cache.store("How many patients have diabetes?", ["201820"], "SELECT 1;")
+    
+    reopened = SemanticSQLCache("model-a|schema", path=path)
+    assert reopened.get_stats()["entries"] == 1
+    assert reopened.lookup("Number of patients with diabetes", ["201820"]) is not None
+    
+    new_model = SemanticSQLCache("model-b|schema", path=path)
+    assert new_model.get_stats()["entries"] == 0
+    assert new_model.lookup("How many patients have diabetes?", ["201820"]) is None
+
+def test_bounded_size_evicts_oldest():
+    """Test the cache evicts the oldest entry when full"""
+    cache = SemanticSQLCache("v1", path=None, max_entries=2)
+    cache.store("How many patients have diabetes?", ["1"], "SELECT 1;")
+    cache.store("Average age of diabetic patients", ["2"], "SELECT 2;")
+    cache.store("Average age of diabetic patients", ["3"], "SELECT 3;")
+    
+    stats = cache.get_stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert cache.lookup("How many patients have diabetes?", ["1"]) is None
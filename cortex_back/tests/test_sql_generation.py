@@ -19,7 +19,7 @@ def test_sql_generation_success(client, auth_headers):
         "similar_example": None
     }
     
-    with patch('app.sql_generation.service.SQLGenerationService.generate_sql', return_value=type('MockResponse', (), mock_response)()):
+    with patch('app.sql_generation.service.SQLGenerationService.generate_sql_async', return_value=type('MockResponse', (), mock_response)()):
         response = client.post("/sql-generation/", json=request_data, headers=auth_headers)
         
         assert response.status_code == 200
@@ -47,8 +47,8 @@ def test_omop_db():
 
 @pytest.fixture
 def sql_validator(test_omop_db):
-    """Create SQL validator with test database"""
-    return SQLValidator(test_omop_db)
+    """Create SQL validator with test database (executing queries, not just EXPLAIN)"""
+    return SQLValidator(test_omop_db, mode="execute")
 
 def test_validate_sql_syntax_valid(sql_validator):
     """Test validation of valid SQL"""
@@ -198,4 +198,84 @@ def test_test_sql_execution_no_database(tmp_path):
 def test_clean_sql_text_semicolon(sql_validator, sql, expected_clean):
     """Test that cleaned SQL always ends with semicolon"""
     cleaned = sql_validator._clean_sql_text(sql)
-    assert cleaned == expected_clean
\ No newline at end of file
+    assert cleaned == expected_clean
+
+@pytest.mark.parametrize("text,complete", [
+    ("SELECT COUNT(*) FROM person", False),
+    ("SELECT COUNT(*) FROM person;", True),
+    ("SELECT * FROM concept WHERE concept_name = 'a;b'", False),
+    ("SELECT * FROM concept WHERE concept_name = 'a;b';", True),
+    ("```sql\nSELECT * FROM person", False),
+    ("```sql\nSELECT * FROM person\n```", True),
+    ("Here is the query; it counts patients", False),
+    ("WITH t AS (SELECT 1) SELECT * FROM t;", True),
+    ("SELECT p.person_id -- join person; then filter", False),
+    ("SELECT p.person_id -- join person; then filter\nFROM person p", False),
+    ("SELECT p.person_id -- join person; then filter\nFROM person p;", True),
+    ("SELECT /* a; b */ person_id FROM person", False),
+    ("SELECT /* a; b */ person_id FROM person;", True),
+    ("SELECT person_id FROM person /* unclosed;", False),
+    ("SELECT '--;' FROM person;", True),
+])
+def test_is_statement_complete(sql_validator, text, complete):
+    """Test detection of a complete SQL statement while streaming"""
+    assert sql_validator.is_statement_complete(text) is complete
+
+def test_test_sql_execution_explain_mode(sql_validator):
+    """Test explain mode checks the query without reading rows"""
+    result = sql_validator.test_sql_execution("SELECT person_id FROM person;", mode="explain")
+    
+    assert result["executable"] is True
+    assert result["validation_mode"] == "explain"
+    assert result["row_count"] is None
+    assert any("person" in step for step in result["plan"])
+
+@pytest.mark.parametrize("sql,error", [
+    ("SELECT COUNT(*) FROM nonexistent_table;", "no such table"),
+    ("SELECT missing_column FROM person;", "no such column"),
+    ("SELCT COUNT(*) FROM person;", "syntax error"),
+])
+def test_test_sql_execution_explain_errors(sql_validator, sql, error):
+    """Test explain mode catches missing tables, columns and syntax errors"""
+    result = sql_validator.test_sql_execution(sql, mode="explain")
+    
+    assert result["executable"] is False
+    assert error in result["error"]
+    assert result["error_type"] == "OperationalError"
+
+def test_test_sql_execution_row_cap(sql_validator):
+    """Test execution stops reading at max_rows"""
+    result = sql_validator.test_sql_execution("SELECT person_id FROM person;", mode="execute", max_rows=1)
+    
+    assert result["executable"] is True
+    assert result["row_count"] == 1
+    assert result["truncated"] is True
+
+def test_validator_rejects_unknown_mode(tmp_path):
+    """Test an unknown validation mode is rejected"""
+    with pytest.raises(ValueError):
+        SQLValidator(str(tmp_path / "omop.db"), mode="dry-run")
+
+RUNAWAY_SQL = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT COUNT(*) FROM n;"
+
+def test_test_sql_execution_time_budget(sql_validator):
+    """Test a runaway query is aborted by the wall-clock budget"""
+    sql_validator.time_budget = 0.2
+    sql_validator.step_budget = 0
+    
+    result = sql_validator.test_sql_execution(RUNAWAY_SQL, mode="execute")
+    
+    assert result["executable"] is False
+    assert result["error_type"] == "BudgetExceeded"
+    assert "s de ejecución" in result["error"]
+
+def test_test_sql_execution_step_budget(sql_validator):
+    """Test a runaway query is aborted by the VM step budget"""
+    sql_validator.time_budget = 0
+    sql_validator.step_budget = 100_000
+    
+    result = sql_validator.test_sql_execution(RUNAWAY_SQL, mode="execute")
+    
+    assert result["executable"] is False
+    assert result["error_type"] == "BudgetExceeded"
+    assert "pasos" in result["error"]
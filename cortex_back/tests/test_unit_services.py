@@ -8,7 +8,8 @@ def mock_dependencies():
     """Mock all external dependencies for SQLGenerationService"""
     with patch('app.sql_generation.service.OllamaClient') as mock_ollama, \
          patch('app.sql_generation.service.SQLValidator') as mock_validator, \
-         patch('app.sql_generation.service.RAGRetriever') as mock_rag:
+         patch('app.sql_generation.service.RAGRetriever') as mock_rag, \
+         patch('app.sql_generation.service.SemanticSQLCache') as mock_cache:
         
         # Configure mocks
         mock_ollama_instance = MagicMock()
@@ -22,10 +23,15 @@ def mock_dependencies():
         mock_rag_instance = MagicMock()
         mock_rag.return_value = mock_rag_instance
         
+        mock_cache_instance = MagicMock()
+        mock_cache_instance.lookup.return_value = None
+        mock_cache.return_value = mock_cache_instance
+        
         yield {
             'ollama': mock_ollama_instance,
             'validator': mock_validator_instance,
-            'rag': mock_rag_instance
+            'rag': mock_rag_instance,
+            'cache': mock_cache_instance
         }
 
 def test_sql_service_init(mock_dependencies):
@@ -228,3 +234,438 @@ def test_sql_service_format_medical_terms(mock_dependencies):
     # Test with empty list
     formatted_empty = service._format_medical_terms([])
     assert "No specific medical codes provided" in formatted_empty
+
+def test_sql_service_create_prompt_multiple_examples(mock_dependencies):
+    """Test initial prompt with several few-shot examples"""
+    service = SQLGenerationService()
+    
+    examples = [
+        {"question": "Find diabetic patients", "sql": "SELECT 1;"},
+        {"question": "Count hypertensive patients", "sql": "SELECT 2;"}
+    ]
+    
+    prompt = service._create_prompt(
+        question="How many patients have diabetes?",
+        medical_terms=[],
+        similar_example=examples[0],
+        similar_examples=examples,
+        iteration=1
+    )
+    
+    assert "Similar examples:" in prompt
+    assert "Find diabetic patients" in prompt
+    assert "Count hypertensive patients" in prompt
+
+def test_sql_service_generate_sql_stream(mock_dependencies):
+    """Test streaming SQL generation emits tokens, validation and result events"""
+    mock_dependencies['ollama'].generate_stream.return_value = iter(["SELECT COUNT(*) ", "FROM person;"])
+    mock_dependencies['validator'].clean_generated_sql.return_value = "SELECT COUNT(*) FROM person;"
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.return_value = {
+        'executable': True,
+        'error': None,
+        'error_type': None
+    }
+    mock_dependencies['rag'].get_similar_examples.return_value = []
+    
+    service = SQLGenerationService()
+    request = SQLGenerationRequest(question="How many patients are there?", medical_terms=[])
+    
+    events = list(service.generate_sql_stream(request))
+    
+    assert [e["event"] for e in events] == ["attempt", "token", "token", "validation", "result"]
+    mock_dependencies['validator'].clean_generated_sql.assert_called_once_with("SELECT COUNT(*) FROM person;")
+    kwargs = mock_dependencies['ollama'].generate_stream.call_args[1]
+    assert kwargs["stop_condition"] == mock_dependencies['validator'].is_statement_complete
+    
+    result = events[-1]["data"]
+    assert result["is_executable"] is True
+    assert result["attempts_count"] == 1
+
+def test_sql_service_generate_sql_stream_ollama_down(mock_dependencies):
+    """Test streaming SQL generation when Ollama is down"""
+    mock_dependencies['ollama'].is_ollama_running.return_value = False
+    
+    service = SQLGenerationService()
+    request = SQLGenerationRequest(question="test", medical_terms=[])
+    
+    events = list(service.generate_sql_stream(request))
+    
+    assert len(events) == 1
+    assert events[0]["event"] == "result"
+    assert "Ollama no está ejecutándose" in events[0]["data"]["error_message"]
+
+def test_sql_service_generate_sql_stream_async(mock_dependencies):
+    """Test the async stream reads tokens from the async Ollama client"""
+    import asyncio
+    
+    async def fake_stream(model_name, prompt, **kwargs):
+        for token in ["SELECT COUNT(*) ", "FROM person;"]:
+            yield token
+    
+    mock_dependencies['validator'].clean_generated_sql.return_value = "SELECT COUNT(*) FROM person;"
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.return_value = {
+        'executable': True, 'error': None, 'error_type': None
+    }
+    mock_dependencies['rag'].get_similar_examples.return_value = []
+    
+    async def collect(service, request):
+        return [event async for event in service.generate_sql_stream_async(request)]
+    
+    with patch('app.sql_generation.service.AsyncOllamaClient') as mock_async:
+        mock_async.return_value.generate_stream = fake_stream
+        service = SQLGenerationService()
+        events = asyncio.run(collect(service, SQLGenerationRequest(question="How many patients?", medical_terms=[])))
+    
+    assert [e["event"] for e in events] == ["attempt", "token", "token", "validation", "result"]
+    mock_dependencies['ollama'].generate_stream.assert_not_called()
+    assert events[-1]["data"]["is_executable"] is True
+
+def test_sql_service_generate_sql_async(mock_dependencies):
+    """Test async SQL generation uses the async Ollama client"""
+    import asyncio
+    from unittest.mock import AsyncMock
+    
+    mock_dependencies['validator'].clean_generated_sql.return_value = "SELECT COUNT(*) FROM person;"
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.return_value = {
+        'executable': True,
+        'error': None,
+        'error_type': None
+    }
+    mock_dependencies['rag'].get_similar_examples.return_value = []
+    
+    with patch('app.sql_generation.service.AsyncOllamaClient') as mock_async:
+        mock_async.return_value.generate = AsyncMock(return_value="SELECT COUNT(*) FROM person;")
+        service = SQLGenerationService()
+        request = SQLGenerationRequest(question="How many patients are there?", medical_terms=[])
+        
+        result = asyncio.run(service.generate_sql_async(request))
+    
+    assert result.is_executable is True
+    assert result.attempts_count == 1
+    mock_async.return_value.generate.assert_awaited_once()
+    mock_dependencies['ollama'].generate.assert_not_called()
+
+def test_sql_service_generate_sql_cache_hit(mock_dependencies):
+    """Test a cache hit skips generation and is marked as cached"""
+    mock_dependencies['cache'].lookup.return_value = {
+        'question': 'How many patients are there?',
+        'sql': 'SELECT COUNT(*) FROM person;',
+        'similarity': 0.98
+    }
+    
+    service = SQLGenerationService()
+    request = SQLGenerationRequest(
+        question="Number of patients?",
+        medical_terms=[MedicalTerm(term="patient", concept_id="116154003")]
+    )
+    
+    result = service.generate_sql(request)
+    
+    assert result.cached is True
+    assert result.is_executable is True
+    assert result.generated_sql == "SELECT COUNT(*) FROM person;"
+    mock_dependencies['cache'].lookup.assert_called_once_with("Number of patients?", ["116154003"])
+    mock_dependencies['ollama'].generate.assert_not_called()
+
+def test_sql_service_generate_sql_stores_executable(mock_dependencies):
+    """Test executable results are stored in the cache"""
+    mock_dependencies['ollama'].generate.return_value = "SELECT COUNT(*) FROM person;"
+    mock_dependencies['validator'].clean_generated_sql.return_value = "SELECT COUNT(*) FROM person;"
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.return_value = {
+        'executable': True,
+        'error': None,
+        'error_type': None
+    }
+    mock_dependencies['rag'].get_similar_examples.return_value = []
+    
+    service = SQLGenerationService()
+    request = SQLGenerationRequest(question="How many patients are there?", medical_terms=[])
+    
+    result = service.generate_sql(request)
+    
+    assert result.cached is False
+    mock_dependencies['cache'].store.assert_called_once_with(
+        "How many patients are there?", [], "SELECT COUNT(*) FROM person;"
+    )
+
+def test_sql_service_parallel_candidates_first_executable_wins(mock_dependencies):
+    """Test parallel sampling returns the first executable candidate and cancels the rest"""
+    import asyncio
+    
+    cancelled = []
+    
+    async def fake_generate(model_name, prompt, temperature, **kwargs):
+        delays = {0.05: 0.05, 0.3: 0.01, 0.6: 0.5}
+        try:
+            await asyncio.sleep(delays[temperature])
+        except asyncio.CancelledError:
+            cancelled.append(temperature)
+            raise
+        return f"SELECT {temperature} FROM person;"
+    
+    mock_dependencies['validator'].clean_generated_sql.side_effect = lambda text: text
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.side_effect = lambda sql: {
+        'executable': "0.05" in sql,
+        'error': None if "0.05" in sql else "no such column",
+        'error_type': None if "0.05" in sql else "OperationalError"
+    }
+    mock_dependencies['rag'].get_similar_examples.return_value = []
+    
+    with patch('app.sql_generation.service.AsyncOllamaClient') as mock_async:
+        mock_async.return_value.generate = fake_generate
+        service = SQLGenerationService(parallel_candidates=3, candidate_temperatures=[0.05, 0.3, 0.6])
+        request = SQLGenerationRequest(question="test", medical_terms=[])
+        
+        result = asyncio.run(service.generate_sql_async(request))
+    
+    assert result.is_executable is True
+    assert result.generated_sql == "SELECT 0.05 FROM person;"
+    # Llegó antes el candidato a T=0.3 (no ejecutable); el de T=0.6 se canceló
+    assert result.attempts_count == 2
+    assert cancelled == [0.6]
+
+def test_sql_service_parallel_candidates_fall_back_to_correction(mock_dependencies):
+    """Test the correction loop continues when no candidate is executable"""
+    import asyncio
+    from unittest.mock import AsyncMock
+    
+    mock_dependencies['validator'].clean_generated_sql.return_value = "SELECT bad FROM person;"
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.return_value = {
+        'executable': False,
+        'error': "no such column: bad",
+        'error_type': "OperationalError"
+    }
+    mock_dependencies['rag'].get_similar_examples.return_value = []
+    
+    with patch('app.sql_generation.service.AsyncOllamaClient') as mock_async:
+        mock_async.return_value.generate = AsyncMock(return_value="SELECT bad FROM person;")
+        service = SQLGenerationService(parallel_candidates=2, max_attempts=3)
+        request = SQLGenerationRequest(question="test", medical_terms=[])
+        
+        result = asyncio.run(service.generate_sql_async(request))
+    
+    # 2 candidatos + iteraciones 2 y 3 de corrección
+    assert result.is_executable is False
+    assert result.attempts_count == 4
+    assert mock_async.return_value.generate.await_count == 4
+
+def test_sql_service_parallel_candidates_generation_errors_retry(mock_dependencies):
+    """Test that a sequential retry still runs when every parallel candidate fails to generate"""
+    import asyncio
+    
+    calls = []
+    
+    async def fake_generate(model_name, prompt, temperature, **kwargs):
+        calls.append(temperature)
+        # The parallel candidates fail; the sequential retry succeeds
+        return None if len(calls) <= 2 else "SELECT COUNT(*) FROM person;"
+    
+    mock_dependencies['validator'].clean_generated_sql.side_effect = lambda text: text
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.return_value = {
+        'executable': True,
+        'error': None,
+        'error_type': None
+    }
+    mock_dependencies['rag'].get_similar_examples.return_value = []
+    
+    with patch('app.sql_generation.service.AsyncOllamaClient') as mock_async:
+        mock_async.return_value.generate = fake_generate
+        service = SQLGenerationService(parallel_candidates=2, max_attempts=3)
+        request = SQLGenerationRequest(question="test", medical_terms=[])
+        
+        result = asyncio.run(service.generate_sql_async(request))
+    
+    assert result.is_executable is True
+    assert result.generated_sql == "SELECT COUNT(*) FROM person;"
+    assert result.attempts_count == 3
+    assert len(calls) == 3
+
+def test_sql_service_prompts_share_static_prefix(mock_dependencies):
+    """Test every prompt starts with the same static prefix"""
+    service = SQLGenerationService()
+    
+    initial = service._create_prompt(
+        question="How many patients have diabetes?",
+        medical_terms=[MedicalTerm(term="diabetes", concept_id="201826")],
+        similar_example={"question": "Find diabetic patients", "sql": "SELECT 1;"}
+    )
+    other = service._create_prompt(
+        question="Average age of asthma patients",
+        medical_terms=[],
+        similar_example=None
+    )
+    correction = service._create_prompt(
+        question="How many patients have diabetes?",
+        medical_terms=[],
+        similar_example=None,
+        iteration=2,
+        previous_sql="SELECT bad;",
+        error_msg="no such column"
+    )
+    
+    for prompt in (initial, other, correction):
+        assert prompt.startswith(service.prompt_prefix)
+    # La parte variable no aparece en el prefijo
+    assert "How many patients have diabetes?" not in service.prompt_prefix
+    assert "Generate ONLY SQL code" in service.prompt_prefix
+
+def test_sql_service_warmup_sends_prefix(mock_dependencies):
+    """Test warmup evaluates the static prefix on the configured model"""
+    mock_dependencies['ollama'].warmup.return_value = {
+        'load_ms': 1200.0, 'prompt_eval_ms': 300.0, 'prompt_eval_count': 900
+    }
+    service = SQLGenerationService()
+    
+    timings = service.warmup()
+    
+    assert timings['prompt_eval_count'] == 900
+    mock_dependencies['ollama'].warmup.assert_called_once_with(service.model_name, service.prompt_prefix)
+
+def test_sql_service_attempt_metrics(mock_dependencies):
+    """Test Ollama telemetry is attached to each attempt and to the response"""
+    def generate(**kwargs):
+        kwargs['metrics'].update({'prompt_eval_count': 1200, 'eval_count': 35, 'eval_ms': 700.0, 'load_ms': 4.0})
+        return "SELECT COUNT(*) FROM person;"
+    
+    mock_dependencies['ollama'].generate.side_effect = generate
+    mock_dependencies['validator'].clean_generated_sql.return_value = "SELECT COUNT(*) FROM person;"
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.return_value = {
+        'executable': True, 'error': None, 'error_type': None
+    }
+    mock_dependencies['rag'].get_similar_examples.return_value = []
+    
+    service = SQLGenerationService()
+    result = service.generate_sql(SQLGenerationRequest(question="How many patients?", medical_terms=[]))
+    
+    assert result.model_name == service.model_name
+    assert len(result.attempt_metrics) == 1
+    assert result.attempt_metrics[0].iteration == 1
+    assert result.attempt_metrics[0].prompt_eval_count == 1200
+    assert result.attempt_metrics[0].eval_count == 35
+
+def test_sql_service_escalates_to_larger_model(mock_dependencies):
+    """Test a failed first attempt on the fast model is corrected by the main model"""
+    from app.sql_generation.llm_router import BackendSpec
+    
+    mock_dependencies['ollama'].generate.side_effect = ["SELECT bad FROM person;", "SELECT COUNT(*) FROM person;"]
+    mock_dependencies['validator'].clean_generated_sql.side_effect = lambda text: text
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.side_effect = [
+        {'executable': False, 'error': 'no such column: bad', 'error_type': 'OperationalError'},
+        {'executable': True, 'error': None, 'error_type': None}
+    ]
+    mock_dependencies['rag'].get_similar_examples.return_value = []
+    
+    service = SQLGenerationService(backends=[
+        BackendSpec("http://localhost:11434", "small-model", tier="fast"),
+        BackendSpec("http://localhost:11434", "large-model", tier="main")
+    ])
+    result = service.generate_sql(SQLGenerationRequest(question="How many patients?", medical_terms=[]))
+    
+    models = [call[1]['model_name'] for call in mock_dependencies['ollama'].generate.call_args_list]
+    assert models == ["small-model", "large-model"]
+    assert service.model_name == "large-model"
+    assert result.is_executable is True
+    assert result.model_name == "large-model"
+
+def test_sql_service_retries_on_another_backend(mock_dependencies):
+    """Test a backend that returns nothing does not receive the next attempt"""
+    from app.sql_generation.llm_router import BackendSpec
+    
+    mock_dependencies['ollama'].generate.side_effect = (
+        lambda model_name, **kwargs: None if model_name == "model-a" else "SELECT COUNT(*) FROM person;"
+    )
+    mock_dependencies['validator'].clean_generated_sql.side_effect = lambda text: text
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.return_value = {
+        'executable': True, 'error': None, 'error_type': None
+    }
+    mock_dependencies['rag'].get_similar_examples.return_value = []
+    
+    service = SQLGenerationService(backends=[
+        BackendSpec("http://a:11434", "model-a"),
+        BackendSpec("http://b:11434", "model-b")
+    ])
+    result = service.generate_sql(SQLGenerationRequest(question="How many patients?", medical_terms=[]))
+    
+    models = [call[1]['model_name'] for call in mock_dependencies['ollama'].generate.call_args_list]
+    assert models == ["model-a", "model-b"]
+    assert result.is_executable is True
+    assert result.model_name == "model-b"
+
+def test_sql_service_budget_exceeded_feedback(mock_dependencies):
+    """Test an expensive query asks the model for a cheaper one"""
+    from app.sql_generation.service import BUDGET_FEEDBACK
+    
+    mock_dependencies['validator'].clean_generated_sql.return_value = "SELECT * FROM person, measurement;"
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.return_value = {
+        'executable': False,
+        'error': 'Consulta demasiado costosa: abortada tras más de 5 s de ejecución',
+        'error_type': 'BudgetExceeded'
+    }
+    
+    service = SQLGenerationService()
+    result = service._validate_candidate("SELECT * FROM person, measurement;", 1)
+    
+    assert result['error_type'] == 'BudgetExceeded'
+    assert result['feedback'] == BUDGET_FEEDBACK
+    assert "Query too expensive" in service._create_prompt(
+        "q", [], None, iteration=2, previous_sql=result['sql'], error_msg=result['feedback']
+    )
+
+def test_sql_service_cost_estimate_feedback(mock_dependencies):
+    """Test a query rejected by the cost estimator steers the model to indexed columns"""
+    mock_dependencies['validator'].clean_generated_sql.return_value = "SELECT * FROM measurement;"
+    mock_dependencies['validator'].validate_sql_syntax.return_value = None
+    mock_dependencies['validator'].test_sql_execution.return_value = {
+        'executable': False,
+        'error': 'Consulta demasiado costosa: se estiman 80,000,000 filas leídas (máximo 50,000,000)',
+        'error_type': 'CostExceeded',
+        'cost': {
+            'estimated_rows': 80_000_000,
+            'hints': ["full scan of measurement (80,000,000 rows); filter on indexed measurement_concept_id"]
+        }
+    }
+    
+    service = SQLGenerationService()
+    result = service._validate_candidate("SELECT * FROM measurement;", 1)
+    
+    assert result['error_type'] == 'CostExceeded'
+    assert "filter on indexed measurement_concept_id" in result['feedback']
+    assert "measurement_concept_id" in service._create_prompt(
+        "q", [], None, iteration=2, previous_sql=result['sql'], error_msg=result['feedback']
+    )
+
+def test_get_sql_service_builds_a_single_instance(monkeypatch):
+    """Test concurrent first calls (startup warmup and requests) share one service"""
+    import threading
+    import time
+    from app.sql_generation import routes
+    
+    created = []
+    
+    def slow_service():
+        time.sleep(0.05)
+        created.append(object())
+        return created[-1]
+    
+    monkeypatch.setattr(routes, "sql_service", None)
+    monkeypatch.setattr(routes, "SQLGenerationService", slow_service)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(routes.get_sql_service())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(created) == 1
+    assert all(result is created[0] for result in results)
@@ -0,0 +1,122 @@
+import os
+import sqlite3
+
+import pytest
+
+from app.sql_generation.sql_validator import SQLValidator
+from app.sql_generation.validation_cache import ValidationCache, normalize_sql
+
+@pytest.fixture
+def omop_db(tmp_path):
+    db_path = tmp_path / "omop.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE person (person_id INTEGER PRIMARY KEY, year_of_birth INTEGER)")
+    conn.executemany("INSERT INTO person VALUES (?, ?)", [(1, 1980), (2, 1975)])
+    conn.commit()
+    conn.close()
+    return db_path
+
+@pytest.fixture
+def validator(omop_db):
+    return SQLValidator(str(omop_db), schema_path=None)
+
+def test_normalize_sql_ignores_layout_case_and_comments():
+    a = "SELECT COUNT(*)\n  FROM person -- total\n WHERE year_of_birth > 1980;"
+    b = "select count(*) from PERSON where YEAR_OF_BIRTH > 1980"
+    assert normalize_sql(a) == normalize_sql(b)
+
+def test_normalize_sql_keeps_string_literals():
+    assert normalize_sql("SELECT 1 FROM concept WHERE concept_name = 'Asthma'") != \
+        normalize_sql("SELECT 1 FROM concept WHERE concept_name = 'asthma'")
+
+def test_positive_result_is_cached(validator):
+    first = validator.test_sql_execution("SELECT COUNT(*) FROM person;")
+    second = validator.test_sql_execution("select count(*)\nfrom person")
+    assert first['executable'] and not first['cached']
+    assert second['executable'] and second['cached']
+    assert second['plan'] == first['plan']
+
+    stats = validator.cache.get_stats()
+    assert stats['hits'] == 1
+    assert stats['positive_hits'] == 1
+    assert stats['hit_rate'] == 0.5
+
+def test_negative_result_is_cached(validator):
+    first = validator.test_sql_execution("SELECT missing_column FROM person;")
+    second = validator.test_sql_execution("SELECT missing_column FROM person;")
+    assert first['error_type'] == 'OperationalError'
+    assert second['cached'] and second['error'] == first['error']
+    assert validator.cache.get_stats()['negative_hits'] == 1
+
+def test_mode_and_row_limit_are_part_of_the_key(validator):
+    validator.test_sql_execution("SELECT * FROM person;", mode="explain")
+    result = validator.test_sql_execution("SELECT * FROM person;", mode="execute", max_rows=1)
+    assert not result['cached']
+    assert result['row_count'] == 1 and result['truncated']
+    assert validator.test_sql_execution("SELECT * FROM person;", mode="execute", max_rows=1)['cached']
+    assert not validator.test_sql_execution("SELECT * FROM person;", mode="execute", max_rows=5)['cached']
+
+def test_database_change_invalidates(validator, omop_db):
+    validator.test_sql_execution("SELECT * FROM person;")
+    stat = os.stat(omop_db)
+    os.utime(omop_db, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    result = validator.test_sql_execution("SELECT * FROM person;")
+    assert not result['cached']
+    assert validator.cache.get_stats()['invalidations'] == 1
+
+def test_transient_errors_are_not_cached():
+    cache = ValidationCache(max_entries=4)
+    cache.put(("k",), (1,), {'executable': False, 'error_type': 'PoolTimeoutError'})
+    assert cache.get(("k",), (1,)) is None
+
+def test_wall_clock_budget_is_cached_briefly(monkeypatch):
+    cache = ValidationCache(max_entries=4, ttl=3600, timeout_ttl=30)
+    steps = {'executable': False, 'error_type': 'BudgetExceeded', 'budget_limit': 'steps'}
+    timeout = {'executable': False, 'error_type': 'BudgetExceeded', 'budget_limit': 'time'}
+    cache.put(("steps",), (1,), steps)
+    cache.put(("time",), (1,), timeout)
+    assert cache.get(("steps",), (1,)) is not None
+    assert cache.get(("time",), (1,)) is not None
+
+    import app.sql_generation.validation_cache as module
+    now = module.time.monotonic()
+    monkeypatch.setattr(module.time, "monotonic", lambda: now + 60)
+    assert cache.get(("time",), (1,)) is None
+    assert cache.get(("steps",), (1,)) is not None
+
+    # With timeout_ttl=0 wall-clock expiries are not cached at all
+    cache = ValidationCache(max_entries=4, timeout_ttl=0)
+    cache.put(("time",), (1,), timeout)
+    assert cache.get(("time",), (1,)) is None
+
+def test_budget_limit_is_reported(omop_db):
+    runaway = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n) SELECT COUNT(*) FROM n;"
+    validator = SQLValidator(str(omop_db), schema_path=None, time_budget=0, step_budget=1_000_000)
+    result = validator.test_sql_execution(runaway, mode="execute")
+    assert result['error_type'] == 'BudgetExceeded' and result['budget_limit'] == 'steps'
+    assert validator.test_sql_execution(runaway, mode="execute")['cached']
+
+    validator = SQLValidator(str(omop_db), schema_path=None, time_budget=0.2, step_budget=0)
+    result = validator.test_sql_execution(runaway, mode="execute")
+    assert result['error_type'] == 'BudgetExceeded' and result['budget_limit'] == 'time'
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    cache = ValidationCache(max_entries=2, ttl=10)
+    for key in ("a", "b", "c"):
+        cache.put((key,), (1,), {'executable': True})
+    assert cache.get(("a",), (1,)) is None
+    assert cache.get(("c",), (1,)) is not None
+    assert cache.get_stats()['evictions'] == 1
+
+    import app.sql_generation.validation_cache as module
+    now = module.time.monotonic()
+    monkeypatch.setattr(module.time, "monotonic", lambda: now + 60)
+    assert cache.get(("c",), (1,)) is None
+    assert cache.get_stats()['expired'] == 1
+
+def test_cache_can_be_disabled(omop_db):
+    validator = SQLValidator(str(omop_db), schema_path=None, cache_size=0)
+    assert validator.cache is None
+    validator.test_sql_execution("SELECT * FROM person;")
+    assert not validator.test_sql_execution("SELECT * FROM person;")['cached']